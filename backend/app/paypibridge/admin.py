@@ -2,15 +2,30 @@ from django.contrib import admin
 
 from .models import (
     Tenant,
+    FxRate,
+    FxRateRollup,
+    SettlementDeadLetter,
+    SettlementJob,
+    SettlementPartition,
+    WebhookDeliveryStats,
     Wallet,
+    BalanceHold,
     LedgerEntry,
     LedgerAccount,
     JournalBatch,
     JournalLine,
+    BalanceCheckpoint,
+    ReconciliationCursor,
+    LegacyMigrationCheckpoint,
+    ExpectedAccountBalance,
+    LedgerCategoryTotal,
+    JournalMerkleCheckpoint,
     RetryTask,
+    OutboxEvent,
     IdempotencyRecord,
     FeeConfig,
     Settlement,
+    SettlementBatch,
     PaymentIntent,
     Consent,
     PixTransaction,
@@ -26,10 +41,17 @@ class TenantAdmin(admin.ModelAdmin):
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ("id", "tenant", "asset", "balance", "updated_at")
+    list_display = ("id", "tenant", "asset", "balance", "held", "updated_at")
     list_filter = ("asset",)
 
 
+@admin.register(BalanceHold)
+class BalanceHoldAdmin(admin.ModelAdmin):
+    list_display = ("id", "wallet", "amount", "reference", "status", "expires_at", "created_at")
+    list_filter = ("status",)
+    search_fields = ("reference", "external_ref")
+
+
 @admin.register(LedgerEntry)
 class LedgerEntryAdmin(admin.ModelAdmin):
     list_display = ("id", "tenant", "entry_type", "asset", "amount", "reference", "created_at")
@@ -44,7 +66,15 @@ class FeeConfigAdmin(admin.ModelAdmin):
 
 @admin.register(Settlement)
 class SettlementAdmin(admin.ModelAdmin):
-    list_display = ("id", "payment_intent", "amount_brl", "status", "pix_txid", "created_at")
+    list_display = ("id", "payment_intent", "batch", "amount_brl", "status", "pix_txid", "created_at")
+
+
+@admin.register(SettlementBatch)
+class SettlementBatchAdmin(admin.ModelAdmin):
+    list_display = ("id", "payee_user", "status", "total_pi", "net_brl", "window_ends_at", "pix_txid", "settled_at")
+    list_filter = ("status",)
+    search_fields = ("pix_txid", "pix_key")
+    exclude = ("cpf",)
 
 
 @admin.register(PaymentIntent)
@@ -56,7 +86,7 @@ class PaymentIntentAdmin(admin.ModelAdmin):
 
 @admin.register(LedgerAccount)
 class LedgerAccountAdmin(admin.ModelAdmin):
-    list_display = ("code", "tenant", "asset", "category", "balance", "account_type")
+    list_display = ("code", "tenant", "asset", "category", "balance", "account_type", "shard_count")
     list_filter = ("asset", "category", "account_type")
     search_fields = ("code", "name")
 
@@ -69,17 +99,147 @@ class JournalLineInline(admin.TabularInline):
 
 @admin.register(JournalBatch)
 class JournalBatchAdmin(admin.ModelAdmin):
-    list_display = ("id", "reference", "idempotency_key", "created_at")
+    list_display = ("id", "reference", "idempotency_key", "chain_seq", "created_at")
     search_fields = ("reference", "idempotency_key")
+    readonly_fields = ("chain_seq", "prev_hash", "hash")
     inlines = [JournalLineInline]
 
 
+@admin.register(BalanceCheckpoint)
+class BalanceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("id", "account", "as_of", "balance", "last_line_id")
+    list_filter = ("account__asset",)
+    readonly_fields = ("account", "as_of", "balance", "last_line_id", "created_at")
+
+
+@admin.register(ReconciliationCursor)
+class ReconciliationCursorAdmin(admin.ModelAdmin):
+    list_display = ("name", "last_journal_id", "last_line_id", "anchored_at", "last_run_at")
+    readonly_fields = ("name", "last_journal_id", "last_line_id", "anchored_at", "last_run_at", "updated_at")
+
+
+@admin.register(LegacyMigrationCheckpoint)
+class LegacyMigrationCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("name", "last_entry_id", "entries", "journals", "finished_at", "updated_at")
+    readonly_fields = ("name", "last_entry_id", "entries", "journals", "finished_at", "updated_at")
+
+
+@admin.register(ExpectedAccountBalance)
+class ExpectedAccountBalanceAdmin(admin.ModelAdmin):
+    list_display = ("account", "balance", "drift", "checked_at")
+    list_filter = ("account__asset",)
+    readonly_fields = ("account", "balance", "drift", "checked_at", "updated_at")
+
+
+@admin.register(LedgerCategoryTotal)
+class LedgerCategoryTotalAdmin(admin.ModelAdmin):
+    list_display = ("category", "asset", "debit_total", "credit_total", "opening_balance", "updated_at")
+    list_filter = ("asset", "category")
+    readonly_fields = ("category", "asset", "debit_total", "credit_total", "opening_balance", "updated_at")
+
+
+@admin.register(JournalMerkleCheckpoint)
+class JournalMerkleCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("start_seq", "end_seq", "root", "created_at")
+    readonly_fields = ("start_seq", "end_seq", "root", "last_hash", "created_at")
+
+
 @admin.register(RetryTask)
 class RetryTaskAdmin(admin.ModelAdmin):
     list_display = ("id", "task_type", "status", "retries", "next_attempt")
     list_filter = ("status", "task_type")
 
 
+@admin.register(SettlementPartition)
+class SettlementPartitionAdmin(admin.ModelAdmin):
+    list_display = ("index", "virtual_time", "dispatched", "updated_at")
+
+
+@admin.register(SettlementJob)
+class SettlementJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "payment_intent",
+        "partition",
+        "partition_key",
+        "status",
+        "attempts",
+        "enqueued_at",
+        "finished_at",
+    )
+    list_filter = ("status", "partition")
+    search_fields = ("payment_intent__intent_id", "partition_key")
+    exclude = ("args",)
+
+
+@admin.register(SettlementDeadLetter)
+class SettlementDeadLetterAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "payment_intent",
+        "tenant",
+        "source",
+        "error_class",
+        "attempts",
+        "status",
+        "replay_count",
+        "created_at",
+    )
+    list_filter = ("status", "source", "error_class")
+    search_fields = ("payment_intent__intent_id",)
+    exclude = ("cpf_sealed",)
+    readonly_fields = ("cpf_masked", "task_args", "replay_count", "replayed_at")
+    raw_id_fields = ("payment_intent", "tenant")
+    # Tabela cresce sem limite: paginação sem COUNT(*) total.
+    show_full_result_count = False
+    actions = ["replay_selected"]
+
+    @admin.action(description="Reenviar liquidação (pendentes selecionadas)")
+    def replay_selected(self, request, queryset):
+        from .services.settlement_dead_letter import replay_dead_letters
+
+        result = replay_dead_letters(queryset, rate=0)
+        self.message_user(request, f"{result['matched']} dead letter(s): {result['counts']}")
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "event_type", "aggregate_id", "status", "attempts", "next_attempt_at", "created_at")
+    list_filter = ("status", "event_type")
+    search_fields = ("aggregate_id",)
+
+
+@admin.register(WebhookDeliveryStats)
+class WebhookDeliveryStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "tenant",
+        "posts",
+        "events_delivered",
+        "failures",
+        "avg_latency_ms",
+        "latency_ms_max",
+        "last_status_code",
+        "last_success_at",
+        "last_failure_at",
+    )
+    readonly_fields = ("updated_at",)
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    list_display = ("id", "pair", "rate", "source", "observed_at")
+    list_filter = ("pair", "source")
+    # Tabela append-only: paginação sem COUNT(*) total.
+    show_full_result_count = False
+
+
+@admin.register(FxRateRollup)
+class FxRateRollupAdmin(admin.ModelAdmin):
+    list_display = ("pair", "resolution", "bucket_start", "open", "high", "low", "close", "samples")
+    list_filter = ("pair", "resolution")
+    show_full_result_count = False
+
+
 @admin.register(IdempotencyRecord)
 class IdempotencyRecordAdmin(admin.ModelAdmin):
     list_display = ("id", "scope", "key", "status_code", "created_at")
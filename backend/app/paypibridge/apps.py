@@ -6,5 +6,6 @@ class PayPiBridgeConfig(AppConfig):
     name = "app.paypibridge"
     
     def ready(self):
-        """Import tasks when app is ready."""
-        import app.paypibridge.tasks  # noqa
\ No newline at end of file
+        """Import tasks and config-cache signal handlers when app is ready."""
+        import app.paypibridge.tasks  # noqa
+        import app.paypibridge.services.config_cache  # noqa
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+Desanexa partições mensais antigas e arquiva-as em CSV comprimido (+ manifesto JSON) — só Postgres.
+Repor com: python manage.py restore_partition <ficheiro>.csv.gz
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Arquiva (DETACH + COPY gzip + DROP) partições mais antigas que --older-than-months"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-months", type=int, default=12)
+        parser.add_argument("--output-dir", default=None, help="Por omissão PARTITION_ARCHIVE_DIR")
+        parser.add_argument("--table", action="append", dest="tables", help="Limita a esta tabela (db_table)")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.partition_service import archive_partitions, partitioning_supported
+
+        if not partitioning_supported():
+            self.stdout.write(self.style.WARNING("partitioning requires PostgreSQL; nothing to do"))
+            return
+        directory = options["output_dir"] or getattr(settings, "PARTITION_ARCHIVE_DIR", "partition_archive")
+        paths = archive_partitions(options["older_than_months"], directory, options["tables"])
+        for path in paths:
+            self.stdout.write(path)
+        self.stdout.write(self.style.SUCCESS(f"{len(paths)} partition(s) archived"))
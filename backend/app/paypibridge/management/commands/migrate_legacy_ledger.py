@@ -0,0 +1,50 @@
+"""
+Migração do histórico LedgerEntry para JournalBatch/JournalLine (retomável, com throttle).
+  migrate_legacy_ledger [--chunk-size N] [--sleep-ms MS] [--max-entries N]   migra e verifica no fim
+  migrate_legacy_ledger --verify-only                                         só a verificação
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Converte os LedgerEntry legados em journals equilibrados e verifica wallets vs contas"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=None, help="Entradas por transação (LEGACY_MIGRATION_CHUNK_SIZE)"
+        )
+        parser.add_argument("--sleep-ms", type=int, default=None, help="Pausa entre chunks (LEGACY_MIGRATION_SLEEP_MS)")
+        parser.add_argument("--max-entries", type=int, default=None, help="Pára depois de N entradas (retoma depois)")
+        parser.add_argument("--verify-only", action="store_true", help="Não migra; só verifica")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.legacy_migration_service import migrate_legacy_entries, verify_legacy_migration
+
+        if not options["verify_only"]:
+            try:
+                result = migrate_legacy_entries(
+                    chunk_size=options["chunk_size"],
+                    sleep_ms=options["sleep_ms"],
+                    max_entries=options["max_entries"],
+                    on_chunk=lambda cp: self.stdout.write(
+                        f"checkpoint: entry {cp.last_entry_id} ({cp.entries} entries, {cp.journals} journals)"
+                    ),
+                )
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(json.dumps(result, indent=2))
+            if not result["finished"]:
+                self.stdout.write("Stopped at --max-entries; run again to continue.")
+                return
+
+        report = verify_legacy_migration()
+        if not report["ok"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            raise CommandError(
+                f"verification failed: {len(report['wallet_account_mismatches'])} wallet mismatch(es), "
+                f"{len(report['unexplained_openings'])} account(s) not explained by history"
+            )
+        self.stdout.write(self.style.SUCCESS("Wallets alinhadas com LedgerAccount e saldos explicados pelas linhas"))
@@ -0,0 +1,53 @@
+"""
+Converte tabelas append-mostly em partições mensais por created_at (só Postgres).
+Sem argumentos mostra, por tabela candidata, se já está particionada ou o que o impede.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Particiona por mês (created_at) as tabelas: journalline, ledgerentry, pixtransaction, paymentintent"
+
+    def add_arguments(self, parser):
+        parser.add_argument("tables", nargs="*", help="Tabelas a converter (ex.: journalline)")
+        parser.add_argument("--months-ahead", type=int, default=3, help="Partições futuras a criar já")
+        parser.add_argument("--keep-old", action="store_true", help="Mantém <tabela>_unpartitioned após a cópia")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.partition_service import (
+            PARTITION_CANDIDATES,
+            convert_to_partitions,
+            is_partitioned,
+            partition_blockers,
+            partitioning_supported,
+        )
+
+        if not partitioning_supported():
+            self.stdout.write(self.style.WARNING("partitioning requires PostgreSQL; nothing to do"))
+            return
+
+        unknown = [t for t in options["tables"] if t not in PARTITION_CANDIDATES]
+        if unknown:
+            raise CommandError(f"unknown table(s): {', '.join(unknown)}")
+
+        if not options["tables"]:
+            for key, model in PARTITION_CANDIDATES.items():
+                table = model._meta.db_table
+                if is_partitioned(table):
+                    self.stdout.write(f"{key}: partitioned")
+                    continue
+                blockers = partition_blockers(model)
+                self.stdout.write(f"{key}: " + ("; ".join(blockers) if blockers else "ready"))
+            return
+
+        for key in options["tables"]:
+            try:
+                created = convert_to_partitions(
+                    PARTITION_CANDIDATES[key],
+                    months_ahead=options["months_ahead"],
+                    keep_old=options["keep_old"],
+                )
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f"{key}: {created} monthly partitions"))
@@ -1,33 +1,46 @@
 """
-Reconciliação: Wallet vs LedgerAccount e soma de linhas por Journal (sanidade).
+Reconciliação de todo o ledger: wallets vs LedgerAccount, journals desequilibrados e saldo das contas
+recalculado das linhas. --json escreve o relatório completo (stdout ou --output).
 """
 
-from django.core.management.base import BaseCommand
-from django.db.models import Sum
-from decimal import Decimal
+import json
 
-from app.paypibridge.models import JournalBatch, JournalLine
+from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
     help = "Verifica consistência entre wallets e contas do ledger em partidas dobradas"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Processos (por omissão RECONCILE_WORKERS)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Journals por chunk (RECONCILE_CHUNK_SIZE)")
+        parser.add_argument("--json", action="store_true", help="Relatório JSON em vez do resumo")
+        parser.add_argument("--output", default=None, help="Grava o relatório JSON neste ficheiro")
+
     def handle(self, *args, **options):
-        from app.paypibridge.services.double_entry_service import reconcile_wallet_vs_account
-
-        issues = reconcile_wallet_vs_account()
-        if issues:
-            self.stdout.write(self.style.ERROR(f"wallet/account mismatches: {len(issues)}"))
-            for i in issues:
-                self.stdout.write(str(i))
-        else:
-            self.stdout.write(self.style.SUCCESS("Wallets alinhadas com LedgerAccount"))
-
-        for jb in JournalBatch.objects.all()[:500]:
-            lines = JournalLine.objects.filter(journal=jb)
-            dr = lines.filter(side="debit").aggregate(t=Sum("amount"))["t"] or Decimal("0")
-            cr = lines.filter(side="credit").aggregate(t=Sum("amount"))["t"] or Decimal("0")
-            if dr != cr:
-                self.stdout.write(self.style.ERROR(f"Journal {jb.id} imbalance: D={dr} C={cr}"))
-
-        self.stdout.write("Done.")
+        from app.paypibridge.services.reconciliation_service import reconcile_ledger
+
+        report = reconcile_ledger(workers=options["workers"], chunk_size=options["chunk_size"])
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        sections = [
+            ("wallet_account_mismatches", "wallet/account mismatches", "Wallets alinhadas com LedgerAccount"),
+            ("imbalanced_journals", "imbalanced journals", "Todos os journals equilibrados"),
+            ("account_mismatches", "account balance mismatches", "Saldos das contas coerentes com as linhas"),
+        ]
+        for key, label, ok_message in sections:
+            issues = report[key]
+            if issues:
+                self.stdout.write(self.style.ERROR(f"{label}: {len(issues)}"))
+                for i in issues:
+                    self.stdout.write(str(i))
+            else:
+                self.stdout.write(self.style.SUCCESS(ok_message))
+
+        self.stdout.write(f"Done: {report['chunks']} chunk(s) in {report['elapsed_ms']} ms.")
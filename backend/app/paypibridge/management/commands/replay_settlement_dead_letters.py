@@ -0,0 +1,56 @@
+"""
+Reenvio em massa das dead letters de liquidação (SettlementDeadLetter pendentes), a ritmo controlado.
+  replay_settlement_dead_letters --error-class ConnectionError --since 2026-10-01 --dry-run   o que seria reenviado
+  replay_settlement_dead_letters --tenant 3 --rate 2 --limit 100                            reenvia 2/s, até 100
+  replay_settlement_dead_letters --ids 10,11,12                                             linhas específicas
+"""
+
+import json
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+class Command(BaseCommand):
+    help = "Volta a enfileirar liquidações em dead letter, filtradas, a no máximo --rate por segundo"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--error-class", default=None, help="Só esta classe de erro (ex.: ConnectionError)")
+        parser.add_argument("--tenant", type=int, default=None, help="Só dead letters deste tenant (id)")
+        parser.add_argument("--source", choices=["task", "scheduler"], default=None, help="Origem da dead letter")
+        parser.add_argument("--since", default=None, help="Criadas a partir de (data ou datetime ISO)")
+        parser.add_argument("--ids", default=None, help="Ids separados por vírgula")
+        parser.add_argument("--limit", type=int, default=None, help="Reenvia no máximo N")
+        parser.add_argument(
+            "--rate", type=float, default=None, help="Reenvios por segundo (SETTLEMENT_DLQ_REPLAY_RATE)"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Só lista os ids que seriam reenviados")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.settlement_dead_letter import filter_dead_letters, replay_dead_letters
+
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                day = parse_date(options["since"])
+                if day is None:
+                    raise CommandError(f"invalid --since: {options['since']}")
+                since = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+        try:
+            ids = [int(i) for i in options["ids"].split(",") if i.strip()] if options["ids"] else None
+        except ValueError:
+            raise CommandError(f"invalid --ids: {options['ids']}")
+        if options["rate"] is not None and options["rate"] <= 0:
+            raise CommandError("--rate must be > 0")
+
+        qs = filter_dead_letters(
+            error_class=options["error_class"],
+            tenant_id=options["tenant"],
+            source=options["source"],
+            since=since,
+            ids=ids,
+        )
+        result = replay_dead_letters(qs, rate=options["rate"], limit=options["limit"], dry_run=options["dry_run"])
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,28 @@
+"""
+Repõe uma partição arquivada por archive_partitions (verifica sha256 e número de linhas).
+"""
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Recria a partição a partir de <partição>.csv.gz e do manifesto .json ao lado"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Ficheiro .csv.gz produzido por archive_partitions")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.partition_service import partitioning_supported, restore_partition
+
+        if not partitioning_supported():
+            raise CommandError("partitioning requires PostgreSQL")
+        path = options["path"]
+        if not os.path.exists(path) or not os.path.exists(path + ".json"):
+            raise CommandError(f"archive or manifest not found: {path}")
+        try:
+            rows = restore_partition(path)
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"{rows} row(s) restored from {path}"))
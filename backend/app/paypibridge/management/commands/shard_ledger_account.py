@@ -0,0 +1,29 @@
+"""
+Liga/desliga sharding de saldo numa conta de sistema quente (ex.: CLEARING_PI, PLATFORM_FEE_BRL).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.paypibridge.models import LedgerAccount
+
+
+class Command(BaseCommand):
+    help = "Configura N sub-saldos (shards) para uma LedgerAccount; --buckets 0 desliga"
+
+    def add_arguments(self, parser):
+        parser.add_argument("code", help="Código da LedgerAccount (ex.: CLEARING_PI)")
+        parser.add_argument("--buckets", type=int, required=True, help="Número de shards (0 ou 1 desliga)")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.double_entry_service import configure_account_sharding, get_account_balance
+
+        acc = LedgerAccount.objects.filter(code=options["code"]).first()
+        if not acc:
+            raise CommandError(f"account not found: {options['code']}")
+        try:
+            acc = configure_account_sharding(acc, options["buckets"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            self.style.SUCCESS(f"{acc.code}: shard_count={acc.shard_count} balance={get_account_balance(acc)}")
+        )
@@ -0,0 +1,61 @@
+"""
+Auditoria da cadeia de hashes dos JournalBatch.
+  verify_journal_chain [--from-seq N] [--to-seq M]   verifica elos, digests e raízes Merkle do intervalo
+  verify_journal_chain --proof <journal_id>          prova de inclusão O(log n) do batch
+  verify_journal_chain --seal                        encadeia batches pendentes e grava checkpoints antes
+  verify_journal_chain --archive <ficheiro.csv.gz>   recalcula os batches arquivados a partir do arquivo
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Verifica a cadeia de hashes dos lançamentos ou gera uma prova de inclusão Merkle"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from-seq", type=int, default=1)
+        parser.add_argument("--to-seq", type=int, default=None, help="Por omissão, a cabeça da cadeia")
+        parser.add_argument("--proof", type=int, default=None, metavar="JOURNAL_ID")
+        parser.add_argument("--seal", action="store_true", help="Corre seal_journal_chain antes de verificar")
+        parser.add_argument("--archive", default=None, metavar="PATH", help="Arquivo de partição de JournalLine")
+
+    def handle(self, *args, **options):
+        from app.paypibridge.services.journal_chain import inclusion_proof, seal_journal_chain, verify_range
+
+        if options["seal"]:
+            sealed = seal_journal_chain()
+            self.stdout.write(f"sealed: {sealed}")
+
+        if options["proof"] is not None:
+            try:
+                proof = inclusion_proof(options["proof"])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(json.dumps(proof, indent=2))
+            if not proof["valid"]:
+                raise CommandError(f"journal {options['proof']} does not match its Merkle checkpoint")
+            return
+
+        if options["archive"]:
+            from app.paypibridge.services.partition_service import verify_archive
+
+            try:
+                report = verify_archive(options["archive"])
+            except (OSError, ValueError) as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(json.dumps(report, indent=2))
+            if not report["ok"]:
+                raise CommandError(f"archive verification failed: {len(report['errors'])} error(s)")
+            return
+
+        report = verify_range(options["from_seq"], options["to_seq"])
+        self.stdout.write(json.dumps(report, indent=2))
+        if not report["ok"]:
+            raise CommandError(f"journal chain verification failed: {len(report['errors'])} error(s)")
+        self.stdout.write(
+            self.style.SUCCESS(f"{report['checked']} batch(es) and {report['checkpoints']} checkpoint(s) verified")
+        )
+        if report["unchained"]:
+            self.stdout.write(self.style.WARNING(f"{report['unchained']} batch(es) not chained yet (run with --seal)"))
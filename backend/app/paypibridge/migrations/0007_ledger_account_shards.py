@@ -0,0 +1,32 @@
+# Sharding de saldo para contas quentes (clearing, receita de taxas)
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0006_v3_double_entry_retry_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgeraccount',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='0 = sem sharding; N > 1 reparte as escritas por N sub-saldos (LedgerAccountShard).'),
+        ),
+        migrations.CreateModel(
+            name='LedgerAccountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='paypibridge.ledgeraccount')),
+            ],
+            options={
+                'ordering': ['account', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'bucket'), name='paypibridge_accountshard_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Checkpoints de saldo por conta (saldo histórico sem replay completo)
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0007_ledger_account_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=8, max_digits=28)),
+                ('last_line_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['account', '-as_of'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='journalline',
+            index=models.Index(fields=['account', 'id'], name='paypibridge_jline_acct_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancecheckpoint',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='paypibridge.ledgeraccount'),
+        ),
+        migrations.AddIndex(
+            model_name='balancecheckpoint',
+            index=models.Index(fields=['account', 'as_of'], name='paypibridge_ckpt_acct_asof_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'last_line_id'), name='paypibridge_ckpt_acct_line_uniq'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# JournalLine.created_at (copiado do batch): chave de partição e filtro por data sem join
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_created_at(apps, schema_editor):
+    JournalBatch = apps.get_model("paypibridge", "JournalBatch")
+    JournalLine = apps.get_model("paypibridge", "JournalLine")
+    JournalLine.objects.update(
+        created_at=Subquery(JournalBatch.objects.filter(pk=OuterRef("journal_id")).values("created_at")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0008_balance_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalline',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='journalline',
+            index=models.Index(fields=['account', 'created_at', 'id'], name='paypibridge_jline_acct_ts_idx'),
+        ),
+    ]
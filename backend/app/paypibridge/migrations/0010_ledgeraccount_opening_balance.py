@@ -0,0 +1,51 @@
+# LedgerAccount.opening_balance: parte do saldo sem linhas (contas criadas com o saldo da wallet)
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_opening_balance(apps, schema_editor):
+    # Só contas de wallet nasceram com saldo sem linhas (0006 / ensure_wallet_ledger_account); nas
+    # restantes uma diferença entre saldo e linhas é drift e tem de continuar visível na reconciliação.
+    LedgerAccount = apps.get_model("paypibridge", "LedgerAccount")
+    LedgerAccountShard = apps.get_model("paypibridge", "LedgerAccountShard")
+    JournalLine = apps.get_model("paypibridge", "JournalLine")
+    dec = DecimalField(max_digits=28, decimal_places=8)
+    zero = Value(Decimal("0"), output_field=dec)
+
+    def _sum(qs, expr):
+        return Coalesce(
+            Subquery(qs.filter(account_id=OuterRef("pk")).values("account_id").annotate(t=expr).values("t")[:1]),
+            zero,
+            output_field=dec,
+        )
+
+    shards = _sum(LedgerAccountShard.objects.order_by(), Sum("balance"))
+    debit = _sum(JournalLine.objects.order_by(), Sum("amount", filter=Q(side="debit")))
+    credit = _sum(JournalLine.objects.order_by(), Sum("amount", filter=Q(side="credit")))
+    LedgerAccount.objects.filter(account_type="wallet", wallet__isnull=False).update(
+        opening_balance=Case(
+            When(category="ASSET", then=F("balance") + shards - debit + credit),
+            default=F("balance") + shards - credit + debit,
+            output_field=dec,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0009_journalline_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgeraccount',
+            name='opening_balance',
+            field=models.DecimalField(decimal_places=8, default=0, help_text='Saldo sem JournalLine (ex.: wallet migrada); saldo efetivo = opening_balance + linhas.', max_digits=28),
+        ),
+        migrations.RunPython(backfill_opening_balance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Reconciliação incremental: cursor (marca de água) e saldos esperados por conta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0010_ledgeraccount_opening_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('last_journal_id', models.BigIntegerField(default=0)),
+                ('last_line_id', models.BigIntegerField(default=0)),
+                ('anchored_at', models.DateTimeField(blank=True, help_text='Último deep scan (re-ancoragem)', null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExpectedAccountBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('drift', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('checked_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='expected_balance', to='paypibridge.ledgeraccount')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Totais por categoria e ativo (balancete) mantidos a partir dos journals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0011_incremental_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCategoryTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('ASSET', 'ASSET'), ('LIABILITY', 'LIABILITY'), ('REVENUE', 'REVENUE')], max_length=20)),
+                ('asset', models.CharField(max_length=10)),
+                ('debit_total', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('credit_total', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('opening_balance', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['asset', 'category'],
+                'constraints': [models.UniqueConstraint(fields=('category', 'asset'), name='paypibridge_cattotal_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Cadeia de hashes dos JournalBatch e checkpoints Merkle
+
+from django.db import migrations, models
+
+
+def create_chain_head(apps, schema_editor):
+    JournalChainHead = apps.get_model("paypibridge", "JournalChainHead")
+    JournalChainHead.objects.get_or_create(name="journal", defaults={"seq": 0, "hash": "0" * 64})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0012_ledger_category_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalChainHead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('seq', models.BigIntegerField(default=0)),
+                ('hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JournalMerkleCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_seq', models.BigIntegerField(unique=True)),
+                ('end_seq', models.BigIntegerField(unique=True)),
+                ('root', models.CharField(max_length=64)),
+                ('last_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['start_seq'],
+            },
+        ),
+        migrations.AddField(
+            model_name='journalbatch',
+            name='chain_seq',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='journalbatch',
+            name='hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='journalbatch',
+            name='prev_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(create_chain_head, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Retenções de saldo (authorize/capture) e Wallet.held
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0013_journal_hash_chain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='held',
+            field=models.DecimalField(decimal_places=8, default=0, help_text='Soma das BalanceHold vivas; saldo disponível = balance - held.', max_digits=28),
+        ),
+        migrations.CreateModel(
+            name='BalanceHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=8, max_digits=28)),
+                ('reference', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('active', 'active'), ('settling', 'settling'), ('captured', 'captured'), ('released', 'released'), ('expired', 'expired')], default='active', max_length=20)),
+                ('external_ref', models.CharField(blank=True, default='', max_length=255)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('payment_intent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='balance_holds', to='paypibridge.paymentintent')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='holds', to='paypibridge.wallet')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='paypibridge_hold_st_exp_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['active', 'settling'])), fields=('reference',), name='paypibridge_hold_live_reference_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Checkpoint da migração do ledger legado (LedgerEntry) para journals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0014_balance_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LegacyMigrationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('last_entry_id', models.BigIntegerField(default=0, help_text='Último LedgerEntry já convertido')),
+                ('entries', models.BigIntegerField(default=0)),
+                ('journals', models.BigIntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
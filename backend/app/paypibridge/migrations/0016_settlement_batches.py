@@ -0,0 +1,65 @@
+# Liquidação em lote (um Pix por beneficiário por janela)
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0015_legacy_migration_checkpoint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='settlement',
+            name='payment_intent',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='settlement_record', to='paypibridge.paymentintent'),
+        ),
+        migrations.CreateModel(
+            name='SettlementBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cpf', models.CharField(max_length=11)),
+                ('pix_key', models.CharField(max_length=255)),
+                ('description', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(choices=[('open', 'open'), ('processing', 'processing'), ('settled', 'settled'), ('failed', 'failed')], default='open', max_length=20)),
+                ('total_pi', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('window_ends_at', models.DateTimeField()),
+                ('fx_rate', models.DecimalField(blank=True, decimal_places=8, max_digits=28, null=True)),
+                ('gross_brl', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('fee_brl', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('net_brl', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('pix_txid', models.CharField(blank=True, default='', max_length=120)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('settled_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('consent', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='settlement_batches', to='paypibridge.consent')),
+                ('payee_user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='settlement_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='paymentintent',
+            name='settlement_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='intents', to='paypibridge.settlementbatch'),
+        ),
+        migrations.AddField(
+            model_name='settlement',
+            name='batch',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='settlement', to='paypibridge.settlementbatch'),
+        ),
+        migrations.AddIndex(
+            model_name='settlementbatch',
+            index=models.Index(fields=['status', 'window_ends_at'], name='paypibridge_sbatch_st_win_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='settlementbatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'open')), fields=('consent', 'cpf', 'pix_key'), name='paypibridge_sbatch_open_uniq'),
+        ),
+    ]
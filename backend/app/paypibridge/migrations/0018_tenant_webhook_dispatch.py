@@ -0,0 +1,45 @@
+# Dispatcher de webhooks do tenant: segredo, envelope em lote e contadores de entrega
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0017_outbox_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='webhook_batch_size',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Eventos por POST do webhook (1 = um evento por POST, sem envelope).'),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='webhook_secret',
+            field=models.CharField(blank=True, default='', help_text='Segredo HMAC da assinatura do webhook (vazio = PPBRIDGE_WEBHOOK_HMAC_SECRET).', max_length=128),
+        ),
+        migrations.CreateModel(
+            name='WebhookDeliveryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts', models.PositiveBigIntegerField(default=0)),
+                ('events_delivered', models.PositiveBigIntegerField(default=0)),
+                ('failures', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms_total', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms_max', models.PositiveIntegerField(default=0)),
+                ('last_latency_ms', models.PositiveIntegerField(default=0)),
+                ('last_status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('last_success_at', models.DateTimeField(blank=True, null=True)),
+                ('last_failure_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='webhook_stats', to='paypibridge.tenant')),
+            ],
+            options={
+                'verbose_name_plural': 'webhook delivery stats',
+            },
+        ),
+    ]
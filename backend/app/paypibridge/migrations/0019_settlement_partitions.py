@@ -0,0 +1,57 @@
+# Scheduler de liquidação particionado (partições, jobs e peso por tenant)
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0018_tenant_webhook_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(unique=True)),
+                ('virtual_time', models.DecimalField(decimal_places=8, default=0, max_digits=28)),
+                ('dispatched', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['index'],
+            },
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='settlement_weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Peso na fila de liquidação particionada (2 = o dobro da vazão de um tenant com peso 1).'),
+        ),
+        migrations.CreateModel(
+            name='SettlementJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('partition_key', models.CharField(max_length=64)),
+                ('partition', models.PositiveSmallIntegerField()),
+                ('virtual_finish', models.DecimalField(decimal_places=8, max_digits=28)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=20)),
+                ('args', models.JSONField(default=dict)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('not_before', models.DateTimeField(default=django.utils.timezone.now)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('payment_intent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='settlement_jobs', to='paypibridge.paymentintent')),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='settlement_jobs', to='paypibridge.tenant')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['partition', 'virtual_finish', 'id'], name='paypibridge_setjob_next_idx'), models.Index(fields=['partition', 'status'], name='paypibridge_setjob_part_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('payment_intent',), name='paypibridge_setjob_live_uniq')],
+            },
+        ),
+    ]
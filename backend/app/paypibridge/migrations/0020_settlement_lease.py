@@ -0,0 +1,29 @@
+# Lease de liquidação no PaymentIntent (claim atómico antes do Pix)
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0019_settlement_partitions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentintent',
+            name='settlement_lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentintent',
+            name='settlement_lease_owner',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='paymentintent',
+            index=models.Index(condition=models.Q(('settlement_status', 'PROCESSING')), fields=['settlement_lease_expires_at'], name='paypibridge_pi_lease_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Dead letters de liquidação em tabela própria (CPF selado)
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0020_settlement_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('task', 'task'), ('scheduler', 'scheduler')], max_length=20)),
+                ('error_class', models.CharField(max_length=120)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('task_args', models.JSONField(default=dict)),
+                ('cpf_masked', models.CharField(blank=True, default='', max_length=14)),
+                ('cpf_sealed', models.TextField(blank=True, default='')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('replayed', 'replayed'), ('discarded', 'discarded')], default='pending', max_length=20)),
+                ('replay_count', models.PositiveIntegerField(default=0)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('payment_intent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='paypibridge.paymentintent')),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dead_letters', to='paypibridge.tenant')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', '-id'], name='paypibridge_sdlq_status_idx'), models.Index(fields=['error_class', '-id'], name='paypibridge_sdlq_error_idx'), models.Index(fields=['tenant', '-id'], name='paypibridge_sdlq_tenant_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Histórico de câmbio (FxRate) e rollups OHLC
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0021_settlement_dead_letters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=16)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('observed_at', models.DateTimeField()),
+                ('source', models.CharField(choices=[('providers', 'providers'), ('fallback', 'fallback')], default='providers', max_length=16)),
+                ('sources', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pair', 'observed_at'], name='paypibridge_fxrate_pair_ts_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FxRateRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=16)),
+                ('resolution', models.CharField(choices=[('minute', 'minute'), ('hour', 'hour')], max_length=8)),
+                ('bucket_start', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('high', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('low', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('close', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('samples', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('pair', 'resolution', 'bucket_start'), name='paypibridge_fxroll_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Marca de envio do Pix na lease de liquidação
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0022_fx_rate_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentintent',
+            name='settlement_pix_sending_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Estado unknown para lotes de liquidação com o Pix possivelmente enviado
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0023_settlement_pix_sending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='settlementbatch',
+            name='status',
+            field=models.CharField(choices=[('open', 'open'), ('processing', 'processing'), ('settled', 'settled'), ('failed', 'failed'), ('unknown', 'unknown')], default='open', max_length=20),
+        ),
+    ]
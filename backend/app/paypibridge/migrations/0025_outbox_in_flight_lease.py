@@ -0,0 +1,27 @@
+# Outbox: estado in_flight com lease durante a entrega (fora da transação do claim)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0024_settlement_batch_unknown'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('in_flight', 'in_flight'), ('delivered', 'delivered'), ('dead', 'dead')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('status', 'in_flight')), fields=['lease_expires_at'], name='paypibridge_outbox_lease_idx'),
+        ),
+    ]
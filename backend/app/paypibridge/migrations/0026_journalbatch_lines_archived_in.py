@@ -0,0 +1,18 @@
+# JournalBatch: partição arquivada com as linhas do batch (verificação da cadeia sem as linhas)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypibridge', '0025_outbox_in_flight_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalbatch',
+            name='lines_archived_in',
+            field=models.CharField(blank=True, default='', max_length=63),
+        ),
+    ]
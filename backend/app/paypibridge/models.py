@@ -10,10 +10,24 @@ class Tenant(models.Model):
     slug = models.SlugField(max_length=64, unique=True, db_index=True)
     api_key = models.CharField(max_length=128, unique=True, db_index=True)
     webhook_url = models.URLField(blank=True, default="")
+    webhook_secret = models.CharField(
+        max_length=128,
+        blank=True,
+        default="",
+        help_text="Segredo HMAC da assinatura do webhook (vazio = PPBRIDGE_WEBHOOK_HMAC_SECRET).",
+    )
+    webhook_batch_size = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Eventos por POST do webhook (1 = um evento por POST, sem envelope).",
+    )
     is_platform = models.BooleanField(
         default=False,
         help_text="Tenant interno da plataforma (recebe taxas em BRL).",
     )
+    settlement_weight = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Peso na fila de liquidação particionada (2 = o dobro da vazão de um tenant com peso 1).",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -33,6 +47,12 @@ class Wallet(models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name="wallets")
     asset = models.CharField(max_length=10, choices=ASSET_CHOICES)
     balance = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    held = models.DecimalField(
+        max_digits=28,
+        decimal_places=8,
+        default=0,
+        help_text="Soma das BalanceHold vivas; saldo disponível = balance - held.",
+    )
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -40,6 +60,10 @@ class Wallet(models.Model):
             models.UniqueConstraint(fields=["tenant", "asset"], name="paypibridge_wallet_tenant_asset_uniq"),
         ]
 
+    @property
+    def available(self):
+        return self.balance - self.held
+
     def __str__(self):
         return f"{self.tenant.slug}:{self.asset}={self.balance}"
 
@@ -113,9 +137,19 @@ class Settlement(models.Model):
 
     payment_intent = models.OneToOneField(
         "PaymentIntent",
+        null=True,
+        blank=True,
         on_delete=models.CASCADE,
         related_name="settlement_record",
     )
+    # Liquidação em lote: um Settlement para o lote; os intents membros estão em batch.intents.
+    batch = models.OneToOneField(
+        "SettlementBatch",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="settlement",
+    )
     amount_brl = models.DecimalField(max_digits=20, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_PENDING)
     pix_txid = models.CharField(max_length=255, blank=True, default="")
@@ -124,9 +158,188 @@ class Settlement(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
+        if self.batch_id:
+            return f"Settlement batch {self.batch_id} {self.status}"
         return f"Settlement {self.payment_intent_id} {self.status}"
 
 
+class SettlementBatch(models.Model):
+    """
+    Liquidação líquida: intents verificados do mesmo beneficiário, consent, CPF e chave Pix acumulados
+    numa janela (ou até um limite em PI) e pagos com um só Pix, a uma só taxa de câmbio.
+    """
+
+    ST_OPEN = "open"
+    ST_PROCESSING = "processing"
+    ST_SETTLED = "settled"
+    ST_FAILED = "failed"
+    ST_UNKNOWN = "unknown"  # parado em PROCESSING depois da marca de envio: Pix possivelmente enviado
+    STATUS_CHOICES = [
+        (ST_OPEN, "open"),
+        (ST_PROCESSING, "processing"),
+        (ST_SETTLED, "settled"),
+        (ST_FAILED, "failed"),
+        (ST_UNKNOWN, "unknown"),
+    ]
+
+    payee_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name="settlement_batches",
+    )
+    consent = models.ForeignKey("Consent", on_delete=models.PROTECT, related_name="settlement_batches")
+    cpf = models.CharField(max_length=11)
+    pix_key = models.CharField(max_length=255)
+    description = models.CharField(max_length=255, blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_OPEN)
+    total_pi = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    window_ends_at = models.DateTimeField()
+    fx_rate = models.DecimalField(max_digits=28, decimal_places=8, null=True, blank=True)
+    gross_brl = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    fee_brl = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    net_brl = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    pix_txid = models.CharField(max_length=120, blank=True, default="")
+    error_message = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "window_ends_at"], name="paypibridge_sbatch_st_win_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["consent", "cpf", "pix_key"],
+                condition=models.Q(status="open"),
+                name="paypibridge_sbatch_open_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"SettlementBatch {self.pk} {self.status} ({self.total_pi} PI)"
+
+
+class SettlementPartition(models.Model):
+    """Relógio virtual (fair queuing) e contadores de uma partição do scheduler de liquidação."""
+
+    index = models.PositiveSmallIntegerField(unique=True)
+    virtual_time = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    dispatched = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["index"]
+
+    def __str__(self):
+        return f"settlement partition {self.index}"
+
+
+class SettlementJob(models.Model):
+    """
+    Liquidação enfileirada no scheduler particionado (services/settlement_scheduler.py): uma por vez por
+    partição, escolhida pelo menor virtual_finish. args (consent, CPF, chave Pix) é apagado ao terminar.
+    """
+
+    ST_QUEUED = "queued"
+    ST_RUNNING = "running"
+    ST_DONE = "done"
+    ST_FAILED = "failed"
+    STATUS_CHOICES = [
+        (ST_QUEUED, "queued"),
+        (ST_RUNNING, "running"),
+        (ST_DONE, "done"),
+        (ST_FAILED, "failed"),
+    ]
+    LIVE_STATUSES = (ST_QUEUED, ST_RUNNING)
+
+    payment_intent = models.ForeignKey("PaymentIntent", on_delete=models.CASCADE, related_name="settlement_jobs")
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.SET_NULL, related_name="settlement_jobs")
+    partition_key = models.CharField(max_length=64)
+    partition = models.PositiveSmallIntegerField()
+    virtual_finish = models.DecimalField(max_digits=28, decimal_places=8)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_QUEUED)
+    args = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    not_before = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(default=dict, blank=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["partition", "virtual_finish", "id"],
+                condition=models.Q(status="queued"),
+                name="paypibridge_setjob_next_idx",
+            ),
+            models.Index(fields=["partition", "status"], name="paypibridge_setjob_part_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["payment_intent"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="paypibridge_setjob_live_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"SettlementJob {self.pk} p{self.partition} {self.status}"
+
+
+class SettlementDeadLetter(models.Model):
+    """
+    Liquidação que esgotou as tentativas (task Celery ou scheduler). Os argumentos originais ficam em
+    task_args sem o CPF; o CPF só existe selado (cpf_sealed) e mascarado. Reenviado pelo comando
+    replay_settlement_dead_letters.
+    """
+
+    ST_PENDING = "pending"
+    ST_REPLAYED = "replayed"
+    ST_DISCARDED = "discarded"
+    STATUS_CHOICES = [
+        (ST_PENDING, "pending"),
+        (ST_REPLAYED, "replayed"),
+        (ST_DISCARDED, "discarded"),
+    ]
+
+    SOURCE_TASK = "task"
+    SOURCE_SCHEDULER = "scheduler"
+    SOURCE_CHOICES = [
+        (SOURCE_TASK, "task"),
+        (SOURCE_SCHEDULER, "scheduler"),
+    ]
+
+    payment_intent = models.ForeignKey("PaymentIntent", on_delete=models.CASCADE, related_name="dead_letters")
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.SET_NULL, related_name="dead_letters")
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    error_class = models.CharField(max_length=120)
+    error_message = models.TextField(blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
+    task_args = models.JSONField(default=dict)
+    cpf_masked = models.CharField(max_length=14, blank=True, default="")
+    cpf_sealed = models.TextField(blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_PENDING)
+    replay_count = models.PositiveIntegerField(default=0)
+    replayed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "-id"], name="paypibridge_sdlq_status_idx"),
+            models.Index(fields=["error_class", "-id"], name="paypibridge_sdlq_error_idx"),
+            models.Index(fields=["tenant", "-id"], name="paypibridge_sdlq_tenant_idx"),
+        ]
+
+    def __str__(self):
+        return f"SettlementDeadLetter {self.pk} {self.error_class} ({self.status})"
+
+
 class Consent(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     provider = models.CharField(max_length=120)
@@ -194,6 +407,27 @@ class PaymentIntent(models.Model):
         max_digits=20, decimal_places=2, null=True, blank=True
     )
     settlement_pix_txid = models.CharField(max_length=120, null=True, blank=True)
+    settlement_batch = models.ForeignKey(
+        "SettlementBatch",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="intents",
+    )
+    # Lease da liquidação em curso (claim_settlement): só o dono envia o Pix.
+    settlement_lease_owner = models.CharField(max_length=64, blank=True, default="")
+    settlement_lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # Marcado dentro da lease imediatamente antes do Pix: com a marca o intent não volta a ser reclamado.
+    settlement_pix_sending_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["settlement_lease_expires_at"],
+                condition=models.Q(settlement_status="PROCESSING"),
+                name="paypibridge_pi_lease_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.intent_id
@@ -262,6 +496,12 @@ class LedgerAccount(models.Model):
     account_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
     balance = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    opening_balance = models.DecimalField(
+        max_digits=28,
+        decimal_places=8,
+        default=0,
+        help_text="Saldo sem JournalLine (ex.: wallet migrada); saldo efetivo = opening_balance + linhas.",
+    )
     wallet = models.OneToOneField(
         Wallet,
         null=True,
@@ -269,6 +509,10 @@ class LedgerAccount(models.Model):
         on_delete=models.SET_NULL,
         related_name="ledger_account",
     )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="0 = sem sharding; N > 1 reparte as escritas por N sub-saldos (LedgerAccountShard).",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -278,6 +522,23 @@ class LedgerAccount(models.Model):
         return f"{self.code} ({self.balance})"
 
 
+class LedgerAccountShard(models.Model):
+    """Sub-saldo de uma conta quente; saldo efetivo = LedgerAccount.balance + soma dos shards."""
+
+    account = models.ForeignKey(LedgerAccount, on_delete=models.CASCADE, related_name="shards")
+    bucket = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+
+    class Meta:
+        ordering = ["account", "bucket"]
+        constraints = [
+            models.UniqueConstraint(fields=["account", "bucket"], name="paypibridge_accountshard_bucket_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}#{self.bucket} ({self.balance})"
+
+
 class JournalBatch(models.Model):
     """Lançamento contábil balanceado (soma débitos = soma créditos)."""
 
@@ -292,6 +553,12 @@ class JournalBatch(models.Model):
     )
     metadata = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Cadeia de hashes (services/journal_chain.py): hash = sha256(prev_hash + digest do batch e linhas).
+    chain_seq = models.BigIntegerField(null=True, blank=True, unique=True)
+    prev_hash = models.CharField(max_length=64, blank=True, default="")
+    hash = models.CharField(max_length=64, blank=True, default="")
+    # Partição de JournalLine arquivada com as linhas deste batch (o digest deixa de ser recalculável).
+    lines_archived_in = models.CharField(max_length=63, blank=True, default="")
 
     class Meta:
         ordering = ["-id"]
@@ -316,9 +583,194 @@ class JournalLine(models.Model):
     )
     side = models.CharField(max_length=10, choices=SIDE_CHOICES)
     amount = models.DecimalField(max_digits=28, decimal_places=8)
+    # Igual ao created_at do batch; chave de partição mensal no Postgres (ver partition_service).
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["account", "id"], name="paypibridge_jline_acct_id_idx"),
+            models.Index(fields=["account", "created_at", "id"], name="paypibridge_jline_acct_ts_idx"),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Saldo de uma conta cobrindo todas as JournalLine com id <= last_line_id.
+    as_of = maior created_at (do batch) entre essas linhas; serve de ponto de partida para saldos históricos.
+    """
+
+    account = models.ForeignKey(LedgerAccount, on_delete=models.CASCADE, related_name="checkpoints")
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=28, decimal_places=8)
+    last_line_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["account", "-as_of"]
+        indexes = [
+            models.Index(fields=["account", "as_of"], name="paypibridge_ckpt_acct_asof_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["account", "last_line_id"], name="paypibridge_ckpt_acct_line_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}@{self.as_of:%Y-%m-%d %H:%M} ({self.balance})"
+
+
+class ReconciliationCursor(models.Model):
+    """Marca de água da reconciliação incremental: journals até last_journal_id já verificados."""
+
+    name = models.CharField(max_length=32, unique=True)
+    last_journal_id = models.BigIntegerField(default=0)
+    last_line_id = models.BigIntegerField(default=0)
+    anchored_at = models.DateTimeField(null=True, blank=True, help_text="Último deep scan (re-ancoragem)")
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}@{self.last_journal_id}"
+
+
+class LegacyMigrationCheckpoint(models.Model):
+    """Progresso da migração LedgerEntry → JournalBatch (manage.py migrate_legacy_ledger)."""
+
+    name = models.CharField(max_length=32, unique=True)
+    last_entry_id = models.BigIntegerField(default=0, help_text="Último LedgerEntry já convertido")
+    entries = models.BigIntegerField(default=0)
+    journals = models.BigIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}@{self.last_entry_id}"
+
+
+class ExpectedAccountBalance(models.Model):
+    """
+    Saldo esperado de uma conta na marca de água do cursor: opening_balance + linhas verificadas.
+    drift = saldo real (na mesma marca de água) - esperado; diferente de 0 gera alerta.
+    """
+
+    account = models.OneToOneField(LedgerAccount, on_delete=models.CASCADE, related_name="expected_balance")
+    balance = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    drift = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    checked_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account_id} ({self.balance})"
+
+
+class LedgerCategoryTotal(models.Model):
+    """
+    Totais por categoria e ativo (balancete), mantidos a partir dos journals pelo cursor "ledger_totals".
+    saldo = opening_balance + (débitos - créditos no ativo, créditos - débitos no passivo/receita).
+    """
+
+    category = models.CharField(max_length=20, choices=LedgerAccount.CATEGORY_CHOICES)
+    asset = models.CharField(max_length=10)
+    debit_total = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    credit_total = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    opening_balance = models.DecimalField(max_digits=28, decimal_places=8, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["asset", "category"]
+        constraints = [
+            models.UniqueConstraint(fields=["category", "asset"], name="paypibridge_cattotal_uniq"),
+        ]
+
+    @property
+    def balance(self):
+        if self.category == LedgerAccount.CAT_ASSET:
+            return self.opening_balance + self.debit_total - self.credit_total
+        return self.opening_balance + self.credit_total - self.debit_total
+
+    def __str__(self):
+        return f"{self.category}/{self.asset} ({self.balance})"
+
+
+class JournalChainHead(models.Model):
+    """Último elo da cadeia de JournalBatch; bloqueado só por seal_journal_chain, fora dos lançamentos."""
+
+    name = models.CharField(max_length=32, unique=True)
+    seq = models.BigIntegerField(default=0)
+    hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}@{self.seq}"
+
+
+class JournalMerkleCheckpoint(models.Model):
+    """Raiz Merkle dos hashes dos batches com start_seq <= chain_seq <= end_seq (intervalo de tamanho fixo)."""
+
+    start_seq = models.BigIntegerField(unique=True)
+    end_seq = models.BigIntegerField(unique=True)
+    root = models.CharField(max_length=64)
+    last_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["start_seq"]
+
+    def __str__(self):
+        return f"{self.start_seq}-{self.end_seq} {self.root[:12]}"
+
+
+class BalanceHold(models.Model):
+    """
+    Reserva de saldo antes de uma chamada externa (ex.: Pix da liquidação).
+    active → settling (efeito externo feito, falta o lançamento) → captured; ou active → released/expired.
+    """
+
+    ST_ACTIVE = "active"
+    ST_SETTLING = "settling"
+    ST_CAPTURED = "captured"
+    ST_RELEASED = "released"
+    ST_EXPIRED = "expired"
+    STATUS_CHOICES = [
+        (ST_ACTIVE, "active"),
+        (ST_SETTLING, "settling"),
+        (ST_CAPTURED, "captured"),
+        (ST_RELEASED, "released"),
+        (ST_EXPIRED, "expired"),
+    ]
+    LIVE_STATUSES = (ST_ACTIVE, ST_SETTLING)
+
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name="holds")
+    amount = models.DecimalField(max_digits=28, decimal_places=8)
+    reference = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_ACTIVE)
+    payment_intent = models.ForeignKey(
+        "PaymentIntent",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="balance_holds",
+    )
+    external_ref = models.CharField(max_length=255, blank=True, default="")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="paypibridge_hold_st_exp_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reference"],
+                condition=models.Q(status__in=["active", "settling"]),
+                name="paypibridge_hold_live_reference_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.reference} {self.amount} ({self.status})"
 
 
 class RetryTask(models.Model):
@@ -346,6 +798,82 @@ class RetryTask(models.Model):
         ordering = ["next_attempt", "id"]
 
 
+class OutboxEvent(models.Model):
+    """
+    Efeito secundário (ex.: webhook do tenant) gravado na mesma transação da mudança de estado;
+    entregue depois pelo dispatcher (services/outbox.py), fora dos pedidos e da liquidação.
+    Durante a entrega fica in_flight com lease (lease_expires_at); lease expirada volta a ser reclamável.
+    """
+
+    ST_PENDING = "pending"
+    ST_IN_FLIGHT = "in_flight"
+    ST_DELIVERED = "delivered"
+    ST_DEAD = "dead"
+    STATUS_CHOICES = [
+        (ST_PENDING, "pending"),
+        (ST_IN_FLIGHT, "in_flight"),
+        (ST_DELIVERED, "delivered"),
+        (ST_DEAD, "dead"),
+    ]
+
+    event_type = models.CharField(max_length=64)
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.CASCADE, related_name="outbox_events")
+    aggregate_id = models.CharField(max_length=120, blank=True, default="", db_index=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ST_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at", "id"],
+                condition=models.Q(status="pending"),
+                name="paypibridge_outbox_due_idx",
+            ),
+            models.Index(
+                fields=["lease_expires_at"],
+                condition=models.Q(status="in_flight"),
+                name="paypibridge_outbox_lease_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.aggregate_id} ({self.status})"
+
+
+class WebhookDeliveryStats(models.Model):
+    """Contadores de entrega do webhook por tenant (latência e falhas), atualizados pelo dispatcher."""
+
+    tenant = models.OneToOneField(Tenant, on_delete=models.CASCADE, related_name="webhook_stats")
+    posts = models.PositiveBigIntegerField(default=0)
+    events_delivered = models.PositiveBigIntegerField(default=0)
+    failures = models.PositiveBigIntegerField(default=0)
+    latency_ms_total = models.PositiveBigIntegerField(default=0)
+    latency_ms_max = models.PositiveIntegerField(default=0)
+    last_latency_ms = models.PositiveIntegerField(default=0)
+    last_status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    last_failure_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "webhook delivery stats"
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return self.latency_ms_total / self.posts if self.posts else 0.0
+
+    def __str__(self):
+        return f"{self.tenant_id}: {self.posts} POSTs, {self.failures} falhas"
+
+
 class IdempotencyRecord(models.Model):
     """Respostas idempotentes para APIs (ex.: POST /api/v3/payments)."""
 
@@ -359,3 +887,56 @@ class IdempotencyRecord(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["scope", "key"], name="paypibridge_idempotency_scope_key_uniq"),
         ]
+
+
+class FxRate(models.Model):
+    """
+    Observação de câmbio (append-only): uma linha por refresh do FXService. Só a compactação por
+    retenção apaga linhas, depois de cobertas por FxRateRollup.
+    """
+
+    SOURCE_PROVIDERS = "providers"
+    SOURCE_FALLBACK = "fallback"
+    SOURCE_CHOICES = [(SOURCE_PROVIDERS, "providers"), (SOURCE_FALLBACK, "fallback")]
+
+    pair = models.CharField(max_length=16)  # ex.: PI/BRL
+    rate = models.DecimalField(max_digits=20, decimal_places=8)
+    observed_at = models.DateTimeField()
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES, default=SOURCE_PROVIDERS)
+    sources = models.JSONField(default=dict, blank=True)  # provider -> taxa que entrou na agregação
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["pair", "observed_at"], name="paypibridge_fxrate_pair_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.pair} {self.rate} @ {self.observed_at:%Y-%m-%d %H:%M:%S}"
+
+
+class FxRateRollup(models.Model):
+    """OHLC de FxRate por minuto ou hora (bucket_start = início do intervalo, UTC)."""
+
+    RES_MINUTE = "minute"
+    RES_HOUR = "hour"
+    RESOLUTION_CHOICES = [(RES_MINUTE, "minute"), (RES_HOUR, "hour")]
+
+    pair = models.CharField(max_length=16)
+    resolution = models.CharField(max_length=8, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    open = models.DecimalField(max_digits=20, decimal_places=8)
+    high = models.DecimalField(max_digits=20, decimal_places=8)
+    low = models.DecimalField(max_digits=20, decimal_places=8)
+    close = models.DecimalField(max_digits=20, decimal_places=8)
+    samples = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["pair", "resolution", "bucket_start"],
+                name="paypibridge_fxroll_bucket_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.pair} {self.resolution} {self.bucket_start:%Y-%m-%d %H:%M} O{self.open} C{self.close}"
@@ -0,0 +1,101 @@
+"""
+Checkpoints de saldo (double-entry): saldo de uma conta numa data passada sem replay completo.
+
+Um BalanceCheckpoint cobre todas as JournalLine da conta com id <= last_line_id; as_of é o maior
+created_at entre elas. balance_as_of(conta, ts) parte do checkpoint mais recente com
+as_of <= ts e soma só as linhas seguintes com created_at <= ts; antes do primeiro checkpoint parte
+de LedgerAccount.opening_balance (saldo sem linhas) e soma as linhas até ts.
+Os checkpoints só cobrem linhas mais antigas que BALANCE_CHECKPOINT_LAG_SECONDS, para não saltar
+ids de transações ainda por confirmar.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Max, QuerySet, Sum, When
+from django.utils import timezone
+
+from app.paypibridge.models import BalanceCheckpoint, JournalLine, LedgerAccount, LedgerEntry, Wallet
+
+logger = logging.getLogger(__name__)
+
+_QUANT = Decimal("0.00000001")
+
+
+def account_sign(account: LedgerAccount) -> int:
+    """+1 se o saldo cresce com débitos (ativo), -1 se cresce com créditos (passivo/receita)."""
+    return 1 if account.category == LedgerAccount.CAT_ASSET else -1
+
+
+def net_amount_expression():
+    """Débito - crédito por linha (usar com account_sign para obter a variação do saldo)."""
+    return Case(
+        When(side=JournalLine.SIDE_DEBIT, then=F("amount")),
+        default=-F("amount"),
+        output_field=DecimalField(max_digits=28, decimal_places=8),
+    )
+
+
+def _line_sum(account: LedgerAccount, lines: QuerySet) -> Decimal:
+    net = lines.aggregate(n=Sum(net_amount_expression()))["n"] or Decimal("0")
+    return net * account_sign(account)
+
+
+def write_balance_checkpoints(now: Optional[datetime] = None) -> int:
+    """Um checkpoint por conta com linhas novas desde o último. Devolve quantos foram gravados."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=int(getattr(settings, "BALANCE_CHECKPOINT_LAG_SECONDS", 300)))
+    high = JournalLine.objects.filter(created_at__lte=cutoff).aggregate(m=Max("id"))["m"]
+    if not high:
+        return 0
+
+    written = 0
+    for acc in LedgerAccount.objects.order_by("pk").iterator():
+        prev = acc.checkpoints.order_by("-last_line_id").first()
+        floor = prev.last_line_id if prev else 0
+        lines = JournalLine.objects.filter(account=acc, id__gt=floor, id__lte=high)
+        agg = lines.aggregate(n=Sum(net_amount_expression()), last=Max("id"), ts=Max("created_at"))
+        if agg["last"] is None:
+            continue
+        base = prev.balance if prev else acc.opening_balance
+        balance = (base + (agg["n"] or Decimal("0")) * account_sign(acc)).quantize(_QUANT)
+        BalanceCheckpoint.objects.create(
+            account=acc,
+            as_of=max(agg["ts"], prev.as_of) if prev else agg["ts"],
+            balance=balance,
+            last_line_id=agg["last"],
+        )
+        written += 1
+
+    logger.info("balance_checkpoints_written", extra={"count": written, "last_line_id": high})
+    return written
+
+
+def balance_as_of(account: LedgerAccount, ts: datetime) -> Decimal:
+    """Saldo da conta considerando as linhas cujo batch foi criado até ts (inclusive)."""
+    lines = JournalLine.objects.filter(account=account, created_at__lte=ts)
+    cp = account.checkpoints.filter(as_of__lte=ts).order_by("-last_line_id").first()
+    if cp:
+        return (cp.balance + _line_sum(account, lines.filter(id__gt=cp.last_line_id))).quantize(_QUANT)
+    return (account.opening_balance + _line_sum(account, lines)).quantize(_QUANT)
+
+
+def wallet_balance_as_of(wallet: Wallet, ts: datetime) -> Decimal:
+    """Saldo histórico de uma Wallet: pela conta double-entry ou, sem ela, replay dos LedgerEntry."""
+    account = LedgerAccount.objects.filter(wallet=wallet).first()
+    if account:
+        return balance_as_of(account, ts)
+    agg = LedgerEntry.objects.filter(tenant_id=wallet.tenant_id, asset=wallet.asset, created_at__lte=ts).aggregate(
+        n=Sum(
+            Case(
+                When(entry_type=LedgerEntry.ENTRY_CREDIT, then=F("amount")),
+                default=-F("amount"),
+                output_field=DecimalField(max_digits=28, decimal_places=8),
+            )
+        )
+    )
+    return (agg["n"] or Decimal("0")).quantize(_QUANT)
@@ -0,0 +1,104 @@
+"""
+Cache de configuração por processo (tenant plataforma, taxa ativa, modo double-entry).
+
+Valores com TTL local (CONFIG_CACHE_TTL) e uma versão partilhada na cache Django: os signals
+post_save/post_delete de Tenant, FeeConfig e LedgerAccount limpam a cache local e, após commit,
+incrementam a versão — os outros processos veem a versão nova em <= CONFIG_CACHE_VERSION_CHECK_SECONDS.
+A invalidação entre processos requer uma cache Django partilhada (ex.: Redis); com LocMemCache é só local.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app.paypibridge.models import FeeConfig, LedgerAccount, Tenant
+
+logger = logging.getLogger(__name__)
+
+_VERSION_KEY = "paypibridge:config_cache:version"
+
+_lock = threading.Lock()
+_entries: Dict[str, Tuple[Any, float, int]] = {}
+_version_seen: Tuple[int, float] = (0, float("-inf"))
+
+
+def _ttl() -> float:
+    return float(getattr(settings, "CONFIG_CACHE_TTL", 60))
+
+
+def _shared_version() -> int:
+    """Versão global, relida da cache Django no máximo a cada CONFIG_CACHE_VERSION_CHECK_SECONDS."""
+    global _version_seen
+    version, checked_at = _version_seen
+    now = time.monotonic()
+    if now - checked_at < float(getattr(settings, "CONFIG_CACHE_VERSION_CHECK_SECONDS", 1)):
+        return version
+    version = cache.get(_VERSION_KEY) or 0
+    _version_seen = (version, now)
+    return version
+
+
+def cached_config(name: str, loader: Callable[[], Any]) -> Any:
+    """
+    Devolve o valor em cache ou chama loader().
+    Dentro de uma transação aberta o valor lido não é guardado (pode ainda ser revertido).
+    """
+    ttl = _ttl()
+    if ttl <= 0:
+        return loader()
+    version = _shared_version()
+    now = time.monotonic()
+    entry = _entries.get(name)
+    if entry and entry[1] > now and entry[2] == version:
+        return entry[0]
+    value = loader()
+    if not connection.in_atomic_block:
+        with _lock:
+            _entries[name] = (value, now + ttl, version)
+    return value
+
+
+def clear_config_cache() -> None:
+    """Limpa só a cache local deste processo."""
+    global _version_seen
+    with _lock:
+        _entries.clear()
+        _version_seen = (0, float("-inf"))
+
+
+def _bump_shared_version() -> None:
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        cache.set(_VERSION_KEY, 1, None)
+    clear_config_cache()
+
+
+def invalidate_config_cache() -> None:
+    clear_config_cache()
+    transaction.on_commit(_bump_shared_version)
+
+
+@receiver(post_save, sender=Tenant)
+@receiver(post_delete, sender=Tenant)
+@receiver(post_save, sender=FeeConfig)
+@receiver(post_delete, sender=FeeConfig)
+@receiver(post_delete, sender=LedgerAccount)
+def _invalidate_on_change(sender, **kwargs):
+    invalidate_config_cache()
+
+
+@receiver(post_save, sender=LedgerAccount)
+def _invalidate_on_account_created(sender, created=False, **kwargs):
+    # Saves de saldo (modo locking) não mudam a configuração; só contas novas contam.
+    if created:
+        invalidate_config_cache()
@@ -6,12 +6,25 @@ Regra: soma(débitos) == soma(créditos) em cada JournalBatch.
 from __future__ import annotations
 
 import logging
+import zlib
 from decimal import Decimal
-from typing import TYPE_CHECKING, Any, List, Optional, TypedDict
-
-from django.db import IntegrityError, transaction
-
-from app.paypibridge.models import JournalBatch, JournalLine, LedgerAccount, Tenant, Wallet
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, TypedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+
+from app.paypibridge.models import (
+    BalanceHold,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    LedgerAccountShard,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.config_cache import cached_config
+from app.paypibridge.services.idempotency import insert_or_get
 
 if TYPE_CHECKING:
     from app.paypibridge.models import PaymentIntent
@@ -31,21 +44,177 @@ class LineSpec(TypedDict, total=False):
 
 
 def is_double_entry_active() -> bool:
-    return LedgerAccount.objects.filter(code=CODE_CLEARING_PI).exists()
+    return cached_config(
+        "double_entry_active",
+        lambda: LedgerAccount.objects.filter(code=CODE_CLEARING_PI).exists(),
+    )
+
+
+def conditional_balance_mode() -> bool:
+    """LEDGER_BALANCE_MODE=conditional: saldos via UPDATEs guardados (F()) por conta, sem select_for_update."""
+    return getattr(settings, "LEDGER_BALANCE_MODE", "locking") == "conditional"
+
+
+def _signed_delta(category: str, side: str, amount: Decimal) -> Decimal:
+    """Variação do saldo da conta (ativo: D-C; passivo/receita: C-D)."""
+    if category == LedgerAccount.CAT_ASSET:
+        return amount if side == JournalLine.SIDE_DEBIT else -amount
+    if category in (LedgerAccount.CAT_LIABILITY, LedgerAccount.CAT_REVENUE):
+        return amount if side == JournalLine.SIDE_CREDIT else -amount
+    raise ValueError(f"unknown category {category}")
+
+
+def _lookup_accounts(lines: List[LineSpec]) -> Dict[tuple, LedgerAccount]:
+    """Todas as contas referidas pelas linhas numa só query (code IN ... OR id IN ...)."""
+    codes = {spec["code"] for spec in lines if spec.get("code")}
+    ids = {spec["account_id"] for spec in lines if not spec.get("code")}
+    found: Dict[tuple, LedgerAccount] = {}
+    for acc in LedgerAccount.objects.filter(Q(code__in=codes) | Q(pk__in=ids)):
+        found[("code", acc.code)] = acc
+        found[("id", acc.pk)] = acc
+    return found
+
+
+def _check_accounts(lines: List[LineSpec], found: Dict[tuple, LedgerAccount]) -> None:
+    for spec in lines:
+        if spec.get("code") and ("code", spec["code"]) not in found:
+            raise ValueError(f"account not found: {spec['code']}")
+        if not spec.get("code") and ("id", spec["account_id"]) not in found:
+            raise ValueError(f"account not found: id={spec['account_id']}")
+
+
+def _resolve_accounts(lines: List[LineSpec]) -> Dict[tuple, LedgerAccount]:
+    found = _lookup_accounts(lines)
+    _check_accounts(lines, found)
+    return found
+
+
+def _apply_account_deltas_locked(deltas: Dict[int, Decimal]) -> None:
+    """
+    Modo locking: um select_for_update ordenado por pk (ordem de lock fixa, sem deadlocks entre
+    lançamentos que tocam as mesmas contas por ordens diferentes) e um UPDATE com CASE.
+    """
+    locked = LedgerAccount.objects.select_for_update().filter(pk__in=deltas).order_by("pk").values_list("pk", "balance")
+    new_balances = {pk: (balance + deltas[pk]).quantize(Decimal("0.00000001")) for pk, balance in locked}
+    LedgerAccount.objects.filter(pk__in=new_balances).update(
+        balance=Case(
+            *[When(pk=pk, then=Value(balance)) for pk, balance in new_balances.items()],
+            output_field=DecimalField(max_digits=28, decimal_places=8),
+        )
+    )
+
+
+def _apply_account_deltas_guarded(accounts: Dict[int, LedgerAccount], deltas: Dict[int, Decimal]) -> None:
+    """
+    LEDGER_BALANCE_MODE=conditional: um UPDATE guardado por conta (balance = balance + delta), sem
+    SELECT ... FOR UPDATE prévio. Os UPDATEs seguem a ordem de pk, como o modo locking: cada um bloqueia
+    só a sua linha, por isso lançamentos com as mesmas contas em ordens diferentes não se bloqueiam.
+    Um journal de uma conta continua a ser um único statement; com N contas são N statements.
+    A guarda (saldo + delta >= 0) só vale para contas ligadas a Wallet (passivo para com o tenant):
+    contas de sistema (clearing, receita) não tinham verificação de saldo e continuam sem ela.
+    Falhar a guarda levanta ValueError; o chamador (transação aberta) desfaz as contas já atualizadas.
+    O saldo retido (Wallet.held) é verificado depois, em _check_wallet_holds.
+    """
+    for pk in sorted(deltas):
+        delta = deltas[pk]
+        qs = LedgerAccount.objects.filter(pk=pk)
+        if accounts[pk].wallet_id and delta < 0:
+            qs = qs.filter(balance__gte=-delta)
+        amount = Value(delta, output_field=DecimalField(max_digits=28, decimal_places=8))
+        if qs.update(balance=F("balance") + amount) != 1:
+            raise ValueError("insufficient_account_balance")
+
+
+def _check_wallet_holds(wallet_ids: List[int], intent_ids: List[int]) -> None:
+    """
+    Modo conditional, depois de _sync_wallet_balances: débitos não podem usar saldo retido
+    (balance >= held), como apply_wallet_delta. O UPDATE da sincronização já bloqueou as wallets e leu a
+    versão mais recente, por isso um reserve_hold concorrente espera pelo commit e vê o novo saldo.
+    As retenções vivas dos payment intents do próprio lançamento não contam: a liquidação lança o débito
+    e só depois captura a sua retenção. Falhar levanta ValueError (o chamador desfaz a transação).
+    """
+    if not wallet_ids:
+        return
+    own: Dict[int, Decimal] = {}
+    if intent_ids:
+        own = {
+            row["wallet_id"]: row["t"]
+            for row in BalanceHold.objects.filter(
+                wallet_id__in=wallet_ids, payment_intent_id__in=intent_ids, status__in=BalanceHold.LIVE_STATUSES
+            )
+            .order_by()
+            .values("wallet_id")
+            .annotate(t=Sum("amount"))
+        }
+    for pk, balance, held in Wallet.objects.filter(pk__in=wallet_ids).values_list("pk", "balance", "held"):
+        if balance < held - own.get(pk, Decimal("0")):
+            raise ValueError("insufficient_available_balance")
+
+
+def _sync_wallet_balances(wallet_ids: List[int]) -> None:
+    """Wallet.balance = saldo da conta ligada, para todas as wallets tocadas, num UPDATE."""
+    if wallet_ids:
+        Wallet.objects.filter(pk__in=wallet_ids).update(
+            balance=Subquery(LedgerAccount.objects.filter(wallet_id=OuterRef("pk")).values("balance")[:1])
+        )
 
 
-def _apply_account_delta(account: LedgerAccount, debit: Decimal, credit: Decimal) -> None:
-    if account.category == LedgerAccount.CAT_ASSET:
-        account.balance = (account.balance + debit - credit).quantize(Decimal("0.00000001"))
-    elif account.category in (LedgerAccount.CAT_LIABILITY, LedgerAccount.CAT_REVENUE):
-        account.balance = (account.balance + credit - debit).quantize(Decimal("0.00000001"))
-    else:
-        raise ValueError(f"unknown category {account.category}")
+def _shard_bucket(shard_key: str, shard_count: int) -> int:
+    return zlib.crc32(shard_key.encode()) % shard_count
 
 
-def _sync_wallet_balance(account: LedgerAccount) -> None:
+def _apply_bucket_delta(account_id: int, bucket: int, delta: Decimal) -> bool:
+    """
+    Conta com sharding: o delta vai para um único LedgerAccountShard (bucket = hash da chave), sem
+    tocar na linha da conta. False se o shard não existir (sharding reconfigurado entretanto).
+    """
+    updated = LedgerAccountShard.objects.filter(account_id=account_id, bucket=bucket).update(
+        balance=F("balance") + delta
+    )
+    return updated == 1
+
+
+def get_account_balance(account: LedgerAccount) -> Decimal:
+    """Saldo efetivo: base da conta + soma dos shards (quando a conta tem sharding)."""
+    if not account.shard_count:
+        return account.balance
+    agg = LedgerAccountShard.objects.filter(account_id=account.pk).aggregate(t=Sum("balance"))
+    return account.balance + (agg["t"] or Decimal("0"))
+
+
+def compact_account_shards(account: LedgerAccount, *, drop_shards: bool = False) -> Decimal:
+    """Dobra os shards na base da conta (transação curta). Devolve o montante movido."""
+    with transaction.atomic():
+        acc = LedgerAccount.objects.select_for_update().get(pk=account.pk)
+        shards = list(LedgerAccountShard.objects.select_for_update().filter(account=acc).order_by("bucket"))
+        total = sum((sh.balance for sh in shards), Decimal("0"))
+        if drop_shards:
+            LedgerAccountShard.objects.filter(account=acc).delete()
+        elif total:
+            nonzero = [sh.pk for sh in shards if sh.balance]
+            LedgerAccountShard.objects.filter(pk__in=nonzero).update(balance=Decimal("0"))
+        if total:
+            acc.balance = (acc.balance + total).quantize(Decimal("0.00000001"))
+            acc.save(update_fields=["balance"])
+        return total
+
+
+def configure_account_sharding(account: LedgerAccount, buckets: int) -> LedgerAccount:
+    """
+    Liga (buckets > 1) ou desliga (buckets <= 1) o sharding de uma conta de sistema.
+    Os shards anteriores são sempre dobrados e removidos antes de criar os novos.
+    """
     if account.wallet_id:
-        Wallet.objects.filter(pk=account.wallet_id).update(balance=account.balance)
+        raise ValueError("wallet-linked accounts cannot be sharded")
+    buckets = buckets if buckets > 1 else 0
+    with transaction.atomic():
+        compact_account_shards(account, drop_shards=True)
+        LedgerAccountShard.objects.bulk_create(
+            [LedgerAccountShard(account=account, bucket=b, balance=Decimal("0")) for b in range(buckets)]
+        )
+        LedgerAccount.objects.filter(pk=account.pk).update(shard_count=buckets)
+    account.refresh_from_db()
+    return account
 
 
 def get_account_by_code(code: str) -> Optional[LedgerAccount]:
@@ -53,10 +222,10 @@ def get_account_by_code(code: str) -> Optional[LedgerAccount]:
 
 
 def ensure_wallet_ledger_account(wallet: Wallet) -> LedgerAccount:
-    if hasattr(wallet, "ledger_account") and wallet.ledger_account_id:
+    if hasattr(wallet, "ledger_account"):
         return wallet.ledger_account
     code = f"WALLET_T{wallet.tenant_id}_{wallet.asset}"
-    acc, _ = LedgerAccount.objects.get_or_create(
+    acc, created = LedgerAccount.objects.get_or_create(
         code=code,
         defaults={
             "tenant": wallet.tenant,
@@ -65,53 +234,32 @@ def ensure_wallet_ledger_account(wallet: Wallet) -> LedgerAccount:
             "account_type": LedgerAccount.TYPE_WALLET,
             "category": LedgerAccount.CAT_LIABILITY,
             "balance": wallet.balance or Decimal("0"),
+            "opening_balance": wallet.balance or Decimal("0"),
         },
     )
+    if created and acc.opening_balance:
+        from app.paypibridge.services.ledger_totals_service import add_opening_balance
+
+        add_opening_balance(acc.category, acc.asset, acc.opening_balance)
     if not acc.wallet_id:
         acc.wallet = wallet
         acc.save(update_fields=["wallet"])
     return acc
 
 
-def post_balanced_journal(
-    reference: str,
-    lines: List[LineSpec],
-    *,
-    idempotency_key: Optional[str] = None,
-    payment_intent: Optional["PaymentIntent"] = None,
-    metadata: Optional[dict] = None,
-) -> JournalBatch:
-    """
-    Cria JournalBatch e linhas; atualiza saldos das contas; sincroniza Wallet ligado.
-    Idempotente por idempotency_key.
-    """
+def _validate_lines(lines: List[LineSpec]) -> None:
     if not lines:
         raise ValueError("empty journal")
 
-    if idempotency_key:
-        existing = JournalBatch.objects.filter(idempotency_key=idempotency_key).first()
-        if existing:
-            return existing
-
     total_debit = Decimal("0")
     total_credit = Decimal("0")
-    resolved: List[tuple[LedgerAccount, str, Decimal]] = []
-
     for spec in lines:
-        side = spec["side"]
         amount = spec["amount"]
         if amount is None or amount <= 0:
             raise ValueError("line amount must be positive")
-        if "code" in spec and spec["code"]:
-            acc = get_account_by_code(spec["code"])
-        elif spec.get("account_id"):
-            acc = LedgerAccount.objects.get(pk=spec["account_id"])
-        else:
+        if not (spec.get("code") or spec.get("account_id")):
             raise ValueError("code or account_id required")
-        if not acc:
-            raise ValueError(f"account not found: {spec.get('code')}")
-        resolved.append((acc, side, amount))
-        if side == JournalLine.SIDE_DEBIT:
+        if spec["side"] == JournalLine.SIDE_DEBIT:
             total_debit += amount
         else:
             total_credit += amount
@@ -119,31 +267,95 @@ def post_balanced_journal(
     if total_debit != total_credit:
         raise ValueError(f"ledger imbalance: debit={total_debit} credit={total_credit}")
 
+
+def _line_account(accounts: Dict[tuple, LedgerAccount], spec: LineSpec) -> LedgerAccount:
+    return accounts[("code", spec["code"]) if spec.get("code") else ("id", spec["account_id"])]
+
+
+def _apply_journal_effects(
+    posted: List[tuple[JournalBatch, List[LineSpec], str]],
+    accounts: Dict[tuple, LedgerAccount],
+) -> None:
+    """
+    Linhas + saldos de um ou mais batches já reclamados (jb, linhas, chave de shard), numa transação aberta.
+    Os deltas são somados por conta (e por shard) antes de aplicados: cada conta é atualizada uma vez.
+    A cadeia de hashes fica para seal_journal_chain (não bloqueia a cabeça da cadeia aqui).
+    """
+    deltas: Dict[int, Decimal] = {}
+    shard_deltas: Dict[tuple[int, int], Decimal] = {}
+    line_objs = []
+    by_pk = {acc.pk: acc for acc in accounts.values()}
+    for jb, lines, shard_key in posted:
+        for spec in lines:
+            acc = _line_account(accounts, spec)
+            delta = _signed_delta(acc.category, spec["side"], spec["amount"])
+            if acc.shard_count > 1:
+                key = (acc.pk, _shard_bucket(shard_key, acc.shard_count))
+                shard_deltas[key] = shard_deltas.get(key, Decimal("0")) + delta
+            else:
+                deltas[acc.pk] = deltas.get(acc.pk, Decimal("0")) + delta
+            line_objs.append(
+                JournalLine(journal=jb, account=acc, side=spec["side"], amount=spec["amount"], created_at=jb.created_at)
+            )
+
+    for (pk, bucket), delta in shard_deltas.items():
+        if delta and not _apply_bucket_delta(pk, bucket, delta):
+            # Shard em falta (sharding reconfigurado entretanto): vai para a base da conta.
+            deltas[pk] = deltas.get(pk, Decimal("0")) + delta
+
+    direct = {pk: delta for pk, delta in deltas.items() if delta}
+    conditional = conditional_balance_mode()
+    if direct:
+        if conditional:
+            _apply_account_deltas_guarded(by_pk, direct)
+        else:
+            _apply_account_deltas_locked(direct)
+    JournalLine.objects.bulk_create(line_objs)
+    _sync_wallet_balances([by_pk[pk].wallet_id for pk in direct if by_pk[pk].wallet_id])
+    if conditional:
+        _check_wallet_holds(
+            [by_pk[pk].wallet_id for pk, delta in direct.items() if by_pk[pk].wallet_id and delta < 0],
+            [jb.payment_intent_id for jb, _, _ in posted if jb.payment_intent_id],
+        )
+
+
+def _shard_key(
+    reference: str, idempotency_key: Optional[str], payment_intent: Optional["PaymentIntent"]
+) -> str:
+    return payment_intent.intent_id if payment_intent is not None else (idempotency_key or reference)
+
+
+def post_balanced_journal(
+    reference: str,
+    lines: List[LineSpec],
+    *,
+    idempotency_key: Optional[str] = None,
+    payment_intent: Optional["PaymentIntent"] = None,
+    metadata: Optional[dict] = None,
+) -> JournalBatch:
+    """
+    Cria JournalBatch e linhas; atualiza saldos das contas; sincroniza Wallet ligado.
+    Idempotente por idempotency_key.
+    """
+    _validate_lines(lines)
+
     with transaction.atomic():
+        # Insert-first: um duplicado custa o INSERT sem efeito + a leitura do batch existente.
+        jb = JournalBatch(
+            reference=reference,
+            idempotency_key=idempotency_key,
+            payment_intent=payment_intent,
+            metadata=metadata or {},
+        )
         if idempotency_key:
-            if JournalBatch.objects.filter(idempotency_key=idempotency_key).exists():
-                return JournalBatch.objects.get(idempotency_key=idempotency_key)
-
-        try:
-            jb = JournalBatch.objects.create(
-                reference=reference,
-                idempotency_key=idempotency_key,
-                payment_intent=payment_intent,
-                metadata=metadata or {},
-            )
-        except IntegrityError:
-            if idempotency_key:
-                return JournalBatch.objects.get(idempotency_key=idempotency_key)
-            raise
-        for acc, side, amount in resolved:
-            acc = LedgerAccount.objects.select_for_update().get(pk=acc.pk)
-            if side == JournalLine.SIDE_DEBIT:
-                _apply_account_delta(acc, amount, Decimal("0"))
-            else:
-                _apply_account_delta(acc, Decimal("0"), amount)
-            acc.save(update_fields=["balance"])
-            JournalLine.objects.create(journal=jb, account=acc, side=side, amount=amount)
-            _sync_wallet_balance(acc)
+            jb, created = insert_or_get(jb)
+            if not created:
+                return jb
+        else:
+            jb.save(force_insert=True)
+
+        accounts = _resolve_accounts(lines)
+        _apply_journal_effects([(jb, lines, _shard_key(reference, idempotency_key, payment_intent))], accounts)
 
         logger.info(
             "double_entry_journal_posted",
@@ -223,15 +435,16 @@ def post_settlement_journals(
         raise ValueError("gross_brl must equal net_brl + fee_brl")
 
     # (1) PI: DR carteira PI (reduz passivo), CR Clearing PI (reduz ativo)
-    post_balanced_journal(
-        f"settle_pi:{ref}",
-        [
-            {"account_id": acc_pi.id, "side": JournalLine.SIDE_DEBIT, "amount": amt_pi},
-            {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_CREDIT, "amount": amt_pi},
-        ],
-        idempotency_key=f"de_settle_pi:{ref}",
-        payment_intent=intent,
-    )
+    journals: List[tuple[str, List[LineSpec], str]] = [
+        (
+            f"settle_pi:{ref}",
+            [
+                {"account_id": acc_pi.id, "side": JournalLine.SIDE_DEBIT, "amount": amt_pi},
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_CREDIT, "amount": amt_pi},
+            ],
+            f"de_settle_pi:{ref}",
+        )
+    ]
 
     # (2) BRL: DR Clearing BRL (ativo recebe “gross”), CR carteira BRL tenant (net), CR receita taxa (fee)
     lines_brl: List[LineSpec] = [
@@ -242,48 +455,85 @@ def post_settlement_journals(
         lines_brl.append(
             {"code": CODE_PLATFORM_FEE_BRL, "side": JournalLine.SIDE_CREDIT, "amount": fee_brl},
         )
-    post_balanced_journal(
-        f"settle_brl_in:{ref}",
-        lines_brl,
-        idempotency_key=f"de_settle_brl_in:{ref}",
-        payment_intent=intent,
-    )
+    journals.append((f"settle_brl_in:{ref}", lines_brl, f"de_settle_brl_in:{ref}"))
 
     # (3) Saída Pix: DR passivo BRL tenant, CR ativo Clearing BRL
     if net_brl > 0:
-        post_balanced_journal(
-            f"settle_pix_out:{ref}",
-            [
-                {"account_id": acc_brl.id, "side": JournalLine.SIDE_DEBIT, "amount": net_brl},
-                {"code": CODE_CLEARING_BRL, "side": JournalLine.SIDE_CREDIT, "amount": net_brl},
-            ],
-            idempotency_key=f"de_settle_pix_out:{ref}",
-            payment_intent=intent,
+        journals.append(
+            (
+                f"settle_pix_out:{ref}",
+                [
+                    {"account_id": acc_brl.id, "side": JournalLine.SIDE_DEBIT, "amount": net_brl},
+                    {"code": CODE_CLEARING_BRL, "side": JournalLine.SIDE_CREDIT, "amount": net_brl},
+                ],
+                f"de_settle_pix_out:{ref}",
+            )
         )
 
+    from app.paypibridge.services.group_commit import JournalRequest, group_commit_enabled, submit_journals
+
+    if group_commit_enabled():
+        # Os três lançamentos vão como uma unidade no mesmo grupo (um commit partilhado com outros pedidos).
+        requests = [JournalRequest(r, lines, idempotency_key=key, payment_intent=intent) for r, lines, key in journals]
+        for future in submit_journals(requests):
+            future.result()
+        return
+    with transaction.atomic():
+        for reference, lines, key in journals:
+            post_balanced_journal(reference, lines, idempotency_key=key, payment_intent=intent)
+
 
 def reconcile_wallet_vs_account() -> List[dict[str, Any]]:
-    """Compara Wallet.balance com LedgerAccount ligado (deve coincidir)."""
+    """Compara Wallet.balance com LedgerAccount ligado (deve coincidir); um LEFT JOIN para todas."""
     out: List[dict[str, Any]] = []
-    for w in Wallet.objects.select_related("tenant").all():
-        la = LedgerAccount.objects.filter(wallet=w).first()
-        if not la:
+    rows = (
+        Wallet.objects.filter(Q(ledger_account__isnull=True) | ~Q(balance=F("ledger_account__balance")))
+        .values("id", "balance", "ledger_account__id", "ledger_account__code", "ledger_account__balance")
+        .order_by("id")
+    )
+    for row in rows:
+        if row["ledger_account__id"] is None:
             out.append(
                 {
-                    "wallet_id": w.id,
+                    "wallet_id": row["id"],
                     "issue": "missing_ledger_account",
-                    "wallet_balance": str(w.balance),
+                    "wallet_balance": str(row["balance"]),
                 }
             )
             continue
-        if w.balance != la.balance:
+        out.append(
+            {
+                "wallet_id": row["id"],
+                "code": row["ledger_account__code"],
+                "issue": "balance_mismatch",
+                "wallet_balance": str(row["balance"]),
+                "ledger_balance": str(row["ledger_account__balance"]),
+            }
+        )
+    return out
+
+
+def reconcile_sharded_accounts() -> List[dict[str, Any]]:
+    """Invariante das contas com sharding: base + soma(shards) == saldo recalculado das linhas."""
+    out: List[dict[str, Any]] = []
+    for acc in LedgerAccount.objects.filter(Q(shard_count__gt=0) | Q(shards__isnull=False)).distinct():
+        sums = JournalLine.objects.filter(account=acc).aggregate(
+            dr=Sum("amount", filter=Q(side=JournalLine.SIDE_DEBIT)),
+            cr=Sum("amount", filter=Q(side=JournalLine.SIDE_CREDIT)),
+        )
+        dr = sums["dr"] or Decimal("0")
+        cr = sums["cr"] or Decimal("0")
+        expected = acc.opening_balance + (dr - cr if acc.category == LedgerAccount.CAT_ASSET else cr - dr)
+        shard_total = acc.shards.aggregate(t=Sum("balance"))["t"] or Decimal("0")
+        effective = acc.balance + shard_total
+        if effective != expected:
             out.append(
                 {
-                    "wallet_id": w.id,
-                    "code": la.code,
-                    "issue": "balance_mismatch",
-                    "wallet_balance": str(w.balance),
-                    "ledger_balance": str(la.balance),
+                    "code": acc.code,
+                    "issue": "sharded_balance_mismatch",
+                    "base_balance": str(acc.balance),
+                    "shard_balance": str(shard_total),
+                    "lines_balance": str(expected),
                 }
             )
     return out
@@ -0,0 +1,245 @@
+"""
+Histórico de câmbio: FxRate (uma linha por refresh do FXService), rollups OHLC e lookup "taxa em T".
+
+- record_rate: acrescenta a observação (falha de escrita só é registada no log; o câmbio segue).
+- rate_at / rates_at: última observação com observed_at <= T. Em lote, um só SELECT com LATERAL sobre o
+  índice (pair, observed_at) no Postgres; noutros backends, timestamps agrupados (FX_HISTORY_GROUP_GAP_SECONDS)
+  com duas consultas por grupo e merge ordenado em Python.
+- Antes do horizonte raw (linhas já compactadas) a taxa vem do close do último bucket (minuto, depois hora)
+  terminado até T: nunca usa informação posterior a T, com a resolução do rollup.
+- rollup_fx_rates: minutos a partir de FxRate e horas a partir dos minutos, recalculando desde o último
+  bucket (incremental e idempotente).
+- compact_fx_rates: apaga raw mais antigo que FX_RATE_RAW_RETENTION_DAYS e minutos mais antigos que
+  FX_RATE_MINUTE_RETENTION_DAYS, nunca além do que já está coberto pelo rollup seguinte. Horas ficam.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from app.paypibridge.models import FxRate, FxRateRollup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAIR = "PI/BRL"
+
+_WIDTH = {
+    FxRateRollup.RES_MINUTE: timedelta(minutes=1),
+    FxRateRollup.RES_HOUR: timedelta(hours=1),
+}
+
+
+def pair_name(from_currency: str = "PI", to_currency: str = "BRL") -> str:
+    return f"{from_currency}/{to_currency}"
+
+
+def record_rate(
+    rate: Decimal,
+    *,
+    pair: str = DEFAULT_PAIR,
+    observed_at: Optional[datetime] = None,
+    source: str = FxRate.SOURCE_PROVIDERS,
+    sources: Optional[Dict[str, str]] = None,
+) -> Optional[FxRate]:
+    if not getattr(settings, "FX_RATE_HISTORY", True):
+        return None
+    try:
+        # Savepoint: uma falha aqui não invalida a transação de quem pediu a taxa.
+        with transaction.atomic():
+            return FxRate.objects.create(
+                pair=pair, rate=rate, observed_at=observed_at or timezone.now(), source=source, sources=sources or {}
+            )
+    except Exception:
+        logger.exception("fx_rate_record_failed", extra={"pair": pair, "rate": str(rate)})
+        return None
+
+
+# --- lookup ---
+
+
+def _floor(ts: datetime, resolution: str) -> datetime:
+    ts = ts.astimezone(dt_timezone.utc)
+    if resolution == FxRateRollup.RES_HOUR:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def _asof_postgres(qs: QuerySet, time_field: str, value_field: str, timestamps: Sequence[datetime]) -> List[Any]:
+    """Um SELECT: unnest dos timestamps e, para cada um, a linha anterior pelo índice (LATERAL ... LIMIT 1)."""
+    inner_sql, inner_params = qs.values(value_field).query.sql_with_params()
+    meta = qs.model._meta
+    time_col = connection.ops.quote_name(meta.get_field(time_field).column)
+    glue = "AND" if " WHERE " in inner_sql else "WHERE"
+    sql = (
+        "SELECT t.i, r.v FROM unnest(%s::timestamptz[]) WITH ORDINALITY AS t(ts, i) "
+        f"LEFT JOIN LATERAL ({inner_sql} {glue} {time_col} <= t.ts ORDER BY {time_col} DESC LIMIT 1) AS r(v) ON true "
+        "ORDER BY t.i"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(timestamps), *inner_params])
+        return [row[1] for row in cursor.fetchall()]
+
+
+def _asof_grouped(qs: QuerySet, time_field: str, value_field: str, timestamps: Sequence[datetime]) -> List[Any]:
+    """Timestamps ordenados em grupos; por grupo, a última linha antes do início e as linhas do intervalo."""
+    gap = timedelta(seconds=float(getattr(settings, "FX_HISTORY_GROUP_GAP_SECONDS", 3600)))
+    order = sorted(range(len(timestamps)), key=lambda i: timestamps[i])
+    out: List[Any] = [None] * len(timestamps)
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and timestamps[order[end]] - timestamps[order[end - 1]] <= gap:
+            end += 1
+        lo, hi = timestamps[order[start]], timestamps[order[end - 1]]
+        before = qs.filter(**{f"{time_field}__lte": lo}).order_by(f"-{time_field}")
+        rows = list(before.values_list(time_field, value_field)[:1])
+        if hi > lo:
+            rows += list(
+                qs.filter(**{f"{time_field}__gt": lo, f"{time_field}__lte": hi})
+                .order_by(time_field)
+                .values_list(time_field, value_field)
+            )
+        times = [t for t, _ in rows]
+        for i in order[start:end]:
+            pos = bisect.bisect_right(times, timestamps[i])
+            out[i] = rows[pos - 1][1] if pos else None
+        start = end
+    return out
+
+
+def _asof_many(qs: QuerySet, time_field: str, value_field: str, timestamps: Sequence[datetime]) -> List[Any]:
+    if not timestamps:
+        return []
+    if connection.vendor == "postgresql":
+        return _asof_postgres(qs, time_field, value_field, timestamps)
+    return _asof_grouped(qs, time_field, value_field, timestamps)
+
+
+def raw_horizon(pair: str = DEFAULT_PAIR) -> Optional[datetime]:
+    """observed_at mais antigo ainda em FxRate (antes disso só há rollups)."""
+    return FxRate.objects.filter(pair=pair).order_by("observed_at").values_list("observed_at", flat=True).first()
+
+
+def rates_at(timestamps: Sequence[datetime], pair: str = DEFAULT_PAIR) -> List[Optional[Decimal]]:
+    """Taxa em vigor em cada timestamp (mesma ordem; None sem observação anterior)."""
+    timestamps = [ts if timezone.is_aware(ts) else timezone.make_aware(ts, dt_timezone.utc) for ts in timestamps]
+    horizon = raw_horizon(pair)
+    out: List[Optional[Decimal]] = [None] * len(timestamps)
+    raw_idx = [i for i, ts in enumerate(timestamps) if horizon is not None and ts >= horizon]
+    if raw_idx:
+        found = _asof_many(FxRate.objects.filter(pair=pair), "observed_at", "rate", [timestamps[i] for i in raw_idx])
+        for i, rate in zip(raw_idx, found):
+            out[i] = rate
+
+    # Antes do horizonte raw: close do último bucket terminado até T (minuto, depois hora).
+    pending = [i for i in range(len(timestamps)) if out[i] is None and (horizon is None or timestamps[i] < horizon)]
+    for resolution in (FxRateRollup.RES_MINUTE, FxRateRollup.RES_HOUR):
+        if not pending:
+            break
+        qs = FxRateRollup.objects.filter(pair=pair, resolution=resolution)
+        found = _asof_many(qs, "bucket_start", "close", [timestamps[i] - _WIDTH[resolution] for i in pending])
+        for i, rate in zip(pending, found):
+            out[i] = rate
+        pending = [i for i in pending if out[i] is None]
+    return out
+
+
+def rate_at(ts: datetime, pair: str = DEFAULT_PAIR) -> Optional[Decimal]:
+    return rates_at([ts], pair)[0]
+
+
+# --- rollups ---
+
+
+def _write_buckets(pair: str, resolution: str, start: Optional[datetime], buckets: List[Dict[str, Any]]) -> int:
+    """Substitui os buckets a partir de `start` (calculados antes, fora da transação)."""
+    with transaction.atomic():
+        stale = FxRateRollup.objects.filter(pair=pair, resolution=resolution)
+        if start is not None:
+            stale = stale.filter(bucket_start__gte=start)
+        stale.delete()
+        FxRateRollup.objects.bulk_create(
+            [FxRateRollup(pair=pair, resolution=resolution, **bucket) for bucket in buckets], batch_size=1000
+        )
+    return len(buckets)
+
+
+def _ohlc(points: Iterable[Tuple[datetime, Decimal, Decimal, Decimal, Decimal, int]], resolution: str):
+    """Agrupa (ts, open, high, low, close, samples) ordenados por ts em buckets da resolução."""
+    current: Optional[Dict[str, Any]] = None
+    for ts, o, h, l, c, n in points:
+        bucket_start = _floor(ts, resolution)
+        if current is None or current["bucket_start"] != bucket_start:
+            if current is not None:
+                yield current
+            current = {"bucket_start": bucket_start, "open": o, "high": h, "low": l, "close": c, "samples": n}
+        else:
+            current["high"] = max(current["high"], h)
+            current["low"] = min(current["low"], l)
+            current["close"] = c
+            current["samples"] += n
+    if current is not None:
+        yield current
+
+
+def _last_bucket(pair: str, resolution: str) -> Optional[datetime]:
+    return (
+        FxRateRollup.objects.filter(pair=pair, resolution=resolution)
+        .order_by("-bucket_start")
+        .values_list("bucket_start", flat=True)
+        .first()
+    )
+
+
+def rollup_fx_rates(pair: str = DEFAULT_PAIR) -> Dict[str, int]:
+    """Recalcula minutos (de FxRate) e horas (dos minutos) desde o último bucket de cada resolução."""
+    start = _last_bucket(pair, FxRateRollup.RES_MINUTE)
+    raw = FxRate.objects.filter(pair=pair)
+    if start is not None:
+        raw = raw.filter(observed_at__gte=start)
+    samples = raw.order_by("observed_at", "id").values_list("observed_at", "rate").iterator()
+    minutes = _write_buckets(
+        pair,
+        FxRateRollup.RES_MINUTE,
+        start,
+        list(_ohlc(((ts, r, r, r, r, 1) for ts, r in samples), FxRateRollup.RES_MINUTE)),
+    )
+
+    start = _last_bucket(pair, FxRateRollup.RES_HOUR)
+    mins = FxRateRollup.objects.filter(pair=pair, resolution=FxRateRollup.RES_MINUTE)
+    if start is not None:
+        mins = mins.filter(bucket_start__gte=start)
+    candles = mins.order_by("bucket_start").values_list("bucket_start", "open", "high", "low", "close", "samples")
+    hours = _write_buckets(pair, FxRateRollup.RES_HOUR, start, list(_ohlc(candles.iterator(), FxRateRollup.RES_HOUR)))
+    return {"minute_buckets": minutes, "hour_buckets": hours}
+
+
+def compact_fx_rates(pair: str = DEFAULT_PAIR, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Apaga raw e minutos fora da retenção que já estão cobertos pelo rollup seguinte."""
+    now = now or timezone.now()
+    out = {"raw_deleted": 0, "minute_deleted": 0}
+
+    last_minute = _last_bucket(pair, FxRateRollup.RES_MINUTE)
+    if last_minute is not None:
+        cutoff = min(now - timedelta(days=int(getattr(settings, "FX_RATE_RAW_RETENTION_DAYS", 30))), last_minute)
+        out["raw_deleted"], _ = FxRate.objects.filter(pair=pair, observed_at__lt=cutoff).delete()
+
+    last_hour = _last_bucket(pair, FxRateRollup.RES_HOUR)
+    if last_hour is not None:
+        cutoff = min(now - timedelta(days=int(getattr(settings, "FX_RATE_MINUTE_RETENTION_DAYS", 180))), last_hour)
+        out["minute_deleted"], _ = FxRateRollup.objects.filter(
+            pair=pair, resolution=FxRateRollup.RES_MINUTE, bucket_start__lt=cutoff
+        ).delete()
+    if out["raw_deleted"] or out["minute_deleted"]:
+        logger.info("fx_rates_compacted", extra={"pair": pair, **out})
+    return out
@@ -0,0 +1,277 @@
+"""
+Fontes de câmbio PI/BRL: registo de providers, chamadas em paralelo e agregação.
+
+Um provider é uma função sem argumentos que devolve a taxa (Decimal) ou levanta exceção. O FXService
+resolve os nomes de FX_PROVIDERS (built-ins fixed/api/custom, register_provider() ou FX_SOURCE_<NOME>_URL)
+e chama aggregate_rate():
+
+- median: todos em paralelo no pool de FX_PROVIDER_WORKERS threads, até FX_PROVIDER_TIMEOUT; valores a
+  mais de FX_OUTLIER_PCT da mediana são rejeitados e a taxa é a mediana dos restantes (mínimo
+  FX_MIN_SOURCES; com duas fontes em desacordo não há taxa).
+- hedged: o primeiro provider; se não responder em FX_HEDGE_AFTER_MS (ou falhar antes), o segundo também
+  é chamado e vale a primeira taxa válida.
+
+Latência, erros, timeouts, outliers e hedges por provider ficam em memória do processo (provider_stats()).
+"""
+
+from __future__ import annotations
+
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+Fetcher = Callable[[], Decimal]
+
+AGG_MEDIAN = "median"
+AGG_HEDGED = "hedged"
+
+_registry: Dict[str, Fetcher] = {}
+
+
+def register_provider(name: str, fetcher: Fetcher) -> None:
+    _registry[name] = fetcher
+
+
+def registered_provider(name: str) -> Optional[Fetcher]:
+    return _registry.get(name)
+
+
+def parse_rate(data: Dict[str, Any], field_path: str = "") -> Decimal:
+    """Taxa do corpo JSON: campo com pontos (ex.: data.BRL) ou, sem campo, rate / price."""
+    if field_path:
+        value: Any = data
+        for part in field_path.split("."):
+            value = value[part]
+    else:
+        value = data.get("rate", data.get("price"))
+    if value is None:
+        raise ValueError("rate not found in provider response")
+    return Decimal(str(value))
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _http() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max(4, _workers()), max_retries=0)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def http_json_provider(url: str, api_key: str = "", field_path: str = "") -> Fetcher:
+    """Provider HTTP GET que devolve JSON (sessão keep-alive partilhada; erro HTTP levanta)."""
+
+    def fetch() -> Decimal:
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        response = _http().get(url, headers=headers, timeout=_timeout())
+        response.raise_for_status()
+        return parse_rate(response.json(), field_path)
+
+    return fetch
+
+
+# --- estatísticas ---
+
+
+@dataclass
+class ProviderStats:
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    outliers: int = 0
+    hedges: int = 0
+    latency_ms_total: int = 0
+    latency_ms_max: int = 0
+    last_latency_ms: Optional[int] = None
+    last_rate: Optional[str] = None
+    last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["avg_latency_ms"] = round(self.latency_ms_total / self.calls) if self.calls else None
+        out["error_rate"] = round(self.errors / self.calls, 4) if self.calls else None
+        return out
+
+
+_stats: Dict[str, ProviderStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _bump(name: str, **changes: Any) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(name, ProviderStats())
+        for key, value in changes.items():
+            if key in ("calls", "errors", "timeouts", "outliers", "hedges", "latency_ms_total"):
+                setattr(stats, key, getattr(stats, key) + value)
+            else:
+                setattr(stats, key, value)
+        if "last_latency_ms" in changes:
+            stats.latency_ms_max = max(stats.latency_ms_max, changes["last_latency_ms"])
+
+
+def provider_stats() -> Dict[str, Dict[str, Any]]:
+    with _stats_lock:
+        return {name: s.as_dict() for name, s in sorted(_stats.items())}
+
+
+def reset_provider_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+# --- chamadas ---
+
+
+def _workers() -> int:
+    return max(1, int(getattr(settings, "FX_PROVIDER_WORKERS", 8)))
+
+
+def _timeout() -> float:
+    return float(getattr(settings, "FX_PROVIDER_TIMEOUT", 5))
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix="fx-provider")
+        return _executor
+
+
+def _call(name: str, fetcher: Fetcher) -> Tuple[str, Optional[Decimal], Optional[str]]:
+    started = time.monotonic()
+    rate: Optional[Decimal] = None
+    error: Optional[str] = None
+    try:
+        rate = Decimal(str(fetcher()))
+        if not rate.is_finite() or rate <= 0:
+            raise ValueError(f"invalid rate {rate}")
+    except Exception as exc:
+        rate, error = None, f"{type(exc).__name__}: {exc}"
+    latency_ms = int((time.monotonic() - started) * 1000)
+    _bump(
+        name,
+        calls=1,
+        errors=1 if error else 0,
+        latency_ms_total=latency_ms,
+        last_latency_ms=latency_ms,
+        **({"last_error": error} if error else {"last_rate": str(rate)}),
+    )
+    if error:
+        logger.warning("fx_provider_failed", extra={"provider": name, "error": error, "latency_ms": latency_ms})
+    return name, rate, error
+
+
+@dataclass
+class FXAggregate:
+    rate: Optional[Decimal]
+    mode: str
+    sources: Dict[str, str] = field(default_factory=dict)  # provider -> taxa usada
+    rejected: Dict[str, str] = field(default_factory=dict)  # outliers
+    errors: Dict[str, str] = field(default_factory=dict)
+    hedged: bool = False
+
+    def as_metadata(self) -> Dict[str, Any]:
+        return {
+            "aggregation": self.mode,
+            "sources": self.sources,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "hedged": self.hedged,
+        }
+
+
+def _median(providers: Dict[str, Fetcher]) -> FXAggregate:
+    out = FXAggregate(rate=None, mode=AGG_MEDIAN)
+    futures = {_pool().submit(_call, name, fetcher): name for name, fetcher in providers.items()}
+    done, pending = wait(futures, timeout=_timeout())
+    for future in pending:
+        name = futures[future]
+        out.errors[name] = "timeout"
+        _bump(name, timeouts=1)
+    values: Dict[str, Decimal] = {}
+    for future in done:
+        name, rate, error = future.result()
+        if error:
+            out.errors[name] = error
+        else:
+            values[name] = rate
+    if not values:
+        return out
+
+    center = statistics.median(values.values())
+    max_dev = Decimal(str(getattr(settings, "FX_OUTLIER_PCT", 0.05)))
+    for name, rate in values.items():
+        if abs(rate - center) / center > max_dev:
+            out.rejected[name] = str(rate)
+            _bump(name, outliers=1)
+        else:
+            out.sources[name] = str(rate)
+    if len(out.sources) >= max(1, int(getattr(settings, "FX_MIN_SOURCES", 1))):
+        out.rate = statistics.median(Decimal(v) for v in out.sources.values())
+    if out.rejected:
+        logger.warning("fx_outliers_rejected", extra={"median": str(center), "rejected": out.rejected})
+    return out
+
+
+def _hedged(providers: Dict[str, Fetcher]) -> FXAggregate:
+    out = FXAggregate(rate=None, mode=AGG_HEDGED)
+    names = list(providers)
+    deadline = time.monotonic() + _timeout()
+    pending: Dict[Future, str] = {_pool().submit(_call, names[0], providers[names[0]]): names[0]}
+    hedge_after = float(getattr(settings, "FX_HEDGE_AFTER_MS", 300)) / 1000.0
+    first_wait = min(hedge_after, _timeout())
+
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=first_wait if not out.hedged else remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, rate, error = future.result()
+            del pending[future]
+            if error is None:
+                out.rate = rate
+                out.sources[name] = str(rate)
+                return out
+            out.errors[name] = error
+        # Primário lento (ou já falhou): pedido ao secundário, sem cancelar o primário.
+        if not out.hedged and len(names) > 1:
+            out.hedged = True
+            _bump(names[1], hedges=1)
+            pending[_pool().submit(_call, names[1], providers[names[1]])] = names[1]
+    for name in pending.values():
+        out.errors[name] = "timeout"
+        _bump(name, timeouts=1)
+    return out
+
+
+def aggregate_rate(providers: Dict[str, Fetcher], mode: Optional[str] = None) -> FXAggregate:
+    """Taxa a partir dos providers dados (ordem = prioridade no modo hedged)."""
+    mode = mode or getattr(settings, "FX_AGGREGATION", AGG_MEDIAN)
+    if not providers:
+        return FXAggregate(rate=None, mode=mode)
+    if mode == AGG_HEDGED:
+        return _hedged(providers)
+    return _median(providers)
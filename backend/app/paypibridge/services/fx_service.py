@@ -3,15 +3,42 @@ Foreign Exchange (FX) Service for Pi → BRL conversion.
 
 This service handles currency conversion rates and provides
 real-time or cached exchange rates for Pi to Brazilian Real (BRL).
+
+Rates are cached in two tiers:
+- L1: per-process dict, valid for FX_L1_TTL seconds (never past the shared entry's freshness).
+- L2: Django cache entry {rate, fetched_at, fresh_until}, kept FX_STALE_TTL seconds past
+  FX_CACHE_TIMEOUT so a stale rate can still be served.
+
+Only one refresh per pair runs at a time (thread lock + cache.add lock shared by all workers).
+A stale rate is returned immediately while a background thread refreshes it; only a cold miss
+waits for the provider, and followers of a cold miss wait for the leader instead of calling it too.
+The update_fx_rates beat task refreshes ahead of expiry, so the request path normally only reads.
+
+Every refresh is appended to FxRate (see fx_history), so get_rate_at / get_rates_at answer
+"which rate applied at time T" without scanning PaymentIntent.fx_quote.
+
+A refresh queries every source in FX_PROVIDERS (default: FX_PROVIDER) through fx_providers:
+median with outlier rejection, or a hedged request to the second source when the first is slow.
+If all sources fail with nothing cached, FX_FIXED_RATE is served (FX_FIXED_FALLBACK) as an already
+stale entry, so the next read retries the providers in the background. Quotes report which sources
+formed the rate and per-provider latency/error stats.
 """
 
 import os
 import logging
-import requests
-from typing import Optional, Dict, Any
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
 from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
+from django.conf import settings
 from django.core.cache import cache
+from django.db import close_old_connections, connection
+
+from .fx_history import pair_name, rate_at, rates_at, record_rate
+from .fx_providers import aggregate_rate, http_json_provider, provider_stats, registered_provider
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +55,37 @@ class FXService:
         self.fixed_rate = Decimal(os.getenv('FX_FIXED_RATE', '4.76'))  # Default rate
         self.api_url = os.getenv('FX_API_URL', '')
         self.api_key = os.getenv('FX_API_KEY', '')
+        self._l1: Dict[str, Tuple[Decimal, float, Dict[str, Any]]] = {}
+        self._l1_lock = threading.Lock()
+        self._flights: Dict[str, threading.Lock] = {}
+        self._refresher: Optional[ThreadPoolExecutor] = None
+        # Token of the shared refresh lock held by this process (one holder per key: the local flight lock).
+        self._refresh_tokens: Dict[str, str] = {}
+
+    # Read on every call (override_settings / no worker restart needed).
+    @property
+    def stale_timeout(self) -> int:
+        return int(getattr(settings, 'FX_STALE_TTL', 600))
+
+    @property
+    def l1_timeout(self) -> float:
+        return float(getattr(settings, 'FX_L1_TTL', 5))
+
+    @property
+    def refresh_lock_timeout(self) -> int:
+        return int(getattr(settings, 'FX_REFRESH_LOCK_TIMEOUT', 15))
+
+    @property
+    def refresh_wait(self) -> float:
+        return float(getattr(settings, 'FX_REFRESH_WAIT', 6))
+
+    @property
+    def provider_names(self) -> List[str]:
+        return list(getattr(settings, 'FX_PROVIDERS', None) or [self.provider])
+
+    @property
+    def fixed_fallback(self) -> bool:
+        return bool(getattr(settings, 'FX_FIXED_FALLBACK', True))
     
     def get_rate(self, from_currency: str = 'PI', to_currency: str = 'BRL') -> Optional[Decimal]:
         """
@@ -47,73 +105,221 @@ class FXService:
             )
             return None
         
-        # Check cache first
+        return self._lookup(f'fx_rate_{from_currency}_{to_currency}')[0]
+
+    def _lookup(self, cache_key: str) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        """Rate plus the metadata of the refresh that produced it."""
+        hit = self._l1_get(cache_key)
+        if hit is not None:
+            return hit
+
+        entry = self._l2_get(cache_key)
+        if entry is not None:
+            rate = Decimal(entry['rate'])
+            meta = entry.get('metadata') or {}
+            if time.time() < entry['fresh_until']:
+                self._l1_set(cache_key, rate, entry['fresh_until'], meta)
+                return rate, meta
+            # Stale: serve it and let one worker refresh in the background.
+            if self._acquire_refresh(cache_key):
+                self._background().submit(self._refresh_in_background, cache_key)
+                logger.info("FX rate stale, refreshing in background", extra={'rate': str(rate)})
+            return rate, {**meta, 'stale': True}
+
+        return self._refresh_cold(cache_key)
+
+    def refresh_rate(self, from_currency: str = 'PI', to_currency: str = 'BRL') -> Optional[Decimal]:
+        """
+        Fetch the rate now and store it in L2/L1 (used by update_fx_rates ahead of expiry).
+
+        Returns:
+            The new rate, or None if the provider failed or another worker is already refreshing
+        """
         cache_key = f'fx_rate_{from_currency}_{to_currency}'
-        cached_rate = cache.get(cache_key)
-        if cached_rate:
-            logger.debug(f"FX rate retrieved from cache", extra={'rate': str(cached_rate)})
-            return Decimal(str(cached_rate))
-        
-        # Get fresh rate
-        rate = self._fetch_rate()
-        
+        if not self._acquire_refresh(cache_key):
+            return None
+        return self._refresh_locked(cache_key)[0]
+
+    def get_rate_at(self, ts: datetime, from_currency: str = 'PI', to_currency: str = 'BRL') -> Optional[Decimal]:
+        """
+        Rate in effect at `ts` (last observation at or before it) from the FxRate history.
+
+        Returns:
+            Exchange rate as Decimal or None if nothing was observed before `ts`
+        """
+        return rate_at(ts, pair_name(from_currency, to_currency))
+
+    def get_rates_at(
+        self, timestamps: List[datetime], from_currency: str = 'PI', to_currency: str = 'BRL'
+    ) -> List[Optional[Decimal]]:
+        """Batch version of get_rate_at (same order as `timestamps`; one query on Postgres)."""
+        return rates_at(timestamps, pair_name(from_currency, to_currency))
+
+    def clear_local_cache(self) -> None:
+        """Drop this process's L1 entries (L2 is untouched)."""
+        with self._l1_lock:
+            self._l1.clear()
+
+    def _l1_get(self, cache_key: str) -> Optional[Tuple[Decimal, Dict[str, Any]]]:
+        entry = self._l1.get(cache_key)
+        if entry and entry[1] > time.time():
+            return entry[0], entry[2]
+        return None
+
+    def _l1_set(self, cache_key: str, rate: Decimal, fresh_until: float, meta: Dict[str, Any]) -> None:
+        with self._l1_lock:
+            self._l1[cache_key] = (rate, min(time.time() + self.l1_timeout, fresh_until), meta)
+
+    def _l2_get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        entry = cache.get(cache_key)
+        if isinstance(entry, str):
+            # Plain string written before the two-tier cache: fresh until its TTL runs out.
+            return {'rate': entry, 'fresh_until': float('inf')}
+        return entry or None
+
+    def _store(self, cache_key: str, rate: Decimal, meta: Dict[str, Any], fresh: bool = True) -> None:
+        now = time.time()
+        meta = {**meta, 'fetched_at': datetime.utcfromtimestamp(now).isoformat()}
+        fresh_until = now + self.cache_timeout if fresh else now
+        entry = {'rate': str(rate), 'fetched_at': now, 'fresh_until': fresh_until, 'metadata': meta}
+        cache.set(cache_key, entry, self.cache_timeout + self.stale_timeout)
+        if fresh:
+            self._l1_set(cache_key, rate, fresh_until, meta)
+
+    def _acquire_refresh(self, cache_key: str) -> bool:
+        """Single-flight: in-process lock first, then the lock shared by all workers (holding a token)."""
+        with self._l1_lock:
+            local = self._flights.setdefault(cache_key, threading.Lock())
+        if not local.acquire(blocking=False):
+            return False
+        token = uuid.uuid4().hex
+        if cache.add(f'{cache_key}:refresh', token, self.refresh_lock_timeout):
+            self._refresh_tokens[cache_key] = token
+            return True
+        local.release()
+        return False
+
+    def _release_refresh(self, cache_key: str) -> None:
+        """
+        Drop the shared lock only if it still holds our token: a refresh slower than
+        FX_REFRESH_LOCK_TIMEOUT must not delete the lock another worker took after it expired.
+        """
+        lock_key = f'{cache_key}:refresh'
+        token = self._refresh_tokens.pop(cache_key, None)
+        if token is not None and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+        self._flights[cache_key].release()
+
+    def _refresh_locked(self, cache_key: str, cold: bool = False) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        try:
+            return self._fetch_and_store(cache_key, cold)
+        except Exception as e:
+            # A failed refresh keeps the stale entry; the next stale read tries again.
+            logger.error(f"Error refreshing FX rate: {e}", exc_info=True)
+            return None, {}
+        finally:
+            self._release_refresh(cache_key)
+
+    def _refresh_in_background(self, cache_key: str) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        """
+        _refresh_locked on the fx-refresh thread. record_rate opens a DB connection on that thread;
+        it is closed when the refresh ends (close_old_connections would keep it open under CONN_MAX_AGE).
+        """
+        close_old_connections()
+        try:
+            return self._refresh_locked(cache_key)
+        finally:
+            connection.close()
+
+    def _fetch_and_store(self, cache_key: str, cold: bool) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        rate, meta = self._fetch_rate()
         if rate:
-            # Cache the rate
-            cache.set(cache_key, str(rate), self.cache_timeout)
+            self._store(cache_key, rate, meta)
+            record_rate(rate, sources=meta.get('sources'))
             logger.info(
-                f"FX rate fetched and cached",
-                extra={'rate': str(rate), 'provider': self.provider}
+                "FX rate fetched and cached",
+                extra={'rate': str(rate), 'provider': ",".join(self.provider_names)}
             )
-        
-        return rate
-    
-    def _fetch_rate(self) -> Optional[Decimal]:
-        """Fetch exchange rate from configured provider."""
-        if self.provider == 'fixed':
-            return self.fixed_rate
-        
-        elif self.provider == 'api':
-            return self._fetch_from_api()
-        
-        elif self.provider == 'custom':
-            # Custom provider implementation
-            return self._fetch_custom()
-        
-        else:
-            logger.warning(f"Unknown FX provider: {self.provider}")
-            return self.fixed_rate  # Fallback to fixed rate
-    
-    def _fetch_from_api(self) -> Optional[Decimal]:
-        """Fetch rate from external API."""
+            return rate, meta
+        if cold and self.fixed_fallback:
+            # Nothing to serve: fixed rate, stored already stale so the next read retries the providers.
+            meta['fallback'] = 'fixed'
+            logger.error("All FX providers failed, serving fixed rate", extra={'errors': meta.get('errors')})
+            self._store(cache_key, self.fixed_rate, meta, fresh=False)
+            record_rate(self.fixed_rate, source='fallback')
+            return self.fixed_rate, meta
+        return None, meta
+
+    def _refresh_cold(self, cache_key: str) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        """Nothing cached: the leader fetches, followers wait for its result (bounded by FX_REFRESH_WAIT)."""
+        if self._acquire_refresh(cache_key):
+            return self._refresh_locked(cache_key, cold=True)
+        deadline = time.monotonic() + self.refresh_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            entry = self._l2_get(cache_key)
+            if entry is not None:
+                rate = Decimal(entry['rate'])
+                meta = entry.get('metadata') or {}
+                if time.time() < entry['fresh_until']:
+                    self._l1_set(cache_key, rate, entry['fresh_until'], meta)
+                return rate, meta
+        logger.warning("FX refresh leader timed out, fetching inline", extra={'cache_key': cache_key})
+        return self._fetch_and_store(cache_key, cold=True)
+
+    def _background(self) -> ThreadPoolExecutor:
+        with self._l1_lock:
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fx-refresh")
+            return self._refresher
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the fx-refresh executor (after a running refresh, if wait); the next stale read starts a new one."""
+        with self._l1_lock:
+            refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.shutdown(wait=wait)
+
+    def _fetch_rate(self) -> Tuple[Optional[Decimal], Dict[str, Any]]:
+        """
+        Fetch exchange rate from the configured providers.
+
+        Returns:
+            (rate or None if no usable rate, metadata of this fetch: sources, outliers, errors)
+        """
+        providers = {}
+        unknown = {}
+        for name in self.provider_names:
+            fetcher = self._provider(name)
+            if fetcher is None:
+                logger.warning(f"Unknown FX provider: {name}")
+                unknown[name] = 'unknown provider'
+            else:
+                providers[name] = fetcher
+        result = aggregate_rate(providers)
+        meta = result.as_metadata()
+        meta['errors'].update(unknown)
+        return result.rate, meta
+
+    def _provider(self, name: str):
+        """Built-in (fixed, api, custom), register_provider() or FX_SOURCE_<NAME>_URL."""
+        builtin = {'fixed': lambda: self.fixed_rate, 'api': self._fetch_from_api, 'custom': self._fetch_custom}
+        if name in builtin:
+            return builtin[name]
+        fetcher = registered_provider(name)
+        if fetcher is not None:
+            return fetcher
+        prefix = f'FX_SOURCE_{name.upper()}_'
+        url = os.getenv(prefix + 'URL', '')
+        if url:
+            return http_json_provider(url, os.getenv(prefix + 'KEY', ''), os.getenv(prefix + 'FIELD', ''))
+        return None
+
+    def _fetch_from_api(self) -> Decimal:
+        """Fetch rate from external API (FX_API_URL); errors propagate to the aggregator."""
         if not self.api_url:
-            logger.warning("FX_API_URL not configured, using fixed rate")
-            return self.fixed_rate
-        
-        try:
-            headers = {}
-            if self.api_key:
-                headers['Authorization'] = f'Bearer {self.api_key}'
-            
-            response = requests.get(
-                self.api_url,
-                headers=headers,
-                timeout=5
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            # Adjust parsing based on API response format
-            rate = Decimal(str(data.get('rate', data.get('price', self.fixed_rate))))
-            
-            return rate
-            
-        except Exception as e:
-            logger.error(
-                f"Error fetching FX rate from API: {e}",
-                exc_info=True,
-                extra={'api_url': self.api_url}
-            )
-            return self.fixed_rate  # Fallback
+            raise ValueError("FX_API_URL not configured")
+        return http_json_provider(self.api_url, self.api_key)()
     
     def _fetch_custom(self) -> Optional[Decimal]:
         """Custom rate provider implementation."""
@@ -145,7 +351,7 @@ class FXService:
             amount_brl = amount_brl.quantize(Decimal('0.01'))
             
             logger.debug(
-                f"Currency conversion completed",
+                "Currency conversion completed",
                 extra={
                     'amount_pi': str(amount_pi),
                     'rate': str(rate),
@@ -171,9 +377,10 @@ class FXService:
             amount_pi: Amount in Pi to quote
             
         Returns:
-            Dict with rate, amount_brl, timestamp, and provider info
+            Dict with rate, amount_brl, timestamp, provider info and metadata
+            (sources used, rejected outliers, errors, per-provider stats)
         """
-        rate = self.get_rate()
+        rate, meta = self._lookup('fx_rate_PI_BRL')
         amount_brl = self.convert(amount_pi, rate) if rate else None
         
         return {
@@ -183,8 +390,9 @@ class FXService:
             'rate': str(rate) if rate else None,
             'amount_brl': str(amount_brl) if amount_brl else None,
             'timestamp': datetime.utcnow().isoformat(),
-            'provider': self.provider,
-            'cache_ttl': self.cache_timeout
+            'provider': ",".join(self.provider_names),
+            'cache_ttl': self.cache_timeout,
+            'metadata': {**meta, 'provider_stats': provider_stats()},
         }
 
 
@@ -0,0 +1,265 @@
+"""
+Group commit de lançamentos (opt-in, JOURNAL_GROUP_COMMIT=1).
+
+Os pedidos de vários threads entram numa fila; um thread de flush junta-os durante
+JOURNAL_GROUP_COMMIT_WINDOW_MS (ou até JOURNAL_GROUP_COMMIT_MAX_BATCH) e grava-os numa só transação:
+um commit (um fsync) por grupo, deltas somados por conta antes de aplicados. Cada chamador recebe o
+seu JournalBatch ou a sua exceção através de um Future.
+
+submit_journals() enfileira vários lançamentos como uma unidade (sempre no mesmo grupo, tudo ou nada).
+Erros de validação (linhas desequilibradas, conta inexistente) só afetam a própria unidade. Se o
+grupo falhar ao aplicar (ex.: saldo insuficiente no modo conditional), as unidades são repetidas uma
+a uma, cada uma na sua transação, para isolar a culpada.
+Dentro de uma transação aberta o pedido é gravado diretamente: o thread de flush usa outra ligação
+e não veria (nem reverteria com) os dados ainda por confirmar do chamador.
+shutdown() grava o que já estiver na fila, para o thread e fecha a sua ligação à base de dados.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from app.paypibridge.models import JournalBatch
+from app.paypibridge.services.double_entry_service import (
+    LineSpec,
+    _apply_journal_effects,
+    _check_accounts,
+    _lookup_accounts,
+    _shard_key,
+    _validate_lines,
+    post_balanced_journal,
+)
+from app.paypibridge.services.idempotency import insert_or_get
+
+if TYPE_CHECKING:
+    from app.paypibridge.models import PaymentIntent
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JournalRequest:
+    reference: str
+    lines: List[LineSpec]
+    idempotency_key: Optional[str] = None
+    payment_intent: Optional["PaymentIntent"] = None
+    metadata: Optional[dict] = None
+    future: Future = field(default_factory=Future)
+
+    def post_direct(self) -> JournalBatch:
+        return post_balanced_journal(
+            self.reference,
+            self.lines,
+            idempotency_key=self.idempotency_key,
+            payment_intent=self.payment_intent,
+            metadata=self.metadata,
+        )
+
+
+class GroupCommitPoster:
+    """Fila + thread de flush; um poster por processo (ver get_group_poster)."""
+
+    def __init__(self, window_ms: Optional[float] = None, max_batch: Optional[int] = None):
+        if window_ms is None:
+            window_ms = float(getattr(settings, "JOURNAL_GROUP_COMMIT_WINDOW_MS", 5))
+        if max_batch is None:
+            max_batch = int(getattr(settings, "JOURNAL_GROUP_COMMIT_MAX_BATCH", 100))
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self._queue: "queue.Queue[Optional[List[JournalRequest]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.stats = {"groups": 0, "requests": 0, "fallbacks": 0}
+
+    def submit_unit(self, unit: List[JournalRequest]) -> List[Future]:
+        if connection.in_atomic_block:
+            _post_unit_direct(unit)
+        else:
+            self._ensure_thread()
+            self._queue.put(unit)
+        return [req.future for req in unit]
+
+    def submit(self, reference: str, lines: List[LineSpec], **kwargs) -> Future:
+        return self.submit_unit([JournalRequest(reference, lines, **kwargs)])[0]
+
+    def post(self, reference: str, lines: List[LineSpec], **kwargs) -> JournalBatch:
+        return self.submit(reference, lines, **kwargs).result()
+
+    def _ensure_thread(self) -> None:
+        # Após fork (workers Celery prefork) o thread do processo pai não existe no filho.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,), name="journal-group-commit", daemon=True
+            )
+            self._thread.start()
+
+    def shutdown(self, timeout: Optional[float] = 5.0) -> None:
+        """Para o thread de flush depois de gravar o que já está na fila; o thread fecha a sua ligação."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None or not thread.is_alive() or self._pid != os.getpid():
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def _run(self, pending: "queue.Queue[Optional[List[JournalRequest]]]") -> None:
+        try:
+            stopping = False
+            while not stopping:
+                first = pending.get()
+                if first is None:
+                    break
+                units = [first]
+                size = len(first)
+                deadline = time.monotonic() + self.window
+                while size < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        unit = pending.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if unit is None:
+                        stopping = True
+                        break
+                    units.append(unit)
+                    size += len(unit)
+                close_old_connections()
+                try:
+                    self.flush(units)
+                except Exception:  # nunca deixar o thread morrer com Futures pendentes
+                    logger.exception("journal_group_commit_flush_failed")
+                    for unit in units:
+                        _fail_unit(unit, RuntimeError("group commit flush failed"))
+        finally:
+            # close_old_connections mantém a ligação viva com CONN_MAX_AGE: fechá-la ao sair.
+            connection.close()
+
+    def flush(self, units: List[List[JournalRequest]]) -> None:
+        """Grava as unidades numa transação e resolve os Futures (chamado pelo thread de flush)."""
+        self.stats["groups"] += 1
+        self.stats["requests"] += sum(len(unit) for unit in units)
+        pending = []
+        for unit in units:
+            try:
+                for req in unit:
+                    _validate_lines(req.lines)
+            except ValueError as exc:
+                _fail_unit(unit, exc)
+                continue
+            pending.append(unit)
+        if not pending:
+            return
+
+        valid: List[List[JournalRequest]] = []
+        results: Dict[int, JournalBatch] = {}
+        try:
+            with transaction.atomic():
+                accounts = _lookup_accounts([spec for unit in pending for req in unit for spec in req.lines])
+                for unit in pending:
+                    try:
+                        for req in unit:
+                            _check_accounts(req.lines, accounts)
+                    except ValueError as exc:
+                        _fail_unit(unit, exc)
+                        continue
+                    valid.append(unit)
+
+                posted = []
+                for req in (req for unit in valid for req in unit):
+                    jb = JournalBatch(
+                        reference=req.reference,
+                        idempotency_key=req.idempotency_key,
+                        payment_intent=req.payment_intent,
+                        metadata=req.metadata or {},
+                    )
+                    if req.idempotency_key:
+                        jb, created = insert_or_get(jb)
+                    else:
+                        jb.save(force_insert=True)
+                        created = True
+                    results[id(req)] = jb
+                    if created:
+                        posted.append(
+                            (jb, req.lines, _shard_key(req.reference, req.idempotency_key, req.payment_intent))
+                        )
+                if posted:
+                    _apply_journal_effects(posted, accounts)
+        except Exception as exc:
+            self.stats["fallbacks"] += 1
+            logger.warning(
+                "journal_group_commit_fallback",
+                extra={"units": len(valid or pending), "error": str(exc)},
+            )
+            for unit in valid or pending:
+                _post_unit_direct(unit)
+            return
+
+        for unit in valid:
+            for req in unit:
+                req.future.set_result(results[id(req)])
+        logger.info("journal_group_committed", extra={"units": len(valid), "posted": len(posted)})
+
+
+def _fail_unit(unit: List[JournalRequest], exc: BaseException) -> None:
+    for req in unit:
+        if not req.future.done():
+            req.future.set_exception(exc)
+
+
+def _post_unit_direct(unit: List[JournalRequest]) -> None:
+    """Unidade gravada sem group commit: numa transação (savepoint se já houver uma aberta)."""
+    try:
+        with transaction.atomic():
+            results = [req.post_direct() for req in unit]
+    except Exception as exc:
+        _fail_unit(unit, exc)
+        return
+    for req, jb in zip(unit, results):
+        req.future.set_result(jb)
+
+
+_poster: Optional[GroupCommitPoster] = None
+_poster_lock = threading.Lock()
+
+
+def group_commit_enabled() -> bool:
+    return bool(getattr(settings, "JOURNAL_GROUP_COMMIT", False))
+
+
+def get_group_poster() -> GroupCommitPoster:
+    global _poster
+    if _poster is None:
+        with _poster_lock:
+            if _poster is None:
+                _poster = GroupCommitPoster()
+    return _poster
+
+
+def submit_journals(requests: List[JournalRequest]) -> List[Future]:
+    """
+    Futures com os JournalBatch, gravados como uma unidade (tudo ou nada): via group commit se
+    JOURNAL_GROUP_COMMIT estiver ativo, senão já, numa transação.
+    """
+    if group_commit_enabled():
+        return get_group_poster().submit_unit(requests)
+    _post_unit_direct(requests)
+    return [req.future for req in requests]
@@ -0,0 +1,77 @@
+"""
+Idempotência insert-first: INSERT ... ON CONFLICT (idempotency_key) DO NOTHING RETURNING id.
+
+O caminho comum é um único INSERT; só há leitura quando a chave já existe, e o duplicado não
+levanta IntegrityError (que abortaria a transação/savepoint em curso no Postgres).
+Backends sem ON CONFLICT + RETURNING usam savepoint + IntegrityError como fallback.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Optional, Tuple, TypeVar
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, router, transaction
+from django.db.models import Model
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=Model)
+
+
+def _supports_insert_ignore_returning(connection) -> bool:
+    # Postgres, e SQLite >= 3.35 (RETURNING); versões anteriores caem no fallback com savepoint.
+    return connection.vendor in ("postgresql", "sqlite") and connection.features.can_return_columns_from_insert
+
+
+def _insert_ignore_returning_pk(obj: Model, key_field: str, using: str) -> Optional[int]:
+    connection = connections[using]
+    meta = obj._meta
+    fields = [f for f in meta.local_concrete_fields if not f.primary_key]
+    values = [f.get_db_prep_save(f.pre_save(obj, True), connection=connection) for f in fields]
+    qn = connection.ops.quote_name
+    key_column = qn(meta.get_field(key_field).column)
+    # O predicado permite inferir tanto unique=True como o índice único parcial (... IS NOT NULL);
+    # outras violações de unicidade continuam a levantar IntegrityError.
+    sql = (
+        "INSERT INTO {table} ({cols}) VALUES ({params}) "
+        "ON CONFLICT ({key}) WHERE {key} IS NOT NULL DO NOTHING RETURNING {pk}"
+    ).format(
+        table=qn(meta.db_table),
+        cols=", ".join(qn(f.column) for f in fields),
+        params=", ".join(["%s"] * len(fields)),
+        key=key_column,
+        pk=qn(meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def insert_or_get(obj: M, key_field: str = "idempotency_key") -> Tuple[M, bool]:
+    """
+    Reclama a chave inserindo `obj` (ainda não gravado).
+    Devolve (obj, True) se inseriu, ou (registo existente com a mesma chave, False).
+    """
+    model = type(obj)
+    using = router.db_for_write(model) or DEFAULT_DB_ALIAS
+    key = getattr(obj, key_field)
+    if _supports_insert_ignore_returning(connections[using]):
+        pk = _insert_ignore_returning_pk(obj, key_field, using)
+        if pk is not None:
+            obj.pk = pk
+            obj._state.adding = False
+            obj._state.db = using
+            return obj, True
+        return model._default_manager.using(using).get(**{key_field: key}), False
+
+    try:
+        with transaction.atomic(using=using):
+            obj.save(force_insert=True, using=using)
+        return obj, True
+    except IntegrityError:
+        existing = model._default_manager.using(using).filter(**{key_field: key}).first()
+        if existing is None:
+            raise
+        return existing, False
@@ -0,0 +1,312 @@
+"""
+Evidência de adulteração para JournalBatch/JournalLine: cadeia de hashes + checkpoints Merkle.
+
+Cada batch recebe chain_seq (sequência sem buracos), prev_hash e hash = sha256(prev_hash || digest),
+onde digest cobre id, referência, chave de idempotência, metadata, created_at e as linhas (conta, lado,
+montante) ordenadas.
+
+O encadeamento não corre na transação do lançamento: bloquear a única JournalChainHead até ao commit
+serializaria todos os lançamentos (anulando shards e group commit). seal_journal_chain (beat, a cada
+JOURNAL_CHAIN_SEAL_INTERVAL_SECONDS) encadeia por id os batches já confirmados ainda sem chain_seq, em
+páginas de uma transação cada, e grava a raiz Merkle de cada intervalo completo de
+JOURNAL_MERKLE_RANGE_SIZE hashes. Custo: um batch só fica protegido pela cadeia depois do selo seguinte;
+por isso um batch por encadear há mais de um intervalo de selo (selo parado ou a falhar, ou chain_seq
+apagado) é erro em verify_range e em ledger_totals_service.check_ledger_totals (stale_unchained).
+verify_range verifica qualquer intervalo em tempo proporcional ao seu tamanho (e conta os batches por
+encadear) e inclusion_proof devolve uma prova O(log n) para um batch. Batches cujas linhas foram
+arquivadas (lines_archived_in) não têm digest recalculável: contam o elo e a raiz Merkle sobre o hash
+guardado; partition_service.verify_archive recalcula-os a partir do arquivo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from app.paypibridge.models import JournalBatch, JournalChainHead, JournalLine, JournalMerkleCheckpoint
+
+logger = logging.getLogger(__name__)
+
+CHAIN_JOURNAL = "journal"
+GENESIS_HASH = "0" * 64
+
+_QUANT = Decimal("0.00000001")
+
+LineTuple = Tuple[int, str, Decimal]
+
+
+def range_size() -> int:
+    return max(2, int(getattr(settings, "JOURNAL_MERKLE_RANGE_SIZE", 1024)))
+
+
+def seal_interval() -> timedelta:
+    return timedelta(seconds=max(1.0, float(getattr(settings, "JOURNAL_CHAIN_SEAL_INTERVAL_SECONDS", 60))))
+
+
+def stale_unchained(now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Batches ainda sem chain_seq criados há mais de um intervalo de selo (None se não houver)."""
+    cutoff = (now or timezone.now()) - seal_interval()
+    stale = JournalBatch.objects.filter(chain_seq__isnull=True, created_at__lt=cutoff).aggregate(
+        count=Count("id"), oldest_journal_id=Min("id"), oldest_created_at=Min("created_at")
+    )
+    if not stale["count"]:
+        return None
+    return {**stale, "oldest_created_at": stale["oldest_created_at"].isoformat()}
+
+
+def journal_digest(jb: JournalBatch, lines: Iterable[LineTuple]) -> str:
+    """Digest canónico do batch e das suas linhas (independente dos ids das linhas)."""
+    payload = {
+        "id": jb.pk,
+        "reference": jb.reference,
+        "idempotency_key": jb.idempotency_key or "",
+        "metadata": jb.metadata or {},
+        "created_at": jb.created_at.astimezone(dt_timezone.utc).isoformat(),
+        "lines": sorted(
+            [account_id, side, format(Decimal(amount).quantize(_QUANT), "f")] for account_id, side, amount in lines
+        ),
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def chain_hash(prev_hash: str, digest: str) -> str:
+    return hashlib.sha256(bytes.fromhex(prev_hash) + bytes.fromhex(digest)).hexdigest()
+
+
+def _lock_head() -> JournalChainHead:
+    head = JournalChainHead.objects.select_for_update().filter(name=CHAIN_JOURNAL).first()
+    if head is None:
+        # Criada pela migração 0013; só falta em BDs esvaziadas (ex.: TransactionTestCase).
+        JournalChainHead.objects.get_or_create(name=CHAIN_JOURNAL, defaults={"hash": GENESIS_HASH})
+        head = JournalChainHead.objects.select_for_update().get(name=CHAIN_JOURNAL)
+    return head
+
+
+def append_to_chain(items: Sequence[Tuple[JournalBatch, List[LineTuple]]]) -> None:
+    """Encadeia os batches pela ordem dada (dentro de uma transação; bloqueia a cabeça até ao commit)."""
+    if not items:
+        return
+    head = _lock_head()
+    for jb, lines in items:
+        head.seq += 1
+        jb.chain_seq = head.seq
+        jb.prev_hash = head.hash
+        jb.hash = chain_hash(head.hash, journal_digest(jb, lines))
+        head.hash = jb.hash
+    JournalBatch.objects.bulk_update([jb for jb, _ in items], ["chain_seq", "prev_hash", "hash"])
+    head.save(update_fields=["seq", "hash", "updated_at"])
+
+
+def _lines_by_journal(journal_ids: List[int]) -> Dict[int, List[LineTuple]]:
+    out: Dict[int, List[LineTuple]] = {jid: [] for jid in journal_ids}
+    rows = JournalLine.objects.filter(journal_id__in=journal_ids).values_list(
+        "journal_id", "account_id", "side", "amount"
+    )
+    for journal_id, account_id, side, amount in rows.order_by():
+        out[journal_id].append((account_id, side, amount))
+    return out
+
+
+def chain_pending_batches(limit: int = 1000) -> int:
+    """Encadeia batches sem chain_seq, por id, em páginas de limit (uma transação cada). Devolve quantos."""
+    total = 0
+    while True:
+        with transaction.atomic():
+            _lock_head()
+            batches = list(JournalBatch.objects.filter(chain_seq__isnull=True).order_by("id")[:limit])
+            lines = _lines_by_journal([jb.pk for jb in batches])
+            append_to_chain([(jb, lines[jb.pk]) for jb in batches])
+        total += len(batches)
+        if len(batches) < limit:
+            break
+    if total:
+        logger.info("journal_chain_sealed", extra={"count": total})
+    return total
+
+
+# --- Merkle (folhas e nós com prefixo 0x00/0x01, como no RFC 6962; nó ímpar sobe sem par) ---
+
+
+def _leaf(h: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(h)).digest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _levels(hashes: Sequence[str]) -> List[List[bytes]]:
+    level = [_leaf(h) for h in hashes]
+    levels = [level]
+    while len(level) > 1:
+        level = [_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def merkle_root(hashes: Sequence[str]) -> str:
+    return _levels(hashes)[-1][0].hex()
+
+
+def merkle_proof(hashes: Sequence[str], index: int) -> List[dict]:
+    proof = []
+    for level in _levels(hashes)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({"side": "left" if sibling < index else "right", "hash": level[sibling].hex()})
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf_hash: str, proof: List[dict], root: str) -> bool:
+    node = _leaf(leaf_hash)
+    for step in proof:
+        sibling = bytes.fromhex(step["hash"])
+        node = _node(sibling, node) if step["side"] == "left" else _node(node, sibling)
+    return node.hex() == root
+
+
+def _range_hashes(start_seq: int, end_seq: int) -> List[str]:
+    return list(
+        JournalBatch.objects.filter(chain_seq__gte=start_seq, chain_seq__lte=end_seq)
+        .order_by("chain_seq")
+        .values_list("hash", flat=True)
+    )
+
+
+def write_merkle_checkpoints() -> int:
+    """Raiz Merkle de cada intervalo completo ainda sem checkpoint. Devolve quantos foram gravados."""
+    size = range_size()
+    head = JournalChainHead.objects.filter(name=CHAIN_JOURNAL).first()
+    if head is None:
+        return 0
+    last = JournalMerkleCheckpoint.objects.aggregate(m=Max("end_seq"))["m"] or 0
+    written = 0
+    while last + size <= head.seq:
+        start, end = last + 1, last + size
+        hashes = _range_hashes(start, end)
+        if len(hashes) != size:
+            logger.error("journal_chain_gap", extra={"start_seq": start, "end_seq": end, "found": len(hashes)})
+            break
+        JournalMerkleCheckpoint.objects.create(
+            start_seq=start, end_seq=end, root=merkle_root(hashes), last_hash=hashes[-1]
+        )
+        last = end
+        written += 1
+    return written
+
+
+def seal_journal_chain(limit: int = 1000) -> Dict[str, int]:
+    return {"chained": chain_pending_batches(limit), "checkpoints": write_merkle_checkpoints()}
+
+
+def verify_range(from_seq: int = 1, to_seq: Optional[int] = None, page_size: int = 1000) -> Dict[str, Any]:
+    """
+    Recalcula digest e elo de cada batch de from_seq a to_seq (por páginas) e as raízes dos checkpoints
+    contidos no intervalo. Tempo proporcional ao tamanho do intervalo.
+    """
+    head = JournalChainHead.objects.filter(name=CHAIN_JOURNAL).first()
+    head_seq = head.seq if head else 0
+    to_seq = head_seq if to_seq is None else min(to_seq, head_seq)
+    errors: List[dict] = []
+
+    if from_seq <= 1:
+        from_seq, prev = 1, GENESIS_HASH
+    else:
+        prev = JournalBatch.objects.filter(chain_seq=from_seq - 1).values_list("hash", flat=True).first()
+        if prev is None:
+            errors.append({"chain_seq": from_seq - 1, "issue": "missing_batch"})
+
+    checkpoints = {
+        cp.end_seq: cp for cp in JournalMerkleCheckpoint.objects.filter(start_seq__gte=from_seq, end_seq__lte=to_seq)
+    }
+    range_hashes: List[str] = []
+    expected_seq = from_seq
+    checked = archived = 0
+    while expected_seq <= to_seq:
+        page = list(
+            JournalBatch.objects.filter(chain_seq__gte=expected_seq, chain_seq__lte=to_seq).order_by("chain_seq")[
+                :page_size
+            ]
+        )
+        if not page:
+            errors.append({"chain_seq": expected_seq, "issue": "missing_batch"})
+            break
+        lines = _lines_by_journal([jb.pk for jb in page])
+        for jb in page:
+            if jb.chain_seq != expected_seq:
+                errors.append({"chain_seq": expected_seq, "issue": "missing_batch"})
+                expected_seq = jb.chain_seq
+                range_hashes = []
+            if prev is not None and jb.prev_hash != prev:
+                errors.append({"chain_seq": jb.chain_seq, "journal_id": jb.pk, "issue": "broken_link"})
+            if jb.lines_archived_in:
+                archived += 1
+            elif jb.hash != chain_hash(jb.prev_hash, journal_digest(jb, lines[jb.pk])):
+                errors.append({"chain_seq": jb.chain_seq, "journal_id": jb.pk, "issue": "hash_mismatch"})
+            prev = jb.hash
+            range_hashes.append(jb.hash)
+            checked += 1
+            cp = checkpoints.get(jb.chain_seq)
+            if cp is not None:
+                width = cp.end_seq - cp.start_seq + 1
+                hashes = range_hashes[-width:]
+                if merkle_root(hashes) != cp.root:
+                    errors.append({"chain_seq": cp.end_seq, "issue": "merkle_root_mismatch", "start_seq": cp.start_seq})
+                range_hashes = []
+            expected_seq += 1
+
+    if head and to_seq == head_seq and checked and prev != head.hash:
+        errors.append({"chain_seq": head_seq, "issue": "head_mismatch"})
+    stale = stale_unchained()
+    if stale:
+        errors.append({"chain_seq": None, "issue": "unchained_batch", **stale})
+    report = {
+        "ok": not errors,
+        "from_seq": from_seq,
+        "to_seq": to_seq,
+        "checked": checked,
+        "archived": archived,
+        "checkpoints": len(checkpoints),
+        "unchained": JournalBatch.objects.filter(chain_seq__isnull=True).count(),
+        "errors": errors,
+    }
+    if errors:
+        logger.error("journal_chain_verification_failed", extra={"errors": len(errors), "from_seq": from_seq})
+    return report
+
+
+def inclusion_proof(journal_id: int) -> Dict[str, Any]:
+    """Prova de que o batch (conteúdo atual) está na raiz Merkle do seu checkpoint: log2(intervalo) hashes."""
+    jb = JournalBatch.objects.get(pk=journal_id)
+    if jb.chain_seq is None:
+        raise ValueError(f"journal {journal_id} is not chained yet")
+    cp = JournalMerkleCheckpoint.objects.filter(start_seq__lte=jb.chain_seq, end_seq__gte=jb.chain_seq).first()
+    if cp is None:
+        raise ValueError(f"journal {journal_id} is not covered by a Merkle checkpoint yet")
+    if jb.lines_archived_in:
+        # Sem as linhas: prova o hash guardado (o conteúdo verifica-se contra o arquivo).
+        leaf = jb.hash
+    else:
+        leaf = chain_hash(jb.prev_hash, journal_digest(jb, _lines_by_journal([jb.pk])[jb.pk]))
+    proof = merkle_proof(_range_hashes(cp.start_seq, cp.end_seq), jb.chain_seq - cp.start_seq)
+    return {
+        "journal_id": jb.pk,
+        "chain_seq": jb.chain_seq,
+        "hash": leaf,
+        "lines_archived_in": jb.lines_archived_in,
+        "checkpoint": {"start_seq": cp.start_seq, "end_seq": cp.end_seq, "root": cp.root},
+        "proof": proof,
+        "valid": leaf == jb.hash and verify_proof(leaf, proof, cp.root),
+    }
@@ -0,0 +1,93 @@
+"""
+Blocos comuns às leituras set-based do ledger (reconciliation_service, ledger_totals_service).
+
+- side_sums / signed_net: débitos e créditos agregados e o seu efeito no saldo por categoria;
+- shard_total: soma dos LedgerAccountShard de cada conta, como anotação;
+- snapshot_atomic: transação em que, no Postgres, todas as leituras veem o mesmo snapshot;
+- high_watermark / last_line_id: até onde um cursor pode avançar sem saltar transações por confirmar.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import DecimalField, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from app.paypibridge.models import JournalBatch, JournalLine, LedgerAccount, LedgerAccountShard
+
+_DEC = DecimalField(max_digits=28, decimal_places=8)
+_ZERO = Value(Decimal("0"), output_field=_DEC)
+
+
+def side_sums() -> Dict[str, Any]:
+    """Anotações dr/cr (0 sem linhas) para .values(...).annotate(**side_sums())."""
+    return {
+        "dr": Coalesce(Sum("amount", filter=Q(side=JournalLine.SIDE_DEBIT)), _ZERO, output_field=_DEC),
+        "cr": Coalesce(Sum("amount", filter=Q(side=JournalLine.SIDE_CREDIT)), _ZERO, output_field=_DEC),
+    }
+
+
+def signed_net(category: str, dr: Decimal, cr: Decimal) -> Decimal:
+    """Variação do saldo: débitos - créditos no ativo, créditos - débitos no passivo/receita."""
+    return dr - cr if category == LedgerAccount.CAT_ASSET else cr - dr
+
+
+def shard_total():
+    """Soma dos shards da conta (OuterRef("pk")), 0 se não tiver."""
+    return Coalesce(
+        Subquery(
+            LedgerAccountShard.objects.filter(account_id=OuterRef("pk"))
+            .order_by()
+            .values("account_id")
+            .annotate(t=Sum("balance"))
+            .values("t")[:1]
+        ),
+        _ZERO,
+        output_field=_DEC,
+    )
+
+
+@contextmanager
+def snapshot_atomic() -> Iterator[None]:
+    """
+    transaction.atomic() em que, no Postgres, todas as leituras veem o mesmo snapshot.
+
+    O isolamento só pode ser fixado pela primeira instrução da transação, ou seja, quando este é o
+    bloco atomic mais externo. Aninhado (ex.: TestCase, chamador com transação aberta) corre num
+    savepoint da transação do chamador: vê as escritas dela e a coerência é a do seu isolamento.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield
+
+
+def high_watermark(after_id: int, now: datetime, limit: Optional[int] = None) -> Optional[int]:
+    """
+    Maior id de JournalBatch verificável: journals depois de after_id com mais de RECONCILE_LAG_SECONDS
+    (transações ainda abertas podem ter ids menores que journals já visíveis), no máximo limit.
+    """
+    cutoff = now - timedelta(seconds=int(getattr(settings, "RECONCILE_LAG_SECONDS", 60)))
+    qs = JournalBatch.objects.filter(id__gt=after_id)
+    blocker = qs.filter(created_at__gt=cutoff).aggregate(m=Min("id"))["m"]
+    if blocker is not None:
+        qs = qs.filter(id__lt=blocker)
+    if limit:
+        first = limit - 1
+        nth = qs.order_by("id").values_list("id", flat=True)[first:limit]
+        if nth:
+            return nth[0]
+    return qs.aggregate(m=Max("id"))["m"]
+
+
+def last_line_id(journal_hi: int) -> int:
+    """Maior id de JournalLine dos journals até journal_hi (0 se não houver)."""
+    return JournalLine.objects.filter(journal_id__lte=journal_hi).aggregate(m=Max("id"))["m"] or 0
@@ -1,22 +1,31 @@
 """
 Ledger interno multi-tenant: wallets + lançamentos atómicos com idempotência.
+Retenções (BalanceHold): reserve_hold antes de uma chamada externa, capture/release depois, cada passo
+numa transação curta; débitos respeitam o saldo disponível (balance - held).
 """
 
 from __future__ import annotations
 
 import logging
 import os
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Set, Tuple, TypedDict
 
+from django.conf import settings
 from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
 
-from app.paypibridge.models import FeeConfig, LedgerEntry, Tenant, Wallet
+from app.paypibridge.models import BalanceHold, FeeConfig, LedgerEntry, Tenant, Wallet
+from app.paypibridge.services.config_cache import cached_config
+from app.paypibridge.services.idempotency import insert_or_get
 
 if TYPE_CHECKING:
     from app.paypibridge.models import PaymentIntent
 
 from app.paypibridge.services.double_entry_service import (
+    conditional_balance_mode,
     is_double_entry_active,
     post_pi_received_journal,
     post_settlement_journals,
@@ -26,6 +35,18 @@ logger = logging.getLogger(__name__)
 
 _ASSET_PI = Wallet.ASSET_PI
 _ASSET_BRL = Wallet.ASSET_BRL
+_QUANT = Decimal("0.00000001")
+
+
+class EntrySpec(TypedDict, total=False):
+    tenant: Tenant
+    asset: str
+    amount: Decimal
+    entry_type: str
+    reference: str
+    description: str
+    idempotency_key: Optional[str]
+    payment_intent: Optional["PaymentIntent"]
 
 
 def ensure_wallet(tenant: Tenant, asset: str) -> Wallet:
@@ -38,21 +59,38 @@ def ensure_wallet(tenant: Tenant, asset: str) -> Wallet:
 
 
 def get_platform_tenant() -> Optional[Tenant]:
-    return Tenant.objects.filter(is_platform=True).first()
+    return cached_config("platform_tenant", lambda: Tenant.objects.filter(is_platform=True).first())
 
 
-def get_active_fee_rate() -> Decimal:
+def _load_active_fee_rate() -> Decimal:
     row = FeeConfig.objects.filter(is_active=True).order_by("-id").first()
     if row:
         return row.percentage
     return Decimal(os.getenv("SETTLEMENT_FEE_RATE", "0"))
 
 
+def get_active_fee_rate() -> Decimal:
+    return cached_config("active_fee_rate", _load_active_fee_rate)
+
+
 def calculate_fee_brl(gross_brl: Decimal, rate: Optional[Decimal] = None) -> Decimal:
     r = rate if rate is not None else get_active_fee_rate()
     return (gross_brl * r).quantize(Decimal("0.01"))
 
 
+def apply_wallet_delta(wallet_id: int, delta: Decimal) -> bool:
+    """
+    UPDATE wallet SET balance = balance + delta WHERE id = ... AND balance + delta >= 0.
+    Sem SELECT ... FOR UPDATE: a guarda corre no próprio UPDATE (o Postgres reavalia-a sobre a
+    versão mais recente da linha), e o saldo insuficiente vê-se pelo número de linhas afetadas.
+    Débitos não podem usar saldo retido (balance + delta >= held).
+    """
+    qs = Wallet.objects.filter(pk=wallet_id)
+    if delta < 0:
+        qs = qs.filter(balance__gte=F("held") - delta)
+    return qs.update(balance=F("balance") + delta, updated_at=timezone.now()) == 1
+
+
 def apply_ledger_entry(
     tenant: Tenant,
     asset: str,
@@ -67,52 +105,149 @@ def apply_ledger_entry(
     """
     Atualiza saldo da wallet e grava LedgerEntry na mesma transação.
     Idempotência: se idempotency_key repetir, devolve o lançamento existente.
+    Com LEDGER_BALANCE_MODE=conditional o saldo muda via UPDATE guardado (ver apply_wallet_delta).
     """
     if amount is None or amount <= 0:
         raise ValueError("amount must be positive")
+    if entry_type not in (LedgerEntry.ENTRY_CREDIT, LedgerEntry.ENTRY_DEBIT):
+        raise ValueError("invalid entry_type")
 
-    if idempotency_key:
-        existing = LedgerEntry.objects.filter(idempotency_key=idempotency_key).first()
-        if existing:
-            return existing
-
+    entry = LedgerEntry(
+        tenant=tenant,
+        entry_type=entry_type,
+        asset=asset,
+        amount=amount,
+        reference=reference,
+        description=description,
+        idempotency_key=idempotency_key,
+        payment_intent=payment_intent,
+    )
     with transaction.atomic():
+        # Insert-first: a chave é reclamada antes de mexer no saldo; um duplicado sai aqui
+        # e um saldo insuficiente reverte o INSERT com o resto da transação.
         if idempotency_key:
-            existing = LedgerEntry.objects.filter(idempotency_key=idempotency_key).select_for_update().first()
-            if existing:
-                return existing
+            entry, created = insert_or_get(entry)
+            if not created:
+                return entry
+        else:
+            entry.save(force_insert=True)
 
         wallet = ensure_wallet(tenant, asset)
-        wallet = Wallet.objects.select_for_update().get(pk=wallet.pk)
+        if conditional_balance_mode():
+            delta = amount if entry_type == LedgerEntry.ENTRY_CREDIT else -amount
+            if not apply_wallet_delta(wallet.pk, delta):
+                raise ValueError("insufficient_wallet_balance")
+            return entry
 
+        wallet = Wallet.objects.select_for_update().get(pk=wallet.pk)
         if entry_type == LedgerEntry.ENTRY_CREDIT:
-            wallet.balance = (wallet.balance + amount).quantize(Decimal("0.00000001"))
-        elif entry_type == LedgerEntry.ENTRY_DEBIT:
-            if wallet.balance < amount:
-                raise ValueError("insufficient_wallet_balance")
-            wallet.balance = (wallet.balance - amount).quantize(Decimal("0.00000001"))
+            wallet.balance = (wallet.balance + amount).quantize(_QUANT)
         else:
+            if wallet.available < amount:
+                raise ValueError("insufficient_wallet_balance")
+            wallet.balance = (wallet.balance - amount).quantize(_QUANT)
+        wallet.save(update_fields=["balance", "updated_at"])
+        return entry
+
+
+def _lock_wallets(pairs: Set[Tuple[int, str]]) -> Dict[Tuple[int, str], Wallet]:
+    """Bloqueia (e cria se faltarem) as wallets (tenant_id, asset) numa única query, por ordem de pk."""
+    q = Q()
+    for tenant_id, asset in pairs:
+        q |= Q(tenant_id=tenant_id, asset=asset)
+    locked = {(w.tenant_id, w.asset): w for w in Wallet.objects.select_for_update().filter(q).order_by("pk")}
+    missing = pairs - locked.keys()
+    if missing:
+        Wallet.objects.bulk_create(
+            [Wallet(tenant_id=t, asset=a, balance=Decimal("0")) for t, a in missing],
+            ignore_conflicts=True,
+        )
+        locked = {(w.tenant_id, w.asset): w for w in Wallet.objects.select_for_update().filter(q).order_by("pk")}
+    return locked
+
+
+def apply_ledger_entries_bulk(
+    entries: List[EntrySpec], *, capture_holds: Sequence[BalanceHold] = ()
+) -> List[LedgerEntry]:
+    """
+    Versão em lote de apply_ledger_entry, numa só transação:
+    idempotency keys resolvidas com um IN, wallets bloqueadas num único SELECT ... FOR UPDATE
+    (ordem de pk, sem deadlocks entre lotes), LedgerEntry via bulk_create e saldos num só UPDATE.
+    Lançamentos cuja idempotency_key já existe são devolvidos sem reaplicar o saldo.
+    Débitos são validados pela ordem dos `entries` (como chamadas sucessivas a apply_ledger_entry)
+    contra o saldo disponível; capture_holds são consumidas (held liberto) depois do lock das wallets.
+    """
+    if not entries:
+        return []
+    for spec in entries:
+        amount = spec.get("amount")
+        if amount is None or amount <= 0:
+            raise ValueError("amount must be positive")
+        if spec.get("entry_type") not in (LedgerEntry.ENTRY_CREDIT, LedgerEntry.ENTRY_DEBIT):
             raise ValueError("invalid entry_type")
 
-        wallet.save(update_fields=["balance", "updated_at"])
+    keys = [spec["idempotency_key"] for spec in entries if spec.get("idempotency_key")]
+    pairs = {(spec["tenant"].pk, spec["asset"]) for spec in entries}
 
-        try:
-            entry = LedgerEntry.objects.create(
+    with transaction.atomic():
+        wallets = _lock_wallets(pairs)
+        # Depois do lock: um lote concorrente com as mesmas chaves já fez commit (mesmas wallets).
+        existing: Dict[str, LedgerEntry] = {}
+        if keys:
+            existing = {le.idempotency_key: le for le in LedgerEntry.objects.filter(idempotency_key__in=keys)}
+
+        held = {w.pk: w.held for w in wallets.values()}
+        captured = _capture_locked_holds(capture_holds)
+        for wallet_id, amount in captured.items():
+            held[wallet_id] = held.get(wallet_id, Decimal("0")) - amount
+
+        original = {w.pk: w.balance for w in wallets.values()}
+        balances = dict(original)
+        out: List[LedgerEntry] = []
+        to_create: List[LedgerEntry] = []
+        for spec in entries:
+            key = spec.get("idempotency_key")
+            if key and key in existing:
+                out.append(existing[key])
+                continue
+            tenant = spec["tenant"]
+            wallet = wallets[(tenant.pk, spec["asset"])]
+            amount = spec["amount"]
+            if spec["entry_type"] == LedgerEntry.ENTRY_CREDIT:
+                balances[wallet.pk] = (balances[wallet.pk] + amount).quantize(_QUANT)
+            else:
+                if balances[wallet.pk] - held[wallet.pk] < amount:
+                    raise ValueError("insufficient_wallet_balance")
+                balances[wallet.pk] = (balances[wallet.pk] - amount).quantize(_QUANT)
+            entry = LedgerEntry(
                 tenant=tenant,
-                entry_type=entry_type,
-                asset=asset,
+                entry_type=spec["entry_type"],
+                asset=spec["asset"],
                 amount=amount,
-                reference=reference,
-                description=description,
-                idempotency_key=idempotency_key,
-                payment_intent=payment_intent,
+                reference=spec.get("reference", ""),
+                description=spec.get("description", ""),
+                idempotency_key=key or None,
+                payment_intent=spec.get("payment_intent"),
             )
-        except IntegrityError:
-            if idempotency_key:
-                return LedgerEntry.objects.get(idempotency_key=idempotency_key)
-            raise
-
-        return entry
+            if key:
+                existing[key] = entry
+            to_create.append(entry)
+            out.append(entry)
+
+        if to_create:
+            LedgerEntry.objects.bulk_create(to_create)
+            changed = {pk: bal for pk, bal in balances.items() if bal != original[pk]}
+            if changed:
+                Wallet.objects.filter(pk__in=changed.keys()).update(
+                    balance=Case(
+                        *[When(pk=pk, then=Value(bal)) for pk, bal in changed.items()],
+                        output_field=Wallet._meta.get_field("balance"),
+                    ),
+                    updated_at=timezone.now(),
+                )
+        for wallet_id, amount in captured.items():
+            Wallet.objects.filter(pk=wallet_id).update(held=F("held") - amount, updated_at=timezone.now())
+        return out
 
 
 def credit_pi_for_verified_intent(intent: "PaymentIntent") -> Optional[LedgerEntry]:
@@ -142,10 +277,14 @@ def apply_settlement_ledger(
     gross_brl: Decimal,
     fee_brl: Decimal,
     net_brl: Decimal,
+    hold: Optional[BalanceHold] = None,
 ) -> None:
     """
     Após Pix bem-sucedido: baixa PI, taxa para plataforma, crédito/débito BRL líquido do tenant.
-    Tudo atómico; idempotente por intent_id.
+    Idempotente por intent_id. Em partidas dobradas os lançamentos são uma unidade (group commit quando
+    ativo: chamado fora de transação) e `hold` (reserva do PI) é capturada depois de gravados, fora da
+    transação que segura a cabeça da cadeia; se a captura falhar, o retry "settlement_ledger" repete
+    tudo (lançamentos já gravados não se duplicam, captura sem efeito se já feita).
     """
     if not intent.tenant_id:
         return
@@ -157,6 +296,8 @@ def apply_settlement_ledger(
             fee_brl=fee_brl,
             net_brl=net_brl,
         )
+        if hold is not None:
+            capture_hold(hold)
         return
 
     tenant = intent.tenant
@@ -166,46 +307,180 @@ def apply_settlement_ledger(
         return
 
     ref = str(intent.intent_id)
+    entries: List[EntrySpec] = [
+        {
+            "tenant": tenant,
+            "asset": _ASSET_PI,
+            "amount": intent.amount_pi,
+            "entry_type": LedgerEntry.ENTRY_DEBIT,
+            "reference": ref,
+            "description": "Conversão Pi → liquidação BRL",
+            "idempotency_key": f"settle_pi_debit:{ref}",
+            "payment_intent": intent,
+        },
+    ]
+    if fee_brl > 0:
+        entries.append(
+            {
+                "tenant": platform,
+                "asset": _ASSET_BRL,
+                "amount": fee_brl,
+                "entry_type": LedgerEntry.ENTRY_CREDIT,
+                "reference": ref,
+                "description": "Taxa de serviço (BRL)",
+                "idempotency_key": f"settle_fee:{ref}",
+                "payment_intent": intent,
+            }
+        )
+    if net_brl > 0:
+        entries.append(
+            {
+                "tenant": tenant,
+                "asset": _ASSET_BRL,
+                "amount": net_brl,
+                "entry_type": LedgerEntry.ENTRY_CREDIT,
+                "reference": ref,
+                "description": "Crédito BRL líquido pós-conversão",
+                "idempotency_key": f"settle_brl_credit:{ref}",
+                "payment_intent": intent,
+            }
+        )
+        entries.append(
+            {
+                "tenant": tenant,
+                "asset": _ASSET_BRL,
+                "amount": net_brl,
+                "entry_type": LedgerEntry.ENTRY_DEBIT,
+                "reference": ref,
+                "description": "Saída Pix (liquidação)",
+                "idempotency_key": f"settle_pix_debit:{ref}",
+                "payment_intent": intent,
+            }
+        )
+    apply_ledger_entries_bulk(entries, capture_holds=[hold] if hold is not None else ())
+
+
+def _hold_ttl_seconds() -> int:
+    return int(getattr(settings, "BALANCE_HOLD_TTL_SECONDS", 900))
+
+
+def reserve_hold(
+    tenant: Tenant,
+    asset: str,
+    amount: Decimal,
+    *,
+    reference: str,
+    payment_intent: Optional["PaymentIntent"] = None,
+    ttl_seconds: Optional[int] = None,
+) -> Tuple[BalanceHold, bool]:
+    """
+    Reserva `amount` do saldo disponível numa transação curta (INSERT + UPDATE guardado, sem
+    SELECT ... FOR UPDATE). Idempotente por reference enquanto a retenção estiver viva: devolve
+    (retenção, criada), como get_or_create.
+    """
+    if amount is None or amount <= 0:
+        raise ValueError("amount must be positive")
+    wallet = ensure_wallet(tenant, asset)
+    ttl = _hold_ttl_seconds() if ttl_seconds is None else ttl_seconds
+    hold = BalanceHold(
+        wallet=wallet,
+        amount=amount,
+        reference=reference,
+        payment_intent=payment_intent,
+        expires_at=timezone.now() + timedelta(seconds=ttl),
+    )
     with transaction.atomic():
-        apply_ledger_entry(
-            tenant,
-            _ASSET_PI,
-            intent.amount_pi,
-            LedgerEntry.ENTRY_DEBIT,
-            reference=ref,
-            description="Conversão Pi → liquidação BRL",
-            idempotency_key=f"settle_pi_debit:{ref}",
-            payment_intent=intent,
+        try:
+            with transaction.atomic():
+                hold.save(force_insert=True)
+        except IntegrityError:
+            return BalanceHold.objects.get(reference=reference, status__in=BalanceHold.LIVE_STATUSES), False
+        reserved = Wallet.objects.filter(pk=wallet.pk, balance__gte=F("held") + amount).update(
+            held=F("held") + amount, updated_at=timezone.now()
         )
-        if fee_brl > 0:
-            apply_ledger_entry(
-                platform,
-                _ASSET_BRL,
-                fee_brl,
-                LedgerEntry.ENTRY_CREDIT,
-                reference=ref,
-                description="Taxa de serviço (BRL)",
-                idempotency_key=f"settle_fee:{ref}",
-                payment_intent=intent,
-            )
-        if net_brl > 0:
-            apply_ledger_entry(
-                tenant,
-                _ASSET_BRL,
-                net_brl,
-                LedgerEntry.ENTRY_CREDIT,
-                reference=ref,
-                description="Crédito BRL líquido pós-conversão",
-                idempotency_key=f"settle_brl_credit:{ref}",
-                payment_intent=intent,
-            )
-            apply_ledger_entry(
-                tenant,
-                _ASSET_BRL,
-                net_brl,
-                LedgerEntry.ENTRY_DEBIT,
-                reference=ref,
-                description="Saída Pix (liquidação)",
-                idempotency_key=f"settle_pix_debit:{ref}",
-                payment_intent=intent,
-            )
+        if not reserved:
+            raise ValueError("insufficient_available_balance")
+    logger.info(
+        "balance_hold_reserved",
+        extra={"hold_id": hold.pk, "reference": reference, "amount": str(amount), "asset": asset},
+    )
+    return hold, True
+
+
+def mark_hold_settling(hold: BalanceHold, external_ref: str = "") -> bool:
+    """O efeito externo aconteceu: a retenção deixa de expirar e só sai por captura."""
+    return (
+        BalanceHold.objects.filter(pk=hold.pk, status=BalanceHold.ST_ACTIVE).update(
+            status=BalanceHold.ST_SETTLING, external_ref=external_ref, updated_at=timezone.now()
+        )
+        == 1
+    )
+
+
+def _capture_locked_holds(holds: Sequence[BalanceHold]) -> Dict[int, Decimal]:
+    """Marca como capturadas as retenções ainda vivas; devolve o montante a libertar por wallet."""
+    if not holds:
+        return {}
+    live = list(
+        BalanceHold.objects.select_for_update()
+        .filter(pk__in=[h.pk for h in holds], status__in=BalanceHold.LIVE_STATUSES)
+        .order_by("pk")
+    )
+    out: Dict[int, Decimal] = {}
+    for h in live:
+        out[h.wallet_id] = out.get(h.wallet_id, Decimal("0")) + h.amount
+    BalanceHold.objects.filter(pk__in=[h.pk for h in live]).update(
+        status=BalanceHold.ST_CAPTURED, updated_at=timezone.now()
+    )
+    return out
+
+
+def capture_hold(hold: BalanceHold) -> bool:
+    """Liberta o held da retenção (o débito em si é o lançamento). Sem efeito se já não estiver viva."""
+    with transaction.atomic():
+        released = _capture_locked_holds([hold])
+        for wallet_id, amount in released.items():
+            Wallet.objects.filter(pk=wallet_id).update(held=F("held") - amount, updated_at=timezone.now())
+    return bool(released)
+
+
+# Liquidação com o Pix possivelmente enviado (settlement_pix_sending_at): a reserva não expira.
+_NOT_PIX_SENDING = Q(payment_intent__isnull=True) | Q(payment_intent__settlement_pix_sending_at__isnull=True)
+
+
+def _release(hold_id: int, status: str, *, only_expired_before: Optional[datetime] = None) -> bool:
+    with transaction.atomic():
+        qs = BalanceHold.objects.select_for_update(skip_locked=only_expired_before is not None, of=("self",)).filter(
+            pk=hold_id
+        )
+        if only_expired_before is not None:
+            qs = qs.filter(_NOT_PIX_SENDING, status=BalanceHold.ST_ACTIVE, expires_at__lt=only_expired_before)
+        else:
+            qs = qs.filter(status=BalanceHold.ST_ACTIVE)
+        hold = qs.first()
+        if hold is None:
+            return False
+        Wallet.objects.filter(pk=hold.wallet_id).update(held=F("held") - hold.amount, updated_at=timezone.now())
+        hold.status = status
+        hold.save(update_fields=["status", "updated_at"])
+    logger.info("balance_hold_released", extra={"hold_id": hold_id, "status": status})
+    return True
+
+
+def release_hold(hold: BalanceHold) -> bool:
+    """Desfaz a reserva (ex.: Pix recusado). Só retenções active: settling já tem efeito externo."""
+    return _release(hold.pk, BalanceHold.ST_RELEASED)
+
+
+def release_expired_holds(now: Optional[datetime] = None, limit: int = 500) -> int:
+    """Sweeper: liberta retenções active expiradas (worker morreu antes de capturar/libertar)."""
+    now = now or timezone.now()
+    ids = list(
+        BalanceHold.objects.filter(_NOT_PIX_SENDING, status=BalanceHold.ST_ACTIVE, expires_at__lt=now)
+        .order_by("expires_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+    released = sum(1 for pk in ids if _release(pk, BalanceHold.ST_EXPIRED, only_expired_before=now))
+    if released:
+        logger.warning("balance_holds_expired", extra={"count": released})
+    return released
@@ -0,0 +1,215 @@
+"""
+Read model de totais por categoria (ASSET/LIABILITY/REVENUE) e ativo: balancete e balanço sem somar
+LedgerAccount a pedido.
+
+LedgerCategoryTotal é atualizado fora do caminho de escrita: cada refresh (beat) agrega por
+(categoria, ativo) só as linhas dos journals novos desde o cursor "ledger_totals", com o mesmo
+RECONCILE_LAG_SECONDS da reconciliação. Atualizar dentro de post_balanced_journal serializaria todos
+os lançamentos nas poucas linhas desta tabela. Os saldos de abertura entram quando a conta é criada
+(ensure_wallet_ledger_account). check_ledger_totals compara com LedgerAccount e acusa também os journals
+que o selo da cadeia de hashes já devia ter encadeado (journal_chain.stale_unchained).
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from app.paypibridge.models import JournalLine, LedgerAccount, LedgerCategoryTotal, ReconciliationCursor
+from app.paypibridge.services.journal_chain import stale_unchained
+from app.paypibridge.services.ledger_scan import (
+    high_watermark,
+    last_line_id,
+    shard_total,
+    side_sums,
+    signed_net,
+    snapshot_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+CURSOR_TOTALS = "ledger_totals"
+
+Key = Tuple[str, str]
+
+
+def _lock_cursor() -> ReconciliationCursor:
+    ReconciliationCursor.objects.get_or_create(name=CURSOR_TOTALS)
+    return ReconciliationCursor.objects.select_for_update().get(name=CURSOR_TOTALS)
+
+
+def _category_sums(lines) -> Dict[Key, Tuple[Decimal, Decimal]]:
+    rows = lines.order_by().values("account__category", "account__asset").annotate(**side_sums())
+    return {(row["account__category"], row["account__asset"]): (row["dr"], row["cr"]) for row in rows}
+
+
+def add_opening_balance(category: str, asset: str, amount: Decimal) -> None:
+    """Saldo de abertura de uma conta nova (sem linhas) entra logo nos totais."""
+    if not amount:
+        return
+    LedgerCategoryTotal.objects.get_or_create(category=category, asset=asset)
+    LedgerCategoryTotal.objects.filter(category=category, asset=asset).update(
+        opening_balance=F("opening_balance") + amount
+    )
+
+
+def rebuild_ledger_totals(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Recalcula a tabela inteira a partir das linhas e dos saldos de abertura (primeira execução / reparação)."""
+    now = now or timezone.now()
+    with snapshot_atomic():
+        cursor = _lock_cursor()
+        hi = high_watermark(0, now) or 0
+        sums = _category_sums(JournalLine.objects.filter(journal_id__lte=hi))
+        openings = {
+            (row["category"], row["asset"]): row["t"]
+            for row in LedgerAccount.objects.order_by().values("category", "asset").annotate(t=Sum("opening_balance"))
+        }
+        LedgerCategoryTotal.objects.all().delete()
+        LedgerCategoryTotal.objects.bulk_create(
+            [
+                LedgerCategoryTotal(
+                    category=category,
+                    asset=asset,
+                    debit_total=sums.get((category, asset), (Decimal("0"), Decimal("0")))[0],
+                    credit_total=sums.get((category, asset), (Decimal("0"), Decimal("0")))[1],
+                    opening_balance=openings.get((category, asset)) or Decimal("0"),
+                )
+                for category, asset in sorted(set(sums) | set(openings))
+            ]
+        )
+        cursor.last_journal_id = hi
+        cursor.last_line_id = last_line_id(hi)
+        cursor.anchored_at = now
+        cursor.last_run_at = now
+        cursor.save()
+    logger.info("ledger_totals_rebuilt", extra={"last_journal_id": hi})
+    return {"rebuilt": True, "last_journal_id": hi}
+
+
+def refresh_ledger_totals(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Soma aos totais as linhas dos journals novos desde o cursor (uma query agregada + uma linha por grupo)."""
+    now = now or timezone.now()
+    if not ReconciliationCursor.objects.filter(name=CURSOR_TOTALS, anchored_at__isnull=False).exists():
+        return rebuild_ledger_totals(now)
+
+    with transaction.atomic():
+        cursor = _lock_cursor()
+        start = cursor.last_journal_id
+        hi = high_watermark(start, now)
+        groups = 0
+        if hi:
+            sums = _category_sums(JournalLine.objects.filter(journal_id__gt=start, journal_id__lte=hi))
+            for (category, asset), (dr, cr) in sums.items():
+                LedgerCategoryTotal.objects.get_or_create(category=category, asset=asset)
+                LedgerCategoryTotal.objects.filter(category=category, asset=asset).update(
+                    debit_total=F("debit_total") + dr, credit_total=F("credit_total") + cr
+                )
+            groups = len(sums)
+            cursor.last_journal_id = hi
+            cursor.last_line_id = last_line_id(hi)
+        cursor.last_run_at = now
+        cursor.save()
+    return {"rebuilt": False, "from_journal_id": start, "last_journal_id": cursor.last_journal_id, "groups": groups}
+
+
+def _meta() -> Dict[str, Any]:
+    cursor = ReconciliationCursor.objects.filter(name=CURSOR_TOTALS).first()
+    return {
+        "last_journal_id": cursor.last_journal_id if cursor else None,
+        "refreshed_at": cursor.last_run_at.isoformat() if cursor and cursor.last_run_at else None,
+    }
+
+
+def trial_balance() -> Dict[str, Any]:
+    """Balancete: débitos, créditos e saldo por categoria e ativo; débitos == créditos por ativo."""
+    rows = []
+    per_asset: Dict[str, Dict[str, Decimal]] = {}
+    for t in LedgerCategoryTotal.objects.all():
+        rows.append(
+            {
+                "category": t.category,
+                "asset": t.asset,
+                "debit": format(t.debit_total, "f"),
+                "credit": format(t.credit_total, "f"),
+                "opening_balance": format(t.opening_balance, "f"),
+                "balance": format(t.balance, "f"),
+            }
+        )
+        totals = per_asset.setdefault(t.asset, {"debit": Decimal("0"), "credit": Decimal("0")})
+        totals["debit"] += t.debit_total
+        totals["credit"] += t.credit_total
+    return {
+        **_meta(),
+        "rows": rows,
+        "totals": {
+            asset: {
+                "debit": format(v["debit"], "f"),
+                "credit": format(v["credit"], "f"),
+                "balanced": v["debit"] == v["credit"],
+            }
+            for asset, v in sorted(per_asset.items())
+        },
+    }
+
+
+def balance_sheet() -> Dict[str, Any]:
+    """Balanço por ativo: ativo vs passivo + receita (difference deve ser 0)."""
+    sheet: Dict[str, Dict[str, Decimal]] = {}
+    for t in LedgerCategoryTotal.objects.all():
+        sheet.setdefault(t.asset, {c: Decimal("0") for c, _ in LedgerAccount.CATEGORY_CHOICES})[t.category] += t.balance
+    out = {}
+    for asset, by_cat in sorted(sheet.items()):
+        diff = by_cat[LedgerAccount.CAT_ASSET] - by_cat[LedgerAccount.CAT_LIABILITY] - by_cat[LedgerAccount.CAT_REVENUE]
+        out[asset] = {
+            "assets": format(by_cat[LedgerAccount.CAT_ASSET], "f"),
+            "liabilities": format(by_cat[LedgerAccount.CAT_LIABILITY], "f"),
+            "revenue": format(by_cat[LedgerAccount.CAT_REVENUE], "f"),
+            "difference": format(diff, "f"),
+        }
+    return {**_meta(), "assets": out}
+
+
+def check_ledger_totals() -> List[dict]:
+    """
+    Compara os totais com a soma de LedgerAccount (base + shards) por categoria e ativo, descontando
+    as linhas ainda acima do cursor. Lê todas as contas: para verificação, não para o endpoint. Journals
+    por encadear há mais de um intervalo de selo entram como {"issue": "unchained_batch", ...}.
+    """
+    with snapshot_atomic():
+        cursor = ReconciliationCursor.objects.filter(name=CURSOR_TOTALS).first()
+        watermark = cursor.last_journal_id if cursor else 0
+        live: Dict[Key, Decimal] = {}
+        for acc in LedgerAccount.objects.annotate(shard_balance=shard_total()).values(
+            "category", "asset", "balance", "shard_balance"
+        ):
+            key = (acc["category"], acc["asset"])
+            live[key] = live.get(key, Decimal("0")) + acc["balance"] + acc["shard_balance"]
+        for (category, asset), (dr, cr) in _category_sums(JournalLine.objects.filter(journal_id__gt=watermark)).items():
+            live[(category, asset)] = live.get((category, asset), Decimal("0")) - signed_net(category, dr, cr)
+        stored = {(t.category, t.asset): t.balance for t in LedgerCategoryTotal.objects.all()}
+
+    out = []
+    for category, asset in sorted(set(live) | set(stored)):
+        expected = live.get((category, asset), Decimal("0"))
+        actual = stored.get((category, asset), Decimal("0"))
+        if expected != actual:
+            out.append(
+                {
+                    "category": category,
+                    "asset": asset,
+                    "totals_balance": format(actual, "f"),
+                    "accounts_balance": format(expected, "f"),
+                }
+            )
+    stale = stale_unchained()
+    if stale:
+        out.append({"issue": "unchained_batch", **stale})
+    if out:
+        logger.error("ledger_totals_mismatch", extra={"groups": len(out)})
+    return out
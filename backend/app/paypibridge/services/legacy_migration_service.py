@@ -0,0 +1,255 @@
+"""
+Migração do histórico legado (LedgerEntry) para journals em partidas dobradas.
+
+Os LedgerEntry são lidos em streaming (.iterator(), por id) e agrupados em journals: entradas
+consecutivas com o mesmo payment_intent (ou, sem ele, a mesma referência). Cada entrada vira uma linha
+na conta da sua wallet (crédito → CR, débito → DR); o resto de cada ativo fecha contra CLEARING_PI /
+CLEARING_BRL, para o journal ficar equilibrado.
+
+O histórico passa a explicar o saldo que já existe: as contas não mudam de saldo, o opening_balance
+(e os totais por categoria e saldos esperados da reconciliação) absorve o efeito das linhas migradas.
+Uma wallet cujo histórico legado explica todo o saldo fica com opening_balance 0.
+As linhas mantêm o created_at do LedgerEntry; os BalanceCheckpoint das contas tocadas são apagados
+(o beat volta a gravá-los já com o histórico).
+
+Cada chunk é uma transação com o checkpoint (LegacyMigrationCheckpoint): interromper e voltar a correr
+continua do último chunk gravado. Entre chunks dorme LEGACY_MIGRATION_SLEEP_MS.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.paypibridge.models import (
+    BalanceCheckpoint,
+    ExpectedAccountBalance,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    LedgerEntry,
+    LegacyMigrationCheckpoint,
+    Wallet,
+)
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_BRL,
+    CODE_CLEARING_PI,
+    _signed_delta,
+    ensure_wallet_ledger_account,
+    get_account_by_code,
+    reconcile_wallet_vs_account,
+)
+from app.paypibridge.services.ledger_totals_service import add_opening_balance
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_LEGACY = "legacy_ledger_entries"
+
+_CLEARING_CODES = {Wallet.ASSET_PI: CODE_CLEARING_PI, Wallet.ASSET_BRL: CODE_CLEARING_BRL}
+
+
+def _group_key(entry: LedgerEntry) -> Tuple[str, Any]:
+    return ("intent", entry.payment_intent_id) if entry.payment_intent_id else ("reference", entry.reference)
+
+
+def iter_entry_groups(after_id: int = 0, chunk_size: int = 2000) -> Iterator[List[LedgerEntry]]:
+    """Grupos de LedgerEntry consecutivos (por id) com a mesma chave, em streaming."""
+    qs = LedgerEntry.objects.filter(id__gt=after_id).order_by("id")
+    group: List[LedgerEntry] = []
+    for entry in qs.iterator(chunk_size=chunk_size):
+        if group and _group_key(entry) != _group_key(group[-1]):
+            yield group
+            group = []
+        group.append(entry)
+    if group:
+        yield group
+
+
+class _Accounts:
+    """Contas das wallets e de clearing, resolvidas uma vez por execução."""
+
+    def __init__(self):
+        self.clearing: Dict[str, LedgerAccount] = {}
+        for asset, code in _CLEARING_CODES.items():
+            acc = get_account_by_code(code)
+            if acc is None:
+                raise ValueError(f"double-entry account {code} missing")
+            self.clearing[asset] = acc
+        self._wallets: Dict[Tuple[int, str], LedgerAccount] = {}
+
+    def wallet(self, tenant_id: int, asset: str) -> LedgerAccount:
+        key = (tenant_id, asset)
+        if key not in self._wallets:
+            w, _ = Wallet.objects.get_or_create(tenant_id=tenant_id, asset=asset, defaults={"balance": Decimal("0")})
+            self._wallets[key] = ensure_wallet_ledger_account(w)
+        return self._wallets[key]
+
+
+def journal_lines(group: List[LedgerEntry], accounts: _Accounts) -> List[Tuple[LedgerAccount, str, Decimal]]:
+    """Linhas equilibradas para um grupo: uma por entrada + fecho por ativo na conta de clearing."""
+    lines = []
+    residual: Dict[str, Decimal] = {}
+    for entry in group:
+        if entry.asset not in accounts.clearing:
+            raise ValueError(f"no clearing account for asset {entry.asset} (entry {entry.pk})")
+        if entry.entry_type == LedgerEntry.ENTRY_CREDIT:
+            side = JournalLine.SIDE_CREDIT
+            residual[entry.asset] = residual.get(entry.asset, Decimal("0")) + entry.amount
+        else:
+            side = JournalLine.SIDE_DEBIT
+            residual[entry.asset] = residual.get(entry.asset, Decimal("0")) - entry.amount
+        lines.append((accounts.wallet(entry.tenant_id, entry.asset), side, entry.amount))
+    for asset, amount in sorted(residual.items()):
+        if amount > 0:
+            lines.append((accounts.clearing[asset], JournalLine.SIDE_DEBIT, amount))
+        elif amount < 0:
+            lines.append((accounts.clearing[asset], JournalLine.SIDE_CREDIT, -amount))
+    return lines
+
+
+def _write_chunk(groups: List[List[LedgerEntry]], accounts: _Accounts) -> Optional[LegacyMigrationCheckpoint]:
+    """Journals, linhas, absorção no opening_balance, cadeia e checkpoint, numa transação."""
+    with transaction.atomic():
+        cp = LegacyMigrationCheckpoint.objects.select_for_update().get(name=CHECKPOINT_LEGACY)
+        if cp.last_entry_id >= groups[0][0].pk:
+            # Outra execução já gravou este chunk.
+            return None
+
+        planned = [(group, journal_lines(group, accounts)) for group in groups]
+        batches = [
+            JournalBatch(
+                reference=group[0].reference,
+                idempotency_key=f"legacy:{group[0].pk}",
+                payment_intent_id=group[0].payment_intent_id,
+                metadata={"flow": "legacy_migration", "legacy_entry_ids": [e.pk for e in group]},
+            )
+            for group, _ in planned
+        ]
+        JournalBatch.objects.bulk_create(batches)
+        # auto_now_add ignora o valor dado no INSERT: o created_at histórico entra a seguir.
+        for jb, (group, _) in zip(batches, planned):
+            jb.created_at = group[0].created_at
+        JournalBatch.objects.bulk_update(batches, ["created_at"])
+
+        line_objs = []
+        nets: Dict[int, Decimal] = {}
+        by_pk: Dict[int, LedgerAccount] = {}
+        for jb, (_, lines) in zip(batches, planned):
+            for acc, side, amount in lines:
+                line_objs.append(
+                    JournalLine(journal=jb, account=acc, side=side, amount=amount, created_at=jb.created_at)
+                )
+                nets[acc.pk] = nets.get(acc.pk, Decimal("0")) + _signed_delta(acc.category, side, amount)
+                by_pk[acc.pk] = acc
+        JournalLine.objects.bulk_create(line_objs)
+
+        openings: Dict[Tuple[str, str], Decimal] = {}
+        for pk, net in nets.items():
+            if not net:
+                continue
+            LedgerAccount.objects.filter(pk=pk).update(opening_balance=F("opening_balance") - net)
+            ExpectedAccountBalance.objects.filter(account_id=pk).update(balance=F("balance") - net)
+            key = (by_pk[pk].category, by_pk[pk].asset)
+            openings[key] = openings.get(key, Decimal("0")) - net
+        for (category, asset), delta in openings.items():
+            add_opening_balance(category, asset, delta)
+        BalanceCheckpoint.objects.filter(account_id__in=list(nets)).delete()
+
+        cp.last_entry_id = groups[-1][-1].pk
+        cp.entries += sum(len(group) for group in groups)
+        cp.journals += len(batches)
+        cp.save(update_fields=["last_entry_id", "entries", "journals", "updated_at"])
+    return cp
+
+
+def migrate_legacy_entries(
+    *,
+    chunk_size: Optional[int] = None,
+    sleep_ms: Optional[int] = None,
+    max_entries: Optional[int] = None,
+    on_chunk: Optional[Callable[[LegacyMigrationCheckpoint], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Converte os LedgerEntry ainda não migrados (a partir do checkpoint), chunk a chunk.
+    max_entries limita a execução (o resto fica para a próxima); devolve o checkpoint final.
+    """
+    if chunk_size is None:
+        chunk_size = int(getattr(settings, "LEGACY_MIGRATION_CHUNK_SIZE", 2000))
+    if sleep_ms is None:
+        sleep_ms = int(getattr(settings, "LEGACY_MIGRATION_SLEEP_MS", 50))
+    chunk_size = max(chunk_size, 1)
+
+    accounts = _Accounts()
+    cp, _ = LegacyMigrationCheckpoint.objects.get_or_create(name=CHECKPOINT_LEGACY)
+    started = time.monotonic()
+    pending: List[List[LedgerEntry]] = []
+    pending_entries = 0
+    processed = 0
+    exhausted = True
+    for group in iter_entry_groups(cp.last_entry_id, chunk_size):
+        if (
+            max_entries is not None
+            and processed + pending_entries + len(group) > max_entries
+            and (processed or pending)
+        ):
+            exhausted = False
+            break
+        pending.append(group)
+        pending_entries += len(group)
+        if pending_entries >= chunk_size:
+            cp = _write_chunk(pending, accounts) or cp
+            processed += pending_entries
+            pending, pending_entries = [], 0
+            if on_chunk:
+                on_chunk(cp)
+            if sleep_ms:
+                time.sleep(sleep_ms / 1000.0)
+    if pending:
+        cp = _write_chunk(pending, accounts) or cp
+        processed += pending_entries
+        if on_chunk:
+            on_chunk(cp)
+
+    if exhausted:
+        cp.finished_at = timezone.now()
+        cp.save(update_fields=["finished_at", "updated_at"])
+    cp.refresh_from_db()
+    logger.info(
+        "legacy_ledger_migrated",
+        extra={"entries": processed, "last_entry_id": cp.last_entry_id, "finished": exhausted},
+    )
+    return {
+        "entries": processed,
+        "last_entry_id": cp.last_entry_id,
+        "total_entries": cp.entries,
+        "total_journals": cp.journals,
+        "finished": exhausted,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+
+
+def verify_legacy_migration() -> Dict[str, Any]:
+    """
+    Wallet.balance == LedgerAccount.balance para todas as wallets e, nas contas de wallet, saldo
+    explicado pelas linhas (opening_balance 0). Listas vazias = migração coerente.
+    """
+    unexplained = [
+        {"code": row["code"], "opening_balance": str(row["opening_balance"])}
+        for row in LedgerAccount.objects.filter(wallet__isnull=False)
+        .exclude(opening_balance=0)
+        .values("code", "opening_balance")
+        .order_by("id")
+    ]
+    mismatches = reconcile_wallet_vs_account()
+    return {
+        "ok": not mismatches and not unexplained,
+        "wallet_account_mismatches": mismatches,
+        "unexplained_openings": unexplained,
+    }
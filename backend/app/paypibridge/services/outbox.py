@@ -0,0 +1,194 @@
+"""
+Outbox transacional: publish() grava um OutboxEvent na transação do chamador (sem I/O);
+dispatch_outbox() (beat) reclama lotes com SELECT ... FOR UPDATE SKIP LOCKED numa transação curta
+(in_flight com lease, OUTBOX_LEASE_SECONDS), entrega cada evento pelo handler do seu event_type (ou o grupo
+inteiro pelo handler em lote, se registado) fora de qualquer transação e regista numa segunda transação
+curta: entregue, ou reagendado com backoff exponencial com jitter até OUTBOX_MAX_ATTEMPTS (depois dead).
+Vários dispatchers em paralelo não se bloqueiam nem repetem eventos; lease expirada volta a ser reclamada.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app.paypibridge.models import OutboxEvent, Tenant
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[OutboxEvent], None]
+Results = Dict[int, Optional[str]]
+# Recebe os eventos do lote com esse event_type e um report(resultados parciais) para o que já acabou
+# (gravado logo, sem esperar pelo resto do lote); devolve {event_id: None (entregue) ou erro}.
+BatchHandler = Callable[[List[OutboxEvent], Callable[[Results], None]], Results]
+
+_handlers: Dict[str, Handler] = {}
+_batch_handlers: Dict[str, BatchHandler] = {}
+
+
+def register_handler(event_type: str, handler: Handler) -> None:
+    _handlers[event_type] = handler
+
+
+def register_batch_handler(event_type: str, handler: BatchHandler) -> None:
+    _batch_handlers[event_type] = handler
+
+
+def publish(
+    event_type: str,
+    payload: Dict[str, Any],
+    *,
+    tenant: Optional[Tenant] = None,
+    aggregate_id: str = "",
+) -> OutboxEvent:
+    """Grava o evento; chamar dentro da transação que muda o estado a que se refere."""
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload, tenant=tenant, aggregate_id=aggregate_id)
+
+
+def _backoff_seconds(attempts: int) -> float:
+    # Metade fixa + metade aleatória: eventos que falharam juntos não voltam todos no mesmo instante.
+    return min(3600, 30 * (2 ** min(attempts, 7))) * random.uniform(0.5, 1.0)
+
+
+def _run_handlers(events: List[OutboxEvent], report: Callable[[Results], None]) -> Results:
+    results: Dict[int, Optional[str]] = {}
+    by_type: Dict[str, List[OutboxEvent]] = {}
+    for event in events:
+        by_type.setdefault(event.event_type, []).append(event)
+    for event_type, group in by_type.items():
+        batch_handler = _batch_handlers.get(event_type)
+        if batch_handler is not None:
+            try:
+                results.update(batch_handler(group, report))
+            except Exception as exc:
+                results.update({event.pk: str(exc) or type(exc).__name__ for event in group})
+            continue
+        handler = _handlers.get(event_type)
+        for event in group:
+            try:
+                if handler is None:
+                    raise LookupError(f"no outbox handler for {event_type}")
+                handler(event)
+            except Exception as exc:
+                results[event.pk] = str(exc) or type(exc).__name__
+            else:
+                results[event.pk] = None
+    return results
+
+
+def _lease_seconds() -> int:
+    return int(getattr(settings, "OUTBOX_LEASE_SECONDS", 300))
+
+
+def _claim(batch_size: int, max_attempts: int, now: datetime) -> tuple[List[OutboxEvent], List[OutboxEvent]]:
+    """
+    Transação curta: reclama eventos devidos (ou in_flight com lease expirada, dispatcher morto) com
+    FOR UPDATE SKIP LOCKED e passa-os a in_flight com lease. A tentativa conta já no claim; um evento
+    reclamado de novo depois de esgotar as tentativas vai para dead sem ser entregue.
+    """
+    expires = now + timedelta(seconds=_lease_seconds())
+    claimed: List[OutboxEvent] = []
+    exhausted: List[OutboxEvent] = []
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("tenant")
+            .filter(
+                Q(status=OutboxEvent.ST_PENDING, next_attempt_at__lte=now)
+                | Q(status=OutboxEvent.ST_IN_FLIGHT, lease_expires_at__lt=now)
+            )
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        for event in events:
+            if event.status == OutboxEvent.ST_IN_FLIGHT and event.attempts >= max_attempts:
+                event.status = OutboxEvent.ST_DEAD
+                event.lease_expires_at = None
+                event.last_error = event.last_error or "outbox lease expired"
+                event.save(update_fields=["status", "lease_expires_at", "last_error"])
+                exhausted.append(event)
+                continue
+            event.status = OutboxEvent.ST_IN_FLIGHT
+            event.lease_expires_at = expires
+            event.attempts += 1
+            event.save(update_fields=["status", "lease_expires_at", "attempts"])
+            claimed.append(event)
+    return claimed, exhausted
+
+
+def _record(event: OutboxEvent, error: Optional[str], max_attempts: int) -> Optional[str]:
+    """
+    Grava o resultado só se a lease ainda é deste dispatcher (mesmo lease_expires_at); senão outro já
+    reclamou o evento e o resultado é descartado. Devolve delivered/retried/dead ou None.
+    """
+    fields: Dict[str, Any] = {"lease_expires_at": None}
+    if error is None:
+        fields.update(status=OutboxEvent.ST_DELIVERED, delivered_at=timezone.now())
+        outcome = "delivered"
+    else:
+        fields["last_error"] = error[:2000]
+        unhandled = event.event_type not in _handlers and event.event_type not in _batch_handlers
+        if event.attempts >= max_attempts or unhandled:
+            fields["status"] = OutboxEvent.ST_DEAD
+            outcome = "dead"
+        else:
+            fields["status"] = OutboxEvent.ST_PENDING
+            fields["next_attempt_at"] = timezone.now() + timedelta(seconds=_backoff_seconds(event.attempts))
+            outcome = "retried"
+    updated = OutboxEvent.objects.filter(
+        pk=event.pk, status=OutboxEvent.ST_IN_FLIGHT, lease_expires_at=event.lease_expires_at
+    ).update(**fields)
+    if not updated:
+        logger.warning("outbox_lease_lost", extra={"event_id": event.pk, "event_type": event.event_type})
+        return None
+    if outcome == "dead":
+        logger.error(
+            "outbox_event_dead",
+            extra={"event_id": event.pk, "event_type": event.event_type, "error": fields["last_error"]},
+        )
+    return outcome
+
+
+def dispatch_outbox(batch_size: Optional[int] = None, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Entrega um lote de eventos pendentes. Devolve contagens (delivered/retried/dead).
+
+    Claim e registo são transações curtas; os handlers (HTTP) correm fora de qualquer transação, sem
+    segurar os locks das linhas. Resultados parciais de um handler em lote são gravados à medida que chegam.
+    """
+    from app.paypibridge.services import tenant_webhook  # noqa: F401  (regista o handler)
+
+    batch_size = batch_size or int(getattr(settings, "OUTBOX_BATCH_SIZE", 100))
+    max_attempts = int(getattr(settings, "OUTBOX_MAX_ATTEMPTS", 10))
+    now = now or timezone.now()
+    stats = {"delivered": 0, "retried": 0, "dead": 0}
+    events, exhausted = _claim(batch_size, max_attempts, now)
+    stats["dead"] += len(exhausted)
+    for event in exhausted:
+        logger.error(
+            "outbox_event_dead",
+            extra={"event_id": event.pk, "event_type": event.event_type, "error": event.last_error},
+        )
+    claimed = {event.pk: event for event in events}
+
+    def report(partial: Results) -> None:
+        with transaction.atomic():
+            for pk, error in partial.items():
+                event = claimed.pop(pk, None)
+                if event is None:
+                    continue
+                outcome = _record(event, error, max_attempts)
+                if outcome is not None:
+                    stats[outcome] += 1
+
+    results = _run_handlers(events, report)
+    report({pk: results.get(pk, "no result from outbox handler") for pk in list(claimed)})
+    if events or exhausted:
+        logger.info("outbox_dispatched", extra=stats)
+    return stats
@@ -0,0 +1,320 @@
+"""
+Reconciliação double-entry de todo o ledger em queries set-based.
+
+- wallets ⇄ contas: um LEFT JOIN (wallet sem conta ou com saldo diferente);
+- journals desequilibrados: GROUP BY journal HAVING soma(débitos) <> soma(créditos);
+- saldo de cada conta recalculado das linhas: opening_balance + linhas vs base + shards.
+
+As linhas são lidas por chunks de ids de JournalBatch (um journal nunca fica partido entre chunks;
+as somas por conta são aditivas). Com workers > 1 os chunks correm num pool de processos; no Postgres
+todos leem o mesmo snapshot (pg_export_snapshot), para o relatório ser coerente com escritas em curso.
+
+Reconciliação incremental (beat): ReconciliationCursor guarda o último journal verificado e
+ExpectedAccountBalance o saldo esperado de cada conta nessa marca de água. Cada execução verifica só
+os journals novos (mais antigos que RECONCILE_LAG_SECONDS), soma os seus deltas aos saldos esperados e
+compara-os com LedgerAccount (menos as linhas acima da marca); diferenças geram alerta. O deep scan
+periódico corre reconcile_ledger e re-ancora cursor e saldos esperados a partir das linhas.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Max, Min, QuerySet
+from django.utils import timezone
+
+from app.paypibridge.models import (
+    ExpectedAccountBalance,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    ReconciliationCursor,
+)
+from app.paypibridge.services import reconciliation_worker
+from app.paypibridge.services.double_entry_service import reconcile_wallet_vs_account
+from app.paypibridge.services.ledger_scan import (
+    high_watermark,
+    last_line_id,
+    shard_total,
+    side_sums,
+    signed_net,
+    snapshot_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def journal_chunks(chunk_size: int) -> List[Tuple[int, int]]:
+    """Intervalos [lo, hi) de ids de JournalBatch que cobrem todo o ledger."""
+    agg = JournalBatch.objects.aggregate(lo=Min("id"), hi=Max("id"))
+    if agg["lo"] is None:
+        return []
+    return [(lo, min(lo + chunk_size, agg["hi"] + 1)) for lo in range(agg["lo"], agg["hi"] + 1, chunk_size)]
+
+
+def _account_totals(lines: QuerySet) -> Dict[int, Tuple[Decimal, Decimal]]:
+    return {row["account_id"]: (row["dr"], row["cr"]) for row in lines.values("account_id").annotate(**side_sums())}
+
+
+def scan_chunk(lo: int, hi: int) -> Dict[str, Any]:
+    """Duas agregações sobre as linhas dos journals lo <= id < hi: desequilíbrios e somas por conta."""
+    lines = JournalLine.objects.filter(journal_id__gte=lo, journal_id__lt=hi).order_by()
+    imbalanced = [
+        {"journal_id": row["journal_id"], "debit": row["dr"], "credit": row["cr"]}
+        for row in lines.values("journal_id").annotate(**side_sums()).exclude(dr=F("cr"))
+    ]
+    return {"imbalanced": imbalanced, "accounts": _account_totals(lines)}
+
+
+def _account_mismatches(totals: Dict[int, Tuple[Decimal, Decimal]]) -> List[dict]:
+    out = []
+    rows = LedgerAccount.objects.annotate(shard_balance=shard_total()).values(
+        "id", "code", "category", "balance", "opening_balance", "shard_balance"
+    )
+    for row in rows.order_by("id"):
+        dr, cr = totals.get(row["id"], (Decimal("0"), Decimal("0")))
+        expected = row["opening_balance"] + signed_net(row["category"], dr, cr)
+        effective = row["balance"] + row["shard_balance"]
+        if expected != effective:
+            out.append(
+                {
+                    "account_id": row["id"],
+                    "code": row["code"],
+                    "issue": "account_balance_mismatch",
+                    "balance": str(effective),
+                    "lines_balance": str(expected),
+                    "opening_balance": str(row["opening_balance"]),
+                    "shard_balance": str(row["shard_balance"]),
+                }
+            )
+    return out
+
+
+def reconcile_ledger(workers: Optional[int] = None, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """Relatório JSON-serializável de todo o ledger (ok=False se houver qualquer problema)."""
+    if workers is None:
+        workers = int(getattr(settings, "RECONCILE_WORKERS", 1))
+    if chunk_size is None:
+        chunk_size = int(getattr(settings, "RECONCILE_CHUNK_SIZE", 50000))
+    workers, chunk_size = max(workers, 1), max(chunk_size, 1)
+    started = time.monotonic()
+
+    with snapshot_atomic():
+        snapshot = None
+        if connection.vendor == "postgresql" and workers > 1:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+
+        chunks = journal_chunks(chunk_size)
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                mp_context=get_context("spawn"),
+                initializer=reconciliation_worker.init_worker,
+                initargs=(connection.settings_dict["NAME"],),
+            ) as pool:
+                results = list(
+                    pool.map(
+                        reconciliation_worker.scan_chunk_in_snapshot,
+                        [lo for lo, _ in chunks],
+                        [hi for _, hi in chunks],
+                        [snapshot] * len(chunks),
+                    )
+                )
+        else:
+            results = [scan_chunk(lo, hi) for lo, hi in chunks]
+
+        totals: Dict[int, Tuple[Decimal, Decimal]] = {}
+        imbalanced: List[dict] = []
+        for result in results:
+            imbalanced.extend(result["imbalanced"])
+            for account_id, (dr, cr) in result["accounts"].items():
+                prev_dr, prev_cr = totals.get(account_id, (Decimal("0"), Decimal("0")))
+                totals[account_id] = (prev_dr + dr, prev_cr + cr)
+
+        wallet_issues = reconcile_wallet_vs_account()
+        account_issues = _account_mismatches(totals)
+
+    report = {
+        "ok": not (wallet_issues or imbalanced or account_issues),
+        "generated_at": timezone.now().isoformat(),
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "chunks": len(chunks),
+        "journal_id_range": [chunks[0][0], chunks[-1][1]] if chunks else None,
+        "wallet_account_mismatches": wallet_issues,
+        "imbalanced_journals": [
+            {"journal_id": i["journal_id"], "debit": str(i["debit"]), "credit": str(i["credit"])}
+            for i in sorted(imbalanced, key=lambda i: i["journal_id"])
+        ],
+        "account_mismatches": account_issues,
+    }
+    logger.info(
+        "ledger_reconciled",
+        extra={
+            "ok": report["ok"],
+            "chunks": len(chunks),
+            "elapsed_ms": report["elapsed_ms"],
+            "wallet_mismatches": len(wallet_issues),
+            "imbalanced_journals": len(imbalanced),
+            "account_mismatches": len(account_issues),
+        },
+    )
+    return report
+
+
+CURSOR_LEDGER = "ledger"
+
+
+def _lock_cursor() -> ReconciliationCursor:
+    ReconciliationCursor.objects.get_or_create(name=CURSOR_LEDGER)
+    return ReconciliationCursor.objects.select_for_update().get(name=CURSOR_LEDGER)
+
+
+def _check_drift(watermark: int, now: datetime) -> List[dict]:
+    """
+    Saldo real na marca de água (base + shards - linhas de journals > watermark) vs esperado.
+    Grava drift em ExpectedAccountBalance e devolve as contas divergentes.
+    """
+    tail = _account_totals(JournalLine.objects.filter(journal_id__gt=watermark).order_by())
+    rows = ExpectedAccountBalance.objects.select_related("account").annotate(shard_balance=shard_total())
+    drifted: List[ExpectedAccountBalance] = []
+    out = []
+    for row in rows:
+        acc = row.account
+        dr, cr = tail.get(acc.pk, (Decimal("0"), Decimal("0")))
+        actual = acc.balance + row.shard_balance - signed_net(acc.category, dr, cr)
+        drift = actual - row.balance
+        if drift != row.drift:
+            row.drift = drift
+            drifted.append(row)
+        if drift:
+            out.append(
+                {
+                    "account_id": acc.pk,
+                    "code": acc.code,
+                    "expected": str(row.balance),
+                    "actual": str(actual),
+                    "drift": str(drift),
+                }
+            )
+    ExpectedAccountBalance.objects.bulk_update(drifted, ["drift"])
+    ExpectedAccountBalance.objects.update(checked_at=now)
+    return out
+
+
+def anchor_expected_balances(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Recalcula todos os saldos esperados a partir das linhas e move o cursor para a marca de água atual."""
+    now = now or timezone.now()
+    with snapshot_atomic():
+        cursor = _lock_cursor()
+        hi = high_watermark(0, now) or 0
+        totals = _account_totals(JournalLine.objects.filter(journal_id__lte=hi).order_by())
+        expected = [
+            ExpectedAccountBalance(
+                account_id=row["id"],
+                balance=row["opening_balance"]
+                + signed_net(row["category"], *totals.get(row["id"], (Decimal("0"), Decimal("0")))),
+                drift=Decimal("0"),
+            )
+            for row in LedgerAccount.objects.values("id", "category", "opening_balance")
+        ]
+        ExpectedAccountBalance.objects.bulk_create(
+            expected,
+            update_conflicts=True,
+            unique_fields=["account"],
+            update_fields=["balance", "drift"],
+        )
+        cursor.last_journal_id = hi
+        cursor.last_line_id = last_line_id(hi)
+        cursor.anchored_at = now
+        cursor.last_run_at = now
+        cursor.save()
+        drift = _check_drift(hi, now)
+
+    logger.info("ledger_reconciliation_anchored", extra={"last_journal_id": hi, "accounts": len(expected)})
+    _alert(drift, [])
+    return {"anchored": True, "last_journal_id": hi, "drift": drift}
+
+
+def reconcile_incremental(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Verifica os journals novos desde o cursor e aplica os seus deltas aos saldos esperados."""
+    now = now or timezone.now()
+    if not ReconciliationCursor.objects.filter(name=CURSOR_LEDGER, anchored_at__isnull=False).exists():
+        return anchor_expected_balances(now)
+
+    with snapshot_atomic():
+        cursor = _lock_cursor()
+        start = cursor.last_journal_id
+        hi = high_watermark(start, now, int(getattr(settings, "RECONCILE_CHUNK_SIZE", 50000)))
+        imbalanced: List[dict] = []
+        if hi:
+            # Contas criadas depois da última ancoragem começam no opening_balance.
+            new_accounts = LedgerAccount.objects.filter(expected_balance__isnull=True).values("id", "opening_balance")
+            ExpectedAccountBalance.objects.bulk_create(
+                [ExpectedAccountBalance(account_id=row["id"], balance=row["opening_balance"]) for row in new_accounts],
+                ignore_conflicts=True,
+            )
+            scan = scan_chunk(start + 1, hi + 1)
+            imbalanced = [
+                {"journal_id": i["journal_id"], "debit": str(i["debit"]), "credit": str(i["credit"])}
+                for i in scan["imbalanced"]
+            ]
+            rows = ExpectedAccountBalance.objects.select_related("account").filter(account_id__in=scan["accounts"])
+            changed = []
+            for row in rows:
+                row.balance += signed_net(row.account.category, *scan["accounts"][row.account_id])
+                changed.append(row)
+            ExpectedAccountBalance.objects.bulk_update(changed, ["balance"])
+            cursor.last_journal_id = hi
+            cursor.last_line_id = last_line_id(hi)
+        cursor.last_run_at = now
+        cursor.save()
+        drift = _check_drift(cursor.last_journal_id, now)
+
+    logger.info(
+        "ledger_reconciled_incremental",
+        extra={"from_journal_id": start, "to_journal_id": cursor.last_journal_id, "drift": len(drift)},
+    )
+    _alert(drift, imbalanced)
+    return {
+        "anchored": False,
+        "from_journal_id": start,
+        "last_journal_id": cursor.last_journal_id,
+        "imbalanced_journals": imbalanced,
+        "drift": drift,
+    }
+
+
+def deep_scan(workers: Optional[int] = None) -> Dict[str, Any]:
+    """Reconciliação completa (reconcile_ledger) seguida de re-ancoragem do cursor."""
+    report = reconcile_ledger(workers=workers)
+    if not report["ok"]:
+        logger.error(
+            "ledger_reconciliation_failed",
+            extra={
+                "wallet_mismatches": len(report["wallet_account_mismatches"]),
+                "imbalanced_journals": len(report["imbalanced_journals"]),
+                "account_mismatches": len(report["account_mismatches"]),
+            },
+        )
+    anchor = anchor_expected_balances()
+    return {"ok": report["ok"], "elapsed_ms": report["elapsed_ms"], "last_journal_id": anchor["last_journal_id"]}
+
+
+def _alert(drift: List[dict], imbalanced: List[dict]) -> None:
+    # logger.error chega ao Sentry (SENTRY_DSN) e aos alertas de logs.
+    for item in drift:
+        logger.error("ledger_balance_drift", extra=item)
+    for item in imbalanced:
+        logger.error("ledger_journal_imbalance", extra=item)
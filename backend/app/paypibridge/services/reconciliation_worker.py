@@ -0,0 +1,29 @@
+"""
+Entrada dos processos do pool de reconciliação (spawn).
+
+Sem imports de modelos ao nível do módulo: o filho importa este módulo antes de django.setup().
+"""
+
+
+def init_worker(db_name: str) -> None:
+    import django
+
+    django.setup()
+    from django.db import connection
+
+    # As settings são relidas no filho: apontar para a mesma BD do pai (ex.: BD de testes).
+    connection.settings_dict["NAME"] = db_name
+
+
+def scan_chunk_in_snapshot(lo: int, hi: int, snapshot):
+    """scan_chunk dentro do snapshot exportado pelo processo pai (Postgres)."""
+    from django.db import connection, transaction
+
+    from app.paypibridge.services.reconciliation_service import scan_chunk
+
+    with transaction.atomic():
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+        return scan_chunk(lo, hi)
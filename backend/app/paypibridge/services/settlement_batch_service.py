@@ -0,0 +1,429 @@
+"""
+Liquidação líquida em lote (SETTLEMENT_BATCHING=1): um Pix por beneficiário por janela.
+
+enqueue_for_batch reserva o PI do intent (BalanceHold, como na liquidação unitária) e junta-o ao lote
+aberto do mesmo consent/CPF/chave Pix. O lote fecha quando a janela SETTLEMENT_BATCH_WINDOW_SECONDS
+acaba (beat flush_due_settlement_batches) ou quando o total atinge SETTLEMENT_BATCH_MAX_PI.
+
+flush_batch converte todos os intents com uma só taxa de câmbio, envia um Pix com a soma dos líquidos
+e grava um Settlement para o lote; os lançamentos continuam por intent (apply_settlement_ledger).
+Falhas parciais: intents que deixaram de ser liquidáveis saem do lote (reserva libertada) antes do Pix;
+Pix recusado, câmbio indisponível ou qualquer erro antes do Pix falham o lote inteiro e libertam todos;
+lançamento falhado de um intent vai para RetryTask sem afetar os outros. Antes do Pix os membros recebem
+a marca de envio (settlement_pix_sending_at); lotes parados em PROCESSING são fechados por
+sweep_stale_batches como na lease unitária (failed sem marca, unknown com ela).
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from app.paypibridge.models import (
+    BalanceHold,
+    Consent,
+    PaymentIntent,
+    PixTransaction,
+    Settlement,
+    SettlementBatch,
+    Wallet,
+)
+
+from .ledger_service import get_active_fee_rate, mark_hold_settling, release_hold, reserve_hold
+from .pricing_service import get_pricing_service
+from .settlement_pix_port import SettlementPixPort
+from .settlement_service import ST_UNKNOWN, SettlementService, mark_intent_settled, settlement_amounts
+from .tenant_webhook import notify_payment_intent_webhook
+
+logger = logging.getLogger(__name__)
+
+ST_BATCHED = "BATCHED"
+
+Leg = Tuple[PaymentIntent, Decimal, Decimal, Decimal]
+
+
+def batching_enabled() -> bool:
+    return bool(getattr(settings, "SETTLEMENT_BATCHING", False))
+
+
+def _window_seconds() -> int:
+    return int(getattr(settings, "SETTLEMENT_BATCH_WINDOW_SECONDS", 300))
+
+
+def _max_pi() -> Decimal:
+    return Decimal(str(getattr(settings, "SETTLEMENT_BATCH_MAX_PI", "0")))
+
+
+def _hold_reference(intent: PaymentIntent) -> str:
+    return f"settle:{intent.intent_id}"
+
+
+@dataclass
+class BatchEnqueueResult:
+    success: bool
+    batch_id: Optional[int]
+    error: Optional[str] = None
+
+
+def _open_batch(consent: Consent, cpf: str, pix_key: str, description: str) -> SettlementBatch:
+    lookup = {"consent": consent, "cpf": cpf, "pix_key": pix_key, "status": SettlementBatch.ST_OPEN}
+    try:
+        with transaction.atomic():
+            batch, _ = SettlementBatch.objects.get_or_create(
+                **lookup,
+                defaults={
+                    "payee_user_id": consent.user_id,
+                    "description": description[:255],
+                    "window_ends_at": timezone.now() + timedelta(seconds=_window_seconds()),
+                },
+            )
+    except IntegrityError:
+        batch = SettlementBatch.objects.get(**lookup)
+    return batch
+
+
+def enqueue_for_batch(
+    intent: PaymentIntent,
+    *,
+    consent: Consent,
+    cpf: str,
+    pix_key: str,
+    description: str = "",
+) -> BatchEnqueueResult:
+    """Reserva o PI e junta o intent ao lote aberto do beneficiário (idempotente por intent)."""
+    if intent.payee_user_id != consent.user_id:
+        return BatchEnqueueResult(False, None, "consent_user_mismatch")
+    if not intent.verified_at:
+        return BatchEnqueueResult(False, None, "pi_payment_not_verified")
+    if intent.status == "SETTLED":
+        return BatchEnqueueResult(False, None, "already_settled")
+    if intent.status == "CANCELLED":
+        return BatchEnqueueResult(False, None, "intent_cancelled")
+    if intent.settlement_status == ST_UNKNOWN or intent.settlement_pix_sending_at is not None:
+        return BatchEnqueueResult(False, intent.settlement_batch_id, "settlement_unknown")
+    if intent.settlement_batch_id and intent.settlement_status == ST_BATCHED:
+        return BatchEnqueueResult(True, intent.settlement_batch_id)
+
+    if intent.tenant_id:
+        try:
+            _, created = reserve_hold(
+                intent.tenant,
+                Wallet.ASSET_PI,
+                intent.amount_pi,
+                reference=_hold_reference(intent),
+                payment_intent=intent,
+                ttl_seconds=_window_seconds() + int(getattr(settings, "BALANCE_HOLD_TTL_SECONDS", 900)),
+            )
+        except ValueError as exc:
+            return BatchEnqueueResult(False, None, str(exc))
+        if not created:
+            return BatchEnqueueResult(False, None, "settlement_in_progress")
+
+    while True:
+        batch = _open_batch(consent, cpf, pix_key, description)
+        with transaction.atomic():
+            batch = SettlementBatch.objects.select_for_update().get(pk=batch.pk)
+            if batch.status != SettlementBatch.ST_OPEN:
+                continue  # fechado entre o get_or_create e o lock: abre-se outro
+            PaymentIntent.objects.filter(pk=intent.pk).update(settlement_batch=batch, settlement_status=ST_BATCHED)
+            batch.total_pi += intent.amount_pi
+            batch.save(update_fields=["total_pi", "updated_at"])
+            full = _max_pi() > 0 and batch.total_pi >= _max_pi()
+        break
+
+    intent.settlement_batch = batch
+    intent.settlement_status = ST_BATCHED
+    logger.info("settlement_batched", extra={"intent_id": intent.intent_id, "batch_id": batch.pk})
+    if full:
+        from app.paypibridge.tasks import flush_settlement_batch
+
+        transaction.on_commit(lambda: flush_settlement_batch.delay(batch.pk))
+    return BatchEnqueueResult(True, batch.pk)
+
+
+def _live_holds(intents: List[PaymentIntent]) -> Dict[int, BalanceHold]:
+    holds = BalanceHold.objects.filter(
+        payment_intent__in=intents,
+        reference__in=[_hold_reference(i) for i in intents],
+        status__in=BalanceHold.LIVE_STATUSES,
+    )
+    return {h.payment_intent_id: h for h in holds}
+
+
+def _drop(intents: List[PaymentIntent], holds: Dict[int, BalanceHold], error: str) -> None:
+    """Tira intents do lote (falham e podem voltar a ser submetidos) e liberta as reservas."""
+    for intent in intents:
+        hold = holds.get(intent.pk)
+        if hold is not None:
+            release_hold(hold)
+        if intent.status not in ("SETTLED", "CANCELLED"):
+            intent.settlement_status = "SETTLEMENT_FAILED"
+        intent.settlement_batch = None
+        intent.settlement_pix_sending_at = None
+        intent.metadata = {**intent.metadata, "settlement_batch_error": error}
+        intent.save(update_fields=["settlement_status", "settlement_batch", "settlement_pix_sending_at", "metadata"])
+    if intents:
+        logger.warning("settlement_batch_dropped", extra={"intents": [i.intent_id for i in intents], "error": error})
+
+
+def _lock_processing(batch: SettlementBatch) -> Optional[SettlementBatch]:
+    """Bloqueia o lote se ainda estiver PROCESSING (None se o sweeper ou outro worker já o tirou de lá)."""
+    return SettlementBatch.objects.select_for_update().filter(pk=batch.pk, status=SettlementBatch.ST_PROCESSING).first()
+
+
+def _fail_batch(batch: SettlementBatch, error: str) -> Dict[str, Any]:
+    """
+    Falha o lote ainda PROCESSING (o Pix não saiu): os membros saem do lote e as reservas são libertadas.
+    Sem efeito se o lote já não estiver PROCESSING (varrido pelo sweeper).
+    """
+    with transaction.atomic():
+        locked = _lock_processing(batch)
+        if locked is None:
+            logger.error("settlement_batch_not_processing", extra={"batch_id": batch.pk, "error": error})
+            return {"batch_id": batch.pk, "status": "lost", "error": error, "settled": 0, "dropped": 0}
+        members = list(PaymentIntent.objects.filter(settlement_batch=locked).order_by("id"))
+        _drop(members, _live_holds(members), error)
+        locked.status = SettlementBatch.ST_FAILED
+        locked.error_message = error
+        locked.save(update_fields=["status", "error_message", "updated_at"])
+    logger.error("settlement_batch_failed", extra={"batch_id": batch.pk, "error": error})
+    return {"batch_id": batch.pk, "status": locked.status, "error": error, "settled": 0, "dropped": len(members)}
+
+
+def _prepare_batch(batch: SettlementBatch, pricing):
+    """Membros liquidáveis, câmbio e líquidos: (legs, holds, rate, dropped) ou o resultado de falha."""
+    members = list(batch.intents.select_related("tenant").order_by("id"))
+    holds = _live_holds(members)
+
+    dropped = [
+        i
+        for i in members
+        if i.status in ("SETTLED", "CANCELLED") or not i.verified_at or (i.tenant_id and i.pk not in holds)
+    ]
+    _drop(dropped, holds, "not_settleable")
+    members = [i for i in members if i not in dropped]
+    if not members:
+        return _fail_batch(batch, "no_settleable_intents")
+
+    rate = pricing.get_rate("PI", "BRL")
+    if rate is None:
+        return _fail_batch(batch, "fx_unavailable")
+
+    fee_rate = get_active_fee_rate()
+    legs: List[Leg] = []
+    too_small = []
+    for intent in members:
+        gross = (intent.amount_pi * rate).quantize(Decimal("0.01"))
+        fee, net = settlement_amounts(gross, fee_rate)
+        if net <= 0:
+            too_small.append(intent)
+            continue
+        legs.append((intent, gross, fee, net))
+    _drop(too_small, holds, "net_amount_non_positive")
+    if not legs:
+        return _fail_batch(batch, "no_settleable_intents")
+    return legs, holds, rate, len(dropped) + len(too_small)
+
+
+def _mark_pix_sending(batch: SettlementBatch, legs: List[Leg], holds: Dict[int, BalanceHold]) -> bool:
+    """
+    Marca os membros (settlement_pix_sending_at, como na liquidação unitária) só com o lote ainda
+    PROCESSING e todas as reservas ativas; com a marca as reservas deixam de expirar.
+    """
+    now = timezone.now()
+    ids = [leg[0].pk for leg in legs]
+    hold_ids = [holds[pk].pk for pk in ids if pk in holds]
+    with transaction.atomic():
+        if _lock_processing(batch) is None:
+            return False
+        live = BalanceHold.objects.select_for_update().filter(pk__in=hold_ids, status=BalanceHold.ST_ACTIVE)
+        if len(live) != len(hold_ids):
+            return False
+        PaymentIntent.objects.filter(pk__in=ids, settlement_batch=batch).update(settlement_pix_sending_at=now)
+    return True
+
+
+def flush_batch(batch_id: int, *, pricing_service=None, pix_port: Optional[SettlementPixPort] = None) -> Dict[str, Any]:
+    """
+    Fecha o lote e paga-o com um Pix. Sem efeito se o lote já não estiver aberto. Erros antes do Pix
+    falham o lote; depois da marca de envio um erro deixa-o PROCESSING para sweep_stale_batches.
+    """
+    with transaction.atomic():
+        batch = SettlementBatch.objects.select_for_update().filter(pk=batch_id, status=SettlementBatch.ST_OPEN).first()
+        if batch is None:
+            return {"batch_id": batch_id, "status": "skipped"}
+        batch.status = SettlementBatch.ST_PROCESSING
+        batch.save(update_fields=["status", "updated_at"])
+
+    try:
+        pricing = pricing_service or get_pricing_service()
+        pix_port = pix_port or SettlementPixPort()
+        prepared = _prepare_batch(batch, pricing)
+        if isinstance(prepared, dict):
+            return prepared
+        legs, holds, rate, dropped = prepared
+        if not _mark_pix_sending(batch, legs, holds):
+            return _fail_batch(batch, "batch_lease_lost")
+    except Exception as exc:
+        logger.exception("settlement_batch_prepare_failed", extra={"batch_id": batch.pk})
+        return _fail_batch(batch, f"{type(exc).__name__}: {exc}"[:500])
+
+    gross_total = sum((leg[1] for leg in legs), Decimal("0"))
+    fee_total = sum((leg[2] for leg in legs), Decimal("0"))
+    net_total = sum((leg[3] for leg in legs), Decimal("0"))
+    # A partir daqui o Pix pode ter saído: uma exceção deixa o lote PROCESSING (sweeper → unknown).
+    pix_out = pix_port.send(
+        consent=batch.consent,
+        cpf=batch.cpf,
+        pix_key=batch.pix_key,
+        amount_brl=net_total,
+        description=batch.description or f"PayPi-Bridge settlement batch {batch.pk}",
+    )
+    if not pix_out.get("success"):
+        return _fail_batch(batch, pix_out.get("error") or "pix_failed")
+
+    txid = pix_out.get("txid") or ""
+    with transaction.atomic():
+        locked = _lock_processing(batch)
+        if locked is not None:
+            _record_batch(locked, legs, holds, pix_out, txid, rate, (gross_total, fee_total, net_total))
+    if locked is None:
+        # Varrido para unknown enquanto o Pix corria: só fica a evidência para a revisão manual.
+        SettlementBatch.objects.filter(pk=batch.pk).update(
+            pix_txid=txid, error_message=f"pix sent after sweep: {txid}", updated_at=timezone.now()
+        )
+        logger.error("settlement_batch_lease_lost", extra={"batch_id": batch.pk, "pix_txid": txid})
+        return {"batch_id": batch.pk, "status": "lost", "settled": 0, "pix_txid": txid}
+    batch = locked
+
+    for intent, gross, fee, net in legs:
+        SettlementService.post_ledger(intent, gross=gross, fee=fee, net=net, hold=holds.get(intent.pk))
+
+    logger.info(
+        "settlement_batch_completed",
+        extra={"batch_id": batch.pk, "intents": len(legs), "net_brl": str(net_total), "pix_txid": txid},
+    )
+    return {
+        "batch_id": batch.pk,
+        "status": batch.status,
+        "settled": len(legs),
+        "dropped": dropped,
+        "net_brl": str(net_total),
+        "pix_txid": txid,
+    }
+
+
+def _record_batch(
+    batch: SettlementBatch,
+    legs: List[Leg],
+    holds: Dict[int, BalanceHold],
+    pix_out: Dict[str, Any],
+    txid: str,
+    rate: Decimal,
+    totals: Tuple[Decimal, Decimal, Decimal],
+) -> None:
+    """Grava Pix, intents liquidados e o lote; totals = (bruto, taxa, líquido) já somados por flush_batch."""
+    PixTransaction.objects.create(
+        intent=legs[0][0],
+        tx_id=txid,
+        status=str(pix_out.get("status") or "PROCESSING"),
+        payload={
+            "batch_id": batch.pk,
+            "intent_ids": [leg[0].intent_id for leg in legs],
+            "provider": pix_out.get("raw") or pix_out,
+        },
+    )
+    for intent, gross, fee, net in legs:
+        mark_intent_settled(
+            intent,
+            gross=gross,
+            fee=fee,
+            net=net,
+            txid=txid,
+            metadata={"settlement_batch_id": batch.pk, "settlement_fx_rate": str(rate)},
+        )
+        if intent.pk in holds:
+            mark_hold_settling(holds[intent.pk], txid)
+        notify_payment_intent_webhook(
+            intent,
+            {
+                "event": "payment_settled",
+                "gross_brl": str(gross),
+                "fee_brl": str(fee),
+                "net_brl": str(net),
+                "pix_txid": txid,
+                "settlement_batch_id": batch.pk,
+            },
+        )
+    gross_total, fee_total, net_total = totals
+    Settlement.objects.create(batch=batch, amount_brl=net_total, status=Settlement.ST_COMPLETED, pix_txid=txid)
+    batch.fx_rate = rate
+    batch.gross_brl = gross_total
+    batch.fee_brl = fee_total
+    batch.net_brl = net_total
+    batch.pix_txid = txid
+    batch.status = SettlementBatch.ST_SETTLED
+    batch.settled_at = timezone.now()
+    batch.save()
+
+
+def flush_due_batches(now=None) -> List[Dict[str, Any]]:
+    """Lotes abertos cuja janela já acabou (beat); a falha de um lote não impede os seguintes."""
+    now = now or timezone.now()
+    due = SettlementBatch.objects.filter(status=SettlementBatch.ST_OPEN, window_ends_at__lte=now)
+    due = due.order_by("window_ends_at")
+    results = []
+    for pk in due.values_list("pk", flat=True):
+        try:
+            results.append(flush_batch(pk))
+        except Exception as exc:
+            logger.exception("settlement_batch_flush_failed", extra={"batch_id": pk})
+            results.append({"batch_id": pk, "status": "error", "error": str(exc)})
+    return results
+
+
+def sweep_stale_batches(now=None, limit: int = 100) -> Dict[str, List[int]]:
+    """
+    Lotes PROCESSING parados há mais de SETTLEMENT_BATCH_STALE_SECONDS (worker morto a meio). Sem marca
+    de envio o Pix não saiu: o lote falha e os membros podem voltar a ser submetidos. Com marca o Pix pode
+    ter saído: lote unknown, membros SETTLEMENT_UNKNOWN, reservas mantidas até à revisão no PSP.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=int(getattr(settings, "SETTLEMENT_BATCH_STALE_SECONDS", 600)))
+    stale = list(
+        SettlementBatch.objects.filter(status=SettlementBatch.ST_PROCESSING, updated_at__lt=cutoff)
+        .order_by("updated_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+    out: Dict[str, List[int]] = {"failed": [], "unknown": []}
+    for pk in stale:
+        with transaction.atomic():
+            batch = (
+                SettlementBatch.objects.select_for_update()
+                .filter(pk=pk, status=SettlementBatch.ST_PROCESSING, updated_at__lt=cutoff)
+                .first()
+            )
+            if batch is None:
+                continue
+            members = list(PaymentIntent.objects.filter(settlement_batch=batch).order_by("id"))
+            if any(m.settlement_pix_sending_at is not None for m in members):
+                PaymentIntent.objects.filter(pk__in=[m.pk for m in members]).update(settlement_status=ST_UNKNOWN)
+                batch.status = SettlementBatch.ST_UNKNOWN
+                batch.error_message = "processing_stale_pix_possibly_sent"
+                out["unknown"].append(pk)
+            else:
+                _drop(members, _live_holds(members), "batch_processing_stale")
+                batch.status = SettlementBatch.ST_FAILED
+                batch.error_message = "processing_stale"
+                out["failed"].append(pk)
+            batch.save(update_fields=["status", "error_message", "updated_at"])
+    if stale:
+        logger.error("settlement_batches_stale", extra=out)
+    return out
@@ -0,0 +1,240 @@
+"""
+Dead letters de liquidação (SettlementDeadLetter): uma linha por liquidação que esgotou as tentativas,
+com classe do erro, tentativas e os argumentos originais da task.
+
+O CPF não fica em claro: task_args leva só consent_id/pix_key/description, cpf_masked serve para
+inspeção e cpf_sealed é o CPF cifrado (NaCl SecretBox, chave derivada de SETTLEMENT_DLQ_SECRET ou,
+sem ele, SECRET_KEY) — só o replay o abre.
+
+list_dead_letters pagina por keyset (id decrescente, ?after=<último id>), sem OFFSET nem COUNT.
+replay_dead_letters volta a enfileirar um subconjunto filtrado a no máximo `rate` por segundo,
+marcando cada linha como replayed antes de a reenviar (dois replays concorrentes não duplicam).
+Intents liquidados ou com o Pix possivelmente enviado (lease expirada após o envio, SETTLEMENT_UNKNOWN,
+PixTransaction existente) não são reenviados: a linha fica discarded.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from app.paypibridge.models import Consent, PaymentIntent, SettlementDeadLetter
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE = 500
+
+
+def _box():
+    from nacl.secret import SecretBox
+
+    secret = getattr(settings, "SETTLEMENT_DLQ_SECRET", "") or settings.SECRET_KEY
+    return SecretBox(hashlib.sha256(f"settlement-dlq:{secret}".encode()).digest())
+
+
+def seal_cpf(cpf: str) -> str:
+    if not cpf:
+        return ""
+    return base64.b64encode(_box().encrypt(cpf.encode())).decode()
+
+
+def unseal_cpf(sealed: str) -> str:
+    if not sealed:
+        return ""
+    return _box().decrypt(base64.b64decode(sealed)).decode()
+
+
+def mask_cpf(cpf: str) -> str:
+    digits = "".join(c for c in cpf or "" if c.isdigit())
+    if len(digits) != 11:
+        return "***" if digits else ""
+    return f"***.{digits[3:6]}.{digits[6:9]}-**"
+
+
+def record_dead_letter(
+    intent: PaymentIntent,
+    *,
+    source: str,
+    error_class: str,
+    error: str,
+    attempts: int,
+    consent_id: Optional[int] = None,
+    cpf: str = "",
+    pix_key: str = "",
+    description: str = "",
+) -> SettlementDeadLetter:
+    dead = SettlementDeadLetter.objects.create(
+        payment_intent=intent,
+        tenant_id=intent.tenant_id,
+        source=source,
+        error_class=(error_class or "Exception")[:120],
+        error_message=(error or "")[:2000],
+        attempts=attempts,
+        task_args={"consent_id": consent_id, "pix_key": pix_key, "description": description or ""},
+        cpf_masked=mask_cpf(cpf),
+        cpf_sealed=seal_cpf(cpf),
+    )
+    logger.error(
+        "settlement_dead_letter_recorded",
+        extra={
+            "intent_id": intent.intent_id,
+            "dead_letter_id": dead.pk,
+            "source": source,
+            "error_class": dead.error_class,
+            "attempts": attempts,
+        },
+    )
+    return dead
+
+
+def filter_dead_letters(
+    *,
+    status: Optional[str] = SettlementDeadLetter.ST_PENDING,
+    error_class: Optional[str] = None,
+    tenant_id: Optional[int] = None,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    ids: Optional[List[int]] = None,
+) -> QuerySet:
+    qs = SettlementDeadLetter.objects.all()
+    if status:
+        qs = qs.filter(status=status)
+    if error_class:
+        qs = qs.filter(error_class=error_class)
+    if tenant_id:
+        qs = qs.filter(tenant_id=tenant_id)
+    if source:
+        qs = qs.filter(source=source)
+    if since:
+        qs = qs.filter(created_at__gte=since)
+    if ids:
+        qs = qs.filter(pk__in=ids)
+    return qs
+
+
+def _row(dead: SettlementDeadLetter) -> Dict[str, Any]:
+    return {
+        "id": dead.pk,
+        "intent_id": dead.payment_intent.intent_id,
+        "tenant_id": dead.tenant_id,
+        "source": dead.source,
+        "error_class": dead.error_class,
+        "error_message": dead.error_message,
+        "attempts": dead.attempts,
+        "task_args": dead.task_args,
+        "cpf_masked": dead.cpf_masked,
+        "status": dead.status,
+        "replay_count": dead.replay_count,
+        "replayed_at": dead.replayed_at.isoformat() if dead.replayed_at else None,
+        "created_at": dead.created_at.isoformat(),
+    }
+
+
+def list_dead_letters(qs: QuerySet, *, after: Optional[int] = None, limit: int = 100) -> Dict[str, Any]:
+    """Página por keyset: ids abaixo de `after`, do mais recente para o mais antigo."""
+    limit = max(1, min(limit, MAX_PAGE))
+    if after:
+        qs = qs.filter(pk__lt=after)
+    rows = list(qs.select_related("payment_intent").order_by("-id")[: limit + 1])
+    page = rows[:limit]
+    return {
+        "results": [_row(d) for d in page],
+        "next_after": page[-1].pk if len(rows) > limit else None,
+    }
+
+
+def _enqueue(intent: PaymentIntent, dead: SettlementDeadLetter, cpf: str) -> Dict[str, Any]:
+    from .settlement_scheduler import enqueue_settlement, partitioning_enabled
+
+    args = dead.task_args
+    if partitioning_enabled():
+        consent = Consent.objects.get(pk=args["consent_id"])
+        job, _ = enqueue_settlement(
+            intent, consent=consent, cpf=cpf, pix_key=args["pix_key"], description=args.get("description") or ""
+        )
+        return {"job_id": job.pk, "partition": job.partition}
+
+    from app.paypibridge.tasks import process_settlement_execute
+
+    transaction.on_commit(
+        lambda: process_settlement_execute.delay(
+            intent.intent_id, args["consent_id"], cpf, args["pix_key"], args.get("description") or ""
+        )
+    )
+    return {}
+
+
+def replay_one(dead_id: int, *, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Reenvia uma dead letter pendente. Intents já liquidados ou com o Pix possivelmente enviado
+    (payout_blocked_reason) só fecham a linha como discarded: nunca um segundo Pix.
+    """
+    from .settlement_service import payout_blocked_reason
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        dead = (
+            SettlementDeadLetter.objects.select_for_update(skip_locked=True)
+            .select_related("payment_intent")
+            .filter(pk=dead_id, status=SettlementDeadLetter.ST_PENDING)
+            .first()
+        )
+        if dead is None:
+            return {"id": dead_id, "status": "skipped"}
+        intent = PaymentIntent.objects.select_for_update().get(pk=dead.payment_intent_id)
+        blocked = payout_blocked_reason(intent)
+        if blocked:
+            dead.status = SettlementDeadLetter.ST_DISCARDED
+            dead.save(update_fields=["status", "updated_at"])
+            if blocked != "already_settled":
+                logger.error(
+                    "settlement_dead_letter_refused",
+                    extra={"dead_letter_id": dead_id, "intent_id": intent.intent_id, "reason": blocked},
+                )
+            return {"id": dead_id, "status": blocked}
+
+        out = _enqueue(intent, dead, unseal_cpf(dead.cpf_sealed))
+        SettlementDeadLetter.objects.filter(pk=dead.pk).update(
+            status=SettlementDeadLetter.ST_REPLAYED,
+            replay_count=F("replay_count") + 1,
+            replayed_at=now,
+            updated_at=now,
+        )
+    logger.info("settlement_dead_letter_replayed", extra={"dead_letter_id": dead_id, "intent_id": intent.intent_id})
+    return {"id": dead_id, "status": "replayed", "intent_id": intent.intent_id, **out}
+
+
+def replay_dead_letters(
+    qs: QuerySet,
+    *,
+    rate: Optional[float] = None,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+    sleep=time.sleep,
+) -> Dict[str, Any]:
+    """Reenvia as dead letters pendentes do filtro, das mais antigas para as mais recentes, a `rate`/s."""
+    rate = float(rate if rate is not None else getattr(settings, "SETTLEMENT_DLQ_REPLAY_RATE", 5))
+    ids = qs.filter(status=SettlementDeadLetter.ST_PENDING).order_by("id").values_list("pk", flat=True)
+    ids = list(ids[:limit] if limit else ids)
+    if dry_run:
+        return {"dry_run": True, "matched": len(ids), "ids": ids}
+
+    interval = 1.0 / rate if rate > 0 else 0.0
+    counts: Dict[str, int] = {}
+    results = []
+    for n, dead_id in enumerate(ids):
+        if n and interval:
+            sleep(interval)
+        result = replay_one(dead_id)
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        results.append(result)
+    return {"dry_run": False, "matched": len(ids), "counts": counts, "results": results}
@@ -0,0 +1,292 @@
+"""
+Scheduler de liquidação particionado (SETTLEMENT_PARTITIONS > 0; 0 = process_settlement_execute direto).
+
+Cada liquidação vira um SettlementJob numa de N partições, escolhida por hash consistente da chave
+(tenant dono da wallet de PI; sem tenant, o beneficiário): a mesma chave cai sempre na mesma partição e
+mudar N só move ~1/N das chaves. Enquanto uma chave tem jobs vivos, os novos ficam na partição deles.
+
+Cada partição corre um job de cada vez: serialização estrita por chave, paralelismo entre partições.
+O próximo job é o de menor virtual_finish (weighted fair queuing): ao enfileirar,
+F = max(V, último F da chave na partição) + 1 / Tenant.settlement_weight, com V o relógio da partição
+(F do último job iniciado). A rajada de um tenant fica atrás dos jobs dos outros em vez de os atrasar.
+
+O dispatch é encadeado (o fim de um job despacha o seguinte) e o beat dispatch_settlement_partitions
+recupera partições paradas; um job "running" há mais de SETTLEMENT_JOB_TIMEOUT_SECONDS volta à fila.
+Falhas transitórias voltam à fila com backoff, mantendo o lugar, até SETTLEMENT_JOB_MAX_ATTEMPTS; depois
+dead letter. partition_stats() dá a profundidade das filas por partição e por chave.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from app.paypibridge.models import Consent, PaymentIntent, SettlementDeadLetter, SettlementJob, SettlementPartition
+
+from .settlement_service import execute_settlement, mark_settlement_dead_letter
+
+logger = logging.getLogger(__name__)
+
+_VQUANT = Decimal("0.00000001")
+
+
+def partition_count() -> int:
+    return max(0, int(getattr(settings, "SETTLEMENT_PARTITIONS", 0)))
+
+
+def partitioning_enabled() -> bool:
+    return partition_count() > 0
+
+
+def partition_key(intent: PaymentIntent) -> str:
+    return f"tenant:{intent.tenant_id}" if intent.tenant_id else f"payee:{intent.payee_user_id}"
+
+
+def partition_queue(partition: int) -> Optional[str]:
+    """Fila Celery da partição (SETTLEMENT_PARTITION_QUEUE_PREFIX + índice); sem prefixo, a fila padrão."""
+    prefix = getattr(settings, "SETTLEMENT_PARTITION_QUEUE_PREFIX", "")
+    return f"{prefix}{partition}" if prefix else None
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Anel de hash consistente com nós virtuais por partição."""
+
+    def __init__(self, partitions: int, vnodes: int = 64):
+        points = sorted((_hash(f"partition-{p}#{v}"), p) for p in range(partitions) for v in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [p for _, p in points]
+
+    def partition_for(self, key: str) -> int:
+        return self._owners[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+@lru_cache(maxsize=8)
+def get_ring(partitions: int) -> HashRing:
+    return HashRing(partitions)
+
+
+def _lock_partition(index: int) -> SettlementPartition:
+    SettlementPartition.objects.get_or_create(index=index)
+    return SettlementPartition.objects.select_for_update().get(index=index)
+
+
+def _kick(partition: int) -> None:
+    from app.paypibridge.tasks import dispatch_settlement_partition
+
+    dispatch_settlement_partition.delay(partition)
+
+
+def enqueue_settlement(
+    intent: PaymentIntent,
+    *,
+    consent: Consent,
+    cpf: str,
+    pix_key: str,
+    description: str = "",
+) -> Tuple[SettlementJob, bool]:
+    """Enfileira a liquidação do intent (idempotente enquanto houver um job vivo). Devolve (job, criado)."""
+    live = SettlementJob.objects.filter(payment_intent=intent, status__in=SettlementJob.LIVE_STATUSES).first()
+    if live is not None:
+        return live, False
+
+    key = partition_key(intent)
+    sticky = (
+        SettlementJob.objects.filter(partition_key=key, status__in=SettlementJob.LIVE_STATUSES)
+        .values_list("partition", flat=True)
+        .first()
+    )
+    partition = sticky if sticky is not None else get_ring(partition_count()).partition_for(key)
+    weight = max(1, intent.tenant.settlement_weight) if intent.tenant_id else 1
+    try:
+        with transaction.atomic():
+            part = _lock_partition(partition)
+            last = SettlementJob.objects.filter(
+                partition=partition, partition_key=key, status=SettlementJob.ST_QUEUED
+            ).aggregate(m=Max("virtual_finish"))["m"]
+            start = max(part.virtual_time, last if last is not None else part.virtual_time)
+            job = SettlementJob.objects.create(
+                payment_intent=intent,
+                tenant_id=intent.tenant_id,
+                partition_key=key,
+                partition=partition,
+                virtual_finish=(start + Decimal(1) / weight).quantize(_VQUANT),
+                args={"consent_id": consent.pk, "cpf": cpf, "pix_key": pix_key, "description": description or ""},
+            )
+    except IntegrityError:
+        return SettlementJob.objects.get(payment_intent=intent, status__in=SettlementJob.LIVE_STATUSES), False
+
+    transaction.on_commit(lambda: _kick(partition))
+    logger.info(
+        "settlement_job_enqueued",
+        extra={"intent_id": intent.intent_id, "job_id": job.pk, "partition": partition, "key": key},
+    )
+    return job, True
+
+
+def claim_next(partition: int, now: Optional[datetime] = None) -> Optional[SettlementJob]:
+    """Marca como running o próximo job da partição, se nenhum estiver a correr."""
+    now = now or timezone.now()
+    timeout = int(getattr(settings, "SETTLEMENT_JOB_TIMEOUT_SECONDS", 600))
+    with transaction.atomic():
+        part = _lock_partition(partition)
+        running = SettlementJob.objects.filter(partition=partition, status=SettlementJob.ST_RUNNING)
+        stale = running.filter(started_at__lt=now - timedelta(seconds=timeout)).update(
+            status=SettlementJob.ST_QUEUED, started_at=None
+        )
+        if stale:
+            logger.warning("settlement_job_requeued_stale", extra={"partition": partition, "jobs": stale})
+        if running.exists():
+            return None
+        job = (
+            SettlementJob.objects.filter(partition=partition, status=SettlementJob.ST_QUEUED, not_before__lte=now)
+            .order_by("virtual_finish", "id")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = SettlementJob.ST_RUNNING
+        job.started_at = now
+        job.attempts += 1
+        job.save(update_fields=["status", "started_at", "attempts"])
+        part.virtual_time = max(part.virtual_time, job.virtual_finish)
+        part.dispatched += 1
+        part.save(update_fields=["virtual_time", "dispatched", "updated_at"])
+    return job
+
+
+def dispatch_partition(partition: int, now: Optional[datetime] = None) -> Optional[int]:
+    """Reclama o próximo job da partição e envia-o para o worker (na fila da partição)."""
+    job = claim_next(partition, now)
+    if job is None:
+        return None
+    from app.paypibridge.tasks import run_settlement_job
+
+    queue = partition_queue(partition)
+    options = {"queue": queue} if queue else {}
+    transaction.on_commit(lambda: run_settlement_job.apply_async(args=[job.pk], **options))
+    return job.pk
+
+
+def _finish(job: SettlementJob, status: str, result: Dict[str, Any]) -> None:
+    # Condicional: se o job foi dado como perdido e reenfileirado entretanto, este resultado não o sobrepõe.
+    SettlementJob.objects.filter(pk=job.pk, status=SettlementJob.ST_RUNNING, started_at=job.started_at).update(
+        status=status, result=result, args={}, finished_at=timezone.now()
+    )
+
+
+def run_job(job_id: int) -> Dict[str, Any]:
+    """Executa um job reclamado e despacha o seguinte da partição."""
+    job = (
+        SettlementJob.objects.select_related("payment_intent")
+        .filter(pk=job_id, status=SettlementJob.ST_RUNNING)
+        .first()
+    )
+    if job is None:
+        return {"status": "skipped", "job_id": job_id}
+
+    intent_id = job.payment_intent.intent_id
+    args = job.args
+    try:
+        result = execute_settlement(
+            intent_id, args["consent_id"], args["cpf"], args["pix_key"], args.get("description") or ""
+        )
+    except Exception as exc:
+        max_attempts = int(getattr(settings, "SETTLEMENT_JOB_MAX_ATTEMPTS", 4))
+        logger.warning(
+            "settlement_job_retry",
+            exc_info=True,
+            extra={"intent_id": intent_id, "job_id": job.pk, "attempts": job.attempts},
+        )
+        if job.attempts >= max_attempts:
+            mark_settlement_dead_letter(
+                intent_id,
+                exc,
+                source=SettlementDeadLetter.SOURCE_SCHEDULER,
+                attempts=job.attempts,
+                consent_id=args["consent_id"],
+                cpf=args["cpf"],
+                pix_key=args["pix_key"],
+                description=args.get("description") or "",
+            )
+            result = {"status": "dead_letter", "code": "max_retries", "detail": str(exc)}
+            _finish(job, SettlementJob.ST_FAILED, result)
+        else:
+            delay = min(300, 10 * (2 ** (job.attempts - 1)))
+            SettlementJob.objects.filter(pk=job.pk, status=SettlementJob.ST_RUNNING, started_at=job.started_at).update(
+                status=SettlementJob.ST_QUEUED,
+                started_at=None,
+                not_before=timezone.now() + timedelta(seconds=delay),
+            )
+            result = {"status": "retry", "code": "transient_error", "detail": str(exc), "retry_in": delay}
+    else:
+        ok = result.get("status") in ("success", "already_settled")
+        _finish(job, SettlementJob.ST_DONE if ok else SettlementJob.ST_FAILED, result)
+
+    dispatch_partition(job.partition)
+    return result
+
+
+def _active_partitions() -> List[int]:
+    live = SettlementJob.objects.filter(status__in=SettlementJob.LIVE_STATUSES).values_list("partition", flat=True)
+    return sorted(set(range(partition_count())) | set(live.distinct()))
+
+
+def dispatch_all(now: Optional[datetime] = None) -> List[int]:
+    """Despacha o próximo job de cada partição parada (beat)."""
+    return [job_id for job_id in (dispatch_partition(p, now) for p in _active_partitions()) if job_id is not None]
+
+
+def partition_stats(now: Optional[datetime] = None, top_keys: int = 10) -> List[Dict[str, Any]]:
+    """Profundidade por partição: queued/running, idade do mais antigo e as chaves com mais jobs na fila."""
+    now = now or timezone.now()
+    counts: Dict[int, Dict[str, Any]] = {}
+    rows = (
+        SettlementJob.objects.filter(status__in=SettlementJob.LIVE_STATUSES)
+        .values("partition", "status")
+        .annotate(n=Count("id"), oldest=Min("enqueued_at"))
+        .order_by()
+    )
+    for row in rows:
+        counts.setdefault(row["partition"], {})[row["status"]] = row
+    keys: Dict[int, List[Tuple[str, int]]] = {}
+    for row in (
+        SettlementJob.objects.filter(status=SettlementJob.ST_QUEUED)
+        .values("partition", "partition_key")
+        .annotate(n=Count("id"))
+        .order_by("partition", "-n", "partition_key")
+    ):
+        keys.setdefault(row["partition"], []).append((row["partition_key"], row["n"]))
+    parts = {p.index: p for p in SettlementPartition.objects.all()}
+
+    out = []
+    for index in sorted(set(range(partition_count())) | set(counts)):
+        queued = counts.get(index, {}).get(SettlementJob.ST_QUEUED)
+        running = counts.get(index, {}).get(SettlementJob.ST_RUNNING)
+        part = parts.get(index)
+        out.append(
+            {
+                "partition": index,
+                "queue": partition_queue(index) or "default",
+                "queued": queued["n"] if queued else 0,
+                "running": running["n"] if running else 0,
+                "oldest_queued_age_seconds": int((now - queued["oldest"]).total_seconds()) if queued else 0,
+                "dispatched": part.dispatched if part else 0,
+                "virtual_time": str(part.virtual_time) if part else "0",
+                "queued_by_key": dict(keys.get(index, [])[:top_keys]),
+            }
+        )
+    return out
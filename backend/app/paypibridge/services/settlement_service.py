@@ -1,27 +1,221 @@
 """
 Motor de liquidação: Pi (montante) → BRL (câmbio + taxa) → Pix para chave do beneficiário.
 Só deve correr após pagamento Pi validado (ex.: verified_at preenchido).
+
+Só um worker liquida cada intent: claim_settlement é um UPDATE condicional que põe
+settlement_status=PROCESSING com dono e validade (SETTLEMENT_LEASE_SECONDS); entregas duplicadas da
+mesma task perdem o claim e não enviam Pix. Imediatamente antes do Pix a lease recebe a marca
+settlement_pix_sending_at (mark_pix_sending); a partir daí o intent nunca volta a ser reclamado. Leases
+expiradas (worker morto) são fechadas por sweep_expired_settlement_leases: sem marca o Pix não saiu
+(SETTLEMENT_FAILED, reserva libertada); com marca pode ter saído (SETTLEMENT_UNKNOWN, reserva mantida,
+revisão manual no PSP).
+
+Nenhuma transação nem lock de wallet fica aberto durante o Pix: o PI é reservado antes (BalanceHold,
+transação curta) e capturado depois, junto com os lançamentos; Pix recusado liberta a reserva.
+O webhook do tenant entra no outbox na transação que regista a liquidação (sem HTTP aqui).
 """
 
 from __future__ import annotations
 
 import logging
+import uuid
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Optional
+from typing import List, Optional, Tuple
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from app.paypibridge.models import Consent, PaymentIntent, PixTransaction, Settlement
+from app.paypibridge.models import (
+    BalanceHold,
+    Consent,
+    PaymentIntent,
+    PixTransaction,
+    Settlement,
+    SettlementDeadLetter,
+    Wallet,
+)
 
 from .pricing_service import get_pricing_service
 from .settlement_pix_port import SettlementPixPort
-from .ledger_service import apply_settlement_ledger, get_active_fee_rate
+from .ledger_service import (
+    apply_settlement_ledger,
+    get_active_fee_rate,
+    mark_hold_settling,
+    release_hold,
+    reserve_hold,
+)
+from .retry_service import schedule_retry
+from .settlement_dead_letter import record_dead_letter
 from .tenant_webhook import notify_payment_intent_webhook
 
 logger = logging.getLogger(__name__)
 
 
+def settlement_amounts(gross: Decimal, fee_rate: Optional[Decimal] = None) -> Tuple[Decimal, Decimal]:
+    """(taxa, líquido) em BRL para um bruto, com a taxa ativa."""
+    if fee_rate is None:
+        fee_rate = get_active_fee_rate()
+    fee = (gross * fee_rate).quantize(Decimal("0.01"))
+    return fee, (gross - fee).quantize(Decimal("0.01"))
+
+
+def mark_intent_settled(
+    intent: PaymentIntent,
+    *,
+    gross: Decimal,
+    fee: Decimal,
+    net: Decimal,
+    txid: str,
+    metadata: Optional[dict] = None,
+) -> None:
+    """Campos de liquidação do intent (dentro da transação que regista o Pix)."""
+    intent.amount_brl = gross
+    intent.settled_amount_brl = net
+    intent.settlement_fee_brl = fee
+    intent.settlement_pix_txid = txid
+    intent.settlement_status = "SETTLED"
+    intent.status = "SETTLED"
+    intent.settlement_lease_owner = ""
+    intent.settlement_lease_expires_at = None
+    intent.settlement_pix_sending_at = None
+    intent.metadata = {
+        **intent.metadata,
+        "settlement_at": timezone.now().isoformat(),
+        "settlement_gross_brl": str(gross),
+        "settlement_net_brl": str(net),
+        "settlement_fee_brl": str(fee),
+        **(metadata or {}),
+    }
+    intent.save(
+        update_fields=[
+            "amount_brl",
+            "settled_amount_brl",
+            "settlement_fee_brl",
+            "settlement_pix_txid",
+            "settlement_status",
+            "status",
+            "metadata",
+            "settlement_lease_owner",
+            "settlement_lease_expires_at",
+            "settlement_pix_sending_at",
+        ]
+    )
+
+
+ST_PROCESSING = "PROCESSING"
+# Lease expirada depois da marca de envio: o Pix pode ter saído. Terminal até revisão manual.
+ST_UNKNOWN = "SETTLEMENT_UNKNOWN"
+
+
+def _lease_seconds() -> int:
+    return int(getattr(settings, "SETTLEMENT_LEASE_SECONDS", 300))
+
+
+def claim_settlement(intent: PaymentIntent, owner: str, *, now: Optional[datetime] = None) -> bool:
+    """
+    UPDATE condicional para PROCESSING com dono e validade, só se o intent é liquidável e não tem lease
+    válida. Devolve True para o único chamador que ganha.
+    """
+    now = now or timezone.now()
+    expires = now + timedelta(seconds=_lease_seconds())
+    won = (
+        PaymentIntent.objects.filter(pk=intent.pk, verified_at__isnull=False)
+        .exclude(status__in=("SETTLED", "CANCELLED"))
+        .exclude(settlement_status__in=("SETTLED", "BATCHED", ST_UNKNOWN))
+        .filter(settlement_pix_sending_at__isnull=True)
+        .filter(~Q(settlement_status=ST_PROCESSING) | Q(settlement_lease_expires_at__lt=now))
+        .update(settlement_status=ST_PROCESSING, settlement_lease_owner=owner, settlement_lease_expires_at=expires)
+    )
+    if won:
+        intent.settlement_status = ST_PROCESSING
+        intent.settlement_lease_owner = owner
+        intent.settlement_lease_expires_at = expires
+    return bool(won)
+
+
+def payout_blocked_reason(intent: PaymentIntent) -> Optional[str]:
+    """
+    Motivo para não tentar outro Pix para o intent (replay, reenvio manual): já liquidado, ou Pix
+    possivelmente enviado (marca de envio, SETTLEMENT_UNKNOWN, lease expirada/perdida após o envio, ou já
+    existe PixTransaction). None se um novo envio é seguro.
+    """
+    if intent.status == "SETTLED" or intent.settlement_status == "SETTLED":
+        return "already_settled"
+    expired = intent.metadata.get("settlement_lease_expired")
+    # Marcas antigas (sem pix_possibly_sent) contam como possivelmente enviadas.
+    expired_after_send = bool(expired) and (not isinstance(expired, dict) or expired.get("pix_possibly_sent", True))
+    if (
+        intent.settlement_status == ST_UNKNOWN
+        or intent.settlement_pix_sending_at is not None
+        or expired_after_send
+        or intent.metadata.get("settlement_lease_lost")
+    ):
+        return "pix_possibly_sent"
+    if PixTransaction.objects.filter(intent=intent).exists():
+        return "pix_exists"
+    return None
+
+
+def mark_pix_sending(
+    intent: PaymentIntent, owner: str, hold: Optional[BalanceHold] = None, *, now: Optional[datetime] = None
+) -> bool:
+    """
+    Marca que o Pix vai sair, só se a lease ainda é deste dono e está válida e a reserva continua
+    ativa. Sem marca não se envia; com marca a reserva deixa de expirar (release_expired_holds).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        marked = PaymentIntent.objects.filter(
+            pk=intent.pk,
+            settlement_status=ST_PROCESSING,
+            settlement_lease_owner=owner,
+            settlement_lease_expires_at__gt=now,
+        ).update(settlement_pix_sending_at=now)
+        # Intent antes da reserva: mesma ordem de locks que o sweeper.
+        if marked and hold is not None:
+            if not BalanceHold.objects.select_for_update().filter(pk=hold.pk, status=BalanceHold.ST_ACTIVE).exists():
+                transaction.set_rollback(True)
+                marked = 0
+    if marked:
+        intent.settlement_pix_sending_at = now
+    return bool(marked)
+
+
+def release_settlement_lease(intent: PaymentIntent, owner: str, settlement_status: Optional[str]) -> bool:
+    """
+    Fecha a lease com o estado final (o Pix não saiu: a marca de envio é limpa); sem efeito se a lease já
+    não for deste dono (expirada e reclamada ou varrida).
+    """
+    released = PaymentIntent.objects.filter(pk=intent.pk, settlement_lease_owner=owner).update(
+        settlement_status=settlement_status,
+        settlement_lease_owner="",
+        settlement_lease_expires_at=None,
+        settlement_pix_sending_at=None,
+    )
+    if released:
+        intent.settlement_status = settlement_status
+        intent.settlement_lease_owner = ""
+        intent.settlement_lease_expires_at = None
+        intent.settlement_pix_sending_at = None
+    return bool(released)
+
+
+def _note_lease_lost(intent: PaymentIntent, **evidence) -> None:
+    """Resposta do Pix chegou depois de a lease ser varrida: fica no intent para a revisão manual."""
+    with transaction.atomic():
+        locked = PaymentIntent.objects.select_for_update().get(pk=intent.pk)
+        locked.metadata = {
+            **locked.metadata,
+            "settlement_lease_lost": {**evidence, "at": timezone.now().isoformat()},
+        }
+        locked.save(update_fields=["metadata"])
+    logger.error("settlement_lease_lost", extra={"intent_id": intent.intent_id, **evidence})
+
+
 @dataclass
 class SettlementResult:
     success: bool
@@ -64,19 +258,36 @@ class SettlementService:
         if intent.status == "CANCELLED":
             return SettlementResult(False, None, None, None, None, "intent_cancelled")
 
-        gross = self.pricing.convert_pi_to_brl(intent.amount_pi)
-        if gross is None:
-            return SettlementResult(
-                False, None, None, None, None, "fx_unavailable"
-            )
+        previous_status = intent.settlement_status
+        owner = uuid.uuid4().hex
+        if not claim_settlement(intent, owner):
+            intent.refresh_from_db(fields=["status", "settlement_status"])
+            if "SETTLED" in (intent.status, intent.settlement_status):
+                error = "already_settled"
+            elif intent.settlement_status == ST_UNKNOWN:
+                error = "settlement_unknown"
+            else:
+                error = "settlement_in_progress"
+            return SettlementResult(False, None, None, None, None, error)
 
-        fee = (gross * get_active_fee_rate()).quantize(Decimal("0.01"))
-        net = (gross - fee).quantize(Decimal("0.01"))
-        if net <= 0:
-            return SettlementResult(
-                False, gross, None, fee, None, "net_amount_non_positive"
-            )
+        try:
+            prepared = self._prepare(intent)
+        except Exception:
+            release_settlement_lease(intent, owner, previous_status)
+            raise
+        if isinstance(prepared, SettlementResult):
+            release_settlement_lease(intent, owner, previous_status)
+            return prepared
+        gross, fee, net, hold = prepared
 
+        if not mark_pix_sending(intent, owner, hold):
+            # Lease expirada (ou reserva perdida) antes do envio: nenhum Pix saiu.
+            if hold is not None:
+                release_hold(hold)
+            release_settlement_lease(intent, owner, previous_status)
+            return SettlementResult(False, gross, net, fee, None, "settlement_lease_lost")
+
+        # A partir daqui o Pix pode ter saído: uma exceção deixa a lease expirar (sweeper), nunca a liberta.
         pix_out = self.pix_port.send(
             consent=consent,
             cpf=cpf,
@@ -86,8 +297,12 @@ class SettlementService:
         )
 
         if not pix_out.get("success"):
-            intent.settlement_status = "SETTLEMENT_FAILED"
-            intent.save(update_fields=["settlement_status"])
+            # Recusa do PSP: o Pix não saiu. Se a lease já foi varrida (SETTLEMENT_UNKNOWN) fica para revisão.
+            if release_settlement_lease(intent, owner, "SETTLEMENT_FAILED"):
+                if hold is not None:
+                    release_hold(hold)
+            else:
+                _note_lease_lost(intent, pix_sent=False, pix_error=pix_out.get("error") or "pix_failed")
             return SettlementResult(
                 False,
                 gross,
@@ -98,6 +313,85 @@ class SettlementService:
             )
 
         txid = pix_out.get("txid") or ""
+        with transaction.atomic():
+            recorded = self._record_settlement(
+                intent, owner, pix_out, txid, gross=gross, fee=fee, net=net, hold=hold
+            )
+            if recorded:
+                notify_payment_intent_webhook(
+                    intent,
+                    {
+                        "event": "payment_settled",
+                        "gross_brl": str(gross),
+                        "fee_brl": str(fee),
+                        "net_brl": str(net),
+                        "pix_txid": txid,
+                    },
+                )
+        if not recorded:
+            _note_lease_lost(intent, pix_sent=True, pix_txid=txid, net_brl=str(net))
+            return SettlementResult(False, gross, net, fee, txid, "settlement_lease_lost")
+        self.post_ledger(intent, gross=gross, fee=fee, net=net, hold=hold)
+
+        logger.info(
+            "Settlement completed",
+            extra={
+                "intent_id": intent.intent_id,
+                "net_brl": str(net),
+                "pix_txid": txid,
+            },
+        )
+
+        return SettlementResult(
+            success=True,
+            gross_brl=gross,
+            net_brl=net,
+            fee_brl=fee,
+            pix_txid=txid,
+            error=None,
+        )
+
+    def _prepare(self, intent: PaymentIntent):
+        """Câmbio, taxa e reserva do PI: (gross, fee, net, hold) ou SettlementResult de erro."""
+        gross = self.pricing.convert_pi_to_brl(intent.amount_pi)
+        if gross is None:
+            return SettlementResult(False, None, None, None, None, "fx_unavailable")
+
+        fee, net = settlement_amounts(gross)
+        if net <= 0:
+            return SettlementResult(False, gross, None, fee, None, "net_amount_non_positive")
+
+        hold = None
+        if intent.tenant_id:
+            try:
+                hold, created = reserve_hold(
+                    intent.tenant,
+                    Wallet.ASSET_PI,
+                    intent.amount_pi,
+                    reference=f"settle:{intent.intent_id}",
+                    payment_intent=intent,
+                )
+            except ValueError as exc:
+                return SettlementResult(False, gross, net, fee, None, str(exc))
+            if not created:
+                return SettlementResult(False, gross, net, fee, None, "settlement_in_progress")
+        return gross, fee, net, hold
+
+    def _record_settlement(
+        self,
+        intent: PaymentIntent,
+        owner: str,
+        pix_out: dict,
+        txid: str,
+        *,
+        gross: Decimal,
+        fee: Decimal,
+        net: Decimal,
+        hold: Optional[BalanceHold],
+    ) -> bool:
+        """Regista o Pix só se a lease ainda é deste dono (não varrida para SETTLEMENT_UNKNOWN)."""
+        if not PaymentIntent.objects.select_for_update().filter(pk=intent.pk, settlement_lease_owner=owner).exists():
+            return False
         PixTransaction.objects.create(
             intent=intent,
             tx_id=txid,
@@ -105,30 +399,7 @@ class SettlementService:
             payload=pix_out.get("raw") or pix_out,
         )
 
-        intent.amount_brl = gross
-        intent.settled_amount_brl = net
-        intent.settlement_fee_brl = fee
-        intent.settlement_pix_txid = txid
-        intent.settlement_status = "SETTLED"
-        intent.status = "SETTLED"
-        intent.metadata = {
-            **intent.metadata,
-            "settlement_at": timezone.now().isoformat(),
-            "settlement_gross_brl": str(gross),
-            "settlement_net_brl": str(net),
-            "settlement_fee_brl": str(fee),
-        }
-        intent.save(
-            update_fields=[
-                "amount_brl",
-                "settled_amount_brl",
-                "settlement_fee_brl",
-                "settlement_pix_txid",
-                "settlement_status",
-                "status",
-                "metadata",
-            ]
-        )
+        mark_intent_settled(intent, gross=gross, fee=fee, net=net, txid=txid)
 
         Settlement.objects.update_or_create(
             payment_intent=intent,
@@ -139,12 +410,27 @@ class SettlementService:
                 "error_message": "",
             },
         )
+        if hold is not None:
+            mark_hold_settling(hold, txid)
+        return True
+
+    @staticmethod
+    def post_ledger(
+        intent: PaymentIntent,
+        *,
+        gross: Decimal,
+        fee: Decimal,
+        net: Decimal,
+        hold: Optional[BalanceHold] = None,
+    ) -> None:
+        """Lançamentos + captura da reserva; se falhar (Pix já enviado) fica em RetryTask "settlement_ledger"."""
         try:
             apply_settlement_ledger(
                 intent,
                 gross_brl=gross,
                 fee_brl=fee,
                 net_brl=net,
+                hold=hold,
             )
         except Exception as exc:
             logger.exception(
@@ -152,32 +438,152 @@ class SettlementService:
                 exc,
                 extra={"intent_id": intent.intent_id},
             )
+            schedule_retry(
+                "settlement_ledger",
+                {
+                    "intent_id": intent.intent_id,
+                    "hold_id": hold.pk if hold is not None else None,
+                    "gross_brl": str(gross),
+                    "fee_brl": str(fee),
+                    "net_brl": str(net),
+                },
+                delay_seconds=60,
+            )
+
+
+def _amount(value: Optional[Decimal]) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+def execute_settlement(intent_id: str, consent_id: int, cpf: str, pix_key: str, description: str = "") -> dict:
+    """
+    Corpo de uma liquidação enfileirada (process_settlement_execute / scheduler por partição).
+    Devolve o payload do resultado; exceções (transitórias) sobem para o chamador decidir o retry.
+    """
+    with transaction.atomic():
+        intent = PaymentIntent.objects.select_for_update().filter(intent_id=intent_id).first()
+        if intent is None:
+            return {"status": "error", "code": "intent_not_found", "detail": "PaymentIntent not found"}
+        if intent.status == "SETTLED" or intent.settlement_status == "SETTLED":
+            return {"status": "already_settled", "intent_id": intent.intent_id}
+        if not intent.verified_at:
+            return {"status": "not_ready", "code": "pi_payment_not_verified", "detail": "pi_payment_not_verified"}
 
-        notify_payment_intent_webhook(
+    consent = Consent.objects.filter(pk=consent_id, status="ACTIVE").first()
+    if not consent:
+        return {"status": "error", "code": "consent_not_found", "detail": "no active consent for payee"}
+
+    intent = PaymentIntent.objects.get(intent_id=intent_id)
+    settlement = SettlementService().settle(
+        intent, consent=consent, cpf=cpf, pix_key=pix_key, description=description or ""
+    )
+    if not settlement.success:
+        return {
+            "status": "error",
+            "code": settlement.error or "settlement_failed",
+            "detail": settlement.error or "settlement_failed",
+            "gross_brl": _amount(settlement.gross_brl),
+            "net_brl": _amount(settlement.net_brl),
+            "fee_brl": _amount(settlement.fee_brl),
+        }
+    return {
+        "status": "success",
+        "intent_id": intent.intent_id,
+        "gross_brl": str(settlement.gross_brl),
+        "net_brl": str(settlement.net_brl),
+        "fee_brl": str(settlement.fee_brl),
+        "pix_txid": settlement.pix_txid,
+    }
+
+
+def mark_settlement_dead_letter(
+    intent_id: str,
+    exc: BaseException,
+    *,
+    source: str,
+    attempts: int,
+    consent_id: Optional[int] = None,
+    cpf: str = "",
+    pix_key: str = "",
+    description: str = "",
+) -> Optional[SettlementDeadLetter]:
+    """
+    Intent fica SETTLEMENT_FAILED e a liquidação vai para SettlementDeadLetter (CPF selado). Lease em
+    curso, Pix possivelmente enviado ou liquidado: o estado não muda (só o sweeper/revisão o fecham).
+    """
+    error = str(exc)
+    with transaction.atomic():
+        intent = PaymentIntent.objects.select_for_update().filter(intent_id=intent_id).first()
+        if not intent:
+            return None
+        intent.metadata = {
+            **intent.metadata,
+            "settlement_dead_letter": True,
+            "settlement_dead_letter_error": error[:500],
+        }
+        in_flight = intent.settlement_status in ("SETTLED", ST_PROCESSING, ST_UNKNOWN)
+        if not in_flight and intent.settlement_pix_sending_at is None:
+            intent.settlement_status = "SETTLEMENT_FAILED"
+        intent.save(update_fields=["metadata", "settlement_status"])
+        return record_dead_letter(
             intent,
-            {
-                "event": "payment_settled",
-                "gross_brl": str(gross),
-                "fee_brl": str(fee),
-                "net_brl": str(net),
-                "pix_txid": txid,
-            },
+            source=source,
+            error_class=type(exc).__name__,
+            error=error,
+            attempts=attempts,
+            consent_id=consent_id,
+            cpf=cpf,
+            pix_key=pix_key,
+            description=description,
         )
 
-        logger.info(
-            "Settlement completed",
-            extra={
-                "intent_id": intent.intent_id,
-                "net_brl": str(net),
-                "pix_txid": txid,
-            },
-        )
 
-        return SettlementResult(
-            success=True,
-            gross_brl=gross,
-            net_brl=net,
-            fee_brl=fee,
-            pix_txid=txid,
-            error=None,
-        )
+def sweep_expired_settlement_leases(now: Optional[datetime] = None, limit: int = 500) -> List[str]:
+    """
+    Fecha leases PROCESSING expiradas (worker morto a meio). Sem marca de envio o Pix não saiu: intent
+    SETTLEMENT_FAILED, reserva libertada, pode voltar a ser submetido. Com marca o Pix pode ter saído:
+    SETTLEMENT_UNKNOWN (claim_settlement não o volta a pegar) e a reserva fica até à revisão no PSP.
+    """
+    now = now or timezone.now()
+    expired = list(
+        PaymentIntent.objects.filter(settlement_status=ST_PROCESSING, settlement_lease_expires_at__lt=now)
+        .order_by("settlement_lease_expires_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+    swept, unknown = [], []
+    for pk in expired:
+        with transaction.atomic():
+            intent = (
+                PaymentIntent.objects.select_for_update()
+                .filter(pk=pk, settlement_status=ST_PROCESSING, settlement_lease_expires_at__lt=now)
+                .first()
+            )
+            if intent is None:
+                continue
+            pix_possibly_sent = intent.settlement_pix_sending_at is not None
+            intent.metadata = {
+                **intent.metadata,
+                "settlement_lease_expired": {
+                    "owner": intent.settlement_lease_owner,
+                    "at": now.isoformat(),
+                    "pix_possibly_sent": pix_possibly_sent,
+                },
+            }
+            intent.settlement_status = ST_UNKNOWN if pix_possibly_sent else "SETTLEMENT_FAILED"
+            intent.settlement_lease_owner = ""
+            intent.settlement_lease_expires_at = None
+            intent.save(
+                update_fields=["metadata", "settlement_status", "settlement_lease_owner", "settlement_lease_expires_at"]
+            )
+            if not pix_possibly_sent:
+                hold = BalanceHold.objects.filter(
+                    payment_intent=intent, reference=f"settle:{intent.intent_id}", status=BalanceHold.ST_ACTIVE
+                ).first()
+                if hold is not None:
+                    release_hold(hold)
+        swept.append(intent.intent_id)
+        if pix_possibly_sent:
+            unknown.append(intent.intent_id)
+    if swept:
+        logger.error("settlement_lease_expired", extra={"intents": swept, "pix_possibly_sent": unknown})
+    return swept
@@ -0,0 +1,175 @@
+"""
+Extrato do tenant em streaming: LedgerEntry (legado) ou JournalLine das contas-wallet (double-entry).
+
+Paginação keyset em (created_at, id) — cada página é um SELECT ... WHERE (created_at, id) > último
+ORDER BY created_at, id LIMIT n lido com .iterator(chunk_size) — e saldo corrente calculado em
+Python linha a linha; a memória não depende do número de linhas exportadas.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db.models import Q, QuerySet, Sum
+
+from app.paypibridge.models import JournalLine, LedgerAccount, LedgerEntry, Tenant
+from app.paypibridge.services.balance_checkpoint_service import balance_as_of
+
+SOURCE_JOURNAL = "journal"
+SOURCE_LEGACY = "legacy"
+
+CSV_COLUMNS = ["source", "id", "created_at", "asset", "type", "amount", "balance", "reference", "intent_id"]
+
+def _page_size() -> int:
+    return max(1, int(getattr(settings, "STATEMENT_PAGE_SIZE", 1000)))
+
+
+def _keyset(qs: QuerySet, ts_field: str, fields: tuple) -> Iterator[dict]:
+    """Percorre qs por páginas ordenadas por (ts_field, id), sem OFFSET nem count()."""
+    size = _page_size()
+    last = None
+    while True:
+        page = qs
+        if last is not None:
+            page = page.filter(Q(**{f"{ts_field}__gt": last[0]}) | Q(**{ts_field: last[0], "id__gt": last[1]}))
+        n = 0
+        for row in page.order_by(ts_field, "id").values(*fields)[:size].iterator(chunk_size=size):
+            n += 1
+            last = (row[ts_field], row["id"])
+            yield row
+        if n < size:
+            return
+
+
+def default_source(tenant: Tenant) -> str:
+    if LedgerAccount.objects.filter(tenant=tenant, wallet__isnull=False).exists():
+        return SOURCE_JOURNAL
+    return SOURCE_LEGACY
+
+
+def _legacy_rows(tenant: Tenant, asset: Optional[str], start: Optional[datetime], end: Optional[datetime]):
+    qs = LedgerEntry.objects.filter(tenant=tenant)
+    if asset:
+        qs = qs.filter(asset=asset)
+
+    balances: Dict[str, Decimal] = {}
+    if start:
+        opening = (
+            qs.filter(created_at__lt=start)
+            .values("asset", "entry_type")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        for row in opening:
+            sign = 1 if row["entry_type"] == LedgerEntry.ENTRY_CREDIT else -1
+            balances[row["asset"]] = balances.get(row["asset"], Decimal("0")) + sign * row["total"]
+        qs = qs.filter(created_at__gte=start)
+    if end:
+        qs = qs.filter(created_at__lte=end)
+
+    fields = ("id", "created_at", "asset", "entry_type", "amount", "reference", "payment_intent__intent_id")
+    for row in _keyset(qs, "created_at", fields):
+        sign = 1 if row["entry_type"] == LedgerEntry.ENTRY_CREDIT else -1
+        balance = balances.get(row["asset"], Decimal("0")) + sign * row["amount"]
+        balances[row["asset"]] = balance
+        yield {
+            "source": SOURCE_LEGACY,
+            "id": row["id"],
+            "created_at": row["created_at"].isoformat(),
+            "asset": row["asset"],
+            "type": row["entry_type"],
+            "amount": format(row["amount"], "f"),
+            "balance": format(balance, "f"),
+            "reference": row["reference"],
+            "intent_id": row["payment_intent__intent_id"],
+        }
+
+
+def _journal_rows(tenant: Tenant, asset: Optional[str], start: Optional[datetime], end: Optional[datetime]):
+    accounts = LedgerAccount.objects.filter(tenant=tenant, wallet__isnull=False)
+    if asset:
+        accounts = accounts.filter(asset=asset)
+    accounts = list(accounts)
+    if not accounts:
+        return
+
+    # Saldo de abertura por conta: sem from, o saldo sem linhas; com from, a partir dos checkpoints.
+    if start:
+        balances = {acc.pk: balance_as_of(acc, start - timedelta(microseconds=1)) for acc in accounts}
+    else:
+        balances = {acc.pk: acc.opening_balance for acc in accounts}
+    by_pk = {acc.pk: acc for acc in accounts}
+
+    qs = JournalLine.objects.filter(account__in=accounts)
+    if start:
+        qs = qs.filter(created_at__gte=start)
+    if end:
+        qs = qs.filter(created_at__lte=end)
+
+    fields = (
+        "id",
+        "created_at",
+        "account_id",
+        "side",
+        "amount",
+        "journal__reference",
+        "journal__payment_intent__intent_id",
+    )
+    for row in _keyset(qs, "created_at", fields):
+        acc = by_pk[row["account_id"]]
+        # Contas-wallet são passivo: crédito aumenta o saldo do tenant.
+        sign = 1 if row["side"] == JournalLine.SIDE_CREDIT else -1
+        balance = balances[acc.pk] + sign * row["amount"]
+        balances[acc.pk] = balance
+        yield {
+            "source": SOURCE_JOURNAL,
+            "id": row["id"],
+            "created_at": row["created_at"].isoformat(),
+            "asset": acc.asset,
+            "type": row["side"],
+            "amount": format(row["amount"], "f"),
+            "balance": format(balance, "f"),
+            "reference": row["journal__reference"],
+            "intent_id": row["journal__payment_intent__intent_id"],
+        }
+
+
+def statement_rows(
+    tenant: Tenant,
+    *,
+    source: Optional[str] = None,
+    asset: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Linhas do extrato por ordem (created_at, id), com saldo corrente por ativo."""
+    source = source or default_source(tenant)
+    if source == SOURCE_JOURNAL:
+        return _journal_rows(tenant, asset, start, end)
+    if source == SOURCE_LEGACY:
+        return _legacy_rows(tenant, asset, start, end)
+    raise ValueError(f"unknown source {source}")
+
+
+def render_ndjson(rows: Iterator[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+class _Echo:
+    """Pseudo-buffer: csv.writer devolve a linha em vez de a acumular."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows: Iterator[dict]) -> Iterator[str]:
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS)
+    yield writer.writerow(dict(zip(CSV_COLUMNS, CSV_COLUMNS)))
+    for row in rows:
+        yield writer.writerow(row)
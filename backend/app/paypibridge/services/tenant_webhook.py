@@ -1,23 +1,27 @@
 """
-Notificações HTTP para o webhook do tenant (best-effort; não falha o fluxo principal).
+Webhook do tenant para mudanças de PaymentIntent, via outbox: notify_payment_intent_webhook só grava
+um OutboxEvent (na transação do chamador); o POST é feito pelo dispatcher do outbox, em lote, por
+services/webhook_dispatcher.py (sessões keep-alive, concorrência por tenant, assinatura e retries).
 """
 
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
-import requests
+from app.paypibridge.models import OutboxEvent, PaymentIntent
 
-from app.paypibridge.models import PaymentIntent
+from .outbox import publish, register_batch_handler
+from .webhook_dispatcher import get_webhook_dispatcher
 
 logger = logging.getLogger(__name__)
 
+EVENT_PAYMENT_INTENT_WEBHOOK = "tenant_webhook.payment_intent"
 
-def notify_payment_intent_webhook(intent: PaymentIntent, extra: Dict[str, Any] | None = None) -> None:
+
+def notify_payment_intent_webhook(intent: PaymentIntent, extra: Dict[str, Any] | None = None) -> OutboxEvent | None:
     if not intent.tenant_id or not (intent.tenant.webhook_url or "").strip():
-        return
-    url = intent.tenant.webhook_url.strip()
+        return None
     payload = {
         "event": "payment_intent_updated",
         "intent_id": intent.intent_id,
@@ -28,7 +32,14 @@ def notify_payment_intent_webhook(intent: PaymentIntent, extra: Dict[str, Any] |
     }
     if extra:
         payload.update(extra)
-    try:
-        requests.post(url, json=payload, timeout=8)
-    except requests.RequestException as exc:
-        logger.warning("Tenant webhook failed: %s", exc, extra={"intent_id": intent.intent_id, "url": url})
+    return publish(EVENT_PAYMENT_INTENT_WEBHOOK, payload, tenant=intent.tenant, aggregate_id=intent.intent_id)
+
+
+def deliver_payment_intent_webhooks(
+    events: List[OutboxEvent], report: Optional[Callable[[Dict[int, Optional[str]]], None]] = None
+) -> Dict[int, Optional[str]]:
+    """Handler em lote do outbox: POST para o webhook atual de cada tenant; cada tenant é reportado ao acabar."""
+    return get_webhook_dispatcher().deliver_events(events, on_results=report)
+
+
+register_batch_handler(EVENT_PAYMENT_INTENT_WEBHOOK, deliver_payment_intent_webhooks)
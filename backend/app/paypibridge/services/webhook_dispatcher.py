@@ -0,0 +1,357 @@
+"""
+Entrega dos webhooks do tenant em volume: handler em lote do outbox para EVENT_PAYMENT_INTENT_WEBHOOK.
+
+- Uma requests.Session (keep-alive, pool de TENANT_WEBHOOK_POOL_SIZE ligações) por host de destino,
+  reutilizada entre lotes e partilhada pelas threads do processo.
+- Os eventos de cada tenant são agrupados em POSTs (tenant.webhook_batch_size eventos por POST; 1 = corpo
+  igual ao evento, como antes) e enviados por no máximo TENANT_WEBHOOK_CONCURRENCY lanes do tenant num
+  pool de TENANT_WEBHOOK_WORKERS threads: um URL lento ocupa só as lanes do seu tenant.
+- Os resultados de cada tenant seguem para o outbox assim que as suas lanes terminam; ao fim de
+  TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS o que falta volta ao backoff do outbox, sem prender o lote.
+- Cada POST leva X-PayPi-Timestamp e X-PayPi-Signature = "sha256=" + HMAC("timestamp.corpo") com
+  tenant.webhook_secret ou PPBRIDGE_WEBHOOK_HMAC_SECRET (sem segredo vai sem assinatura).
+- Erro de rede, 429 e 5xx repetem até TENANT_WEBHOOK_RETRIES vezes com backoff exponencial com jitter
+  (base TENANT_WEBHOOK_RETRY_BASE_MS); outro 4xx falha logo. O que falhar volta ao backoff do outbox.
+- Latência e falhas por tenant ficam em WebhookDeliveryStats (um UPDATE por tenant por lote).
+
+As threads só fazem HTTP; leituras e escritas na BD ficam na thread do dispatcher do outbox.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from app.paypibridge.models import OutboxEvent, Tenant, WebhookDeliveryStats
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-PayPi-Signature"
+TIMESTAMP_HEADER = "X-PayPi-Timestamp"
+DELIVERY_HEADER = "X-PayPi-Delivery"
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def _retryable(status_code: Optional[int]) -> bool:
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+@dataclass
+class WebhookDelivery:
+    """Um POST: eventos de um tenant já serializados num corpo."""
+
+    tenant_id: int
+    url: str
+    secret: str
+    events: List[OutboxEvent]
+    body: bytes
+    # Preenchidos pela lane que a envia.
+    attempts: List[tuple] = field(default_factory=list)  # (latency_ms, status_code | None)
+    error: Optional[str] = None
+
+
+class WebhookDispatcher:
+    """Sessões por host e pool de threads do processo; ver get_webhook_dispatcher()."""
+
+    def __init__(
+        self,
+        *,
+        workers: Optional[int] = None,
+        tenant_concurrency: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        retry_base_ms: Optional[int] = None,
+    ):
+        self.workers = workers or int(getattr(settings, "TENANT_WEBHOOK_WORKERS", 16))
+        self.pool_size = pool_size or int(getattr(settings, "TENANT_WEBHOOK_POOL_SIZE", 10))
+        self._tenant_concurrency = tenant_concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._retry_base_ms = retry_base_ms
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tenant-webhook")
+
+    # Lidos a cada lote (override_settings / alteração sem reiniciar o worker), salvo se dados no construtor.
+    @property
+    def tenant_concurrency(self) -> int:
+        return max(1, self._tenant_concurrency or int(getattr(settings, "TENANT_WEBHOOK_CONCURRENCY", 4)))
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout or float(getattr(settings, "OUTBOX_WEBHOOK_TIMEOUT_SECONDS", 8))
+
+    @property
+    def retries(self) -> int:
+        return self._retries if self._retries is not None else int(getattr(settings, "TENANT_WEBHOOK_RETRIES", 2))
+
+    @property
+    def retry_base_ms(self) -> int:
+        if self._retry_base_ms is not None:
+            return self._retry_base_ms
+        return int(getattr(settings, "TENANT_WEBHOOK_RETRY_BASE_MS", 200))
+
+    def session_for(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}".lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = "PayPi-Bridge-Webhooks/1"
+                self._sessions[host] = session
+        return session
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    # --- montagem ---
+
+    def build_deliveries(self, tenant: Tenant, events: List[OutboxEvent]) -> List[WebhookDelivery]:
+        url = (tenant.webhook_url or "").strip()
+        secret = tenant.webhook_secret or getattr(settings, "PPBRIDGE_WEBHOOK_HMAC_SECRET", "")
+        size = max(1, tenant.webhook_batch_size or 1)
+        out = []
+        for start in range(0, len(events), size):
+            end = start + size
+            chunk = events[start:end]
+            if size == 1:
+                doc = chunk[0].payload
+            else:
+                doc = {"event": "batch", "events": [{"event_id": e.pk, **e.payload} for e in chunk]}
+            body = json.dumps(doc, separators=(",", ":"), default=str).encode()
+            out.append(WebhookDelivery(tenant_id=tenant.pk, url=url, secret=secret, events=chunk, body=body))
+        return out
+
+    # --- envio (threads do pool) ---
+
+    def _post(self, delivery: WebhookDelivery) -> int:
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            TIMESTAMP_HEADER: timestamp,
+            DELIVERY_HEADER: ",".join(str(e.pk) for e in delivery.events),
+        }
+        if delivery.secret:
+            headers[SIGNATURE_HEADER] = sign_payload(delivery.secret, timestamp, delivery.body)
+        resp = self.session_for(delivery.url).post(
+            delivery.url, data=delivery.body, headers=headers, timeout=self.timeout
+        )
+        return resp.status_code
+
+    def send(self, delivery: WebhookDelivery) -> WebhookDelivery:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, self.retry_base_ms * 2 ** (attempt - 1)) / 1000.0)
+            started = time.monotonic()
+            status: Optional[int] = None
+            try:
+                status = self._post(delivery)
+            except requests.RequestException as exc:
+                delivery.error = f"{type(exc).__name__}: {exc}"
+            else:
+                delivery.error = None if status < 400 else f"HTTP {status}"
+            delivery.attempts.append((int((time.monotonic() - started) * 1000), status))
+            if delivery.error is None or not _retryable(status):
+                break
+        return delivery
+
+    def _drain(self, queue: Deque[WebhookDelivery], done: List[WebhookDelivery], stop: threading.Event) -> None:
+        # Depois do prazo do lote não começa novos POSTs; os que ficam na fila voltam ao outbox.
+        while not stop.is_set():
+            try:
+                delivery = queue.popleft()
+            except IndexError:
+                return
+            done.append(self.send(delivery))
+
+    # --- lote do outbox ---
+
+    @property
+    def batch_deadline(self) -> float:
+        return float(getattr(settings, "TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS", 30))
+
+    def deliver_events(
+        self,
+        events: List[OutboxEvent],
+        on_results: Optional[Callable[[Dict[int, Optional[str]]], None]] = None,
+    ) -> Dict[int, Optional[str]]:
+        """
+        Entrega os eventos; devolve {event_id: None (entregue) ou erro}. Cada tenant é entregue a
+        on_results (na thread do chamador) assim que as suas lanes terminam, sem esperar pelos outros.
+        Ao fim de TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS os eventos ainda por entregar saem com erro (o
+        outbox reagenda-os); um POST já em curso pode chegar ao destino, a entrega é at-least-once.
+        """
+        results: Dict[int, Optional[str]] = {}
+        by_tenant: Dict[int, List[OutboxEvent]] = {}
+        for event in events:
+            if not event.tenant_id or not (event.tenant.webhook_url or "").strip():
+                logger.info("tenant_webhook_dropped", extra={"event_id": event.pk, "reason": "no_webhook_url"})
+                results[event.pk] = None
+                continue
+            by_tenant.setdefault(event.tenant_id, []).append(event)
+        if results and on_results is not None:
+            on_results(dict(results))
+
+        stop = threading.Event()
+        done: Dict[int, List[WebhookDelivery]] = {}
+        pending: Dict[int, set] = {}
+        tenant_of: Dict[Future, int] = {}
+        for tenant_id, tenant_events in by_tenant.items():
+            queue = deque(self.build_deliveries(tenant_events[0].tenant, tenant_events))
+            done[tenant_id] = []
+            pending[tenant_id] = set()
+            for _ in range(min(self.tenant_concurrency, len(queue))):
+                lane = self._executor.submit(self._drain, queue, done[tenant_id], stop)
+                pending[tenant_id].add(lane)
+                tenant_of[lane] = tenant_id
+
+        deadline = time.monotonic() + self.batch_deadline
+        waiting = set(tenant_of)
+        while waiting:
+            finished, waiting = wait(
+                waiting, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+            )
+            if not finished:
+                break
+            for lane in finished:
+                lane.result()
+                tenant_id = tenant_of[lane]
+                pending[tenant_id].discard(lane)
+                if not pending[tenant_id]:
+                    results.update(self._finish_tenant(by_tenant.pop(tenant_id), done[tenant_id], on_results))
+        stop.set()
+        for tenant_id, tenant_events in by_tenant.items():
+            # Prazo do lote esgotado: fecha o que acabou; o resto volta ao outbox.
+            results.update(self._finish_tenant(tenant_events, list(done[tenant_id]), on_results, timed_out=True))
+        return results
+
+    def _finish_tenant(
+        self,
+        events: List[OutboxEvent],
+        deliveries: List[WebhookDelivery],
+        on_results: Optional[Callable[[Dict[int, Optional[str]]], None]],
+        timed_out: bool = False,
+    ) -> Dict[int, Optional[str]]:
+        results: Dict[int, Optional[str]] = {}
+        for delivery in deliveries:
+            for event in delivery.events:
+                results[event.pk] = delivery.error
+            if delivery.error:
+                logger.warning(
+                    "tenant_webhook_failed",
+                    extra={
+                        "tenant_id": delivery.tenant_id,
+                        "url": delivery.url,
+                        "events": len(delivery.events),
+                        "attempts": len(delivery.attempts),
+                        "error": delivery.error,
+                    },
+                )
+        unfinished = [event.pk for event in events if event.pk not in results]
+        for pk in unfinished:
+            results[pk] = "webhook batch deadline exceeded"
+        if timed_out and unfinished:
+            logger.warning(
+                "tenant_webhook_deadline",
+                extra={"tenant_id": events[0].tenant_id, "events": len(unfinished), "deadline": self.batch_deadline},
+            )
+        record_delivery_stats(deliveries)
+        if on_results is not None:
+            on_results(dict(results))
+        return results
+
+
+def record_delivery_stats(deliveries: List[WebhookDelivery]) -> None:
+    """Soma latências e falhas por tenant (cada tentativa conta como um POST)."""
+    per_tenant: Dict[int, dict] = {}
+    for d in deliveries:
+        s = per_tenant.setdefault(
+            d.tenant_id,
+            {
+                "posts": 0,
+                "events": 0,
+                "failures": 0,
+                "total": 0,
+                "max": 0,
+                "last": 0,
+                "status": None,
+                "error": None,
+                "ok": False,
+            },
+        )
+        for latency_ms, status in d.attempts:
+            s["posts"] += 1
+            s["total"] += latency_ms
+            s["max"] = max(s["max"], latency_ms)
+            s["last"], s["status"] = latency_ms, status
+            if status is None or status >= 400:
+                s["failures"] += 1
+        if d.error:
+            s["error"] = d.error
+        else:
+            s["events"] += len(d.events)
+            s["ok"] = True
+
+    now = timezone.now()
+    for tenant_id, s in per_tenant.items():
+        if not s["posts"]:
+            continue
+        WebhookDeliveryStats.objects.get_or_create(tenant_id=tenant_id)
+        update = {
+            "posts": F("posts") + s["posts"],
+            "events_delivered": F("events_delivered") + s["events"],
+            "failures": F("failures") + s["failures"],
+            "latency_ms_total": F("latency_ms_total") + s["total"],
+            "latency_ms_max": Greatest(F("latency_ms_max"), Value(s["max"])),
+            "last_latency_ms": s["last"],
+            "last_status_code": s["status"],
+            "updated_at": now,
+        }
+        if s["ok"]:
+            update["last_success_at"] = now
+        if s["error"]:
+            update["last_error"] = s["error"][:2000]
+            update["last_failure_at"] = now
+        WebhookDeliveryStats.objects.filter(tenant_id=tenant_id).update(**update)
+
+
+_dispatcher: Optional[WebhookDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_webhook_dispatcher() -> WebhookDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher()
+        return _dispatcher
@@ -11,13 +11,10 @@ Tasks for:
 import logging
 
 from celery import shared_task
-from celery.exceptions import MaxRetriesExceededError
 from decimal import Decimal
-from django.db import transaction
-from django.utils import timezone
 
-from .models import Consent, PaymentIntent, PixTransaction, WebhookEvent
-from .services.settlement_service import SettlementService
+from .models import Consent, PaymentIntent, PixTransaction, SettlementDeadLetter, WebhookEvent
+from .services.settlement_service import execute_settlement, mark_settlement_dead_letter
 from .services.pi_service import get_pi_service
 from .services.fx_service import get_fx_service
 from .services.relayer import get_relayer
@@ -26,19 +23,6 @@ from .clients.pix import PixClient
 logger = logging.getLogger(__name__)
 
 
-def _mark_settlement_dead_letter(intent_id: str, error: str) -> None:
-    intent = PaymentIntent.objects.filter(intent_id=intent_id).first()
-    if not intent:
-        return
-    intent.metadata = {
-        **intent.metadata,
-        "settlement_dead_letter": True,
-        "settlement_dead_letter_error": (error or "")[:500],
-    }
-    intent.settlement_status = "SETTLEMENT_FAILED"
-    intent.save(update_fields=["metadata", "settlement_status"])
-
-
 @shared_task(bind=True, max_retries=3)
 def process_settlement_execute(
     self,
@@ -49,9 +33,10 @@ def process_settlement_execute(
     description: str = "",
 ):
     """
-    Liquidação Pi → BRL → Pix fora da request HTTP.
-    Usa select_for_update no intent para reduzir corrida entre workers.
-    Erros transitórios: retry; após esgotar retries: dead letter no metadata.
+    Liquidação Pi → BRL → Pix fora da request HTTP (corpo em execute_settlement).
+    Entregas duplicadas (acks_late + retry) não enviam dois Pix: só quem ganha a lease do intent
+    (claim_settlement em SettlementService.settle) liquida; as outras devolvem settlement_in_progress.
+    Erros transitórios: retry; após esgotar retries: SettlementDeadLetter (ver replay_settlement_dead_letters).
     """
     logger.info(
         "settlement_task_start",
@@ -62,73 +47,7 @@ def process_settlement_execute(
         },
     )
     try:
-        with transaction.atomic():
-            try:
-                intent = PaymentIntent.objects.select_for_update().get(
-                    intent_id=intent_id
-                )
-            except PaymentIntent.DoesNotExist:
-                return {
-                    "status": "error",
-                    "code": "intent_not_found",
-                    "detail": "PaymentIntent not found",
-                }
-
-            if intent.status == "SETTLED" or intent.settlement_status == "SETTLED":
-                return {
-                    "status": "already_settled",
-                    "intent_id": intent.intent_id,
-                }
-
-            if not intent.verified_at:
-                return {
-                    "status": "not_ready",
-                    "code": "pi_payment_not_verified",
-                    "detail": "pi_payment_not_verified",
-                }
-
-        consent = Consent.objects.filter(pk=consent_id, status="ACTIVE").first()
-        if not consent:
-            return {
-                "status": "error",
-                "code": "consent_not_found",
-                "detail": "no active consent for payee",
-            }
-
-        intent = PaymentIntent.objects.get(intent_id=intent_id)
-        settlement = SettlementService().settle(
-            intent,
-            consent=consent,
-            cpf=cpf,
-            pix_key=pix_key,
-            description=description or "",
-        )
-
-        if not settlement.success:
-            return {
-                "status": "error",
-                "code": settlement.error or "settlement_failed",
-                "detail": settlement.error or "settlement_failed",
-                "gross_brl": str(settlement.gross_brl)
-                if settlement.gross_brl is not None
-                else None,
-                "net_brl": str(settlement.net_brl)
-                if settlement.net_brl is not None
-                else None,
-                "fee_brl": str(settlement.fee_brl)
-                if settlement.fee_brl is not None
-                else None,
-            }
-
-        return {
-            "status": "success",
-            "intent_id": intent.intent_id,
-            "gross_brl": str(settlement.gross_brl),
-            "net_brl": str(settlement.net_brl),
-            "fee_brl": str(settlement.fee_brl),
-            "pix_txid": settlement.pix_txid,
-        }
-
+        return execute_settlement(intent_id, consent_id, cpf, pix_key, description)
     except Exception as exc:
         logger.warning(
             "settlement_task_retry",
@@ -139,23 +58,32 @@ def process_settlement_execute(
                 "retries": self.request.retries,
             },
         )
-        try:
+        # retry(exc=...) relança exc (não MaxRetriesExceededError) quando esgota: decidir aqui.
+        if self.request.retries < self.max_retries:
             raise self.retry(
                 exc=exc,
                 countdown=min(300, 10 * (2 ** self.request.retries)),
             )
-        except MaxRetriesExceededError:
-            logger.error(
-                "settlement_task_dead_letter",
-                extra={"intent_id": intent_id, "error": str(exc)},
-                exc_info=True,
-            )
-            _mark_settlement_dead_letter(intent_id, str(exc))
-            return {
-                "status": "dead_letter",
-                "code": "max_retries",
-                "detail": str(exc),
-            }
+        logger.error(
+            "settlement_task_dead_letter",
+            extra={"intent_id": intent_id, "error": str(exc)},
+            exc_info=True,
+        )
+        mark_settlement_dead_letter(
+            intent_id,
+            exc,
+            source=SettlementDeadLetter.SOURCE_TASK,
+            attempts=self.request.retries + 1,
+            consent_id=consent_id,
+            cpf=cpf,
+            pix_key=pix_key,
+            description=description,
+        )
+        return {
+            "status": "dead_letter",
+            "code": "max_retries",
+            "detail": str(exc),
+        }
 
 
 @shared_task(bind=True, max_retries=3)
@@ -391,11 +319,15 @@ def process_incomplete_payments():
 def update_fx_rates():
     """
     Update FX rates cache.
-    Runs periodically to refresh exchange rates.
+    Runs every FX_REFRESH_INTERVAL_SECONDS (< FX_CACHE_TIMEOUT) so the cached rate is refreshed
+    before it goes stale and requests never wait for the provider.
     """
     try:
         fx_service = get_fx_service()
-        rate = fx_service.get_rate()
+        rate = fx_service.refresh_rate()
+        if rate is None:
+            # Provider failed or another worker holds the refresh lock: report what is cached.
+            rate = fx_service.get_rate()
         
         logger.info(
             f"FX rates updated",
@@ -522,9 +454,30 @@ def process_retry_tasks():
     Registar handlers por task_type quando integrações precisarem de retry persistente.
     """
 
+    def _settlement_ledger(task):
+        from app.paypibridge.models import BalanceHold
+        from app.paypibridge.services.ledger_service import apply_settlement_ledger
+
+        payload = task.payload
+        intent = PaymentIntent.objects.get(intent_id=payload["intent_id"])
+        hold = BalanceHold.objects.filter(pk=payload.get("hold_id")).first() if payload.get("hold_id") else None
+        # Sem try/except: uma exceção volta a agendar a tarefa com backoff.
+        apply_settlement_ledger(
+            intent,
+            gross_brl=Decimal(payload["gross_brl"]),
+            fee_brl=Decimal(payload["fee_brl"]),
+            net_brl=Decimal(payload["net_brl"]),
+            hold=hold,
+        )
+
+    handlers = {"settlement_ledger": _settlement_ledger}
+
     def _handle(task):
         from app.paypibridge.models import RetryTask as RT
 
+        if task.task_type in handlers:
+            handlers[task.task_type](task)
+            return
         logger.info(
             "retry_task_no_handler",
             extra={"task_id": task.id, "task_type": task.task_type},
@@ -536,3 +489,142 @@ def process_retry_tasks():
     from app.paypibridge.services.retry_service import process_pending_retries
 
     return process_pending_retries(_handle)
+
+
+@shared_task
+def compact_ledger_shards():
+    """Dobra periodicamente os sub-saldos das contas com sharding na base da conta."""
+    from app.paypibridge.models import LedgerAccount
+    from app.paypibridge.services.double_entry_service import compact_account_shards
+
+    moved = 0
+    for acc in LedgerAccount.objects.filter(shard_count__gt=0):
+        if compact_account_shards(acc):
+            moved += 1
+    return {"compacted_accounts": moved}
+
+
+@shared_task
+def write_balance_checkpoints():
+    """Grava checkpoints de saldo por conta (ponto de partida para saldos históricos)."""
+    from app.paypibridge.services.balance_checkpoint_service import write_balance_checkpoints as write
+
+    return {"checkpoints": write()}
+
+
+@shared_task
+def maintain_partitions():
+    """Cria antecipadamente as partições mensais futuras das tabelas particionadas (Postgres)."""
+    from app.paypibridge.services.partition_service import ensure_future_partitions
+
+    return ensure_future_partitions()
+
+
+@shared_task
+def reconcile_ledger_incremental():
+    """Verifica só os journals novos desde o cursor e alerta se algum saldo divergir do esperado."""
+    from app.paypibridge.services.reconciliation_service import reconcile_incremental
+
+    result = reconcile_incremental()
+    return {"last_journal_id": result["last_journal_id"], "drift": len(result["drift"])}
+
+
+@shared_task
+def reconcile_ledger_deep():
+    """Reconciliação completa do ledger e re-ancoragem do cursor incremental."""
+    from app.paypibridge.services.reconciliation_service import deep_scan
+
+    return deep_scan()
+
+
+@shared_task
+def refresh_ledger_totals():
+    """Atualiza os totais por categoria e ativo com os journals novos desde o último refresh."""
+    from app.paypibridge.services.ledger_totals_service import refresh_ledger_totals as refresh
+
+    return refresh()
+
+
+@shared_task
+def seal_journal_chain():
+    """Encadeia os batches ainda sem hash e grava as raízes Merkle dos intervalos completos."""
+    from app.paypibridge.services.journal_chain import seal_journal_chain as seal
+
+    return seal()
+
+
+@shared_task
+def release_expired_holds():
+    """Liberta retenções de saldo expiradas (liquidação interrompida antes de capturar/libertar)."""
+    from app.paypibridge.services.ledger_service import release_expired_holds as release
+
+    return {"released": release()}
+
+
+@shared_task
+def sweep_settlement_leases():
+    """Fecha leases de liquidação expiradas e lotes parados em PROCESSING (worker morreu a meio)."""
+    from app.paypibridge.services.settlement_batch_service import sweep_stale_batches
+    from app.paypibridge.services.settlement_service import sweep_expired_settlement_leases
+
+    return {"swept": sweep_expired_settlement_leases(), "stale_batches": sweep_stale_batches()}
+
+
+@shared_task
+def flush_settlement_batch(batch_id: int):
+    """Fecha e paga um lote de liquidação (limite SETTLEMENT_BATCH_MAX_PI atingido)."""
+    from app.paypibridge.services.settlement_batch_service import flush_batch
+
+    return flush_batch(batch_id)
+
+
+@shared_task
+def flush_due_settlement_batches():
+    """Paga os lotes de liquidação cuja janela já acabou."""
+    from app.paypibridge.services.settlement_batch_service import flush_due_batches
+
+    return {"batches": flush_due_batches()}
+
+
+@shared_task
+def dispatch_settlement_partition(partition: int):
+    """Despacha o próximo job de liquidação da partição (se nenhum estiver a correr)."""
+    from app.paypibridge.services.settlement_scheduler import dispatch_partition
+
+    return dispatch_partition(partition)
+
+
+@shared_task
+def run_settlement_job(job_id: int):
+    """Executa um SettlementJob reclamado e encadeia o seguinte da partição."""
+    from app.paypibridge.services.settlement_scheduler import run_job
+
+    return run_job(job_id)
+
+
+@shared_task
+def dispatch_settlement_partitions():
+    """Retoma partições paradas e regista a profundidade das filas de liquidação."""
+    from app.paypibridge.services.settlement_scheduler import dispatch_all, partition_stats
+
+    dispatched = dispatch_all()
+    stats = partition_stats()
+    depth = [{k: p[k] for k in ("partition", "queued", "running", "oldest_queued_age_seconds")} for p in stats]
+    logger.info("settlement_queue_depth", extra={"partitions": depth})
+    return {"dispatched": dispatched, "partitions": stats}
+
+
+@shared_task
+def rollup_fx_rates():
+    """Rollups OHLC (minuto/hora) do histórico de câmbio e compactação do raw e minutos fora da retenção."""
+    from app.paypibridge.services.fx_history import compact_fx_rates, rollup_fx_rates as rollup
+
+    return {**rollup(), **compact_fx_rates()}
+
+
+@shared_task
+def dispatch_outbox():
+    """Entrega os eventos pendentes do outbox (webhooks do tenant)."""
+    from app.paypibridge.services.outbox import dispatch_outbox as dispatch
+
+    return dispatch()
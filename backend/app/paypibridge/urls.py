@@ -10,7 +10,15 @@ from .views import (
     AdminStatsView, AdminIntentsView,
     LedgerTransactionAuditView,
 )
-from .views_v3 import V3PaymentCreateView, V3BalanceView, V3WithdrawView
+from .views_v3 import (
+    V3PaymentCreateView,
+    V3BalanceView,
+    V3StatementView,
+    V3WithdrawView,
+    V3LedgerTotalsView,
+    V3SettlementQueuesView,
+    V3SettlementDeadLettersView,
+)
 from .auth_views import (
     RegisterView,
     LoginView,
@@ -37,7 +45,15 @@ urlpatterns = [
     path("v2/tenant/wallets", TenantWalletView.as_view(), name="tenant-wallets"),
     path("v3/payments", V3PaymentCreateView.as_view(), name="v3-payments"),
     path("v3/balance", V3BalanceView.as_view(), name="v3-balance"),
+    path("v3/statement", V3StatementView.as_view(), name="v3-statement"),
     path("v3/withdraw", V3WithdrawView.as_view(), name="v3-withdraw"),
+    path("v3/admin/ledger-totals", V3LedgerTotalsView.as_view(), name="v3-ledger-totals"),
+    path("v3/admin/settlement-queues", V3SettlementQueuesView.as_view(), name="v3-settlement-queues"),
+    path(
+        "v3/admin/settlement-dead-letters",
+        V3SettlementDeadLettersView.as_view(),
+        name="v3-settlement-dead-letters",
+    ),
     path("payments/verify", VerifyPiPaymentView.as_view(), name="verify-payment"),
     path(
         "payments/ledger/<str:txid>",
@@ -27,6 +27,8 @@ from .serializers import (
     LinkBankAccountSerializer, ReconcilePaymentSerializer
 )
 from .clients.pix import PixClient
+from .services.settlement_batch_service import batching_enabled, enqueue_for_batch
+from .services.settlement_scheduler import enqueue_settlement, partitioning_enabled
 from .services.settlement_service import SettlementService
 from .services.ledger_service import credit_pi_for_verified_intent, ensure_wallet
 from .services.fraud_service import evaluate_intent_creation
@@ -163,8 +165,8 @@ class TenantWalletView(views.APIView):
             {
                 "tenant_slug": tenant.slug,
                 "wallets": [
-                    {"asset": pi.asset, "balance": str(pi.balance)},
-                    {"asset": brl.asset, "balance": str(brl.balance)},
+                    {"asset": w.asset, "balance": str(w.balance), "held": str(w.held), "available": str(w.available)}
+                    for w in (pi, brl)
                 ],
             }
         )
@@ -262,8 +264,7 @@ class VerifyPiPaymentView(views.APIView):
             with transaction.atomic():
                 intent.save()
                 credit_pi_for_verified_intent(intent)
-
-            notify_payment_intent_webhook(intent)
+                notify_payment_intent_webhook(intent)
 
             return Response({
                 "intent_id": intent.intent_id,
@@ -455,6 +456,7 @@ class SettlementExecuteView(views.APIView):
     Liquidação Pi → BRL → Pix após verificação Pi no intent.
     Usa FXService (câmbio), SETTLEMENT_FEE_RATE (env) e Pix (mock ou Open Finance).
     Com SETTLEMENT_ASYNC=1 a liquidação corre na fila Celery (202 Accepted).
+    Com SETTLEMENT_BATCHING=1 o intent entra no lote do beneficiário (202; um Pix por janela).
     """
 
     permission_classes = [AllowAny]
@@ -488,6 +490,26 @@ class SettlementExecuteView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if batching_enabled():
+            queued = enqueue_for_batch(
+                intent,
+                consent=consent,
+                cpf=data["cpf"],
+                pix_key=data["pix_key"],
+                description=data.get("description") or "",
+            )
+            if not queued.success:
+                return Response({"detail": queued.error}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {
+                    "accepted": True,
+                    "intent_id": intent.intent_id,
+                    "settlement_status": "BATCHED",
+                    "batch_id": queued.batch_id,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+
         if not getattr(settings, "SETTLEMENT_ASYNC", True):
             settlement = SettlementService().settle(
                 intent,
@@ -525,6 +547,25 @@ class SettlementExecuteView(views.APIView):
                 status=status.HTTP_200_OK,
             )
 
+        if partitioning_enabled():
+            job, _ = enqueue_settlement(
+                intent,
+                consent=consent,
+                cpf=data["cpf"],
+                pix_key=data["pix_key"],
+                description=data.get("description") or "",
+            )
+            return Response(
+                {
+                    "accepted": True,
+                    "intent_id": intent.intent_id,
+                    "job_id": job.pk,
+                    "partition": job.partition,
+                    "detail": "Liquidação enfileirada na partição; o worker Celery atualiza o PaymentIntent.",
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+
         ar = process_settlement_execute.delay(
             intent.intent_id,
             consent.id,
@@ -1454,6 +1495,9 @@ class AdminStatsView(views.APIView):
                 "settlement_failed": PaymentIntent.objects.filter(
                     settlement_status="SETTLEMENT_FAILED"
                 ).count(),
+                "settlement_unknown": PaymentIntent.objects.filter(
+                    settlement_status="SETTLEMENT_UNKNOWN"
+                ).count(),
             },
         }
         
@@ -4,18 +4,31 @@ API v3: pagamentos, saldo, saque (stub), idempotência em POST.
 
 import logging
 
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django_ratelimit.decorators import ratelimit
 from django.utils.decorators import method_decorator
 from rest_framework import status, views
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 
-from .models import IdempotencyRecord, PaymentIntent, Tenant, Wallet
+from .models import IdempotencyRecord, PaymentIntent, SettlementDeadLetter, Tenant, Wallet
 from .serializers import CreateIntentSerializer, PaymentIntentSerializer
+from .services.balance_checkpoint_service import wallet_balance_as_of
 from .services.fx_service import get_fx_service
 from .services.fraud_service import evaluate_intent_creation
 from .services.ledger_service import ensure_wallet
+from .services.ledger_totals_service import balance_sheet, check_ledger_totals, trial_balance
+from .services.settlement_dead_letter import filter_dead_letters, list_dead_letters
+from .services.settlement_scheduler import partition_count, partition_stats
+from .services.statement_service import (
+    SOURCE_JOURNAL,
+    SOURCE_LEGACY,
+    render_csv,
+    render_ndjson,
+    statement_rows,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -103,7 +116,10 @@ class V3PaymentCreateView(views.APIView):
 
 
 class V3BalanceView(views.APIView):
-    """GET /api/v3/balance — saldos PI/BRL (header X-PayPi-Tenant-Key)."""
+    """
+    GET /api/v3/balance — saldos PI/BRL, retido e disponível (header X-PayPi-Tenant-Key).
+    ?as_of=<ISO 8601> devolve o saldo nessa data (a partir de checkpoints, sem replay completo).
+    """
 
     permission_classes = [AllowAny]
 
@@ -120,17 +136,152 @@ class V3BalanceView(views.APIView):
                 {"detail": "Invalid tenant API key"},
                 status=status.HTTP_401_UNAUTHORIZED,
             )
+        as_of_raw = (request.query_params.get("as_of") or "").strip()
+        as_of = None
+        if as_of_raw:
+            as_of = parse_datetime(as_of_raw)
+            if as_of is None:
+                return Response(
+                    {"detail": "Invalid as_of (expected ISO 8601 datetime)"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+
         pi = ensure_wallet(tenant, Wallet.ASSET_PI)
         brl = ensure_wallet(tenant, Wallet.ASSET_BRL)
-        return Response(
-            {
-                "tenant_slug": tenant.slug,
-                "wallets": [
-                    {"asset": pi.asset, "balance": str(pi.balance)},
-                    {"asset": brl.asset, "balance": str(brl.balance)},
-                ],
-            }
+        body = {"tenant_slug": tenant.slug, "wallets": []}
+        for w in (pi, brl):
+            if as_of:
+                body["wallets"].append({"asset": w.asset, "balance": format(wallet_balance_as_of(w, as_of), "f")})
+            else:
+                body["wallets"].append(
+                    {
+                        "asset": w.asset,
+                        "balance": format(w.balance, "f"),
+                        "held": format(w.held, "f"),
+                        "available": format(w.available, "f"),
+                    }
+                )
+        if as_of:
+            body["as_of"] = as_of.isoformat()
+        return Response(body)
+
+
+class V3StatementView(views.APIView):
+    """
+    GET /api/v3/statement — extrato do tenant em streaming (header X-PayPi-Tenant-Key).
+    Query: format=ndjson|csv, asset=PI|BRL, from/to (ISO 8601), source=journal|legacy.
+    """
+
+    permission_classes = [AllowAny]
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format=csv é tratado aqui, não pelos renderers do DRF.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        tenant = _tenant_from_request(request, {})
+        if not tenant:
+            return Response(
+                {"detail": "Missing or invalid X-PayPi-Tenant-Key header"},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        params = request.query_params
+        fmt = (params.get("format") or "ndjson").lower()
+        source = params.get("source") or None
+        if fmt not in ("ndjson", "csv") or source not in (None, SOURCE_JOURNAL, SOURCE_LEGACY):
+            return Response({"detail": "Invalid format or source"}, status=status.HTTP_400_BAD_REQUEST)
+        bounds = {}
+        for name in ("from", "to"):
+            raw = (params.get(name) or "").strip()
+            if not raw:
+                continue
+            value = parse_datetime(raw)
+            if value is None:
+                return Response(
+                    {"detail": f"Invalid {name} (expected ISO 8601 datetime)"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            bounds[name] = timezone.make_aware(value) if timezone.is_naive(value) else value
+
+        rows = statement_rows(
+            tenant,
+            source=source,
+            asset=(params.get("asset") or "").upper() or None,
+            start=bounds.get("from"),
+            end=bounds.get("to"),
+        )
+        if fmt == "csv":
+            resp = StreamingHttpResponse(render_csv(rows), content_type="text/csv")
+            resp["Content-Disposition"] = f'attachment; filename="statement-{tenant.slug}.csv"'
+        else:
+            resp = StreamingHttpResponse(render_ndjson(rows), content_type="application/x-ndjson")
+        logger.info("v3_statement_export", extra={"tenant_id": tenant.id, "format": fmt})
+        return resp
+
+
+class V3LedgerTotalsView(views.APIView):
+    """
+    GET /api/v3/admin/ledger-totals — balancete e balanço de todos os tenants (staff).
+    Lê só LedgerCategoryTotal (tempo constante). Query: view=trial_balance|balance_sheet (omissão: ambos);
+    check=1 acrescenta a verificação contra LedgerAccount (lê todas as contas).
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        view = request.query_params.get("view") or None
+        if view not in (None, "trial_balance", "balance_sheet"):
+            return Response({"detail": "Invalid view"}, status=status.HTTP_400_BAD_REQUEST)
+        body = {}
+        if view in (None, "trial_balance"):
+            body["trial_balance"] = trial_balance()
+        if view in (None, "balance_sheet"):
+            body["balance_sheet"] = balance_sheet()
+        if request.query_params.get("check") in ("1", "true"):
+            mismatches = check_ledger_totals()
+            body["check"] = {"ok": not mismatches, "mismatches": mismatches}
+        return Response(body)
+
+
+class V3SettlementQueuesView(views.APIView):
+    """GET /api/v3/admin/settlement-queues — profundidade das filas de liquidação por partição (staff)."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"partitions_configured": partition_count(), "partitions": partition_stats()})
+
+
+class V3SettlementDeadLettersView(views.APIView):
+    """
+    GET /api/v3/admin/settlement-dead-letters — dead letters de liquidação, mais recentes primeiro (staff).
+    Query: status (omissão pending; all = todos), error_class, tenant, source, limit (máx. 500) e
+    after=<next_after da página anterior> (keyset; sem contagem total). CPF só mascarado.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        status_filter = params.get("status") or SettlementDeadLetter.ST_PENDING
+        if status_filter not in ("all", *dict(SettlementDeadLetter.STATUS_CHOICES)):
+            return Response({"detail": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            after = int(params["after"]) if params.get("after") else None
+            limit = int(params.get("limit") or 100)
+            tenant_id = int(params["tenant"]) if params.get("tenant") else None
+        except ValueError:
+            return Response({"detail": "after, limit and tenant must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        qs = filter_dead_letters(
+            status=None if status_filter == "all" else status_filter,
+            error_class=params.get("error_class") or None,
+            tenant_id=tenant_id,
+            source=params.get("source") or None,
         )
+        return Response(list_dead_letters(qs, after=after, limit=limit))
 
 
 class V3WithdrawView(views.APIView):
@@ -238,6 +238,58 @@ CELERY_TASK_ALWAYS_EAGER = os.getenv(
 CELERY_TASK_EAGER_PROPAGATES = True
 # Liquidação via fila (POST /api/settlements/execute → 202); 0 força caminho síncrono.
 SETTLEMENT_ASYNC = os.getenv("SETTLEMENT_ASYNC", "1").lower() in ("1", "true", "yes")
+# Lease do worker que liquida um intent (deve exceder o timeout do Pix); expiradas fecham no sweeper
+SETTLEMENT_LEASE_SECONDS = int(os.getenv("SETTLEMENT_LEASE_SECONDS", "300"))
+# Liquidação em lote: um Pix por beneficiário/consent/chave por janela (ou ao atingir o limite em PI; 0 = sem limite)
+SETTLEMENT_BATCHING = os.getenv("SETTLEMENT_BATCHING", "0").lower() in ("1", "true", "yes")
+SETTLEMENT_BATCH_WINDOW_SECONDS = int(os.getenv("SETTLEMENT_BATCH_WINDOW_SECONDS", "300"))
+SETTLEMENT_BATCH_MAX_PI = os.getenv("SETTLEMENT_BATCH_MAX_PI", "0")
+# Lote parado em PROCESSING há mais disto é fechado pelo sweeper (failed, ou unknown se o Pix pode ter saído)
+SETTLEMENT_BATCH_STALE_SECONDS = int(os.getenv("SETTLEMENT_BATCH_STALE_SECONDS", "600"))
+# Scheduler particionado: N partições por hash consistente do tenant (0 = process_settlement_execute direto),
+# fila Celery por partição (prefixo vazio = fila padrão), job perdido após TIMEOUT, tentativas até dead letter
+SETTLEMENT_PARTITIONS = int(os.getenv("SETTLEMENT_PARTITIONS", "0"))
+SETTLEMENT_PARTITION_QUEUE_PREFIX = os.getenv("SETTLEMENT_PARTITION_QUEUE_PREFIX", "")
+SETTLEMENT_JOB_TIMEOUT_SECONDS = int(os.getenv("SETTLEMENT_JOB_TIMEOUT_SECONDS", "600"))
+SETTLEMENT_JOB_MAX_ATTEMPTS = int(os.getenv("SETTLEMENT_JOB_MAX_ATTEMPTS", "4"))
+# Dead letters de liquidação: segredo que sela o CPF (vazio = SECRET_KEY) e ritmo do replay em massa (por segundo)
+SETTLEMENT_DLQ_SECRET = os.getenv("SETTLEMENT_DLQ_SECRET", "")
+SETTLEMENT_DLQ_REPLAY_RATE = float(os.getenv("SETTLEMENT_DLQ_REPLAY_RATE", "5"))
+# Outbox (webhooks do tenant): eventos por lote do dispatcher, tentativas até dead, timeout do POST
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_WEBHOOK_TIMEOUT_SECONDS", "8"))
+# Dispatcher dos webhooks do tenant: threads, POSTs em paralelo por tenant, ligações keep-alive por host, retries
+TENANT_WEBHOOK_WORKERS = int(os.getenv("TENANT_WEBHOOK_WORKERS", "16"))
+TENANT_WEBHOOK_CONCURRENCY = int(os.getenv("TENANT_WEBHOOK_CONCURRENCY", "4"))
+TENANT_WEBHOOK_POOL_SIZE = int(os.getenv("TENANT_WEBHOOK_POOL_SIZE", "10"))
+TENANT_WEBHOOK_RETRIES = int(os.getenv("TENANT_WEBHOOK_RETRIES", "2"))
+TENANT_WEBHOOK_RETRY_BASE_MS = int(os.getenv("TENANT_WEBHOOK_RETRY_BASE_MS", "200"))
+TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS = float(os.getenv("TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS", "30"))
+# Cache de câmbio: TTL local por processo, janela em que a taxa expirada ainda é servida (refresh em
+# background), lock do refresh único e espera máxima de quem aguarda o refresh de uma cache vazia
+FX_L1_TTL = float(os.getenv("FX_L1_TTL", "5"))
+FX_STALE_TTL = int(os.getenv("FX_STALE_TTL", "600"))
+FX_REFRESH_LOCK_TIMEOUT = int(os.getenv("FX_REFRESH_LOCK_TIMEOUT", "15"))
+FX_REFRESH_WAIT = float(os.getenv("FX_REFRESH_WAIT", "6"))
+# Fontes de câmbio (vazio = FX_PROVIDER): median (todas em paralelo, outliers a mais de FX_OUTLIER_PCT da
+# mediana rejeitados) ou hedged (segunda fonte chamada se a primeira passar de FX_HEDGE_AFTER_MS)
+FX_PROVIDERS = [p.strip() for p in os.getenv("FX_PROVIDERS", "").split(",") if p.strip()]
+FX_AGGREGATION = os.getenv("FX_AGGREGATION", "median")
+FX_PROVIDER_TIMEOUT = float(os.getenv("FX_PROVIDER_TIMEOUT", "5"))
+FX_PROVIDER_WORKERS = int(os.getenv("FX_PROVIDER_WORKERS", "8"))
+FX_OUTLIER_PCT = float(os.getenv("FX_OUTLIER_PCT", "0.05"))
+FX_MIN_SOURCES = int(os.getenv("FX_MIN_SOURCES", "1"))
+FX_HEDGE_AFTER_MS = int(os.getenv("FX_HEDGE_AFTER_MS", "300"))
+FX_FIXED_FALLBACK = os.getenv("FX_FIXED_FALLBACK", "1").lower() in ("1", "true", "yes")
+# Histórico de câmbio (FxRate, uma linha por refresh); rollup_fx_rates agrega em minutos/horas e apaga raw
+# com mais de FX_RATE_RAW_RETENTION_DAYS e minutos com mais de FX_RATE_MINUTE_RETENTION_DAYS (horas ficam)
+FX_RATE_HISTORY = os.getenv("FX_RATE_HISTORY", "1").lower() in ("1", "true", "yes")
+FX_RATE_RAW_RETENTION_DAYS = int(os.getenv("FX_RATE_RAW_RETENTION_DAYS", "30"))
+FX_RATE_MINUTE_RETENTION_DAYS = int(os.getenv("FX_RATE_MINUTE_RETENTION_DAYS", "180"))
+# Lookup em lote fora do Postgres: timestamps a menos disto entre si partilham uma consulta
+FX_HISTORY_GROUP_GAP_SECONDS = int(os.getenv("FX_HISTORY_GROUP_GAP_SECONDS", "3600"))
 CELERY_BEAT_SCHEDULE = {
     "monitor-soroban-events": {
         "task": "app.paypibridge.tasks.monitor_soroban_events",
@@ -249,14 +301,101 @@ CELERY_BEAT_SCHEDULE = {
     },
     "update-fx-rates": {
         "task": "app.paypibridge.tasks.update_fx_rates",
-        "schedule": 300.0,  # Every 5 minutes
+        "schedule": float(os.getenv("FX_REFRESH_INTERVAL_SECONDS", "60")),
     },
     "process-retry-tasks": {
         "task": "app.paypibridge.tasks.process_retry_tasks",
         "schedule": 60.0,
     },
+    "compact-ledger-shards": {
+        "task": "app.paypibridge.tasks.compact_ledger_shards",
+        "schedule": 60.0,
+    },
+    "maintain-partitions": {
+        "task": "app.paypibridge.tasks.maintain_partitions",
+        "schedule": 86400.0,  # Daily
+    },
+    "write-balance-checkpoints": {
+        "task": "app.paypibridge.tasks.write_balance_checkpoints",
+        "schedule": float(os.getenv("BALANCE_CHECKPOINT_INTERVAL_SECONDS", "3600")),
+    },
+    "reconcile-ledger-incremental": {
+        "task": "app.paypibridge.tasks.reconcile_ledger_incremental",
+        "schedule": float(os.getenv("RECONCILE_INCREMENTAL_INTERVAL_SECONDS", "60")),
+    },
+    "refresh-ledger-totals": {
+        "task": "app.paypibridge.tasks.refresh_ledger_totals",
+        "schedule": float(os.getenv("LEDGER_TOTALS_INTERVAL_SECONDS", "60")),
+    },
+    "seal-journal-chain": {
+        "task": "app.paypibridge.tasks.seal_journal_chain",
+        "schedule": float(os.getenv("JOURNAL_CHAIN_SEAL_INTERVAL_SECONDS", "60")),
+    },
+    "release-expired-holds": {
+        "task": "app.paypibridge.tasks.release_expired_holds",
+        "schedule": float(os.getenv("BALANCE_HOLD_SWEEP_INTERVAL_SECONDS", "60")),
+    },
+    "sweep-settlement-leases": {
+        "task": "app.paypibridge.tasks.sweep_settlement_leases",
+        "schedule": float(os.getenv("SETTLEMENT_LEASE_SWEEP_INTERVAL_SECONDS", "60")),
+    },
+    "flush-due-settlement-batches": {
+        "task": "app.paypibridge.tasks.flush_due_settlement_batches",
+        "schedule": float(os.getenv("SETTLEMENT_BATCH_FLUSH_INTERVAL_SECONDS", "30")),
+    },
+    "dispatch-settlement-partitions": {
+        "task": "app.paypibridge.tasks.dispatch_settlement_partitions",
+        "schedule": float(os.getenv("SETTLEMENT_DISPATCH_INTERVAL_SECONDS", "5")),
+    },
+    "rollup-fx-rates": {
+        "task": "app.paypibridge.tasks.rollup_fx_rates",
+        "schedule": float(os.getenv("FX_RATE_ROLLUP_INTERVAL_SECONDS", "300")),
+    },
+    "dispatch-outbox": {
+        "task": "app.paypibridge.tasks.dispatch_outbox",
+        "schedule": float(os.getenv("OUTBOX_DISPATCH_INTERVAL_SECONDS", "5")),
+    },
+    "reconcile-ledger-deep": {
+        "task": "app.paypibridge.tasks.reconcile_ledger_deep",
+        "schedule": float(os.getenv("RECONCILE_DEEP_SCAN_INTERVAL_SECONDS", "86400")),
+    },
 }
 
+# Ledger: "locking" (select_for_update + save) ou "conditional" (UPDATE guardado com F(), sem lock explícito)
+LEDGER_BALANCE_MODE = os.getenv("LEDGER_BALANCE_MODE", "locking").strip().lower()
+
+# Cache por processo de tenant plataforma / taxa ativa / modo double-entry (0 desliga).
+# Invalidação entre processos via versão na cache Django (precisa de cache partilhada, ex.: Redis).
+CONFIG_CACHE_TTL = int(os.getenv("CONFIG_CACHE_TTL", "60"))
+CONFIG_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CONFIG_CACHE_VERSION_CHECK_SECONDS", "1"))
+
+# Group commit de lançamentos (opt-in): junta pedidos durante WINDOW_MS (ou até MAX_BATCH) numa transação.
+JOURNAL_GROUP_COMMIT = os.getenv("JOURNAL_GROUP_COMMIT", "0").lower() in ("1", "true", "yes")
+JOURNAL_GROUP_COMMIT_WINDOW_MS = float(os.getenv("JOURNAL_GROUP_COMMIT_WINDOW_MS", "5"))
+JOURNAL_GROUP_COMMIT_MAX_BATCH = int(os.getenv("JOURNAL_GROUP_COMMIT_MAX_BATCH", "100"))
+
+# Checkpoints de saldo (GET /api/v3/balance?as_of=): só cobrem linhas com mais de LAG segundos.
+BALANCE_CHECKPOINT_LAG_SECONDS = int(os.getenv("BALANCE_CHECKPOINT_LAG_SECONDS", "300"))
+# Extrato em streaming (GET /api/v3/statement): linhas por página keyset.
+STATEMENT_PAGE_SIZE = int(os.getenv("STATEMENT_PAGE_SIZE", "1000"))
+# Reconciliação (manage.py reconcile_double_entry): processos e journals por chunk de ids
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "1"))
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "50000"))
+# Reconciliação incremental (beat): só journals com mais de LAG segundos; no máximo CHUNK_SIZE por execução
+RECONCILE_LAG_SECONDS = int(os.getenv("RECONCILE_LAG_SECONDS", "60"))
+# Cadeia de hashes dos JournalBatch: batches por checkpoint Merkle (manage.py verify_journal_chain)
+JOURNAL_MERKLE_RANGE_SIZE = int(os.getenv("JOURNAL_MERKLE_RANGE_SIZE", "1024"))
+# Intervalo do selo da cadeia (beat seal-journal-chain); batches por encadear há mais do que isto são erro
+JOURNAL_CHAIN_SEAL_INTERVAL_SECONDS = float(os.getenv("JOURNAL_CHAIN_SEAL_INTERVAL_SECONDS", "60"))
+# Migração LedgerEntry → journals (manage.py migrate_legacy_ledger): entradas por chunk e pausa entre chunks
+LEGACY_MIGRATION_CHUNK_SIZE = int(os.getenv("LEGACY_MIGRATION_CHUNK_SIZE", "2000"))
+LEGACY_MIGRATION_SLEEP_MS = int(os.getenv("LEGACY_MIGRATION_SLEEP_MS", "50"))
+# Retenções de saldo (BalanceHold): validade de uma reserva não capturada (segundos)
+BALANCE_HOLD_TTL_SECONDS = int(os.getenv("BALANCE_HOLD_TTL_SECONDS", "900"))
+# Partições mensais (Postgres; ver manage.py partition_tables / archive_partitions / restore_partition)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR") or str(BASE_DIR / "partition_archive")
+
 # Antifraude (v3): valor máximo Pi por intent; intents por tenant / hora
 FRAUD_MAX_PI_SINGLE = os.getenv("FRAUD_MAX_PI_SINGLE", "10000")
 FRAUD_MAX_INTENTS_PER_HOUR = int(os.getenv("FRAUD_MAX_INTENTS_PER_HOUR", "120"))
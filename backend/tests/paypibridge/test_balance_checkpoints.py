@@ -0,0 +1,147 @@
+"""Checkpoints de saldo: saldo histórico a partir do checkpoint vs. replay completo."""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import (
+    BalanceCheckpoint,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    LedgerEntry,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.balance_checkpoint_service import balance_as_of, write_balance_checkpoints
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.ledger_service import ensure_wallet
+
+
+def _replay(account, ts):
+    net = JournalLine.objects.filter(account=account, created_at__lte=ts).aggregate(
+        n=Sum(
+            Case(
+                When(side=JournalLine.SIDE_CREDIT, then=F("amount")),
+                default=-F("amount"),
+                output_field=DecimalField(max_digits=28, decimal_places=8),
+            )
+        )
+    )["n"]
+    return net or Decimal("0")
+
+
+@override_settings(BALANCE_CHECKPOINT_LAG_SECONDS=0)
+class BalanceCheckpointTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Ckpt", slug="ckpt", api_key="lk_ckpt_1")
+        self.acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        self.t0 = timezone.now() - timedelta(days=30)
+
+    def _post(self, n, day, side=JournalLine.SIDE_CREDIT, amount=Decimal("1.25")):
+        other = JournalLine.SIDE_DEBIT if side == JournalLine.SIDE_CREDIT else JournalLine.SIDE_CREDIT
+        jb = post_balanced_journal(
+            f"ckpt-{n}",
+            [
+                {"code": CODE_CLEARING_PI, "side": other, "amount": amount},
+                {"account_id": self.acc.id, "side": side, "amount": amount},
+            ],
+        )
+        ts = self.t0 + timedelta(days=day)
+        JournalBatch.objects.filter(pk=jb.pk).update(created_at=ts)
+        JournalLine.objects.filter(journal=jb).update(created_at=ts)
+
+    def test_checkpointed_matches_full_replay(self):
+        for i in range(10):
+            self._post(i, i)
+        self._post(10, 4, side=JournalLine.SIDE_DEBIT, amount=Decimal("2"))
+        self.assertEqual(write_balance_checkpoints(), 2)
+        for i in range(11, 16):
+            self._post(i, i)
+        write_balance_checkpoints()
+        self._post(16, 20)
+
+        for day in range(-1, 25):
+            ts = self.t0 + timedelta(days=day, hours=12)
+            self.assertEqual(balance_as_of(self.acc, ts), _replay(self.acc, ts), day)
+
+    def test_uses_checkpoint_instead_of_history(self):
+        for i in range(3):
+            self._post(i, i)
+        write_balance_checkpoints()
+        BalanceCheckpoint.objects.filter(account=self.acc).update(balance=Decimal("100"))
+        self._post(3, 5)
+        self.assertEqual(balance_as_of(self.acc, self.t0 + timedelta(days=6)), Decimal("101.25"))
+
+    def test_no_new_lines_no_checkpoint(self):
+        self._post(0, 0)
+        self.assertEqual(write_balance_checkpoints(), 2)
+        self.assertEqual(write_balance_checkpoints(), 0)
+
+    def test_opening_balance_is_kept(self):
+        other = Tenant.objects.create(name="Open", slug="open", api_key="lk_open_1")
+        wallet = ensure_wallet(other, Wallet.ASSET_PI)
+        Wallet.objects.filter(pk=wallet.pk).update(balance=Decimal("7"))
+        wallet.refresh_from_db()
+        self.acc = ensure_wallet_ledger_account(wallet)
+        self._post(0, 1)
+        write_balance_checkpoints()
+        self._post(1, 3)
+        self.assertEqual(balance_as_of(self.acc, self.t0), Decimal("7"))
+        self.assertEqual(balance_as_of(self.acc, self.t0 + timedelta(days=2)), Decimal("8.25"))
+        self.assertEqual(balance_as_of(self.acc, timezone.now()), Decimal("9.5"))
+
+
+    def test_before_first_checkpoint_starts_from_opening_balance(self):
+        self._post(0, 1)
+        self._post(1, 3)
+        # Sem checkpoint: opening_balance + linhas até ts, sem ler o saldo corrente da conta.
+        LedgerAccount.objects.filter(pk=self.acc.pk).update(opening_balance=Decimal("3"), balance=Decimal("999"))
+        self.acc.refresh_from_db()
+        self.assertEqual(balance_as_of(self.acc, self.t0 + timedelta(days=2)), Decimal("4.25"))
+        self.assertEqual(balance_as_of(self.acc, self.t0 - timedelta(days=1)), Decimal("3"))
+
+
+@override_settings(BALANCE_CHECKPOINT_LAG_SECONDS=0)
+class BalanceAsOfApiTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Api", slug="api-ckpt", api_key="lk_api_ckpt")
+        self.acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_PAYPI_TENANT_KEY="lk_api_ckpt")
+
+    def test_as_of(self):
+        jb = post_balanced_journal(
+            "api-ckpt",
+            [
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("3")},
+                {"account_id": self.acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("3")},
+            ],
+        )
+        ts = timezone.now() - timedelta(days=2)
+        JournalBatch.objects.filter(pk=jb.pk).update(created_at=ts)
+        JournalLine.objects.filter(journal=jb).update(created_at=ts)
+        LedgerEntry.objects.create(
+            tenant=self.tenant, entry_type=LedgerEntry.ENTRY_CREDIT, asset=Wallet.ASSET_BRL, amount=Decimal("5")
+        )
+        write_balance_checkpoints()
+
+        past = (timezone.now() - timedelta(days=3)).isoformat()
+        r = self.client.get(reverse("v3-balance"), {"as_of": past})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data["wallets"][0]["balance"], "0.00000000")
+        r = self.client.get(reverse("v3-balance"), {"as_of": timezone.now().isoformat()})
+        self.assertEqual([w["balance"] for w in r.data["wallets"]], ["3.00000000", "5.00000000"])
+
+    def test_invalid_as_of(self):
+        r = self.client.get(reverse("v3-balance"), {"as_of": "yesterday"})
+        self.assertEqual(r.status_code, 400)
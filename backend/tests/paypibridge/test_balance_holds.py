@@ -0,0 +1,147 @@
+"""Retenções de saldo (reserve/capture/release) e liquidação sem locks durante o Pix."""
+
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from app.paypibridge.models import BalanceHold, Consent, LedgerEntry, PaymentIntent, RetryTask, Tenant, Wallet
+from app.paypibridge.services.ledger_service import (
+    apply_ledger_entry,
+    capture_hold,
+    ensure_wallet,
+    release_expired_holds,
+    release_hold,
+    reserve_hold,
+)
+from app.paypibridge.services.settlement_service import SettlementService
+from app.paypibridge.tasks import process_retry_tasks
+
+User = get_user_model()
+
+
+class BalanceHoldTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Hold", slug="hold", api_key="lk_hold_1")
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_CREDIT, "seed")
+
+    def _wallet(self):
+        return ensure_wallet(self.tenant, Wallet.ASSET_PI)
+
+    def test_reserve_reduces_available_and_blocks_debits(self):
+        hold, created = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("7"), reference="h1")
+        self.assertTrue(created)
+        w = self._wallet()
+        self.assertEqual((w.balance, w.held, w.available), (Decimal("10"), Decimal("7"), Decimal("3")))
+        with self.assertRaisesMessage(ValueError, "insufficient_wallet_balance"):
+            apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("4"), LedgerEntry.ENTRY_DEBIT, "d")
+        with self.assertRaisesMessage(ValueError, "insufficient_available_balance"):
+            reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("4"), reference="h2")
+        self.assertFalse(BalanceHold.objects.filter(reference="h2").exists())
+
+        again, created = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("7"), reference="h1")
+        self.assertEqual((again.pk, created), (hold.pk, False))
+        self.assertEqual(self._wallet().held, Decimal("7"))
+
+    def test_capture_and_release_are_one_shot(self):
+        hold, _ = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("4"), reference="h1")
+        self.assertTrue(release_hold(hold))
+        self.assertFalse(release_hold(hold))
+        self.assertFalse(capture_hold(hold))
+        self.assertEqual(self._wallet().held, Decimal("0"))
+
+        hold, _ = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("4"), reference="h1")
+        self.assertTrue(capture_hold(hold))
+        self.assertFalse(capture_hold(hold))
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, BalanceHold.ST_CAPTURED)
+        self.assertEqual(self._wallet().held, Decimal("0"))
+
+    def test_sweeper_releases_only_expired_active_holds(self):
+        expired, _ = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("2"), reference="old", ttl_seconds=0)
+        settling, _ = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("3"), reference="pix", ttl_seconds=0)
+        BalanceHold.objects.filter(pk=settling.pk).update(status=BalanceHold.ST_SETTLING)
+        reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("1"), reference="fresh")
+
+        self.assertEqual(release_expired_holds(timezone.now() + timedelta(seconds=1)), 1)
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, BalanceHold.ST_EXPIRED)
+        self.assertEqual(self._wallet().held, Decimal("4"))
+
+
+class SettlementHoldTest(TestCase):
+    def setUp(self):
+        Tenant.objects.get_or_create(
+            slug="platform",
+            defaults={"name": "Platform", "api_key": "ppb_platform_hold", "is_platform": True},
+        )
+        self.tenant = Tenant.objects.create(name="Hold", slug="hold", api_key="lk_hold_2")
+        self.user = User.objects.create_user(username="hold", email="h@t.com", password="x")
+        self.consent = Consent.objects.create(
+            user=self.user, provider="mock", scope={}, consent_id="c_hold", status="ACTIVE"
+        )
+        self.intent = PaymentIntent.objects.create(
+            intent_id="pi_hold_1",
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("10"),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+        pricing = MagicMock()
+        pricing.convert_pi_to_brl.return_value = Decimal("47.60")
+        self.pix = MagicMock()
+        self.service = SettlementService(pricing_service=pricing, pix_port=self.pix)
+
+    def _settle(self):
+        return self.service.settle(self.intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com")
+
+    def test_insufficient_pi_fails_before_pix(self):
+        result = self._settle()
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, "insufficient_available_balance")
+        self.pix.send.assert_not_called()
+
+    def test_pix_failure_releases_hold(self):
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_CREDIT, "seed")
+        self.pix.send.return_value = {"success": False, "error": "pix_rejected"}
+        self.assertEqual(self._settle().error, "pix_rejected")
+        self.assertEqual(BalanceHold.objects.get().status, BalanceHold.ST_RELEASED)
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("0"))
+
+    def test_hold_is_held_during_pix_and_captured_with_ledger(self):
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_CREDIT, "seed")
+
+        def send(**kwargs):
+            w = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+            self.assertEqual((w.held, w.available), (Decimal("10"), Decimal("0")))
+            return {"success": True, "txid": "tx-hold", "status": "COMPLETED"}
+
+        self.pix.send.side_effect = send
+        self.assertTrue(self._settle().success)
+        hold = BalanceHold.objects.get()
+        self.assertEqual((hold.status, hold.external_ref), (BalanceHold.ST_CAPTURED, "tx-hold"))
+        w = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.assertEqual((w.balance, w.held), (Decimal("0"), Decimal("0")))
+
+    def test_ledger_failure_is_retried_and_captures(self):
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_CREDIT, "seed")
+        self.pix.send.return_value = {"success": True, "txid": "tx-retry", "status": "COMPLETED"}
+        with patch(
+            "app.paypibridge.services.settlement_service.apply_settlement_ledger",
+            side_effect=RuntimeError("db down"),
+        ):
+            self.assertTrue(self._settle().success)
+        self.assertEqual(BalanceHold.objects.get().status, BalanceHold.ST_SETTLING)
+        task = RetryTask.objects.get(task_type="settlement_ledger")
+
+        RetryTask.objects.filter(pk=task.pk).update(next_attempt=timezone.now())
+        process_retry_tasks()
+        task.refresh_from_db()
+        self.assertEqual(task.status, RetryTask.ST_DONE)
+        self.assertEqual(BalanceHold.objects.get().status, BalanceHold.ST_CAPTURED)
+        w = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.assertEqual((w.balance, w.held), (Decimal("0"), Decimal("0")))
@@ -0,0 +1,87 @@
+"""Cache de configuração (tenant plataforma, taxa ativa, modo double-entry) fora do hot path."""
+
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import Consent, FeeConfig, PaymentIntent, Tenant
+from app.paypibridge.services.config_cache import clear_config_cache
+from app.paypibridge.services.ledger_service import credit_pi_for_verified_intent, get_active_fee_rate
+
+User = get_user_model()
+
+_CONFIG_SQL = (
+    'FROM "paypibridge_feeconfig"',
+    'SELECT 1 AS "a" FROM "paypibridge_ledgeraccount"',
+    'WHERE "paypibridge_tenant"."is_platform"',
+)
+
+
+@override_settings(SETTLEMENT_ASYNC=False, CONFIG_CACHE_TTL=60)
+class ConfigCacheTest(TransactionTestCase):
+    def setUp(self):
+        clear_config_cache()
+        Tenant.objects.get_or_create(
+            slug="platform",
+            defaults={"name": "Platform", "api_key": "ppb_platform_cache", "is_platform": True},
+        )
+        FeeConfig.objects.create(label="default", percentage=Decimal("0.02"), is_active=True)
+        self.tenant = Tenant.objects.create(name="Cache", slug="cache", api_key="lk_cache_1")
+        self.user = User.objects.create_user(username="cache", email="c@t.com", password="x")
+        Consent.objects.create(user=self.user, provider="mock", scope={}, consent_id="c_cache", status="ACTIVE")
+        self.client = APIClient()
+
+    def tearDown(self):
+        clear_config_cache()
+
+    def _settle(self, intent_id):
+        intent = PaymentIntent.objects.create(
+            intent_id=intent_id,
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("10"),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+        # A liquidação reserva o PI do tenant antes do Pix.
+        credit_pi_for_verified_intent(intent)
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.post(
+                reverse("settlement-execute"),
+                {"intent_id": intent_id, "cpf": "12345678901", "pix_key": "k@x.com"},
+                format="json",
+            )
+        self.assertEqual(r.status_code, 200, r.data)
+        return [q["sql"] for q in ctx.captured_queries]
+
+    @patch("app.paypibridge.services.settlement_pix_port._of_mock", return_value=True)
+    @patch("app.paypibridge.services.settlement_service.get_pricing_service")
+    def test_config_lookups_leave_the_hot_path(self, mock_pricing, _of):
+        pr = MagicMock()
+        pr.convert_pi_to_brl.return_value = Decimal("47.60")
+        mock_pricing.return_value = pr
+
+        # 1.º pedido cria as wallets/contas do tenant (e invalida a cache pelo caminho).
+        self._settle("pi_cache_0")
+        clear_config_cache()
+        cold = self._settle("pi_cache_1")
+        warm = self._settle("pi_cache_2")
+
+        def config_queries(sqls):
+            return [sql for sql in sqls if any(t in sql for t in _CONFIG_SQL)]
+
+        self.assertTrue(config_queries(cold))
+        self.assertEqual(config_queries(warm), [])
+        self.assertLess(len(warm), len(cold))
+
+    def test_signal_invalidates_fee_rate(self):
+        self.assertEqual(get_active_fee_rate(), Decimal("0.02"))
+        FeeConfig.objects.create(label="new", percentage=Decimal("0.03"), is_active=True)
+        self.assertEqual(get_active_fee_rate(), Decimal("0.03"))
@@ -0,0 +1,180 @@
+"""
+Cache de câmbio em dois níveis: refresh único por par, taxa expirada servida enquanto renova, refresh
+antecipado.
+"""
+
+import threading
+import time
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from app.paypibridge.services.fx_service import FXService
+from app.paypibridge.tasks import update_fx_rates
+
+KEY = "fx_rate_PI_BRL"
+
+
+@override_settings(FX_L1_TTL=5, FX_STALE_TTL=600, FX_REFRESH_WAIT=5, FX_RATE_HISTORY=False)
+class FXCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fx = FXService()
+        self.addCleanup(self.fx.shutdown)
+        self.calls = 0
+        self.provider_latency = 0.0
+        self.gate = None
+        self.rates = iter(Decimal(f"5.{n:02d}") for n in range(1, 100))
+
+    def _provider(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        time.sleep(self.provider_latency)
+        return next(self.rates), {"sources": {"stand-in": None}}
+
+    def _make_stale(self):
+        entry = cache.get(KEY)
+        entry["fresh_until"] = time.time() - 1
+        cache.set(KEY, entry, 600)
+        self.fx.clear_local_cache()
+
+    def _wait_background(self):
+        self.fx._background().submit(lambda: None).result(5)
+
+    def test_cold_miss_fetches_once_for_all_threads(self):
+        self.provider_latency = 0.1
+        results = []
+        start = threading.Barrier(32)
+
+        def worker():
+            start.wait(5)
+            results.append(self.fx.get_rate())
+
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            threads = [threading.Thread(target=worker) for _ in range(32)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [Decimal("5.01")] * 32)
+
+    def test_stale_rate_served_while_one_refresh_runs(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.fx.get_rate()
+            self._make_stale()
+            self.gate = threading.Event()
+            self.provider_latency = 0.2
+
+            t0 = time.perf_counter()
+            served = [self.fx.get_rate() for _ in range(50)]
+            elapsed = time.perf_counter() - t0
+            self.gate.set()
+            self._wait_background()
+
+            self.assertEqual(served, [Decimal("5.01")] * 50)
+            self.assertLess(elapsed, 0.2, f"50 stale reads took {elapsed * 1000:.0f} ms (provider latency 200 ms)")
+            self.assertEqual(self.calls, 2)
+            self.assertEqual(self.fx.get_rate(), Decimal("5.02"))
+        self.assertEqual(cache.get(KEY)["rate"], "5.02")
+
+    def test_background_refresh_closes_its_db_connection(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.fx.get_rate()
+            self._make_stale()
+            calls = []
+
+            def track(name):
+                return lambda: calls.append((name, threading.current_thread().name.split("_")[0]))
+
+            recycle = patch("app.paypibridge.services.fx_service.close_old_connections", side_effect=track("recycle"))
+            with recycle, patch("app.paypibridge.services.fx_service.connection") as conn:
+                conn.close.side_effect = track("close")
+                self.fx.get_rate()
+                self._wait_background()
+        # Antes do refresh (que grava o FxRate) recicla, no fim fecha; sempre na thread do executor.
+        self.assertEqual(calls, [("recycle", "fx-refresh"), ("close", "fx-refresh")])
+        self.assertEqual(self.calls, 2)
+
+    def test_shutdown_stops_the_executor(self):
+        executor = self.fx._background()
+        self.fx.shutdown()
+        self.assertTrue(executor._shutdown)
+        self.assertIsNot(self.fx._background(), executor)
+
+    def test_l1_shields_shared_cache(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.fx.get_rate()
+            self.fx.clear_local_cache()
+            with patch("app.paypibridge.services.fx_service.cache.get", wraps=cache.get) as l2_get:
+                for _ in range(100):
+                    self.fx.get_rate()
+        self.assertEqual(l2_get.call_count, 1)
+
+    def test_failed_refresh_keeps_stale_rate(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.fx.get_rate()
+        self._make_stale()
+        with patch.object(self.fx, "_fetch_rate", side_effect=RuntimeError("provider down")):
+            self.assertEqual(self.fx.get_rate(), Decimal("5.01"))
+            self._wait_background()
+            self.assertEqual(self.fx.get_rate(), Decimal("5.01"))
+            self._wait_background()
+        # O lock foi libertado: o próximo refresh corre.
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.assertEqual(self.fx.refresh_rate(), Decimal("5.02"))
+
+    def test_update_fx_rates_refreshes_ahead_of_expiry(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider), patch(
+            "app.paypibridge.tasks.get_fx_service", return_value=self.fx
+        ):
+            self.fx.get_rate()
+            fresh_until = cache.get(KEY)["fresh_until"]
+            self.assertEqual(update_fx_rates(), {"rate": "5.02", "provider": "fixed"})
+            self.assertGreater(cache.get(KEY)["fresh_until"], fresh_until)
+            self.fx.clear_local_cache()
+            self.assertEqual(self.fx.get_rate(), Decimal("5.02"))
+        self.assertEqual(self.calls, 2)
+
+    def test_refresh_lock_is_released_only_by_its_holder(self):
+        with patch.object(self.fx, "_fetch_rate", side_effect=self._provider):
+            self.assertTrue(self.fx._acquire_refresh(KEY))
+            # O lock expirou durante um refresh lento e outro worker tomou-o.
+            cache.set(f"{KEY}:refresh", "other-worker", 15)
+            self.fx._release_refresh(KEY)
+            self.assertEqual(cache.get(f"{KEY}:refresh"), "other-worker")
+            self.assertIsNone(self.fx.refresh_rate())
+
+            cache.delete(f"{KEY}:refresh")
+            self.assertEqual(self.fx.refresh_rate(), Decimal("5.01"))
+            self.assertIsNone(cache.get(f"{KEY}:refresh"))
+
+    def test_fetch_metadata_is_per_call(self):
+        gate = threading.Event()
+        metas = iter([{"sources": {"slow": "5.01"}}, {"sources": {"fast": "5.02"}}])
+
+        def fetch():
+            meta = next(metas)
+            if "slow" in meta["sources"]:
+                gate.wait(5)
+            return Decimal(list(meta["sources"].values())[0]), meta
+
+        with patch.object(self.fx, "_fetch_rate", side_effect=fetch):
+            slow = threading.Thread(target=lambda: self.fx._fetch_and_store(KEY, False))
+            slow.start()
+            time.sleep(0.05)
+            # Outro refresh concorrente não troca a metadata do primeiro.
+            self.assertEqual(self.fx._fetch_and_store("fx_rate_other", False)[1]["sources"], {"fast": "5.02"})
+            gate.set()
+            slow.join(5)
+        self.assertEqual(cache.get(KEY)["metadata"]["sources"], {"slow": "5.01"})
+
+    def test_reads_plain_string_entries(self):
+        cache.set(KEY, "4.90", 300)
+        with patch.object(self.fx, "_fetch_rate") as fetch:
+            self.assertEqual(self.fx.get_rate(), Decimal("4.90"))
+        fetch.assert_not_called()
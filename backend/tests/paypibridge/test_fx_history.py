@@ -0,0 +1,144 @@
+"""Histórico de câmbio: taxa em T, lookup em lote, rollups OHLC e compactação por retenção."""
+
+import random
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.paypibridge.models import FxRate, FxRateRollup
+from app.paypibridge.services import fx_history
+from app.paypibridge.services.fx_history import compact_fx_rates, rate_at, rates_at, rollup_fx_rates
+from app.paypibridge.services.fx_service import FXService
+from app.paypibridge.tasks import rollup_fx_rates as rollup_task
+
+T0 = datetime(2026, 1, 5, 12, 0, tzinfo=dt_timezone.utc)
+
+
+def _at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+class FxHistoryTest(TestCase):
+    def _record(self, seconds, rate, pair="PI/BRL"):
+        return FxRate.objects.create(pair=pair, rate=Decimal(rate), observed_at=_at(seconds))
+
+    def test_rate_at_is_last_observation_not_after_t(self):
+        self._record(0, "4.70")
+        self._record(60, "4.80")
+        self._record(30, "9.99", pair="PI/USD")
+
+        self.assertIsNone(rate_at(_at(-1)))
+        self.assertEqual(rate_at(_at(0)), Decimal("4.70"))
+        self.assertEqual(rate_at(_at(59)), Decimal("4.70"))
+        self.assertEqual(rate_at(_at(60)), Decimal("4.80"))
+        self.assertEqual(rate_at(_at(86400)), Decimal("4.80"))
+        self.assertEqual(FXService().get_rate_at(_at(45), "PI", "USD"), Decimal("9.99"))
+
+    def test_batch_matches_single_lookups_with_few_queries(self):
+        rng = random.Random(7)
+        # Dois blocos de observações separados por 30 dias; os timestamps caem à volta de cada bloco.
+        blocks = (0, 30 * 86400)
+        for block in blocks:
+            for i in range(120):
+                self._record(block + i * 30, f"4.{rng.randint(10, 99)}")
+        stamps = [_at(rng.choice(blocks) + rng.randint(-600, 4000)) for _ in range(300)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            batch = rates_at(stamps)
+        self.assertEqual(batch, [rate_at(ts) for ts in stamps])
+        self.assertLessEqual(len(ctx.captured_queries), 12)
+
+        # Ordem de entrada preservada, incluindo repetidos.
+        self.assertEqual(rates_at([_at(31), _at(-5), _at(31)]), [rate_at(_at(31)), None, rate_at(_at(31))])
+        self.assertEqual(rates_at([]), [])
+
+    def test_minute_and_hour_ohlc(self):
+        for seconds, rate in [(5, "4.70"), (20, "4.90"), (40, "4.60"), (55, "4.75"), (65, "4.80"), (3605, "5.00")]:
+            self._record(seconds, rate)
+
+        self.assertEqual(rollup_fx_rates(), {"minute_buckets": 3, "hour_buckets": 2})
+        first = FxRateRollup.objects.get(resolution=FxRateRollup.RES_MINUTE, bucket_start=T0)
+        self.assertEqual(
+            (first.open, first.high, first.low, first.close, first.samples),
+            (Decimal("4.70"), Decimal("4.90"), Decimal("4.60"), Decimal("4.75"), 4),
+        )
+        hour = FxRateRollup.objects.get(resolution=FxRateRollup.RES_HOUR, bucket_start=T0)
+        self.assertEqual(
+            (hour.open, hour.high, hour.low, hour.close, hour.samples),
+            (Decimal("4.70"), Decimal("4.90"), Decimal("4.60"), Decimal("4.80"), 5),
+        )
+
+        # Incremental: refaz só desde o último bucket; repetir não duplica.
+        self._record(3620, "5.20")
+        rollup_fx_rates()
+        rollup_fx_rates()
+        last = FxRateRollup.objects.get(resolution=FxRateRollup.RES_MINUTE, bucket_start=_at(3600))
+        self.assertEqual((last.close, last.high, last.samples), (Decimal("5.20"), Decimal("5.20"), 2))
+        self.assertEqual(FxRateRollup.objects.filter(resolution=FxRateRollup.RES_MINUTE).count(), 3)
+        self.assertEqual(FxRateRollup.objects.get(resolution=FxRateRollup.RES_HOUR, bucket_start=_at(3600)).samples, 2)
+
+    def test_compaction_keeps_uncovered_rows_and_lookups_use_rollups(self):
+        for i in range(180):  # 3 horas, uma observação por minuto
+            self._record(i * 60 + 10, f"{4 + i / 1000:.3f}")
+        self.assertEqual(compact_fx_rates(now=_at(86400 * 365)), {"raw_deleted": 0, "minute_deleted": 0})
+
+        rollup_fx_rates()
+        with self.settings(FX_RATE_RAW_RETENTION_DAYS=0, FX_RATE_MINUTE_RETENTION_DAYS=0):
+            result = compact_fx_rates(now=_at(86400))
+        # O último minuto e a última hora continuam em aberto: não são apagados.
+        self.assertEqual(result, {"raw_deleted": 179, "minute_deleted": 120})
+        self.assertEqual(FxRate.objects.count(), 1)
+
+        # Antes do horizonte raw: close do bucket já terminado, nunca uma taxa posterior a T.
+        self.assertIsNone(rate_at(_at(3599)))
+        self.assertEqual(rate_at(_at(3600)), Decimal("4.059"))
+        self.assertEqual(rate_at(_at(2 * 3600 + 90)), Decimal("4.120"))
+        self.assertEqual(rate_at(_at(179 * 60 + 10)), Decimal("4.179"))
+
+    def test_task_rolls_up_and_compacts(self):
+        self._record(0, "4.70")
+        result = rollup_task()
+        self.assertEqual((result["minute_buckets"], result["hour_buckets"], result["raw_deleted"]), (1, 1, 0))
+
+
+@override_settings(FX_PROVIDERS=["fixed"])
+class FXServiceHistoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_refresh_appends_observation(self):
+        fx = FXService()
+        fx.refresh_rate()
+        row = FxRate.objects.get()
+        self.assertEqual((row.pair, row.rate, row.source), ("PI/BRL", fx.fixed_rate, FxRate.SOURCE_PROVIDERS))
+        self.assertEqual(row.sources, {"fixed": str(fx.fixed_rate)})
+        self.assertEqual(fx.get_rates_at([row.observed_at]), [fx.fixed_rate])
+
+    @override_settings(FX_PROVIDERS=["nope"])
+    def test_fallback_is_recorded_as_such(self):
+        fx = FXService()
+        self.assertEqual(fx.get_rate(), fx.fixed_rate)
+        self.assertEqual(FxRate.objects.get().source, FxRate.SOURCE_FALLBACK)
+
+    @override_settings(FX_RATE_HISTORY=False)
+    def test_history_can_be_disabled(self):
+        FXService().refresh_rate()
+        self.assertFalse(FxRate.objects.exists())
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "LATERAL batch lookup needs PostgreSQL")
+class FxHistoryPostgresTest(TestCase):
+    def test_batch_lookup_is_one_query(self):
+        FxRate.objects.bulk_create(
+            [FxRate(pair="PI/BRL", rate=Decimal("4.70") + i, observed_at=_at(i * 60)) for i in range(50)]
+        )
+        stamps = [_at(s) for s in range(-60, 50 * 60, 17)]
+        with CaptureQueriesContext(connection) as ctx:
+            batch = fx_history._asof_many(FxRate.objects.filter(pair="PI/BRL"), "observed_at", "rate", stamps)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(batch, fx_history._asof_grouped(FxRate.objects.filter(pair="PI/BRL"), "observed_at", "rate", stamps))
@@ -0,0 +1,157 @@
+"""Fontes de câmbio: chamadas em paralelo, mediana sem outliers, pedido hedged e estatísticas por provider."""
+
+import time
+from concurrent.futures import Future
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from app.paypibridge.services.fx_providers import (
+    AGG_HEDGED,
+    aggregate_rate,
+    http_json_provider,
+    parse_rate,
+    provider_stats,
+    register_provider,
+    reset_provider_stats,
+)
+from app.paypibridge.services.fx_service import FXService
+
+
+def _source(rate, latency=0.0, error=None):
+    def fetch():
+        time.sleep(latency)
+        if error:
+            raise error
+        return Decimal(rate)
+
+    return fetch
+
+
+class _InlineExecutor:
+    """Refresh de background corrido já, na ligação (e transação) do teste: nada escapa ao rollback."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@override_settings(FX_PROVIDER_TIMEOUT=2, FX_OUTLIER_PCT=0.05, FX_HEDGE_AFTER_MS=50, FX_MIN_SOURCES=1)
+class FXProvidersTest(TestCase):
+    def setUp(self):
+        reset_provider_stats()
+
+    def test_median_rejects_outlier_and_runs_in_parallel(self):
+        providers = {
+            "a": _source("4.70", 0.2),
+            "b": _source("4.80", 0.2),
+            "c": _source("9.99", 0.2),
+            "d": _source("4.76", 0.2),
+        }
+        t0 = time.perf_counter()
+        result = aggregate_rate(providers)
+        elapsed = time.perf_counter() - t0
+
+        self.assertEqual(result.rate, Decimal("4.76"))
+        self.assertEqual(result.rejected, {"c": "9.99"})
+        self.assertEqual(set(result.sources), {"a", "b", "d"})
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(provider_stats()["c"]["outliers"], 1)
+
+    def test_slow_and_failing_sources_are_reported(self):
+        with self.settings(FX_PROVIDER_TIMEOUT=0.2):
+            result = aggregate_rate(
+                {"ok": _source("4.76"), "slow": _source("4.77", 0.5), "down": _source("0", error=ConnectionError("refused"))}
+            )
+        self.assertEqual(result.rate, Decimal("4.76"))
+        self.assertEqual(result.errors["slow"], "timeout")
+        self.assertIn("ConnectionError", result.errors["down"])
+        stats = provider_stats()
+        self.assertEqual((stats["slow"]["timeouts"], stats["down"]["errors"]), (1, 1))
+
+    def test_min_sources(self):
+        with self.settings(FX_MIN_SOURCES=2):
+            result = aggregate_rate({"a": _source("4.76"), "b": _source("0", error=ValueError("bad"))})
+        self.assertIsNone(result.rate)
+
+    def test_hedge_fires_when_primary_is_slow(self):
+        t0 = time.perf_counter()
+        result = aggregate_rate({"primary": _source("4.80", 0.5), "secondary": _source("4.76")}, mode=AGG_HEDGED)
+        elapsed = time.perf_counter() - t0
+
+        self.assertEqual((result.rate, result.hedged, result.sources), (Decimal("4.76"), True, {"secondary": "4.76"}))
+        self.assertLess(elapsed, 0.3, f"hedged FX fetch: {elapsed * 1000:.0f} ms (primary 500 ms, hedge after 50 ms)")
+        self.assertEqual(provider_stats()["secondary"]["hedges"], 1)
+
+    def test_no_hedge_when_primary_is_fast(self):
+        secondary = MagicMock(return_value=Decimal("4.70"))
+        result = aggregate_rate({"primary": _source("4.76"), "secondary": secondary}, mode=AGG_HEDGED)
+        self.assertEqual((result.rate, result.hedged), (Decimal("4.76"), False))
+        secondary.assert_not_called()
+
+    def test_hedge_fires_immediately_when_primary_fails(self):
+        with self.settings(FX_HEDGE_AFTER_MS=1000):
+            t0 = time.perf_counter()
+            result = aggregate_rate(
+                {"primary": _source("0", error=ConnectionError("refused")), "secondary": _source("4.76")}, mode=AGG_HEDGED
+            )
+        self.assertEqual(result.rate, Decimal("4.76"))
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertIn("primary", result.errors)
+
+    def test_http_json_provider(self):
+        response = MagicMock()
+        response.json.return_value = {"data": {"brl": "4.81"}}
+        with patch("app.paypibridge.services.fx_providers._http") as http:
+            http.return_value.get.return_value = response
+            self.assertEqual(http_json_provider("https://fx.test/pi", "k", "data.brl")(), Decimal("4.81"))
+        self.assertEqual(http.return_value.get.call_args.kwargs["headers"], {"Authorization": "Bearer k"})
+        self.assertEqual(parse_rate({"price": 4.5}), Decimal("4.5"))
+
+
+@override_settings(FX_PROVIDER_TIMEOUT=2, FX_OUTLIER_PCT=0.05, FX_AGGREGATION="median")
+class FXServiceProvidersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_provider_stats()
+        register_provider("test_a", _source("4.70"))
+        register_provider("test_b", _source("4.80"))
+        register_provider("test_bad", _source("7.00"))
+        register_provider("test_down", _source("0", error=ConnectionError("refused")))
+
+    @override_settings(FX_PROVIDERS=["test_a", "test_b", "test_bad", "nope"])
+    def test_quote_metadata(self):
+        quote = FXService().get_quote(Decimal("10"))
+        self.assertEqual((quote["rate"], quote["amount_brl"]), ("4.75", "47.50"))
+        meta = quote["metadata"]
+        self.assertEqual(meta["sources"], {"test_a": "4.70", "test_b": "4.80"})
+        self.assertEqual(meta["rejected"], {"test_bad": "7.00"})
+        self.assertEqual(meta["errors"], {"nope": "unknown provider"})
+        self.assertEqual(meta["provider_stats"]["test_a"]["calls"], 1)
+        self.assertIn("avg_latency_ms", meta["provider_stats"]["test_a"])
+
+    @override_settings(FX_PROVIDERS=["test_down"])
+    def test_fixed_fallback_is_visible_and_retried(self):
+        fx = FXService()
+        quote = fx.get_quote(Decimal("1"))
+        self.assertEqual((quote["rate"], quote["metadata"]["fallback"]), (str(fx.fixed_rate), "fixed"))
+        self.assertIn("test_down", quote["metadata"]["errors"])
+
+        # Guardada já expirada: a leitura seguinte tenta de novo as fontes (em background).
+        with self.settings(FX_PROVIDERS=["test_a"]), patch.object(
+            fx, "_background", return_value=_InlineExecutor()
+        ), patch.object(fx, "_refresh_in_background", fx._refresh_locked):
+            self.assertEqual(fx.get_rate(), fx.fixed_rate)
+            self.assertEqual(fx.get_rate(), Decimal("4.70"))
+
+    @override_settings(FX_PROVIDERS=["test_down"], FX_FIXED_FALLBACK=False)
+    def test_unavailable_without_fallback(self):
+        self.assertIsNone(FXService().get_rate())
+
+    def test_default_single_provider(self):
+        fx = FXService()
+        self.assertEqual(fx.provider_names, ["fixed"])
+        self.assertEqual(fx.get_quote(Decimal("1"))["provider"], "fixed")
@@ -0,0 +1,257 @@
+"""Group commit de lançamentos: agregação, isolamento de erros por pedido e benchmark (Postgres)."""
+
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app.paypibridge.models import (
+    BalanceHold,
+    Consent,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    PaymentIntent,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.config_cache import clear_config_cache
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    is_double_entry_active,
+)
+from app.paypibridge.services.group_commit import GroupCommitPoster, JournalRequest, submit_journals
+from app.paypibridge.services.ledger_service import credit_pi_for_verified_intent, ensure_wallet
+from app.paypibridge.services.settlement_service import SettlementService
+
+User = get_user_model()
+
+
+def _credit(acc, ref, amount="1", key=None):
+    return JournalRequest(
+        ref,
+        [
+            {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+            {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+        ],
+        idempotency_key=key,
+    )
+
+
+def _debit(acc, ref, amount):
+    return JournalRequest(
+        ref,
+        [
+            {"account_id": acc.id, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+            {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+        ],
+    )
+
+
+class GroupCommitFlushTest(TestCase):
+    """flush() chamado no thread do teste (o thread de flush real só corre no benchmark)."""
+
+    def setUp(self):
+        self.accs = []
+        for n in range(2):
+            tenant = Tenant.objects.create(name=f"GC {n}", slug=f"gc-{n}", api_key=f"lk_gc_{n}")
+            self.accs.append(ensure_wallet_ledger_account(ensure_wallet(tenant, Wallet.ASSET_PI)))
+        self.poster = GroupCommitPoster(window_ms=1, max_batch=50)
+        self.addCleanup(self.poster.shutdown)
+
+    def test_group_aggregates_deltas(self):
+        units = [[_credit(self.accs[i % 2], f"gc-{i}")] for i in range(20)]
+        with CaptureQueriesContext(connection) as ctx:
+            self.poster.flush(units)
+        updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('UPDATE "paypibridge_ledgeraccount"')]
+        self.assertEqual(len(updates), 1)
+        batches = [unit[0].future.result() for unit in units]
+        self.assertEqual(len({jb.pk for jb in batches}), 20)
+        for acc in self.accs:
+            acc.refresh_from_db()
+            self.assertEqual(acc.balance, Decimal("10"))
+            self.assertEqual(Wallet.objects.get(pk=acc.wallet_id).balance, Decimal("10"))
+
+    def test_errors_stay_with_their_request(self):
+        good = [_credit(self.accs[0], "ok-1")]
+        unbalanced = [
+            JournalRequest("bad-1", [{"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")}])
+        ]
+        unknown = [
+            JournalRequest(
+                "bad-2",
+                [
+                    {"code": "NOPE", "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")},
+                    {"account_id": self.accs[0].id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")},
+                ],
+            )
+        ]
+        self.poster.flush([good, unbalanced, unknown])
+        self.assertEqual(good[0].future.result().reference, "ok-1")
+        with self.assertRaisesMessage(ValueError, "ledger imbalance"):
+            unbalanced[0].future.result()
+        with self.assertRaisesMessage(ValueError, "account not found: NOPE"):
+            unknown[0].future.result()
+        self.assertEqual(self.poster.stats["fallbacks"], 0)
+
+    def test_duplicate_keys_in_one_group(self):
+        units = [[_credit(self.accs[0], "dup", key="gc:dup")] for _ in range(3)]
+        self.poster.flush(units)
+        self.assertEqual(len({unit[0].future.result().pk for unit in units}), 1)
+        self.accs[0].refresh_from_db()
+        self.assertEqual(self.accs[0].balance, Decimal("1"))
+
+    @override_settings(LEDGER_BALANCE_MODE="conditional")
+    def test_failed_group_falls_back_per_unit(self):
+        self.poster.flush([[_credit(self.accs[0], "seed", "3")]])
+        units = [[_debit(self.accs[0], "d-1", "2")], [_debit(self.accs[0], "d-2", "2")]]
+        self.poster.flush(units)
+        self.assertEqual(self.poster.stats["fallbacks"], 1)
+        self.assertEqual(units[0][0].future.result().reference, "d-1")
+        with self.assertRaisesMessage(ValueError, "insufficient_account_balance"):
+            units[1][0].future.result()
+        self.accs[0].refresh_from_db()
+        self.assertEqual(self.accs[0].balance, Decimal("1"))
+
+    def test_unit_is_all_or_nothing(self):
+        unit = [_credit(self.accs[0], "u-1"), _debit(self.accs[1], "u-2", "5")]
+        with override_settings(LEDGER_BALANCE_MODE="conditional"):
+            self.poster.flush([unit])
+        for req in unit:
+            with self.assertRaises(ValueError):
+                req.future.result()
+        self.assertFalse(JournalBatch.objects.filter(reference__in=["u-1", "u-2"]).exists())
+
+    @override_settings(JOURNAL_GROUP_COMMIT=True)
+    def test_inside_transaction_posts_directly(self):
+        with transaction.atomic():
+            (future,) = submit_journals([_credit(self.accs[0], "in-tx")])
+            self.assertTrue(future.done())
+        self.assertEqual(future.result().reference, "in-tx")
+
+
+@override_settings(JOURNAL_GROUP_COMMIT=True, JOURNAL_GROUP_COMMIT_WINDOW_MS=1)
+class GroupCommitSettlementTest(TransactionTestCase):
+    """settle() fora de transação: os lançamentos passam pelo thread de flush e a reserva é capturada depois."""
+
+    def setUp(self):
+        clear_config_cache()
+        # TransactionTestCase esvazia a base entre testes: contas de sistema e tenant plataforma aqui.
+        for code, asset, category in (
+            ("CLEARING_PI", "PI", "ASSET"),
+            ("CLEARING_BRL", "BRL", "ASSET"),
+            ("PLATFORM_FEE_BRL", "BRL", "REVENUE"),
+        ):
+            LedgerAccount.objects.get_or_create(
+                code=code,
+                defaults={"name": code, "asset": asset, "account_type": "clearing", "category": category},
+            )
+        Tenant.objects.get_or_create(
+            slug="platform", defaults={"name": "Platform", "api_key": "ppb_platform_gcs", "is_platform": True}
+        )
+        self.tenant = Tenant.objects.create(name="GCS", slug="gcs", api_key="lk_gcs_1")
+        user = User.objects.create_user(username="gcs", email="g@t.com", password="x")
+        self.consent = Consent.objects.create(user=user, provider="mock", scope={}, consent_id="c_gcs", status="ACTIVE")
+        self.intent = PaymentIntent.objects.create(
+            intent_id="pi_gcs_1",
+            payer_address="x",
+            payee_user=user,
+            amount_pi=Decimal("10"),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+        credit_pi_for_verified_intent(self.intent)
+
+    def tearDown(self):
+        clear_config_cache()
+
+    def test_settlement_journals_use_group_commit(self):
+        self.assertTrue(is_double_entry_active())
+        pricing = MagicMock()
+        pricing.convert_pi_to_brl.return_value = Decimal("47.60")
+        pix = MagicMock()
+        pix.send.return_value = {"success": True, "txid": "tx-gcs", "status": "COMPLETED"}
+        poster = GroupCommitPoster(window_ms=1, max_batch=10)
+        self.addCleanup(poster.shutdown)
+
+        with patch("app.paypibridge.services.group_commit._poster", poster), patch(
+            "app.paypibridge.services.group_commit._post_unit_direct"
+        ) as direct:
+            result = SettlementService(pricing_service=pricing, pix_port=pix).settle(
+                self.intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com"
+            )
+
+        self.assertTrue(result.success)
+        direct.assert_not_called()
+        self.assertEqual((poster.stats["groups"], poster.stats["requests"]), (1, 3))
+        self.assertEqual(JournalBatch.objects.filter(payment_intent=self.intent, reference__startswith="settle_").count(), 3)
+        self.assertEqual(BalanceHold.objects.get(payment_intent=self.intent).status, BalanceHold.ST_CAPTURED)
+        wallet = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.assertEqual((wallet.balance, wallet.held), (Decimal("0"), Decimal("0")))
+
+    def test_shutdown_flushes_the_queue_and_stops_the_thread(self):
+        acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        poster = GroupCommitPoster(window_ms=50, max_batch=10)
+        self.addCleanup(poster.shutdown)
+        (future,) = poster.submit_unit([_credit(acc, "gc-stop")])
+        thread = poster._thread
+        poster.shutdown()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(future.result(timeout=0).reference, "gc-stop")
+
+        # Depois do shutdown o próximo pedido arranca outro thread.
+        self.assertEqual(poster.post("gc-again", _credit(acc, "x").lines).reference, "gc-again")
+        self.assertIsNot(poster._thread, thread)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "benchmark de group commit requer Postgres")
+class GroupCommitBenchmarkTest(TransactionTestCase):
+    THREADS = 16
+    OPS_PER_THREAD = 20
+
+    def _run(self, post):
+        tenant = Tenant.objects.create(name="GCB", slug=f"gcb-{time.monotonic_ns()}", api_key=f"lk_gcb_{time.monotonic_ns()}")
+        acc = ensure_wallet_ledger_account(ensure_wallet(tenant, Wallet.ASSET_PI))
+        LedgerAccount.objects.get_or_create(
+            code=CODE_CLEARING_PI,
+            defaults={"name": CODE_CLEARING_PI, "asset": "PI", "account_type": "clearing", "category": "ASSET"},
+        )
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(n):
+            try:
+                barrier.wait()
+                for i in range(self.OPS_PER_THREAD):
+                    post(_credit(acc, f"gcb-{n}-{i}"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        acc.refresh_from_db()
+        self.assertEqual(acc.balance, Decimal(self.THREADS * self.OPS_PER_THREAD))
+        return self.THREADS * self.OPS_PER_THREAD / elapsed
+
+    def test_group_commit_needs_fewer_commits_than_per_call(self):
+        per_call = self._run(lambda req: req.post_direct())
+        poster = GroupCommitPoster(window_ms=5, max_batch=100)
+        self.addCleanup(poster.shutdown)
+        grouped = self._run(lambda req: poster.submit_unit([req])[0].result())
+        units = self.THREADS * self.OPS_PER_THREAD
+        detail = f"journals/s: per-call={per_call:.0f} group-commit={grouped:.0f} (groups={poster.stats['groups']})"
+        # Por chamada: um commit por lançamento. Group commit: um por grupo, com vários lançamentos cada.
+        self.assertEqual((poster.stats["requests"], poster.stats["fallbacks"]), (units, 0), detail)
+        self.assertLess(poster.stats["groups"], units // 2, detail)
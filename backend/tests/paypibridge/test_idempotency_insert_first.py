@@ -0,0 +1,92 @@
+"""Idempotência insert-first (ON CONFLICT DO NOTHING RETURNING) nos dois caminhos de lançamento."""
+
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from app.paypibridge.models import JournalBatch, JournalLine, LedgerEntry, Tenant, Wallet
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.idempotency import insert_or_get
+from app.paypibridge.services.ledger_service import apply_ledger_entry, ensure_wallet
+
+
+class InsertFirstIdempotencyTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Idem", slug="idem", api_key="lk_idem_1")
+        self.wallet = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.acc = ensure_wallet_ledger_account(self.wallet)
+
+    def _credit(self, key):
+        return apply_ledger_entry(
+            self.tenant, Wallet.ASSET_PI, Decimal("2"), LedgerEntry.ENTRY_CREDIT, "r", idempotency_key=key
+        )
+
+    def _journal(self, key):
+        return post_balanced_journal(
+            "idem-j",
+            [
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")},
+                {"account_id": self.acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")},
+            ],
+            idempotency_key=key,
+        )
+
+    def test_duplicate_is_one_insert_and_one_read(self):
+        first = self._credit("idem:1")
+        with CaptureQueriesContext(connection) as ctx:
+            again = self._credit("idem:1")
+        sqls = [q["sql"] for q in ctx.captured_queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(len(sqls), 2)
+        self.assertIn("ON CONFLICT", sqls[0])
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("2"))
+
+    def test_common_path_has_no_pre_read(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self._credit("idem:2")
+        lookups = [q["sql"] for q in ctx.captured_queries if "SELECT" in q["sql"] and "paypibridge_ledgerentry" in q["sql"]]
+        self.assertEqual(lookups, [])
+
+    def test_journal_duplicate_inside_outer_transaction(self):
+        first = self._journal("idem:j1")
+        with transaction.atomic():
+            again = self._journal("idem:j1")
+            # A transação externa continua utilizável (sem IntegrityError abortado).
+            self.assertTrue(JournalBatch.objects.filter(pk=first.pk).exists())
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(JournalLine.objects.filter(journal=first).count(), 2)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, Decimal("1"))
+
+    def test_failed_posting_releases_key(self):
+        with self.assertRaisesMessage(ValueError, "insufficient_wallet_balance"):
+            apply_ledger_entry(
+                self.tenant, Wallet.ASSET_PI, Decimal("5"), LedgerEntry.ENTRY_DEBIT, "r", idempotency_key="idem:3"
+            )
+        self.assertFalse(LedgerEntry.objects.filter(idempotency_key="idem:3").exists())
+
+    def test_fallback_without_on_conflict(self):
+        with patch("app.paypibridge.services.idempotency._supports_insert_ignore_returning", return_value=False):
+            first = self._credit("idem:4")
+            again = self._credit("idem:4")
+            jb = self._journal("idem:j2")
+            self.assertEqual(self._journal("idem:j2").pk, jb.pk)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(LedgerEntry.objects.filter(idempotency_key="idem:4").count(), 1)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, Decimal("1"))
+
+    def test_primitive_sets_defaults(self):
+        jb, created = insert_or_get(JournalBatch(reference="p", idempotency_key="idem:p", metadata={"a": 1}))
+        self.assertTrue(created)
+        stored = JournalBatch.objects.get(pk=jb.pk)
+        self.assertEqual(stored.metadata, {"a": 1})
+        self.assertIsNotNone(stored.created_at)
+        self.assertFalse(insert_or_get(JournalBatch(reference="p2", idempotency_key="idem:p"))[1])
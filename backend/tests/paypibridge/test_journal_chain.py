@@ -0,0 +1,170 @@
+"""Cadeia de hashes dos JournalBatch, checkpoints Merkle, verificação e provas de inclusão."""
+
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from app.paypibridge.models import JournalBatch, JournalChainHead, JournalLine, JournalMerkleCheckpoint, Tenant, Wallet
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.group_commit import GroupCommitPoster, JournalRequest
+from app.paypibridge.services.journal_chain import (
+    GENESIS_HASH,
+    _lines_by_journal,
+    chain_hash,
+    inclusion_proof,
+    journal_digest,
+    merkle_proof,
+    merkle_root,
+    seal_journal_chain,
+    verify_proof,
+    verify_range,
+)
+from app.paypibridge.services.ledger_service import ensure_wallet
+
+
+def _lines(acc, amount="1"):
+    return [
+        {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+        {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+    ]
+
+
+class MerkleTest(SimpleTestCase):
+    def test_proofs_for_every_leaf_and_size(self):
+        for n in range(1, 10):
+            hashes = [f"{i:064x}" for i in range(n)]
+            root = merkle_root(hashes)
+            for i, h in enumerate(hashes):
+                proof = merkle_proof(hashes, i)
+                self.assertLessEqual(len(proof), max(1, (n - 1).bit_length()))
+                self.assertTrue(verify_proof(h, proof, root))
+                self.assertFalse(verify_proof(f"{99:064x}", proof, root))
+
+
+@override_settings(JOURNAL_MERKLE_RANGE_SIZE=4)
+class JournalChainTest(TestCase):
+    def setUp(self):
+        tenant = Tenant.objects.create(name="Chain", slug="chain", api_key="lk_chain_1")
+        self.acc = ensure_wallet_ledger_account(ensure_wallet(tenant, Wallet.ASSET_PI))
+
+    def _post(self, n):
+        return [post_balanced_journal(f"chain-{i}", _lines(self.acc), metadata={"i": i}) for i in range(n)]
+
+    def test_batches_are_chained_by_the_seal_not_at_posting(self):
+        batches = self._post(3)
+        self.assertEqual([jb.chain_seq for jb in batches], [None] * 3)
+        self.assertEqual(JournalChainHead.objects.get().seq, 0)
+        self.assertEqual(verify_range()["unchained"], 3)
+
+        self.assertEqual(seal_journal_chain(limit=2), {"chained": 3, "checkpoints": 0})
+        batches = list(JournalBatch.objects.order_by("id"))
+        self.assertEqual([jb.chain_seq for jb in batches], [1, 2, 3])
+        self.assertEqual(batches[0].prev_hash, GENESIS_HASH)
+        self.assertEqual(batches[1].prev_hash, batches[0].hash)
+        self.assertEqual(JournalChainHead.objects.get().hash, batches[2].hash)
+        report = verify_range()
+        self.assertTrue(report["ok"], report)
+        self.assertEqual((report["checked"], report["unchained"]), (3, 0))
+
+    def test_group_commit_chains_each_batch(self):
+        self._post(1)
+        units = [[JournalRequest(f"gc-{i}", _lines(self.acc))] for i in range(3)]
+        GroupCommitPoster().flush(units)
+        seal_journal_chain()
+        self.assertEqual([JournalBatch.objects.get(pk=u[0].future.result().pk).chain_seq for u in units], [2, 3, 4])
+        self.assertTrue(verify_range()["ok"])
+
+    def test_batches_left_unchained_past_the_seal_interval_fail_verification(self):
+        batches = self._post(3)
+        seal_journal_chain()
+        late = self._post(2)
+        self.assertTrue(verify_range()["ok"])
+
+        # Selo parado: ao fim de um intervalo os batches por encadear deixam de ser só contados.
+        JournalBatch.objects.filter(pk__in=[jb.pk for jb in late]).update(
+            created_at=timezone.now() - timedelta(seconds=61)
+        )
+        report = verify_range()
+        self.assertFalse(report["ok"])
+        (error,) = report["errors"]
+        self.assertEqual(
+            (error["issue"], error["count"], error["oldest_journal_id"]), ("unchained_batch", 2, late[0].pk)
+        )
+
+        # O mesmo para um batch já selado a quem apagaram o chain_seq (some da cadeia sem missing_batch no fim).
+        seal_journal_chain()
+        self.assertTrue(verify_range()["ok"])
+        JournalBatch.objects.filter(pk=batches[0].pk).update(
+            chain_seq=None, created_at=timezone.now() - timedelta(seconds=61)
+        )
+        self.assertIn("unchained_batch", [e["issue"] for e in verify_range(2)["errors"]])
+
+    def test_tampering_is_detected(self):
+        batches = self._post(6)
+        seal_journal_chain()
+        JournalLine.objects.filter(journal=batches[1], side=JournalLine.SIDE_DEBIT).update(amount=Decimal("2"))
+        JournalBatch.objects.filter(pk=batches[3].pk).update(reference="edited")
+        issues = {(e["chain_seq"], e["issue"]) for e in verify_range()["errors"]}
+        self.assertEqual(issues, {(2, "hash_mismatch"), (4, "hash_mismatch")})
+
+    def test_deleted_batch_and_rewritten_chain(self):
+        batches = self._post(6)
+        seal_journal_chain()
+        JournalBatch.objects.filter(pk=batches[4].pk).delete()
+        self.assertIn((5, "missing_batch"), {(e["chain_seq"], e["issue"]) for e in verify_range()["errors"]})
+
+        # Reescrever o conteúdo e recalcular o elo desse batch continua a partir a raiz Merkle e o elo seguinte.
+        jb = JournalBatch.objects.get(pk=batches[1].pk)
+        jb.reference = "forged"
+        jb.hash = chain_hash(jb.prev_hash, journal_digest(jb, _lines_by_journal([jb.pk])[jb.pk]))
+        jb.save(update_fields=["reference", "hash"])
+        issues = {(e["chain_seq"], e["issue"]) for e in verify_range(1, 4)["errors"]}
+        self.assertEqual(issues, {(3, "broken_link"), (4, "merkle_root_mismatch")})
+
+    def test_pending_batches_are_chained_by_id_and_sealed(self):
+        self._post(2)
+        seal_journal_chain()
+        legacy = JournalBatch.objects.create(reference="legacy")
+        JournalLine.objects.create(journal=legacy, account=self.acc, side=JournalLine.SIDE_CREDIT, amount=Decimal("1"))
+        self._post(5)
+        self.assertEqual(seal_journal_chain(), {"chained": 6, "checkpoints": 2})
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.chain_seq, 3)
+        self.assertEqual(list(JournalMerkleCheckpoint.objects.values_list("start_seq", "end_seq")), [(1, 4), (5, 8)])
+        report = verify_range(3, 8)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual((report["checked"], report["checkpoints"]), (6, 1))
+
+    def test_inclusion_proof(self):
+        batches = self._post(5)
+        with self.assertRaisesMessage(ValueError, "not chained"):
+            inclusion_proof(batches[0].pk)
+        seal_journal_chain()
+        with self.assertRaisesMessage(ValueError, "not covered"):
+            inclusion_proof(batches[4].pk)
+        proof = inclusion_proof(batches[2].pk)
+        self.assertTrue(proof["valid"])
+        self.assertEqual(len(proof["proof"]), 2)
+        self.assertEqual(proof["checkpoint"]["root"], JournalMerkleCheckpoint.objects.get().root)
+
+        JournalBatch.objects.filter(pk=batches[2].pk).update(metadata={"i": 99})
+        self.assertFalse(inclusion_proof(batches[2].pk)["valid"])
+
+    def test_command(self):
+        batches = self._post(4)
+        out = StringIO()
+        call_command("verify_journal_chain", "--seal", "--proof", str(batches[3].pk), stdout=out)
+        self.assertIn('"valid": true', out.getvalue())
+        call_command("verify_journal_chain", stdout=StringIO())
+
+        JournalLine.objects.filter(journal=batches[0]).update(amount=Decimal("3"))
+        with self.assertRaisesMessage(CommandError, "verification failed"):
+            call_command("verify_journal_chain", stdout=StringIO())
@@ -0,0 +1,125 @@
+"""Lançamentos em lote no ledger legado (apply_ledger_entries_bulk)."""
+
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from app.paypibridge.models import LedgerEntry, PaymentIntent, Tenant, Wallet
+from app.paypibridge.services.ledger_service import (
+    apply_ledger_entries_bulk,
+    apply_ledger_entry,
+    apply_settlement_ledger,
+    ensure_wallet,
+    get_platform_tenant,
+)
+
+User = get_user_model()
+
+
+class LedgerBulkTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Bulk", slug="bulk", api_key="lk_bulk_1")
+        self.user = User.objects.create_user(username="bulk", email="b@t.com", password="x")
+
+    def _intent(self, intent_id, amount_pi="10"):
+        return PaymentIntent.objects.create(
+            intent_id=intent_id,
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal(amount_pi),
+            tenant=self.tenant,
+        )
+
+    def test_bulk_applies_in_order_and_is_idempotent(self):
+        entries = [
+            {
+                "tenant": self.tenant,
+                "asset": Wallet.ASSET_BRL,
+                "amount": Decimal("5"),
+                "entry_type": LedgerEntry.ENTRY_CREDIT,
+                "reference": "r1",
+                "idempotency_key": "bulk:c",
+            },
+            {
+                "tenant": self.tenant,
+                "asset": Wallet.ASSET_BRL,
+                "amount": Decimal("3"),
+                "entry_type": LedgerEntry.ENTRY_DEBIT,
+                "reference": "r1",
+                "idempotency_key": "bulk:d",
+            },
+        ]
+        first = apply_ledger_entries_bulk(entries)
+        second = apply_ledger_entries_bulk(entries)
+        self.assertEqual([e.pk for e in first], [e.pk for e in second])
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_BRL).balance, Decimal("2"))
+        self.assertEqual(LedgerEntry.objects.filter(reference="r1").count(), 2)
+
+    def test_bulk_insufficient_balance_rolls_back(self):
+        with self.assertRaisesMessage(ValueError, "insufficient_wallet_balance"):
+            apply_ledger_entries_bulk(
+                [
+                    {
+                        "tenant": self.tenant,
+                        "asset": Wallet.ASSET_PI,
+                        "amount": Decimal("1"),
+                        "entry_type": LedgerEntry.ENTRY_CREDIT,
+                        "reference": "r2",
+                    },
+                    {
+                        "tenant": self.tenant,
+                        "asset": Wallet.ASSET_PI,
+                        "amount": Decimal("2"),
+                        "entry_type": LedgerEntry.ENTRY_DEBIT,
+                        "reference": "r2",
+                    },
+                ]
+            )
+        self.assertFalse(LedgerEntry.objects.filter(reference="r2").exists())
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("0"))
+
+    @patch("app.paypibridge.services.ledger_service.is_double_entry_active", return_value=False)
+    def test_settlement_round_trips_before_and_after(self, _de):
+        """Benchmark: round trips por liquidação (4 × apply_ledger_entry vs. lote)."""
+        platform = get_platform_tenant()
+        legacy = self._intent("pi_bulk_legacy")
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("20"), LedgerEntry.ENTRY_CREDIT, "seed")
+        ensure_wallet(self.tenant, Wallet.ASSET_BRL)
+        ref = legacy.intent_id
+        with CaptureQueriesContext(connection) as before:
+            apply_ledger_entry(
+                self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_DEBIT, ref,
+                idempotency_key=f"settle_pi_debit:{ref}", payment_intent=legacy,
+            )
+            apply_ledger_entry(
+                platform, Wallet.ASSET_BRL, Decimal("1"), LedgerEntry.ENTRY_CREDIT, ref,
+                idempotency_key=f"settle_fee:{ref}", payment_intent=legacy,
+            )
+            apply_ledger_entry(
+                self.tenant, Wallet.ASSET_BRL, Decimal("46.6"), LedgerEntry.ENTRY_CREDIT, ref,
+                idempotency_key=f"settle_brl_credit:{ref}", payment_intent=legacy,
+            )
+            apply_ledger_entry(
+                self.tenant, Wallet.ASSET_BRL, Decimal("46.6"), LedgerEntry.ENTRY_DEBIT, ref,
+                idempotency_key=f"settle_pix_debit:{ref}", payment_intent=legacy,
+            )
+
+        bulk = self._intent("pi_bulk_new")
+        with CaptureQueriesContext(connection) as after:
+            apply_settlement_ledger(
+                bulk,
+                gross_brl=Decimal("47.6"),
+                fee_brl=Decimal("1"),
+                net_brl=Decimal("46.6"),
+            )
+
+        n_before, n_after = len(before), len(after)
+        self.assertLess(n_after, n_before, f"settlement round trips: per-entry={n_before} bulk={n_after}")
+        # platform tenant + lock wallets + IN idempotência + bulk_create + UPDATE (+ savepoints)
+        self.assertLessEqual(n_after, 7)
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("0"))
+        self.assertEqual(LedgerEntry.objects.filter(payment_intent=bulk).count(), 4)
@@ -0,0 +1,260 @@
+"""Modos de atualização de saldo (locking vs. conditional) e stress de concorrência."""
+
+import re
+import threading
+import time
+import unittest
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.paypibridge.models import JournalLine, LedgerAccount, LedgerEntry, PaymentIntent, Tenant, Wallet
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_BRL,
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.ledger_service import apply_ledger_entry, capture_hold, ensure_wallet, reserve_hold
+
+
+@override_settings(LEDGER_BALANCE_MODE="conditional")
+class ConditionalBalanceModeTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Cond", slug="cond", api_key="lk_cond_1")
+
+    def test_credit_debit_and_insufficient(self):
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("2"), LedgerEntry.ENTRY_CREDIT, "r")
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("1.5"), LedgerEntry.ENTRY_DEBIT, "r")
+        with self.assertRaisesMessage(ValueError, "insufficient_wallet_balance"):
+            apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("1"), LedgerEntry.ENTRY_DEBIT, "r-fail")
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("0.5"))
+        self.assertFalse(LedgerEntry.objects.filter(reference="r-fail").exists())
+
+    def test_idempotent(self):
+        for _ in range(2):
+            apply_ledger_entry(
+                self.tenant, Wallet.ASSET_BRL, Decimal("3"), LedgerEntry.ENTRY_CREDIT, "r", idempotency_key="cond:1"
+            )
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_BRL).balance, Decimal("3"))
+
+    def test_journal_syncs_wallet_and_guards_wallet_accounts(self):
+        acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        post_balanced_journal(
+            "cond-j1",
+            [
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("4")},
+                {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("4")},
+            ],
+        )
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("4"))
+        with self.assertRaisesMessage(ValueError, "insufficient_account_balance"):
+            post_balanced_journal(
+                "cond-j2",
+                [
+                    {"account_id": acc.id, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("5")},
+                    {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("5")},
+                ],
+            )
+        acc.refresh_from_db()
+        self.assertEqual(acc.balance, Decimal("4"))
+
+    def test_journal_debits_respect_holds_except_their_own(self):
+        acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        user = get_user_model().objects.create_user(username="cond", email="c@t.com", password="x")
+        intent = PaymentIntent.objects.create(
+            intent_id="pi_cond_hold", payer_address="x", payee_user=user, amount_pi=Decimal("7")
+        )
+
+        def post(ref, amount, payment_intent=None):
+            return post_balanced_journal(
+                ref,
+                [
+                    {"account_id": acc.id, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+                    {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+                ],
+                payment_intent=payment_intent,
+            )
+
+        post_balanced_journal(
+            "cond-h0",
+            [
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("10")},
+                {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("10")},
+            ],
+        )
+        hold, _ = reserve_hold(self.tenant, Wallet.ASSET_PI, Decimal("7"), reference="h", payment_intent=intent)
+        with self.assertRaisesMessage(ValueError, "insufficient_available_balance"):
+            post("cond-h1", "4")
+        acc.refresh_from_db()
+        self.assertEqual(acc.balance, Decimal("10"))
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("10"))
+
+        post("cond-h2", "3")
+        # O débito da liquidação consome a sua própria retenção antes da captura.
+        post("cond-h3", "7", payment_intent=intent)
+        self.assertTrue(capture_hold(hold))
+        w = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.assertEqual((w.balance, w.held), (Decimal("0"), Decimal("0")))
+
+
+    def test_guarded_updates_run_per_account_in_pk_order(self):
+        acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        clearing = LedgerAccount.objects.get(code=CODE_CLEARING_PI)
+        table = LedgerAccount._meta.db_table
+        with CaptureQueriesContext(connection) as ctx:
+            post_balanced_journal(
+                "cond-order",
+                [
+                    {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")},
+                    {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")},
+                ],
+            )
+        sqls = [q["sql"] for q in ctx.captured_queries]
+        # Sem SELECT de lock antes: um UPDATE guardado por conta, por ordem de pk.
+        self.assertFalse([sql for sql in sqls if sql.startswith(f'SELECT "{table}"."id" AS "pk"')])
+        updated = [
+            int(re.search(rf'"{table}"\."id" = (\d+)', sql).group(1))
+            for sql in sqls
+            if sql.startswith(f'UPDATE "{table}" SET "balance"')
+        ]
+        self.assertEqual(updated, sorted([acc.pk, clearing.pk]))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "stress de concorrência requer Postgres")
+class BalanceModeStressTest(TransactionTestCase):
+    """N threads a debitar a mesma wallet: nunca negativo, e throughput por modo."""
+
+    THREADS = 8
+    OPS_PER_THREAD = 25
+    SEED = Decimal("100")
+
+    def _run(self, mode):
+        tenant = Tenant.objects.create(name=f"Stress {mode}", slug=f"stress-{mode}", api_key=f"lk_stress_{mode}")
+        apply_ledger_entry(tenant, Wallet.ASSET_PI, self.SEED, LedgerEntry.ENTRY_CREDIT, "seed")
+        ok, insufficient = [], []
+
+        def worker(n):
+            try:
+                for i in range(self.OPS_PER_THREAD):
+                    try:
+                        apply_ledger_entry(tenant, Wallet.ASSET_PI, Decimal("1"), LedgerEntry.ENTRY_DEBIT, f"s{n}-{i}")
+                        ok.append(1)
+                    except ValueError:
+                        insufficient.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        with override_settings(LEDGER_BALANCE_MODE=mode):
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+
+        total = self.THREADS * self.OPS_PER_THREAD
+        self.assertEqual(len(ok) + len(insufficient), total)
+        self.assertEqual(len(ok), min(total, int(self.SEED)))
+        self.assertEqual(ensure_wallet(tenant, Wallet.ASSET_PI).balance, self.SEED - len(ok))
+        return total / elapsed
+
+    def test_throughput_locking_vs_conditional(self):
+        locking = self._run("locking")
+        conditional = self._run("conditional")
+        self.assertGreater(
+            min(locking, conditional), 0, f"ledger debits/s: locking={locking:.0f} conditional={conditional:.0f}"
+        )
+
+
+class SetBasedJournalTest(TestCase):
+    def setUp(self):
+        self.accounts = []
+        for n in range(3):
+            tenant = Tenant.objects.create(name=f"Set {n}", slug=f"set-{n}", api_key=f"lk_set_{n}")
+            self.accounts.append(ensure_wallet_ledger_account(ensure_wallet(tenant, Wallet.ASSET_PI)))
+
+    def _journal(self, ref, n_accounts):
+        lines = [{"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(n_accounts)}]
+        lines += [
+            {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")}
+            for acc in self.accounts[:n_accounts]
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            post_balanced_journal(ref, lines)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        self.assertEqual(self._journal("set-1", 1), self._journal("set-3", 3))
+        for acc, expected in zip(self.accounts, ("2", "1", "1")):
+            acc.refresh_from_db()
+            self.assertEqual(acc.balance, Decimal(expected))
+            self.assertEqual(Wallet.objects.get(pk=acc.wallet_id).balance, acc.balance)
+
+    def test_unknown_account_rolls_back(self):
+        with self.assertRaisesMessage(ValueError, "account not found: NOPE"):
+            post_balanced_journal(
+                "set-x",
+                [
+                    {"code": "NOPE", "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")},
+                    {"account_id": self.accounts[0].id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")},
+                ],
+            )
+        self.assertFalse(JournalLine.objects.filter(journal__reference="set-x").exists())
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "stress de concorrência requer Postgres")
+class JournalLockOrderStressTest(TransactionTestCase):
+    """Lançamentos concorrentes A→B e B→A: com lock ordenado por pk não há deadlocks."""
+
+    THREADS = 8
+    OPS_PER_THREAD = 25
+
+    def test_opposite_order_journals(self):
+        # TransactionTestCase esvazia as tabelas: as contas semeadas pela migração podem não existir.
+        a, b = (
+            LedgerAccount.objects.get_or_create(
+                code=code,
+                defaults={"name": code, "asset": asset, "account_type": "clearing", "category": "ASSET"},
+            )[0]
+            for code, asset in ((CODE_CLEARING_PI, Wallet.ASSET_PI), (CODE_CLEARING_BRL, Wallet.ASSET_BRL))
+        )
+        errors = []
+
+        def worker(n, barrier):
+            first, second = (a, b) if n % 2 else (b, a)
+            try:
+                barrier.wait()
+                for i in range(self.OPS_PER_THREAD):
+                    post_balanced_journal(
+                        f"dl-{n}-{i}",
+                        [
+                            {"account_id": first.id, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("1")},
+                            {"account_id": second.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("1")},
+                        ],
+                    )
+            except OperationalError as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        for mode in ("locking", "conditional"):
+            barrier = threading.Barrier(self.THREADS)
+            threads = [threading.Thread(target=worker, args=(n, barrier)) for n in range(self.THREADS)]
+            with override_settings(LEDGER_BALANCE_MODE=mode):
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            self.assertEqual(errors, [], mode)
+
+        # Metade das threads debita A e credita B, a outra metade o inverso: os saldos voltam a zero.
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.balance, b.balance), (Decimal("0"), Decimal("0")))
+        posted = JournalLine.objects.filter(journal__reference__startswith="dl-").count()
+        self.assertEqual(posted, 2 * 2 * self.THREADS * self.OPS_PER_THREAD)
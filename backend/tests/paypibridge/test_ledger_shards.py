@@ -0,0 +1,76 @@
+"""Sharding de saldo para contas quentes do ledger em partidas dobradas."""
+
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from app.paypibridge.models import LedgerAccount, LedgerAccountShard, PaymentIntent, Tenant
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    compact_account_shards,
+    configure_account_sharding,
+    get_account_balance,
+    post_pi_received_journal,
+    reconcile_sharded_accounts,
+)
+
+User = get_user_model()
+
+
+class LedgerShardTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Shard", slug="shard", api_key="lk_shard_1")
+        self.user = User.objects.create_user(username="shard", email="s@t.com", password="x")
+        self.clearing = LedgerAccount.objects.get(code=CODE_CLEARING_PI)
+        configure_account_sharding(self.clearing, 4)
+
+    def _receive(self, n):
+        for i in range(n):
+            intent = PaymentIntent.objects.create(
+                intent_id=f"pi_shard_{i}",
+                payer_address="x",
+                payee_user=self.user,
+                amount_pi=Decimal("1.5"),
+                tenant=self.tenant,
+            )
+            post_pi_received_journal(intent)
+
+    def test_writes_spread_over_buckets_and_read_sums(self):
+        self._receive(12)
+        self.clearing.refresh_from_db()
+        self.assertEqual(self.clearing.balance, Decimal("0"))
+        self.assertEqual(get_account_balance(self.clearing), Decimal("18"))
+        self.assertGreater(LedgerAccountShard.objects.filter(account=self.clearing, balance__gt=0).count(), 1)
+        self.assertEqual(reconcile_sharded_accounts(), [])
+
+    def test_compaction_folds_buckets(self):
+        self._receive(5)
+        moved = compact_account_shards(self.clearing)
+        self.clearing.refresh_from_db()
+        self.assertEqual(moved, Decimal("7.5"))
+        self.assertEqual(self.clearing.balance, Decimal("7.5"))
+        self.assertEqual(get_account_balance(self.clearing), Decimal("7.5"))
+        self.assertFalse(LedgerAccountShard.objects.filter(account=self.clearing).exclude(balance=0).exists())
+
+    def test_reconcile_detects_tampered_bucket(self):
+        self._receive(2)
+        LedgerAccountShard.objects.filter(account=self.clearing, bucket=0).update(balance=Decimal("99"))
+        issues = reconcile_sharded_accounts()
+        self.assertEqual(issues[0]["code"], CODE_CLEARING_PI)
+
+    def test_disable_via_command(self):
+        self._receive(3)
+        out = StringIO()
+        call_command("shard_ledger_account", CODE_CLEARING_PI, "--buckets", "0", stdout=out)
+        self.clearing.refresh_from_db()
+        self.assertEqual(self.clearing.shard_count, 0)
+        self.assertEqual(self.clearing.balance, Decimal("4.5"))
+        self.assertFalse(LedgerAccountShard.objects.filter(account=self.clearing).exists())
+
+    def test_wallet_accounts_cannot_be_sharded(self):
+        acc = LedgerAccount.objects.filter(wallet__isnull=False).first()
+        with self.assertRaises(ValueError):
+            configure_account_sharding(acc, 4)
@@ -0,0 +1,137 @@
+"""Totais por categoria e ativo (balancete / balanço) mantidos a partir dos journals."""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import JournalBatch, JournalLine, LedgerAccount, LedgerCategoryTotal, Tenant, Wallet
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_BRL,
+    CODE_CLEARING_PI,
+    CODE_PLATFORM_FEE_BRL,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.journal_chain import seal_journal_chain
+from app.paypibridge.services.ledger_service import ensure_wallet
+from app.paypibridge.services.ledger_totals_service import (
+    balance_sheet,
+    check_ledger_totals,
+    refresh_ledger_totals,
+    trial_balance,
+)
+
+User = get_user_model()
+
+
+@override_settings(RECONCILE_LAG_SECONDS=0)
+class LedgerTotalsTest(TestCase):
+    def setUp(self):
+        tenant = Tenant.objects.create(name="Tot", slug="tot", api_key="lk_tot_1")
+        wallet = ensure_wallet(tenant, Wallet.ASSET_PI)
+        Wallet.objects.filter(pk=wallet.pk).update(balance=Decimal("5"))
+        wallet.refresh_from_db()
+        self.acc = ensure_wallet_ledger_account(wallet)
+        self._credit("t-1", "10")
+
+    def _credit(self, ref, amount):
+        post_balanced_journal(
+            ref,
+            [
+                {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+                {"account_id": self.acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+            ],
+        )
+
+    def _refresh(self):
+        return refresh_ledger_totals(timezone.now() + timedelta(seconds=1))
+
+    def _row(self, category, asset="PI"):
+        return LedgerCategoryTotal.objects.get(category=category, asset=asset)
+
+    def test_first_refresh_rebuilds_then_adds_only_new_journals(self):
+        self.assertTrue(self._refresh()["rebuilt"])
+        self.assertEqual(self._row(LedgerAccount.CAT_LIABILITY).balance, Decimal("15"))
+        self.assertEqual(self._row(LedgerAccount.CAT_ASSET).balance, Decimal("10"))
+
+        self._credit("t-2", "3")
+        post_balanced_journal(
+            "fee",
+            [
+                {"code": CODE_CLEARING_BRL, "side": JournalLine.SIDE_DEBIT, "amount": Decimal("2")},
+                {"code": CODE_PLATFORM_FEE_BRL, "side": JournalLine.SIDE_CREDIT, "amount": Decimal("2")},
+            ],
+        )
+        result = self._refresh()
+        self.assertEqual((result["rebuilt"], result["groups"]), (False, 4))
+        self.assertEqual(self._row(LedgerAccount.CAT_LIABILITY).balance, Decimal("18"))
+        self.assertEqual(self._row(LedgerAccount.CAT_REVENUE, "BRL").balance, Decimal("2"))
+        self.assertEqual(check_ledger_totals(), [])
+
+    def test_new_account_opening_balance_is_counted(self):
+        self._refresh()
+        tenant = Tenant.objects.create(name="Tot2", slug="tot2", api_key="lk_tot_2")
+        wallet = ensure_wallet(tenant, Wallet.ASSET_PI)
+        Wallet.objects.filter(pk=wallet.pk).update(balance=Decimal("7"))
+        wallet.refresh_from_db()
+        ensure_wallet_ledger_account(wallet)
+        self.assertEqual(self._row(LedgerAccount.CAT_LIABILITY).opening_balance, Decimal("12"))
+        self.assertEqual(check_ledger_totals(), [])
+
+    def test_unrefreshed_journals_are_not_a_mismatch_but_tampering_is(self):
+        self._refresh()
+        self._credit("t-3", "1")
+        self.assertEqual(check_ledger_totals(), [])
+        LedgerAccount.objects.filter(pk=self.acc.pk).update(balance=Decimal("0"))
+        (mismatch,) = check_ledger_totals()
+        self.assertEqual(mismatch["category"], LedgerAccount.CAT_LIABILITY)
+
+    def test_journals_the_seal_missed_are_reported(self):
+        self._refresh()
+        self.assertEqual(check_ledger_totals(), [])
+        JournalBatch.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        (issue,) = check_ledger_totals()
+        self.assertEqual((issue["issue"], issue["count"]), ("unchained_batch", JournalBatch.objects.count()))
+        seal_journal_chain()
+        self.assertEqual(check_ledger_totals(), [])
+
+    def test_views(self):
+        self._refresh()
+        tb = trial_balance()
+        self.assertEqual(tb["totals"]["PI"], {"debit": "10.00000000", "credit": "10.00000000", "balanced": True})
+        sheet = balance_sheet()["assets"]["PI"]
+        # Saldo de abertura da wallet migrada não tem contrapartida em ativo.
+        self.assertEqual(Decimal(sheet["difference"]), Decimal("-5"))
+
+    def test_endpoint_is_admin_only_and_constant_queries(self):
+        self._refresh()
+        client = APIClient()
+        url = reverse("v3-ledger-totals")
+        client.force_authenticate(User.objects.create_user(username="u", email="u@t.com", password="x"))
+        self.assertEqual(client.get(url).status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(username="a", email="a@t.com", password="x", is_staff=True))
+        with CaptureQueriesContext(connection) as before:
+            client.get(url)
+        with CaptureQueriesContext(connection) as checked:
+            client.get(url, {"check": "1"})
+        for i in range(5):
+            self._credit(f"more-{i}", "1")
+        self._refresh()
+        with CaptureQueriesContext(connection) as after:
+            r = client.get(url, {"check": "1"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(after), len(checked))
+        self.assertEqual(set(r.data), {"trial_balance", "balance_sheet", "check"})
+        self.assertTrue(r.data["check"]["ok"])
+        with CaptureQueriesContext(connection) as again:
+            client.get(url)
+        self.assertEqual(len(again), len(before))
+        self.assertEqual(client.get(url, {"view": "x"}).status_code, 400)
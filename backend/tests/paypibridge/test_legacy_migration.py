@@ -0,0 +1,96 @@
+"""Migração do histórico LedgerEntry para journals em partidas dobradas."""
+
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from app.paypibridge.models import (
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    LedgerEntry,
+    LegacyMigrationCheckpoint,
+    PaymentIntent,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.journal_chain import seal_journal_chain, verify_range
+from app.paypibridge.services.ledger_service import apply_ledger_entries_bulk, apply_ledger_entry, ensure_wallet
+from app.paypibridge.services.legacy_migration_service import migrate_legacy_entries, verify_legacy_migration
+from app.paypibridge.services.reconciliation_service import reconcile_ledger
+
+User = get_user_model()
+
+
+def _entry(tenant, asset, amount, entry_type, intent):
+    return {
+        "tenant": tenant,
+        "asset": asset,
+        "amount": Decimal(amount),
+        "entry_type": entry_type,
+        "reference": intent.intent_id,
+        "payment_intent": intent,
+    }
+
+
+@override_settings(LEGACY_MIGRATION_SLEEP_MS=0)
+class LegacyMigrationTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Old", slug="old", api_key="lk_old_1")
+        # Sem a plataforma semeada: a sua conta BRL já existe e o histórico dela não é legado.
+        self.fees = Tenant.objects.create(name="Fees", slug="old-fees", api_key="lk_old_fees")
+        user = User.objects.create_user(username="old", email="o@t.com", password="x")
+        intent = PaymentIntent.objects.create(
+            intent_id="pi_old_1", payer_address="x", payee_user=user, amount_pi=Decimal("10")
+        )
+        apply_ledger_entry(
+            self.tenant, Wallet.ASSET_PI, Decimal("10"), LedgerEntry.ENTRY_CREDIT, "pi_old_1", payment_intent=intent
+        )
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("5"), LedgerEntry.ENTRY_CREDIT, "manual")
+        apply_ledger_entries_bulk(
+            [
+                _entry(self.tenant, Wallet.ASSET_PI, "10", LedgerEntry.ENTRY_DEBIT, intent),
+                _entry(self.fees, Wallet.ASSET_BRL, "1", LedgerEntry.ENTRY_CREDIT, intent),
+                _entry(self.tenant, Wallet.ASSET_BRL, "46.6", LedgerEntry.ENTRY_CREDIT, intent),
+                _entry(self.tenant, Wallet.ASSET_BRL, "46.6", LedgerEntry.ENTRY_DEBIT, intent),
+            ]
+        )
+        apply_ledger_entry(self.tenant, Wallet.ASSET_PI, Decimal("2"), LedgerEntry.ENTRY_DEBIT, "manual2")
+
+    def test_resumable_migration_explains_wallet_balances(self):
+        first = migrate_legacy_entries(chunk_size=2, max_entries=3)
+        self.assertFalse(first["finished"])
+        cp = LegacyMigrationCheckpoint.objects.get()
+        self.assertEqual(cp.journals, 2)
+
+        second = migrate_legacy_entries(chunk_size=2)
+        self.assertTrue(second["finished"])
+        self.assertEqual((second["total_entries"], second["total_journals"]), (7, 4))
+        self.assertEqual(migrate_legacy_entries()["entries"], 0)
+
+        report = verify_legacy_migration()
+        self.assertTrue(report["ok"], report)
+        pi = LedgerAccount.objects.get(wallet=ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        self.assertEqual((pi.balance, pi.opening_balance), (Decimal("3"), Decimal("0")))
+        self.assertTrue(reconcile_ledger()["ok"])
+        seal_journal_chain()
+        report = verify_range()
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["unchained"], 0)
+
+        (settle,) = [jb for jb in JournalBatch.objects.filter(reference="pi_old_1") if len(jb.metadata["legacy_entry_ids"]) == 4]
+        entries = LedgerEntry.objects.filter(pk__in=settle.metadata["legacy_entry_ids"])
+        self.assertEqual(entries.count(), 4)
+        self.assertEqual(settle.created_at, entries.order_by("id").first().created_at)
+        self.assertEqual(
+            set(JournalLine.objects.filter(journal=settle).values_list("created_at", flat=True)), {settle.created_at}
+        )
+
+    def test_command_reports_balances_not_explained_by_history(self):
+        Wallet.objects.filter(tenant=self.tenant, asset=Wallet.ASSET_PI).update(balance=Decimal("4"))
+        with self.assertRaisesMessage(CommandError, "1 account(s) not explained by history"):
+            call_command("migrate_legacy_ledger", "--chunk-size", "3", stdout=StringIO())
+        self.assertIsNotNone(LegacyMigrationCheckpoint.objects.get().finished_at)
@@ -0,0 +1,173 @@
+"""Outbox transacional: webhooks do tenant gravados com a mudança de estado e entregues pelo dispatcher."""
+
+import json
+import threading
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import requests
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from app.paypibridge.models import Consent, OutboxEvent, PaymentIntent, Tenant
+from app.paypibridge.services.ledger_service import credit_pi_for_verified_intent
+from app.paypibridge.services import outbox
+from app.paypibridge.services.outbox import dispatch_outbox, publish
+from app.paypibridge.services.settlement_service import SettlementService
+from app.paypibridge.services.tenant_webhook import EVENT_PAYMENT_INTENT_WEBHOOK, notify_payment_intent_webhook
+
+User = get_user_model()
+
+_POST = "app.paypibridge.services.webhook_dispatcher.WebhookDispatcher._post"
+
+
+def _body(delivery):
+    return json.loads(delivery.body)
+
+
+@override_settings(TENANT_WEBHOOK_RETRIES=0)
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(
+            name="Hook", slug="hook", api_key="lk_hook_1", webhook_url="https://tenant.example/hook"
+        )
+        self.user = User.objects.create_user(username="hook", email="h@t.com", password="x")
+        self.intent = PaymentIntent.objects.create(
+            intent_id="pi_hook_1",
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("10"),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+
+    def test_settlement_writes_event_without_http(self):
+        credit_pi_for_verified_intent(self.intent)
+        consent = Consent.objects.create(user=self.user, provider="mock", scope={}, consent_id="c_hook", status="ACTIVE")
+        pricing = MagicMock()
+        pricing.convert_pi_to_brl.return_value = Decimal("47.60")
+        pix = MagicMock()
+        pix.send.return_value = {"success": True, "txid": "tx-hook", "status": "COMPLETED"}
+
+        with patch(_POST) as post:
+            result = SettlementService(pricing_service=pricing, pix_port=pix).settle(
+                self.intent, consent=consent, cpf="12345678901", pix_key="k@x.com"
+            )
+        self.assertTrue(result.success)
+        post.assert_not_called()
+        event = OutboxEvent.objects.get(aggregate_id="pi_hook_1")
+        self.assertEqual((event.event_type, event.status), (EVENT_PAYMENT_INTENT_WEBHOOK, OutboxEvent.ST_PENDING))
+        self.assertEqual((event.payload["event"], event.payload["status"]), ("payment_settled", "SETTLED"))
+
+    def test_event_rolls_back_with_the_state_change(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            notify_payment_intent_webhook(self.intent)
+            raise RuntimeError("boom")
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_dispatch_delivers_and_retries_with_backoff(self):
+        notify_payment_intent_webhook(self.intent)
+        notify_payment_intent_webhook(self.intent, {"event": "second"})
+
+        with patch(_POST, side_effect=lambda d: 503 if _body(d)["event"] == "second" else 200) as post:
+            self.assertEqual(dispatch_outbox(), {"delivered": 1, "retried": 1, "dead": 0})
+        self.assertEqual({_body(c.args[0])["intent_id"] for c in post.call_args_list}, {"pi_hook_1"})
+        failed = OutboxEvent.objects.get(status=OutboxEvent.ST_PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+
+        with patch(_POST) as post:
+            self.assertEqual(dispatch_outbox(), {"delivered": 0, "retried": 0, "dead": 0})
+            post.assert_not_called()
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_event_goes_dead_after_max_attempts(self):
+        event = notify_payment_intent_webhook(self.intent)
+        with patch(_POST, side_effect=requests.ConnectionError("down")):
+            dispatch_outbox()
+            dispatch_outbox(now=timezone.now() + timedelta(hours=2))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.ST_DEAD, 2))
+
+    def test_handlers_run_outside_the_claim_transaction(self):
+        event = publish("test.probe", {})
+        depth = len(connection.atomic_blocks)
+        seen = {}
+
+        def handler(e):
+            seen["depth"] = len(connection.atomic_blocks)
+            seen["status"] = OutboxEvent.objects.get(pk=e.pk).status
+
+        with patch.dict(outbox._handlers, {"test.probe": handler}):
+            self.assertEqual(dispatch_outbox()["delivered"], 1)
+        # Nenhuma transação aberta pelo dispatcher durante a entrega; o evento estava reclamado (in_flight).
+        self.assertEqual(seen, {"depth": depth, "status": OutboxEvent.ST_IN_FLIGHT})
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.lease_expires_at), (OutboxEvent.ST_DELIVERED, 1, None))
+
+    def test_expired_lease_is_reclaimed_and_stale_result_discarded(self):
+        event = publish("test.probe", {})
+        later = timezone.now() + timedelta(hours=1)
+        calls = []
+
+        def handler(e):
+            calls.append(e.pk)
+            if len(calls) == 1:
+                # Enquanto este dispatcher entrega, a lease expira e outro reclama e entrega o evento.
+                self.assertEqual(dispatch_outbox(now=later)["delivered"], 1)
+                raise RuntimeError("stale worker")
+
+        with patch.dict(outbox._handlers, {"test.probe": handler}):
+            self.assertEqual(dispatch_outbox(), {"delivered": 0, "retried": 0, "dead": 0})
+        self.assertEqual(len(calls), 2)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.last_error), (OutboxEvent.ST_DELIVERED, 2, ""))
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=1)
+    def test_in_flight_event_past_max_attempts_goes_dead(self):
+        event = notify_payment_intent_webhook(self.intent)
+        OutboxEvent.objects.filter(pk=event.pk).update(
+            status=OutboxEvent.ST_IN_FLIGHT, attempts=1, lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        with patch(_POST) as post:
+            self.assertEqual(dispatch_outbox()["dead"], 1)
+            post.assert_not_called()
+        self.assertEqual(OutboxEvent.objects.get(pk=event.pk).status, OutboxEvent.ST_DEAD)
+
+    def test_no_event_without_webhook_url(self):
+        Tenant.objects.filter(pk=self.tenant.pk).update(webhook_url="")
+        self.assertIsNone(notify_payment_intent_webhook(PaymentIntent.objects.get(pk=self.intent.pk)))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "SKIP LOCKED requer Postgres")
+class OutboxSkipLockedTest(TransactionTestCase):
+    def test_locked_events_are_skipped(self):
+        tenant = Tenant.objects.create(name="Hook", slug="hook", api_key="lk_hook_2", webhook_url="https://t.example/h")
+        first = OutboxEvent.objects.create(event_type=EVENT_PAYMENT_INTENT_WEBHOOK, tenant=tenant, payload={})
+        OutboxEvent.objects.create(event_type=EVENT_PAYMENT_INTENT_WEBHOOK, tenant=tenant, payload={})
+
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with transaction.atomic():
+                list(OutboxEvent.objects.select_for_update().filter(pk=first.pk))
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        t = threading.Thread(target=hold_lock)
+        t.start()
+        locked.wait(10)
+        try:
+            with patch(_POST, return_value=200) as post:
+                self.assertEqual(dispatch_outbox()["delivered"], 1)
+            self.assertEqual(post.call_count, 1)
+        finally:
+            release.set()
+            t.join()
+        self.assertEqual(OutboxEvent.objects.get(pk=first.pk).status, OutboxEvent.ST_PENDING)
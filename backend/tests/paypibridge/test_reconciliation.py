@@ -0,0 +1,200 @@
+"""Reconciliação set-based de todo o ledger (chunks de ids, relatório JSON)."""
+
+import json
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app.paypibridge.models import (
+    ExpectedAccountBalance,
+    JournalBatch,
+    JournalLine,
+    LedgerAccount,
+    ReconciliationCursor,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.ledger_service import ensure_wallet
+from app.paypibridge.services.reconciliation_service import (
+    deep_scan,
+    reconcile_incremental,
+    reconcile_ledger,
+)
+
+
+def _credit(acc, ref, amount="2"):
+    return post_balanced_journal(
+        ref,
+        [
+            {"code": CODE_CLEARING_PI, "side": JournalLine.SIDE_DEBIT, "amount": Decimal(amount)},
+            {"account_id": acc.id, "side": JournalLine.SIDE_CREDIT, "amount": Decimal(amount)},
+        ],
+    )
+
+
+def _seed(n_journals=6):
+    tenant = Tenant.objects.create(name="Rec", slug="rec", api_key="lk_rec_1")
+    wallet = ensure_wallet(tenant, Wallet.ASSET_PI)
+    wallet.balance = Decimal("5")
+    wallet.save(update_fields=["balance"])
+    acc = ensure_wallet_ledger_account(wallet)
+    for i in range(n_journals):
+        _credit(acc, f"rec-{i}")
+    return wallet, acc
+
+
+class ReconcileLedgerTest(TestCase):
+    def setUp(self):
+        self.wallet, self.acc = _seed()
+
+    def test_clean_ledger_with_opening_balance(self):
+        report = reconcile_ledger(chunk_size=4)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["chunks"], 2)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.opening_balance, Decimal("5"))
+        self.assertEqual(self.acc.balance, Decimal("17"))
+
+    def test_detects_each_kind_of_issue(self):
+        jb = JournalBatch.objects.filter(reference="rec-3").get()
+        JournalLine.objects.filter(journal=jb, side=JournalLine.SIDE_DEBIT).update(amount=Decimal("3"))
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal("1"))
+        orphan = ensure_wallet(self.wallet.tenant, Wallet.ASSET_BRL)
+
+        report = reconcile_ledger(chunk_size=2)
+        self.assertFalse(report["ok"])
+        (imbalance,) = report["imbalanced_journals"]
+        self.assertEqual(imbalance["journal_id"], jb.id)
+        self.assertEqual((Decimal(imbalance["debit"]), Decimal(imbalance["credit"])), (Decimal("3"), Decimal("2")))
+        issues = {(i["wallet_id"], i["issue"]) for i in report["wallet_account_mismatches"]}
+        self.assertEqual(issues, {(self.wallet.id, "balance_mismatch"), (orphan.id, "missing_ledger_account")})
+        (mismatch,) = report["account_mismatches"]
+        self.assertEqual(mismatch["code"], CODE_CLEARING_PI)
+        json.dumps(report)
+
+    def test_tampered_account_balance(self):
+        LedgerAccount.objects.filter(pk=self.acc.pk).update(balance=Decimal("100"))
+        report = reconcile_ledger()
+        (mismatch,) = report["account_mismatches"]
+        self.assertEqual((mismatch["account_id"], Decimal(mismatch["lines_balance"])), (self.acc.id, Decimal("17")))
+
+    def test_queries_do_not_grow_with_journals(self):
+        with CaptureQueriesContext(connection) as few:
+            reconcile_ledger(chunk_size=1000)
+        for i in range(30):
+            _credit(self.acc, f"more-{i}", "1")
+        with CaptureQueriesContext(connection) as many:
+            report = reconcile_ledger(chunk_size=1000)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(len(many), len(few))
+
+    def test_command_json_report(self):
+        out = StringIO()
+        call_command("reconcile_double_entry", "--json", "--chunk-size", "3", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertTrue(report["ok"])
+        self.assertEqual(report["chunks"], 2)
+
+
+@override_settings(RECONCILE_LAG_SECONDS=0)
+class IncrementalReconciliationTest(TestCase):
+    def setUp(self):
+        self.wallet, self.acc = _seed()
+
+    def _later(self):
+        return timezone.now() + timedelta(seconds=1)
+
+    def _expected(self, acc):
+        return ExpectedAccountBalance.objects.get(account=acc).balance
+
+    def test_first_run_anchors_then_only_new_journals(self):
+        first = reconcile_incremental(self._later())
+        self.assertTrue(first["anchored"])
+        cursor = ReconciliationCursor.objects.get()
+        self.assertEqual(cursor.last_journal_id, JournalBatch.objects.latest("id").id)
+        self.assertEqual(self._expected(self.acc), Decimal("17"))
+
+        for i in range(3):
+            _credit(self.acc, f"new-{i}")
+        result = reconcile_incremental(self._later())
+        self.assertEqual(result["from_journal_id"], cursor.last_journal_id)
+        self.assertEqual(result["last_journal_id"], JournalBatch.objects.latest("id").id)
+        self.assertEqual(result["drift"], [])
+        self.assertEqual(self._expected(self.acc), Decimal("23"))
+        self.assertEqual(
+            ReconciliationCursor.objects.get().last_line_id, JournalLine.objects.latest("id").id
+        )
+
+    def test_drift_is_alerted(self):
+        reconcile_incremental(self._later())
+        LedgerAccount.objects.filter(pk=self.acc.pk).update(balance=Decimal("20"))
+        with self.assertLogs("app.paypibridge.services.reconciliation_service", "ERROR") as logs:
+            result = reconcile_incremental(self._later())
+        (drift,) = result["drift"]
+        self.assertEqual((drift["account_id"], Decimal(drift["drift"])), (self.acc.id, Decimal("3")))
+        self.assertIn("ledger_balance_drift", logs.output[0])
+        self.assertEqual(ExpectedAccountBalance.objects.get(account=self.acc).drift, Decimal("3"))
+
+    @override_settings(RECONCILE_LAG_SECONDS=3600)
+    def test_recent_journals_wait_for_lag_without_false_drift(self):
+        reconcile_incremental(self._later() + timedelta(hours=2))
+        cursor = ReconciliationCursor.objects.get()
+        _credit(self.acc, "fresh")
+        result = reconcile_incremental()
+        self.assertEqual(result["last_journal_id"], cursor.last_journal_id)
+        self.assertEqual(result["drift"], [])
+
+    @override_settings(RECONCILE_CHUNK_SIZE=2)
+    def test_run_is_capped_and_new_accounts_start_at_opening(self):
+        reconcile_incremental(self._later())
+        tenant = Tenant.objects.create(name="Rec2", slug="rec2", api_key="lk_rec_2")
+        wallet = ensure_wallet(tenant, Wallet.ASSET_PI)
+        Wallet.objects.filter(pk=wallet.pk).update(balance=Decimal("4"))
+        wallet.refresh_from_db()
+        acc2 = ensure_wallet_ledger_account(wallet)
+        for i in range(3):
+            _credit(acc2, f"acc2-{i}", "1")
+        first = reconcile_incremental(self._later())
+        self.assertEqual(first["last_journal_id"] - first["from_journal_id"], 2)
+        self.assertEqual(self._expected(acc2), Decimal("6"))
+        second = reconcile_incremental(self._later())
+        self.assertEqual(self._expected(acc2), Decimal("7"))
+        self.assertEqual(second["drift"], [])
+
+    def test_deep_scan_reanchors(self):
+        reconcile_incremental(self._later())
+        ExpectedAccountBalance.objects.filter(account=self.acc).update(balance=Decimal("0"))
+        self.assertTrue(reconcile_incremental(self._later())["drift"])
+        ReconciliationCursor.objects.update(last_journal_id=0)
+        result = deep_scan()
+        self.assertTrue(result["ok"])
+        self.assertEqual(self._expected(self.acc), Decimal("17"))
+        self.assertEqual(ReconciliationCursor.objects.get().last_journal_id, JournalBatch.objects.latest("id").id)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "pool de processos com snapshot exportado requer Postgres")
+class ReconcileLedgerPoolTest(TransactionTestCase):
+    def test_pool_matches_single_process(self):
+        for code, cat in ((CODE_CLEARING_PI, LedgerAccount.CAT_ASSET),):
+            LedgerAccount.objects.get_or_create(
+                code=code, defaults={"name": code, "asset": "PI", "account_type": "clearing", "category": cat}
+            )
+        _, acc = _seed(20)
+        LedgerAccount.objects.filter(pk=acc.pk).update(balance=Decimal("1"))
+        single = reconcile_ledger(workers=1, chunk_size=3)
+        pooled = reconcile_ledger(workers=3, chunk_size=3)
+        for key in ("ok", "chunks", "wallet_account_mismatches", "imbalanced_journals", "account_mismatches"):
+            self.assertEqual(single[key], pooled[key])
+        self.assertFalse(pooled["ok"])
@@ -0,0 +1,215 @@
+"""Liquidação líquida em lote: um Pix por beneficiário por janela, lançamentos por intent."""
+
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import (
+    BalanceHold,
+    Consent,
+    FeeConfig,
+    JournalBatch,
+    PaymentIntent,
+    Settlement,
+    SettlementBatch,
+    Tenant,
+    Wallet,
+)
+from app.paypibridge.services.config_cache import clear_config_cache
+from app.paypibridge.services.ledger_service import credit_pi_for_verified_intent, ensure_wallet, release_expired_holds
+from app.paypibridge.services.settlement_batch_service import (
+    enqueue_for_batch,
+    flush_batch,
+    flush_due_batches,
+    sweep_stale_batches,
+)
+from app.paypibridge.services.settlement_service import SettlementService
+
+User = get_user_model()
+
+
+class SettlementBatchTest(TestCase):
+    def setUp(self):
+        clear_config_cache()
+        FeeConfig.objects.create(label="batch", percentage=Decimal("0.02"), is_active=True)
+        self.tenant = Tenant.objects.create(name="Batch", slug="batch", api_key="lk_batch_1")
+        self.user = User.objects.create_user(username="batch", email="b@t.com", password="x")
+        self.consent = Consent.objects.create(
+            user=self.user, provider="mock", scope={}, consent_id="c_batch", status="ACTIVE"
+        )
+        self.intents = [self._intent(f"pi_batch_{i}", amount) for i, amount in enumerate(("1", "2.5", "3"))]
+        self.pricing = MagicMock()
+        self.pricing.get_rate.return_value = Decimal("4.76")
+        self.pix = MagicMock()
+        self.pix.send.return_value = {"success": True, "txid": "tx-batch", "status": "COMPLETED"}
+
+    def tearDown(self):
+        clear_config_cache()
+
+    def _intent(self, intent_id, amount):
+        intent = PaymentIntent.objects.create(
+            intent_id=intent_id,
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal(amount),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+        credit_pi_for_verified_intent(intent)
+        return intent
+
+    def _enqueue_all(self):
+        results = [
+            enqueue_for_batch(i, consent=self.consent, cpf="12345678901", pix_key="k@x.com") for i in self.intents
+        ]
+        self.assertTrue(all(r.success for r in results))
+        self.assertEqual(len({r.batch_id for r in results}), 1)
+        return results[0].batch_id
+
+    def _flush(self, batch_id):
+        return flush_batch(batch_id, pricing_service=self.pricing, pix_port=self.pix)
+
+    def test_one_pix_one_rate_per_batch_and_ledger_per_intent(self):
+        batch_id = self._enqueue_all()
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).available, Decimal("0"))
+
+        result = self._flush(batch_id)
+        self.assertEqual(result["settled"], 3)
+        self.pix.send.assert_called_once()
+        self.pricing.get_rate.assert_called_once()
+
+        # 6.5 PI a 4.76: líquidos 4.66 + 11.66 + 13.99 (taxa de 2% arredondada por intent)
+        self.assertEqual(self.pix.send.call_args.kwargs["amount_brl"], Decimal("30.31"))
+        batch = SettlementBatch.objects.get(pk=batch_id)
+        self.assertEqual(
+            (batch.status, batch.net_brl, batch.fx_rate), (SettlementBatch.ST_SETTLED, Decimal("30.31"), Decimal("4.76"))
+        )
+        settlement = Settlement.objects.get(batch=batch)
+        self.assertIsNone(settlement.payment_intent_id)
+        self.assertEqual(set(batch.intents.values_list("status", "settlement_pix_txid")), {("SETTLED", "tx-batch")})
+
+        for intent in self.intents:
+            self.assertTrue(JournalBatch.objects.filter(reference=f"settle_pi:{intent.intent_id}").exists())
+        self.assertFalse(BalanceHold.objects.exclude(status=BalanceHold.ST_CAPTURED).exists())
+        w = ensure_wallet(self.tenant, Wallet.ASSET_PI)
+        self.assertEqual((w.balance, w.held), (Decimal("0"), Decimal("0")))
+
+    def test_intents_that_stopped_being_settleable_leave_the_batch(self):
+        batch_id = self._enqueue_all()
+        PaymentIntent.objects.filter(pk=self.intents[1].pk).update(status="CANCELLED")
+
+        result = self._flush(batch_id)
+        self.assertEqual((result["settled"], result["dropped"]), (2, 1))
+        self.assertEqual(self.pix.send.call_args.kwargs["amount_brl"], Decimal("18.65"))
+        cancelled = PaymentIntent.objects.get(pk=self.intents[1].pk)
+        self.assertIsNone(cancelled.settlement_batch_id)
+        self.assertEqual(BalanceHold.objects.get(payment_intent=cancelled).status, BalanceHold.ST_RELEASED)
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).balance, Decimal("2.5"))
+
+    def test_pix_failure_fails_batch_and_releases_every_hold(self):
+        batch_id = self._enqueue_all()
+        self.pix.send.return_value = {"success": False, "error": "pix_rejected"}
+
+        result = self._flush(batch_id)
+        self.assertEqual((result["status"], result["error"]), (SettlementBatch.ST_FAILED, "pix_rejected"))
+        statuses = PaymentIntent.objects.filter(tenant=self.tenant).values_list("settlement_status", flat=True)
+        self.assertEqual(set(statuses), {"SETTLEMENT_FAILED"})
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("0"))
+
+        # Podem voltar a entrar num lote novo.
+        self.intents = list(PaymentIntent.objects.filter(tenant=self.tenant).order_by("id"))
+        self.assertNotEqual(self._enqueue_all(), batch_id)
+
+    def test_window_controls_flush(self):
+        batch_id = self._enqueue_all()
+        self.assertEqual(flush_due_batches(), [])
+        SettlementBatch.objects.filter(pk=batch_id).update(window_ends_at=timezone.now() - timedelta(seconds=1))
+        with patch("app.paypibridge.services.settlement_batch_service.get_pricing_service", return_value=self.pricing), patch(
+            "app.paypibridge.services.settlement_batch_service.SettlementPixPort", return_value=self.pix
+        ):
+            (result,) = flush_due_batches()
+        self.assertEqual((result["batch_id"], result["settled"]), (batch_id, 3))
+        self.assertEqual(self._flush(batch_id)["status"], "skipped")
+
+    def test_error_before_pix_fails_batch_and_frees_members(self):
+        batch_id = self._enqueue_all()
+        self.pricing.get_rate.side_effect = ConnectionError("fx down")
+
+        result = self._flush(batch_id)
+        self.assertEqual(result["status"], SettlementBatch.ST_FAILED)
+        self.assertIn("ConnectionError", result["error"])
+        self.pix.send.assert_not_called()
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("0"))
+        self.intents = list(PaymentIntent.objects.filter(tenant=self.tenant).order_by("id"))
+        self.assertNotEqual(self._enqueue_all(), batch_id)
+
+    def test_stale_processing_batch_without_pix_is_failed(self):
+        batch_id = self._enqueue_all()
+        SettlementBatch.objects.filter(pk=batch_id).update(status=SettlementBatch.ST_PROCESSING)  # worker morto
+
+        self.assertEqual(sweep_stale_batches(), {"failed": [], "unknown": []})
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(sweep_stale_batches(later), {"failed": [batch_id], "unknown": []})
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("0"))
+        self.intents = list(PaymentIntent.objects.filter(tenant=self.tenant).order_by("id"))
+        self.assertNotEqual(self._enqueue_all(), batch_id)
+
+    def test_stale_batch_after_pix_is_unknown_and_never_paid_again(self):
+        batch_id = self._enqueue_all()
+        self.pix.send.side_effect = RuntimeError("worker killed")
+        with self.assertRaises(RuntimeError):
+            self._flush(batch_id)
+        self.assertEqual(SettlementBatch.objects.get(pk=batch_id).status, SettlementBatch.ST_PROCESSING)
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(sweep_stale_batches(later), {"failed": [], "unknown": [batch_id]})
+        statuses = PaymentIntent.objects.filter(tenant=self.tenant).values_list("settlement_status", flat=True)
+        self.assertEqual(set(statuses), {"SETTLEMENT_UNKNOWN"})
+        self.assertEqual(release_expired_holds(later + timedelta(days=1)), 0)
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("6.5"))
+
+        intent = PaymentIntent.objects.get(pk=self.intents[0].pk)
+        again = enqueue_for_batch(intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com")
+        self.assertEqual((again.success, again.error), (False, "settlement_unknown"))
+        self.pix.send.side_effect = None
+        result = SettlementService(pricing_service=MagicMock(), pix_port=self.pix).settle(
+            intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com"
+        )
+        self.assertEqual(result.error, "settlement_unknown")
+        self.assertEqual(self.pix.send.call_count, 1)
+
+    def test_one_failing_batch_does_not_block_the_others(self):
+        first = self._enqueue_all()
+        other = self._intent("pi_batch_other", "1")
+        second = enqueue_for_batch(other, consent=self.consent, cpf="12345678901", pix_key="other@x.com").batch_id
+        SettlementBatch.objects.update(window_ends_at=timezone.now() - timedelta(seconds=1))
+        self.pix.send.side_effect = [RuntimeError("psp crashed"), {"success": True, "txid": "tx-2", "status": "COMPLETED"}]
+
+        with patch("app.paypibridge.services.settlement_batch_service.get_pricing_service", return_value=self.pricing), patch(
+            "app.paypibridge.services.settlement_batch_service.SettlementPixPort", return_value=self.pix
+        ):
+            results = flush_due_batches()
+        self.assertEqual([(r["batch_id"], r["status"]) for r in results], [(first, "error"), (second, "settled")])
+
+    @override_settings(SETTLEMENT_BATCHING=True, SETTLEMENT_BATCH_MAX_PI="6")
+    def test_execute_endpoint_batches_and_flushes_at_threshold(self):
+        client = APIClient()
+        with patch("app.paypibridge.services.settlement_batch_service.get_pricing_service", return_value=self.pricing), patch(
+            "app.paypibridge.services.settlement_batch_service.SettlementPixPort", return_value=self.pix
+        ):
+            for intent in self.intents:
+                with self.captureOnCommitCallbacks(execute=True):
+                    r = client.post(
+                        reverse("settlement-execute"),
+                        {"intent_id": intent.intent_id, "cpf": "12345678901", "pix_key": "k@x.com"},
+                        format="json",
+                    )
+                self.assertEqual(r.status_code, 202, r.data)
+        self.pix.send.assert_called_once()
+        self.assertEqual(SettlementBatch.objects.get(pk=r.data["batch_id"]).status, SettlementBatch.ST_SETTLED)
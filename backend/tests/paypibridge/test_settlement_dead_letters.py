@@ -0,0 +1,181 @@
+"""Dead letters de liquidação: registo com CPF selado, listagem por keyset e replay em massa."""
+
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import Consent, PaymentIntent, PixTransaction, SettlementDeadLetter, SettlementJob, Tenant
+from app.paypibridge.services.settlement_dead_letter import (
+    filter_dead_letters,
+    list_dead_letters,
+    mask_cpf,
+    replay_dead_letters,
+    seal_cpf,
+    unseal_cpf,
+)
+from app.paypibridge.services.settlement_service import mark_settlement_dead_letter
+from app.paypibridge.tasks import process_settlement_execute
+
+User = get_user_model()
+
+CPF = "12345678901"
+
+
+class SettlementDeadLetterTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="DLQ", slug="dlq", api_key="lk_dlq_1")
+        self.other = Tenant.objects.create(name="Other", slug="dlq-other", api_key="lk_dlq_2")
+        self.user = User.objects.create_user(username="dlq", email="d@t.com", password="x")
+        self.consent = Consent.objects.create(user=self.user, provider="mock", scope={}, consent_id="c_dlq", status="ACTIVE")
+        self.n = 0
+
+    def _intent(self, tenant=None):
+        self.n += 1
+        return PaymentIntent.objects.create(
+            intent_id=f"pi_dlq_{self.n}",
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("1"),
+            verified_at=timezone.now(),
+            tenant=tenant or self.tenant,
+        )
+
+    def _dead(self, exc=None, tenant=None):
+        intent = self._intent(tenant)
+        return mark_settlement_dead_letter(
+            intent.intent_id,
+            exc or ConnectionError("psp down"),
+            source=SettlementDeadLetter.SOURCE_TASK,
+            attempts=4,
+            consent_id=self.consent.pk,
+            cpf=CPF,
+            pix_key="k@x.com",
+        )
+
+    def test_cpf_is_sealed_not_stored(self):
+        sealed = seal_cpf(CPF)
+        self.assertNotIn(CPF, sealed)
+        self.assertEqual(unseal_cpf(sealed), CPF)
+        self.assertEqual(mask_cpf("123.456.789-01"), "***.456.789-**")
+
+    def test_task_exhaustion_records_row(self):
+        intent = self._intent()
+        with patch("app.paypibridge.tasks.execute_settlement", side_effect=TimeoutError("pix timeout")):
+            result = process_settlement_execute.apply(
+                args=[intent.intent_id, self.consent.pk, CPF, "k@x.com"], retries=3
+            ).get()
+        self.assertEqual(result["status"], "dead_letter")
+
+        dead = SettlementDeadLetter.objects.get(payment_intent=intent)
+        self.assertEqual((dead.source, dead.error_class, dead.attempts), ("task", "TimeoutError", 4))
+        self.assertEqual(dead.task_args, {"consent_id": self.consent.pk, "pix_key": "k@x.com", "description": ""})
+        self.assertEqual(dead.cpf_masked, "***.456.789-**")
+        row = SettlementDeadLetter.objects.filter(pk=dead.pk).values()[0]
+        self.assertNotIn(CPF, json.dumps(row, default=str))
+        intent.refresh_from_db()
+        self.assertEqual(intent.settlement_status, "SETTLEMENT_FAILED")
+        self.assertTrue(intent.metadata["settlement_dead_letter"])
+
+    def test_keyset_pages_cover_all_rows_once(self):
+        ids = sorted((self._dead().pk for _ in range(7)), reverse=True)
+        seen, after = [], None
+        while True:
+            page = list_dead_letters(filter_dead_letters(), after=after, limit=3)
+            seen += [r["id"] for r in page["results"]]
+            if page["next_after"] is None:
+                break
+            after = page["next_after"]
+        self.assertEqual(seen, ids)
+
+    def test_api_lists_with_filters(self):
+        self._dead(TimeoutError("t"))
+        wanted = self._dead(ConnectionError("c"), tenant=self.other)
+        client = APIClient()
+        url = reverse("v3-settlement-dead-letters")
+        self.assertEqual(client.get(url).status_code, 401)
+
+        client.force_authenticate(User.objects.create_user(username="ops", password="x", is_staff=True))
+        r = client.get(url, {"error_class": "ConnectionError", "tenant": self.other.pk})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([row["id"] for row in r.data["results"]], [wanted.pk])
+        self.assertEqual(r.data["results"][0]["cpf_masked"], "***.456.789-**")
+        self.assertNotIn("cpf_sealed", r.data["results"][0])
+        self.assertEqual(client.get(url, {"status": "nope"}).status_code, 400)
+
+    def test_replay_filtered_subset_at_rate(self):
+        timeouts = [self._dead(TimeoutError("t")) for _ in range(3)]
+        other = self._dead(ValueError("bad key"))
+        settled = self._dead(TimeoutError("t"))
+        PaymentIntent.objects.filter(pk=settled.payment_intent_id).update(status="SETTLED")
+        sleeps = []
+
+        with patch("app.paypibridge.tasks.process_settlement_execute.delay") as delay, self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            result = replay_dead_letters(filter_dead_letters(error_class="TimeoutError"), rate=4, sleep=sleeps.append)
+
+        self.assertEqual(result["counts"], {"replayed": 3, "already_settled": 1})
+        self.assertEqual(sleeps, [0.25] * 3)
+        self.assertEqual(
+            [c.args for c in delay.call_args_list],
+            [(d.payment_intent.intent_id, self.consent.pk, CPF, "k@x.com", "") for d in timeouts],
+        )
+        statuses = dict(SettlementDeadLetter.objects.values_list("pk", "status"))
+        self.assertEqual({statuses[d.pk] for d in timeouts}, {SettlementDeadLetter.ST_REPLAYED})
+        self.assertEqual(statuses[other.pk], SettlementDeadLetter.ST_PENDING)
+        self.assertEqual(statuses[settled.pk], SettlementDeadLetter.ST_DISCARDED)
+
+        # Já reenviadas não voltam a sair.
+        self.assertEqual(replay_dead_letters(filter_dead_letters(error_class="TimeoutError"))["matched"], 0)
+
+    def test_replay_refuses_possible_second_payout(self):
+        unknown = self._dead()
+        PaymentIntent.objects.filter(pk=unknown.payment_intent_id).update(
+            settlement_status="SETTLEMENT_UNKNOWN", settlement_pix_sending_at=timezone.now()
+        )
+        legacy = self._dead()
+        legacy_intent = legacy.payment_intent
+        legacy_intent.metadata = {"settlement_lease_expired": {"owner": "w1", "at": "2026-01-01T00:00:00+00:00"}}
+        legacy_intent.save(update_fields=["metadata"])
+        paid = self._dead()
+        PixTransaction.objects.create(intent=paid.payment_intent, tx_id="tx-paid", status="COMPLETED", payload={})
+        swept_before_send = self._dead()
+        intent = swept_before_send.payment_intent
+        intent.metadata = {"settlement_lease_expired": {"owner": "w2", "at": "2026-01-01T00:00:00+00:00", "pix_possibly_sent": False}}
+        intent.save(update_fields=["metadata"])
+
+        with patch("app.paypibridge.tasks.process_settlement_execute.delay") as delay, self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            result = replay_dead_letters(filter_dead_letters(), rate=0)
+
+        self.assertEqual(result["counts"], {"pix_possibly_sent": 2, "pix_exists": 1, "replayed": 1})
+        self.assertEqual([c.args[0] for c in delay.call_args_list], [intent.intent_id])
+        statuses = dict(SettlementDeadLetter.objects.values_list("pk", "status"))
+        self.assertEqual(
+            [statuses[d.pk] for d in (unknown, legacy, paid)], [SettlementDeadLetter.ST_DISCARDED] * 3
+        )
+
+    @override_settings(SETTLEMENT_PARTITIONS=2)
+    def test_replay_uses_scheduler_when_partitioned(self):
+        dead = self._dead()
+        with patch("app.paypibridge.services.settlement_scheduler._kick"):
+            [result] = replay_dead_letters(filter_dead_letters(), rate=0)["results"]
+        job = SettlementJob.objects.get(pk=result["job_id"])
+        self.assertEqual((job.payment_intent_id, job.args["cpf"]), (dead.payment_intent_id, CPF))
+
+    def test_command_dry_run(self):
+        dead = self._dead()
+        out = StringIO()
+        call_command("replay_settlement_dead_letters", "--dry-run", "--source", "task", "--since", "2000-01-01", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["ids"], [dead.pk])
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, SettlementDeadLetter.ST_PENDING)
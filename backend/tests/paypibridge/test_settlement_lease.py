@@ -0,0 +1,234 @@
+"""Lease de liquidação: claim atómico antes do Pix, sweeper de leases expiradas e tasks duplicadas."""
+
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from app.paypibridge.models import Consent, PaymentIntent, PixTransaction, Tenant, Wallet
+from app.paypibridge.services.ledger_service import credit_pi_for_verified_intent, ensure_wallet, release_expired_holds
+from app.paypibridge.services.settlement_pix_port import SettlementPixPort
+from app.paypibridge.services.settlement_service import (
+    ST_PROCESSING,
+    ST_UNKNOWN,
+    SettlementService,
+    claim_settlement,
+    execute_settlement,
+    mark_settlement_dead_letter,
+    sweep_expired_settlement_leases,
+)
+
+User = get_user_model()
+
+
+def _pricing():
+    pricing = MagicMock()
+    pricing.convert_pi_to_brl.return_value = Decimal("47.60")
+    return pricing
+
+
+class SettlementLeaseTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Lease", slug="lease", api_key="lk_lease_1")
+        self.user = User.objects.create_user(username="lease", email="l@t.com", password="x")
+        self.consent = Consent.objects.create(user=self.user, provider="mock", scope={}, consent_id="c_lease", status="ACTIVE")
+        self.intent = PaymentIntent.objects.create(
+            intent_id="pi_lease_1",
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("10"),
+            verified_at=timezone.now(),
+            tenant=self.tenant,
+        )
+        credit_pi_for_verified_intent(self.intent)
+        self.pix = MagicMock()
+        self.pix.send.return_value = {"success": True, "txid": "tx-lease", "status": "COMPLETED"}
+
+    def _settle(self, intent=None):
+        return SettlementService(pricing_service=_pricing(), pix_port=self.pix).settle(
+            intent or PaymentIntent.objects.get(pk=self.intent.pk),
+            consent=self.consent,
+            cpf="12345678901",
+            pix_key="k@x.com",
+        )
+
+    def test_only_one_claim_wins_until_the_lease_expires(self):
+        self.assertTrue(claim_settlement(self.intent, "w1"))
+        self.assertFalse(claim_settlement(self.intent, "w2"))
+        self.intent.refresh_from_db()
+        self.assertEqual((self.intent.settlement_status, self.intent.settlement_lease_owner), (ST_PROCESSING, "w1"))
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertTrue(claim_settlement(self.intent, "w2", now=later))
+
+    def test_duplicate_delivery_does_not_send_pix(self):
+        claim_settlement(PaymentIntent.objects.get(pk=self.intent.pk), "other-worker")
+        result = self._settle()
+        self.assertEqual((result.success, result.error), (False, "settlement_in_progress"))
+        self.pix.send.assert_not_called()
+
+    def test_stale_copy_of_settled_intent_is_rejected(self):
+        stale = PaymentIntent.objects.get(pk=self.intent.pk)
+        self.assertTrue(self._settle().success)
+        result = self._settle(stale)
+        self.assertEqual((result.success, result.error), (False, "already_settled"))
+        self.assertEqual(self.pix.send.call_count, 1)
+
+        self.intent.refresh_from_db()
+        self.assertEqual((self.intent.settlement_lease_owner, self.intent.settlement_lease_expires_at), ("", None))
+
+    def test_failures_close_the_lease(self):
+        self.pix.send.return_value = {"success": False, "error": "pix_rejected"}
+        self.assertEqual(self._settle().error, "pix_rejected")
+        self.intent.refresh_from_db()
+        self.assertEqual((self.intent.settlement_status, self.intent.settlement_lease_owner), ("SETTLEMENT_FAILED", ""))
+
+        pricing = _pricing()
+        pricing.convert_pi_to_brl.return_value = None
+        result = SettlementService(pricing_service=pricing, pix_port=self.pix).settle(
+            self.intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com"
+        )
+        self.assertEqual(result.error, "fx_unavailable")
+        self.intent.refresh_from_db()
+        # Antes do Pix a lease volta ao estado anterior.
+        self.assertEqual((self.intent.settlement_status, self.intent.settlement_lease_owner), ("SETTLEMENT_FAILED", ""))
+
+    def test_sweeper_recovers_worker_that_died_before_the_pix(self):
+        self.assertTrue(claim_settlement(PaymentIntent.objects.get(pk=self.intent.pk), "dead-worker"))
+
+        self.assertEqual(sweep_expired_settlement_leases(), [])
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(sweep_expired_settlement_leases(later), ["pi_lease_1"])
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.settlement_status, "SETTLEMENT_FAILED")
+        self.assertFalse(self.intent.metadata["settlement_lease_expired"]["pix_possibly_sent"])
+
+        self.assertTrue(self._settle().success)
+        self.assertEqual(self.pix.send.call_count, 1)
+
+    def test_lease_expired_after_send_is_never_paid_twice(self):
+        def crash(**kwargs):
+            raise RuntimeError("worker killed")
+
+        self.pix.send.side_effect = crash
+        with self.assertRaises(RuntimeError):
+            self._settle()
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.settlement_status, ST_PROCESSING)
+        self.assertIsNotNone(self.intent.settlement_pix_sending_at)
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(sweep_expired_settlement_leases(later), ["pi_lease_1"])
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.settlement_status, ST_UNKNOWN)
+        self.assertTrue(self.intent.metadata["settlement_lease_expired"]["pix_possibly_sent"])
+        # A reserva fica (nem o sweeper de reservas expiradas a liberta).
+        self.assertEqual(release_expired_holds(later + timedelta(days=1)), 0)
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("10"))
+
+        self.pix.send.side_effect = None
+        self.assertEqual(self._settle().error, "settlement_unknown")
+        self.assertFalse(claim_settlement(self.intent, "w3", now=later + timedelta(hours=1)))
+        self.assertEqual(self.pix.send.call_count, 1)
+
+    def test_lease_swept_while_pix_in_flight_is_not_recorded(self):
+        def slow_send(**kwargs):
+            sweep_expired_settlement_leases(timezone.now() + timedelta(hours=1))
+            return {"success": True, "txid": "tx-late", "status": "COMPLETED"}
+
+        self.pix.send.side_effect = slow_send
+        result = self._settle()
+        self.assertEqual((result.success, result.error, result.pix_txid), (False, "settlement_lease_lost", "tx-late"))
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.settlement_status, ST_UNKNOWN)
+        self.assertEqual(self.intent.metadata["settlement_lease_lost"]["pix_txid"], "tx-late")
+        self.assertFalse(PixTransaction.objects.exists())
+        self.assertEqual(self.pix.send.call_count, 1)
+
+    def test_expired_lease_is_not_sent(self):
+        with patch(
+            "app.paypibridge.services.settlement_service._lease_seconds", return_value=-1
+        ):
+            result = self._settle()
+        self.assertEqual(result.error, "settlement_lease_lost")
+        self.pix.send.assert_not_called()
+        self.assertEqual(ensure_wallet(self.tenant, Wallet.ASSET_PI).held, Decimal("0"))
+
+    def test_dead_letter_does_not_reopen_a_possibly_sent_settlement(self):
+        self.pix.send.side_effect = RuntimeError("worker killed")
+        with self.assertRaises(RuntimeError):
+            self._settle()
+        mark_settlement_dead_letter(self.intent.intent_id, RuntimeError("worker killed"), source="task", attempts=4)
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.settlement_status, ST_PROCESSING)
+        self.assertFalse(claim_settlement(self.intent, "w2", now=timezone.now() + timedelta(hours=1)))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "tasks concorrentes requerem Postgres")
+class DuplicateSettlementTaskStressTest(TransactionTestCase):
+    """Várias entregas da mesma task em paralelo contra o Pix mock: um Pix por intent."""
+
+    INTENTS = 20
+    DUPLICATES = 6
+
+    def test_concurrent_duplicates_send_one_pix_each(self):
+        Tenant.objects.get_or_create(
+            slug="platform", defaults={"name": "Platform", "api_key": "ppb_platform_lease", "is_platform": True}
+        )
+        tenant = Tenant.objects.create(name="Dup", slug="dup", api_key="lk_dup_1")
+        user = User.objects.create_user(username="dup", email="d@t.com", password="x")
+        consent = Consent.objects.create(user=user, provider="mock", scope={}, consent_id="c_dup", status="ACTIVE")
+        intents = []
+        for n in range(self.INTENTS):
+            intent = PaymentIntent.objects.create(
+                intent_id=f"pi_dup_{n}",
+                payer_address="x",
+                payee_user=user,
+                amount_pi=Decimal("1"),
+                verified_at=timezone.now(),
+                tenant=tenant,
+            )
+            credit_pi_for_verified_intent(intent)
+            intents.append(intent.intent_id)
+
+        sent = []
+        send = SettlementPixPort.send
+
+        def counting_send(port, **kwargs):
+            time.sleep(0.01)  # latência do PSP: alarga a janela de corrida
+            out = send(port, **kwargs)
+            sent.append(out["txid"])
+            return out
+
+        results = []
+        start = threading.Barrier(self.INTENTS * self.DUPLICATES)
+
+        def worker(intent_id):
+            try:
+                start.wait(10)
+                results.append(execute_settlement(intent_id, consent.pk, "12345678901", "k@x.com"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in intents for _ in range(self.DUPLICATES)]
+        with patch("app.paypibridge.services.settlement_pix_port._of_mock", return_value=True), patch.object(
+            SettlementPixPort, "send", counting_send
+        ), patch("app.paypibridge.services.settlement_service.get_pricing_service", return_value=_pricing()):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(len(results), len(threads))
+        self.assertEqual(len(sent), self.INTENTS)
+        self.assertEqual(sum(r["status"] == "success" for r in results), self.INTENTS)
+        self.assertEqual(PixTransaction.objects.count(), self.INTENTS)
+        self.assertEqual(PaymentIntent.objects.filter(status="SETTLED").count(), self.INTENTS)
+        self.assertEqual(ensure_wallet(tenant, Wallet.ASSET_PI).balance, Decimal("0"))
@@ -0,0 +1,168 @@
+"""Scheduler de liquidação particionado: hash consistente, serialização por partição e fair queuing."""
+
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import Consent, PaymentIntent, SettlementJob, Tenant
+from app.paypibridge.services.settlement_scheduler import (
+    HashRing,
+    claim_next,
+    enqueue_settlement,
+    partition_stats,
+    run_job,
+)
+
+User = get_user_model()
+
+_EXECUTE = "app.paypibridge.services.settlement_scheduler.execute_settlement"
+
+
+class HashRingTest(TestCase):
+    def test_balanced_and_stable_on_resize(self):
+        keys = [f"tenant:{n}" for n in range(2000)]
+        eight = HashRing(8)
+        spread = Counter(eight.partition_for(k) for k in keys)
+        self.assertEqual(set(spread), set(range(8)))
+        self.assertTrue(all(120 <= n <= 400 for n in spread.values()), spread)
+        self.assertEqual([eight.partition_for(k) for k in keys], [HashRing(8).partition_for(k) for k in keys])
+
+        nine = HashRing(9)
+        moved = sum(eight.partition_for(k) != nine.partition_for(k) for k in keys)
+        # Modulo moveria ~8/9 das chaves; o anel só ~1/9.
+        self.assertLess(moved / len(keys), 0.25)
+
+
+@override_settings(SETTLEMENT_PARTITIONS=1)
+class SettlementSchedulerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="sched", email="s@t.com", password="x")
+        self.consent = Consent.objects.create(user=self.user, provider="mock", scope={}, consent_id="c_sched", status="ACTIVE")
+        self.tenants = {
+            slug: Tenant.objects.create(name=slug, slug=slug, api_key=f"lk_{slug}", settlement_weight=weight)
+            for slug, weight in (("burst", 1), ("quiet", 1), ("heavy", 2))
+        }
+        self.n = 0
+
+    def _enqueue(self, slug, count=1):
+        jobs = []
+        for _ in range(count):
+            self.n += 1
+            intent = PaymentIntent.objects.create(
+                intent_id=f"pi_sched_{self.n}",
+                payer_address="x",
+                payee_user=self.user,
+                amount_pi=Decimal("1"),
+                verified_at=timezone.now(),
+                tenant=self.tenants[slug],
+            )
+            job, created = enqueue_settlement(intent, consent=self.consent, cpf="12345678901", pix_key="k@x.com")
+            self.assertTrue(created)
+            jobs.append(job)
+        return jobs
+
+    def _drain_order(self):
+        order = []
+        while (job := claim_next(0)) is not None:
+            order.append(job.tenant.slug)
+            SettlementJob.objects.filter(pk=job.pk).update(status=SettlementJob.ST_DONE)
+        return order
+
+    def test_enqueue_is_idempotent_per_intent(self):
+        [job] = self._enqueue("burst")
+        again, created = enqueue_settlement(job.payment_intent, consent=self.consent, cpf="1", pix_key="k")
+        self.assertEqual((again.pk, created), (job.pk, False))
+
+    def test_key_sticks_to_partition_of_live_jobs(self):
+        with self.settings(SETTLEMENT_PARTITIONS=64):
+            first = self._enqueue("burst")[0]
+            SettlementJob.objects.filter(pk=first.pk).update(partition=63)
+            second = self._enqueue("burst")[0]
+        self.assertEqual(second.partition, 63)
+
+    def test_burst_does_not_starve_other_tenants(self):
+        self._enqueue("burst", 6)
+        self._enqueue("quiet", 2)
+        order = self._drain_order()
+        self.assertEqual(order[:4], ["burst", "quiet", "burst", "quiet"])
+        self.assertEqual(len(order), 8)
+
+    def test_weight_gives_proportional_share(self):
+        self._enqueue("burst", 6)
+        self._enqueue("heavy", 6)
+        first_six = Counter(self._drain_order()[:6])
+        self.assertEqual(first_six, {"heavy": 4, "burst": 2})
+
+    def test_one_job_at_a_time_per_partition(self):
+        self._enqueue("burst")
+        self._enqueue("quiet")
+        job = claim_next(0)
+        self.assertIsNotNone(job)
+        self.assertIsNone(claim_next(0))
+
+        # Worker perdido: depois do timeout o job volta à fila e é reclamado de novo.
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(claim_next(0, now=later).pk, job.pk)
+
+    def test_run_job_chains_the_partition(self):
+        jobs = self._enqueue("burst", 2) + self._enqueue("quiet", 1)
+        with patch(_EXECUTE, return_value={"status": "success"}) as execute, self.captureOnCommitCallbacks(execute=True):
+            claim = claim_next(0)
+            run_job(claim.pk)
+
+        self.assertEqual([c.args[0] for c in execute.call_args_list], ["pi_sched_1", "pi_sched_3", "pi_sched_2"])
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.args), (SettlementJob.ST_DONE, {}))
+
+    @override_settings(SETTLEMENT_JOB_MAX_ATTEMPTS=2)
+    def test_transient_failure_requeues_then_dead_letters(self):
+        [job] = self._enqueue("burst")
+        with patch(_EXECUTE, side_effect=RuntimeError("pix timeout")):
+            self.assertEqual(run_job(claim_next(0).pk)["status"], "retry")
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (SettlementJob.ST_QUEUED, 1))
+            self.assertIsNone(claim_next(0))
+            self.assertEqual(run_job(claim_next(0, now=job.not_before).pk)["status"], "dead_letter")
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, SettlementJob.ST_FAILED)
+        self.assertTrue(job.payment_intent.metadata["settlement_dead_letter"])
+        dead = job.payment_intent.dead_letters.get()
+        self.assertEqual((dead.source, dead.error_class, dead.attempts), ("scheduler", "RuntimeError", 2))
+
+    def test_partition_stats(self):
+        self._enqueue("burst", 3)
+        self._enqueue("quiet", 1)
+        claim_next(0)
+        [stats] = partition_stats()
+        self.assertEqual((stats["partition"], stats["queued"], stats["running"], stats["dispatched"]), (0, 3, 1, 1))
+        self.assertEqual(stats["queued_by_key"], {f"tenant:{self.tenants['burst'].pk}": 2, f"tenant:{self.tenants['quiet'].pk}": 1})
+
+    @override_settings(SETTLEMENT_PARTITIONS=4)
+    def test_execute_endpoint_enqueues(self):
+        intent = PaymentIntent.objects.create(
+            intent_id="pi_sched_view",
+            payer_address="x",
+            payee_user=self.user,
+            amount_pi=Decimal("1"),
+            verified_at=timezone.now(),
+            tenant=self.tenants["burst"],
+        )
+        with patch("app.paypibridge.services.settlement_scheduler._kick") as kick, self.captureOnCommitCallbacks(execute=True):
+            r = APIClient().post(
+                reverse("settlement-execute"),
+                {"intent_id": intent.intent_id, "cpf": "12345678901", "pix_key": "k@x.com"},
+                format="json",
+            )
+        self.assertEqual(r.status_code, 202, r.data)
+        job = SettlementJob.objects.get(pk=r.data["job_id"])
+        self.assertEqual((job.payment_intent_id, job.partition), (intent.pk, r.data["partition"]))
+        kick.assert_called_once_with(job.partition)
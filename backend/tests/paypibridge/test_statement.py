@@ -0,0 +1,100 @@
+"""Extrato em streaming (NDJSON/CSV) com paginação keyset e saldo corrente."""
+
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.paypibridge.models import JournalBatch, JournalLine, LedgerAccount, LedgerEntry, Tenant, Wallet
+from app.paypibridge.services.double_entry_service import (
+    CODE_CLEARING_PI,
+    ensure_wallet_ledger_account,
+    post_balanced_journal,
+)
+from app.paypibridge.services.ledger_service import ensure_wallet
+
+
+@override_settings(STATEMENT_PAGE_SIZE=3)
+class StatementExportTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Stmt", slug="stmt", api_key="lk_stmt_1")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_PAYPI_TENANT_KEY="lk_stmt_1")
+        self.t0 = timezone.now() - timedelta(days=10)
+
+    def _journal(self, n, day, side, amount):
+        acc = ensure_wallet_ledger_account(ensure_wallet(self.tenant, Wallet.ASSET_PI))
+        other = JournalLine.SIDE_DEBIT if side == JournalLine.SIDE_CREDIT else JournalLine.SIDE_CREDIT
+        jb = post_balanced_journal(
+            f"stmt-{n}",
+            [
+                {"code": CODE_CLEARING_PI, "side": other, "amount": amount},
+                {"account_id": acc.id, "side": side, "amount": amount},
+            ],
+        )
+        ts = self.t0 + timedelta(days=day)
+        JournalBatch.objects.filter(pk=jb.pk).update(created_at=ts)
+        JournalLine.objects.filter(journal=jb).update(created_at=ts)
+
+    def _get(self, **params):
+        r = self.client.get(reverse("v3-statement"), params)
+        self.assertEqual(r.status_code, 200)
+        return b"".join(r.streaming_content).decode()
+
+    def test_ndjson_keyset_with_running_balance(self):
+        # Dias repetidos: o keyset tem de desempatar por id ao mudar de página.
+        for n, day in enumerate([0, 1, 1, 1, 2, 3, 3]):
+            self._journal(n, day, JournalLine.SIDE_CREDIT, Decimal("2"))
+        self._journal(7, 4, JournalLine.SIDE_DEBIT, Decimal("5"))
+
+        with CaptureQueriesContext(connection) as ctx:
+            rows = [json.loads(line) for line in self._get().splitlines()]
+        self.assertEqual([r["reference"] for r in rows], [f"stmt-{n}" for n in range(8)])
+        self.assertEqual([r["balance"] for r in rows][-3:], ["12.00000000", "14.00000000", "9.00000000"])
+        self.assertTrue(all(r["source"] == "journal" and r["asset"] == "PI" for r in rows))
+        sqls = " ".join(q["sql"] for q in ctx.captured_queries)
+        self.assertNotIn("OFFSET", sqls)
+        self.assertNotIn("COUNT(", sqls)
+
+    def test_from_to_start_from_opening_balance(self):
+        for n in range(5):
+            self._journal(n, n, JournalLine.SIDE_CREDIT, Decimal("1"))
+        start = (self.t0 + timedelta(days=2)).isoformat()
+        end = (self.t0 + timedelta(days=3)).isoformat()
+        rows = [json.loads(line) for line in self._get(**{"from": start, "to": end}).splitlines()]
+        self.assertEqual([r["balance"] for r in rows], ["3.00000000", "4.00000000"])
+
+    def test_without_from_starts_from_the_account_opening_balance(self):
+        for n in range(2):
+            self._journal(n, n, JournalLine.SIDE_CREDIT, Decimal("1"))
+        LedgerAccount.objects.filter(wallet__tenant=self.tenant).update(opening_balance=Decimal("5"))
+        with CaptureQueriesContext(connection) as ctx:
+            rows = [json.loads(line) for line in self._get().splitlines()]
+        self.assertEqual([r["balance"] for r in rows], ["6.00000000", "7.00000000"])
+        self.assertNotIn("balancecheckpoint", " ".join(q["sql"] for q in ctx.captured_queries))
+
+    def test_csv_legacy(self):
+        for i, (kind, amount) in enumerate([("credit", "10"), ("debit", "4"), ("credit", "1")]):
+            LedgerEntry.objects.create(
+                tenant=self.tenant, entry_type=kind, asset=Wallet.ASSET_BRL, amount=Decimal(amount), reference=f"l{i}"
+            )
+        body = self._get(format="csv", source="legacy")
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([r["balance"] for r in rows], ["10.00000000", "6.00000000", "7.00000000"])
+        self.assertEqual(rows[0]["source"], "legacy")
+
+    def test_requires_tenant_key(self):
+        r = APIClient().get(reverse("v3-statement"))
+        self.assertEqual(r.status_code, 401)
+
+    def test_invalid_params(self):
+        r = self.client.get(reverse("v3-statement"), {"format": "xml"})
+        self.assertEqual(r.status_code, 400)
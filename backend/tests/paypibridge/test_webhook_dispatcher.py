@@ -0,0 +1,254 @@
+"""Dispatcher dos webhooks do tenant contra um servidor HTTP local com latência artificial."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.test import TestCase, override_settings
+
+from app.paypibridge.models import OutboxEvent, Tenant, WebhookDeliveryStats
+from app.paypibridge.services.outbox import dispatch_outbox
+from app.paypibridge.services.tenant_webhook import EVENT_PAYMENT_INTENT_WEBHOOK
+from app.paypibridge.services.webhook_dispatcher import (
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    WebhookDispatcher,
+    sign_payload,
+)
+
+
+class _StandIn:
+    """Servidor keep-alive (HTTP/1.1) que dorme `latency` por pedido e regista concorrência por caminho."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.status = {}  # caminho -> lista de códigos a devolver (depois 200)
+        self.requests = []
+        self.connections = 0
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Resposta num só segmento: sem Nagle + ACK atrasado a somar ~40 ms por pedido em keep-alive.
+            disable_nagle_algorithm = True
+            wbufsize = 64 * 1024
+
+            def setup(self):
+                super().setup()
+                with standin._lock:
+                    standin.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with standin._lock:
+                    standin.in_flight[self.path] = standin.in_flight.get(self.path, 0) + 1
+                    standin.max_in_flight[self.path] = max(
+                        standin.max_in_flight.get(self.path, 0), standin.in_flight[self.path]
+                    )
+                    queued = standin.status.get(self.path) or []
+                    code = queued.pop(0) if queued else 200
+                time.sleep(standin.latency)
+                with standin._lock:
+                    standin.in_flight[self.path] -= 1
+                    standin.requests.append((self.path, dict(self.headers), body))
+                self.send_response(code)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _tenant(slug, url, **kwargs):
+    return Tenant.objects.create(name=slug, slug=slug, api_key=f"lk_{slug}", webhook_url=url, **kwargs)
+
+
+def _events(tenant, n):
+    return [
+        OutboxEvent.objects.create(
+            event_type=EVENT_PAYMENT_INTENT_WEBHOOK,
+            tenant=tenant,
+            aggregate_id=f"pi_{tenant.slug}_{i}",
+            payload={"event": "payment_intent_updated", "intent_id": f"pi_{tenant.slug}_{i}"},
+        )
+        for i in range(n)
+    ]
+
+
+class WebhookDispatcherTest(TestCase):
+    def setUp(self):
+        self.server = _StandIn()
+        self.dispatcher = WebhookDispatcher(workers=8, tenant_concurrency=2, retries=2, retry_base_ms=1)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        self.server.stop()
+
+    def test_signed_post_and_keep_alive(self):
+        tenant = _tenant("sig", f"{self.server.url}/sig", webhook_secret="s3cret")
+        results = {}
+        for event in _events(tenant, 5):
+            results.update(self.dispatcher.deliver_events([event]))
+
+        self.assertEqual(set(results.values()), {None})
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(self.server.connections, 1)
+        _, headers, body = self.server.requests[0]
+        self.assertEqual(headers[SIGNATURE_HEADER], sign_payload("s3cret", headers[TIMESTAMP_HEADER], body))
+        self.assertEqual(json.loads(body)["event"], "payment_intent_updated")
+
+    @override_settings(PPBRIDGE_WEBHOOK_HMAC_SECRET="")
+    def test_unsigned_without_secret(self):
+        tenant = _tenant("nosig", f"{self.server.url}/nosig")
+        self.dispatcher.deliver_events(_events(tenant, 1))
+        self.assertNotIn(SIGNATURE_HEADER, self.server.requests[0][1])
+
+    def test_batches_events_into_one_post(self):
+        tenant = _tenant("batch", f"{self.server.url}/batch", webhook_batch_size=10)
+        events = _events(tenant, 25)
+        results = self.dispatcher.deliver_events(events)
+
+        self.assertEqual(len(results), 25)
+        self.assertEqual(len(self.server.requests), 3)
+        bodies = [json.loads(body) for _, _, body in self.server.requests]
+        self.assertEqual({b["event"] for b in bodies}, {"batch"})
+        self.assertEqual(sorted(e["event_id"] for b in bodies for e in b["events"]), sorted(e.pk for e in events))
+
+    def test_retries_5xx_but_not_4xx(self):
+        flaky = _tenant("flaky", f"{self.server.url}/flaky")
+        gone = _tenant("gone", f"{self.server.url}/gone")
+        self.server.status = {"/flaky": [503, 502], "/gone": [410]}
+        [flaky_event] = _events(flaky, 1)
+        [gone_event] = _events(gone, 1)
+
+        results = self.dispatcher.deliver_events([flaky_event, gone_event])
+
+        self.assertIsNone(results[flaky_event.pk])
+        self.assertEqual(results[gone_event.pk], "HTTP 410")
+        paths = [path for path, _, _ in self.server.requests]
+        self.assertEqual((paths.count("/flaky"), paths.count("/gone")), (3, 1))
+
+        stats = WebhookDeliveryStats.objects.get(tenant=flaky)
+        self.assertEqual((stats.posts, stats.failures, stats.events_delivered), (3, 2, 1))
+        self.assertEqual(stats.last_status_code, 200)
+        self.assertIsNotNone(stats.last_success_at)
+        stats = WebhookDeliveryStats.objects.get(tenant=gone)
+        self.assertEqual((stats.posts, stats.failures, stats.events_delivered), (1, 1, 0))
+        self.assertEqual(stats.last_error, "HTTP 410")
+
+    def test_connection_error_is_reported(self):
+        self.server.stop()
+        tenant = _tenant("down", f"{self.server.url}/down")
+        [event] = _events(tenant, 1)
+        self.server = _StandIn()  # tearDown
+        self.assertIn("ConnectionError", WebhookDispatcher(retries=0).deliver_events([event])[event.pk])
+
+    def test_concurrency_is_bounded_per_tenant(self):
+        self.server.latency = 0.03
+        slow = _tenant("slow", f"{self.server.url}/slow")
+        fast = _tenant("fast", f"{self.server.url}/fast")
+        events = _events(slow, 12) + _events(fast, 12)
+
+        results = self.dispatcher.deliver_events(events)
+
+        self.assertEqual(set(results.values()), {None})
+        self.assertEqual(self.server.max_in_flight, {"/slow": 2, "/fast": 2})
+
+    def test_slow_tenant_does_not_hold_back_fast_tenant(self):
+        slow_server = _StandIn(latency=1.0)
+        self.addCleanup(slow_server.stop)
+        slow = _tenant("lag", f"{slow_server.url}/lag")
+        fast = _tenant("quick", f"{self.server.url}/quick")
+        slow_events, fast_events = _events(slow, 2), _events(fast, 3)
+        reported = []
+        started = time.monotonic()
+
+        with self.settings(TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS=0.4):
+            results = self.dispatcher.deliver_events(
+                slow_events + fast_events, on_results=lambda r: reported.append((time.monotonic() - started, r))
+            )
+        elapsed = time.monotonic() - started
+
+        # O tenant rápido é reportado logo, sem esperar pelo lento nem pelo prazo do lote.
+        fast_latency, fast_results = reported[0]
+        self.assertEqual(fast_results, {e.pk: None for e in fast_events})
+        self.assertLess(fast_latency, 0.3)
+        # O lote acaba no prazo; os eventos do tenant lento voltam ao outbox com erro.
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual({results[e.pk] for e in slow_events}, {"webhook batch deadline exceeded"})
+
+        with self.settings(TENANT_WEBHOOK_BATCH_DEADLINE_SECONDS=0.4):
+            self.assertEqual(dispatch_outbox(), {"delivered": 3, "retried": 2, "dead": 0})
+        self.assertEqual(
+            set(OutboxEvent.objects.filter(pk__in=[e.pk for e in fast_events]).values_list("status", flat=True)),
+            {OutboxEvent.ST_DELIVERED},
+        )
+
+    def test_outbox_uses_dispatcher(self):
+        tenant = _tenant("outbox", f"{self.server.url}/outbox", webhook_batch_size=5)
+        _events(tenant, 7)
+        with self.settings(TENANT_WEBHOOK_CONCURRENCY=1):
+            self.assertEqual(dispatch_outbox(), {"delivered": 7, "retried": 0, "dead": 0})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(WebhookDeliveryStats.objects.get(tenant=tenant).events_delivered, 7)
+
+
+class WebhookThroughputTest(TestCase):
+    """Eventos/s contra 20 ms de latência: POST a POST sem sessão vs dispatcher (com e sem envelope)."""
+
+    TENANTS = 4
+    EVENTS_PER_TENANT = 25
+    LATENCY = 0.02
+
+    def setUp(self):
+        self.server = _StandIn(latency=self.LATENCY)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _sequential(self, events):
+        t0 = time.perf_counter()
+        for event in events:
+            requests.post(event.tenant.webhook_url, json=event.payload, timeout=5).raise_for_status()
+        return len(events) / (time.perf_counter() - t0)
+
+    def _dispatcher(self, events):
+        dispatcher = WebhookDispatcher(workers=16, tenant_concurrency=4, retries=0)
+        try:
+            t0 = time.perf_counter()
+            results = dispatcher.deliver_events(events)
+            elapsed = time.perf_counter() - t0
+        finally:
+            dispatcher.close()
+        self.assertEqual(set(results.values()), {None})
+        return len(events) / elapsed
+
+    def test_throughput(self):
+        tenants = [_tenant(f"tp{n}", f"{self.server.url}/tp{n}") for n in range(self.TENANTS)]
+        events = [e for t in tenants for e in _events(t, self.EVENTS_PER_TENANT)]
+
+        sequential = self._sequential(events)
+        pooled = self._dispatcher(events)
+        for t in tenants:
+            t.webhook_batch_size = 10
+        batched = self._dispatcher(events)
+
+        rates = f"tenant webhooks/s: sequential={sequential:.0f} pooled={pooled:.0f} batched={batched:.0f}"
+        self.assertGreater(pooled, sequential * 3, rates)
+        self.assertGreater(batched, pooled, rates)